@@ -1,8 +1,17 @@
 import logging
 from NodeGraphQt.custom_widgets.properties_bin.node_property_widgets import PropertiesBinWidget, NodePropEditorWidget #type: ignore
 from NodeGraphQt import BaseNode # type: ignore
+from NodeGraphQt.constants import NodePropWidgetEnum # type: ignore
+from NodeGraphQt.widgets.node_widgets import NodeComboBox, NodeLineEdit # type: ignore
 from Qt import QtCore, QtWidgets, QtGui # type: ignore
 from itertools import product
+import weakref
+
+from app.nodes.node_spec import MENU_PROP, NodeSpec
+from app.gui.graph_lod import LodNodeItem
+
+# The graphs in which node classes registered their accepted connections
+_ACCEPT_GRAPHS = weakref.WeakSet()
 
 # -----------------------------
 # Custom BaseNode
@@ -13,15 +22,23 @@ class MyBaseNode(BaseNode):
     Attributes:
         NODE_TYPES (list): A list of supported node types.
         PORT_TYPES (list): A list of supported port types.
+        spec (NodeSpec): The immutable description of the node class (labels, defaults,
+            ports, file flags), shared by every instance of the class.
+        all_ports (dict): The input and output ports of the node, by port name.
     
     Methods:
         __init__(): Initializes the MyBaseNode instance and sets up properties and ports.
-        _add_text_input(name, label=None, text=""): Adds a text input property to the node.
+        changed_props(): Returns, for display, the custom properties whose value differs from the spec default.
+        _add_prop(name, label=None, default=""): Adds a property to the node model, without widget.
         _add_base_props(): Adds base properties to the node.
         _add_optional_props(): Adds optional properties to the node if available.
-        _hide_all_props(): Hides all custom properties from the node's interface.
+        expand_widgets(): Builds (once) and shows the property widgets embedded in the node.
+        collapse_widgets(): Hides the property widgets embedded in the node.
+        toggle_widgets(): Switches between the expanded and collapsed node display.
+        sync_view(): Updates the canvas item from the model where it is stale.
         _add_ports(): Adds input and output ports to the node.
-        _manage_accepts(): Manages the acceptance of port types for input ports.
+        register_accepts(node_graph): Registers the accepted connections of the input ports of the class in a graph.
+        add_node_type(node_type): Adds a node type to NODE_TYPES and to the registered accepted connections.
         _auto_setup(): Automatically sets up the node by adding properties and ports.
     """
 
@@ -32,40 +49,90 @@ class MyBaseNode(BaseNode):
         "genion.Genion",
         "grompp.Grompp",
         "mdrun.Mdrun",
+        "mdrun.MdrunMulti",
         "trjconv.Trjconv",
     ]
 
     PORT_TYPES = ["in", "out"]
 
     def __init__(self):
-        super().__init__()
-        self._prop_labels = {}
-        self.all_ports = {}
+        # LodNodeItem draws a simplified box when the graph is zoomed out
+        super().__init__(qgraphics_item=LodNodeItem)
+        self.spec = NodeSpec.of(type(self))
+        self._widgets_expanded = False
 
         self._auto_setup()
 
-    def _add_text_input(self, name, label=None, text=""):
-        """Adds a text input field to the form.
-        
-        Args:
-            name (str): The name of the text input field.
-            label (str, optional): The label for the text input field. Defaults to None.
-            text (str, optional): The initial text for the text input field. Defaults to an empty string.
-        
+    @property
+    def _prop_labels(self):
+        return self.spec.labels
+
+    @property
+    def _opt_label_to_key(self):
+        return self.spec.opt_label_to_key
+
+    @property
+    def all_ports(self):
+        return {**self.inputs(), **self.outputs()}
+
+    def changed_props(self):
+        """Returns, for display, the custom properties whose value differs from the spec default.
+
+        This is a diff computed on each call: the node model (NodeGraphQt) still stores
+        every property value of the instance, only the metadata is shared in the spec.
+        Optional properties added to the node are always returned, as their presence
+        is itself a change.
+
         Returns:
-            TextInput: The created text input field.
+            dict: The changed values, by flag.
         """
-        if label:
-            self._prop_labels[name] = label
-        return super().add_text_input(name=name, label=label, text=text)
-    
+        defaults = self.spec.defaults
+        optional = self.spec.optional_flags
+        return {
+            k: v for k, v in self.model.custom_properties.items()
+            if k != MENU_PROP
+            and (k in optional or k not in defaults or defaults[k] != v)
+        }
+
+    def _add_prop(self, name, label=None, default=""):
+        """Registers a property as plain model data, without building any Qt widget.
+
+        The value lives in the node model only (so it is serialized, previewed and
+        shown by `MyPropertiesBin`, which builds its own editors from the widget
+        type). The widget embedded in the node on the canvas is only created on
+        demand by `expand_widgets`.
+
+        Args:
+            name (str): The name (flag) of the property.
+            label (str, optional): The pretty label of the property; labels of declared
+                flags are read from the shared spec. Defaults to None.
+            default (str | list, optional): The initial text, or the list of choices
+                for a combo menu. Defaults to an empty string.
+        """
+        # Set up list if limited choices
+        if isinstance(default, (list, tuple)):
+            items = list(default)
+            self.create_property(
+                name,
+                value=items[0] if items else None,
+                items=items,
+                widget_type=NodePropWidgetEnum.QCOMBO_BOX.value,
+            )
+        # Else set up writable zone
+        else:
+            self.create_property(
+                name,
+                value=default,
+                widget_type=NodePropWidgetEnum.QLINE_EDIT.value,
+            )
+
     def _add_base_props(self):
-        """Adds base properties to the user interface.
+        """Adds base properties to the node model.
         
-        This method iterates over the `BASE_PROPS` dictionary and adds either a combo menu or a text input 
-        to the user interface based on the type of the property value. If the value is a list, a combo menu 
-        is created; otherwise, a text input is added. Any exceptions raised during the addition of properties 
-        are logged as warnings.
+        This method iterates over the `BASE_PROPS` dictionary and registers each entry as
+        model data through `_add_prop`. If the value is a list, a combo property is created;
+        otherwise, a text property is added. Any exceptions raised during the addition of
+        properties are logged as warnings.
         
         Attributes:
             BASE_PROPS (dict): A dictionary containing base property names as keys and a tuple of 
@@ -74,67 +141,112 @@ class MyBaseNode(BaseNode):
         Raises:
             Exception: Logs a warning if there is an error while adding a base property.
         """
-        for k, v in self.BASE_PROPS.items():
+        for k in self.spec.base_flags:
             try:
-                # Set up list if limited choices
-                if isinstance(v[1], list):
-                    self.add_combo_menu(name=k, label=v[0], items=v[1])
-                # Else set up writabble zone
-                else:
-                    self._add_text_input(name=k, label=v[0], text=v[1])
+                label, default = self.spec.prop(k)
+                self._add_prop(name=k, label=label, default=default)
             except Exception as e:
                 logging.warning("Failed to add base prop %s: %s", k, e)
 
     def _add_optional_props(self):
-        """Adds optional properties widget picker
-        
-        This method checks if the instance has the attribute `OPTIONAL_PROPS` and if it is not empty. 
-        If so, it creates a mapping of optional property labels to their corresponding keys, 
-        adds a combo menu for selecting optional properties, hides the widget, 
-        and sets the initial property value to None.
-        
-        Attributes:
-            OPTIONAL_PROPS (dict): A dictionary containing optional properties.
+        """Adds optional properties picker
         
-        Methods:
-            add_combo_menu(name, label, items): Adds a combo menu to the widget.
-            hide_widget(name, push_undo): Hides the specified widget.
-            set_property(name, value): Sets the property of the widget.
+        If the node declares optional properties, this method registers a combo property 
+        listing their labels (read from the shared spec), with no initial value.
         """
-        if hasattr(self, "OPTIONAL_PROPS") and self.OPTIONAL_PROPS:
-            self._opt_label_to_key = {v[0]: k for k, v in self.OPTIONAL_PROPS.items()}
-
-            self.add_combo_menu(
-                name="Add optional property",
-                label="Add optional property",
-                items=list(self._opt_label_to_key.keys())
+        if self.spec.opt_label_to_key:
+            self.create_property(
+                "Add optional property",
+                value=None,
+                items=list(self.spec.opt_label_to_key.keys()),
+                widget_type=NodePropWidgetEnum.QCOMBO_BOX.value,
             )
-            self.hide_widget("Add optional property", push_undo=False)
-            self.set_property("Add optional property", None)
 
-    def _hide_all_props(self):
-        """Hides all embedded custom properties, so they don't appear in the node itself
+    def expand_widgets(self):
+        """Shows the node properties as widgets embedded in the node on the canvas.
         
-        This method iterates through the custom properties of the widget and calls
-        the `hide_widget` method for each property, suppressing the undo functionality.
-        If an error occurs during the process, a warning is logged.
-        
-        Raises:
-            Exception: Logs a warning if an error occurs while hiding properties.
+        The widgets are only built the first time a property is expanded; later calls
+        just show the existing ones. The optional property picker stays in the
+        properties bin.
         """
-        try:
-            [
-                self.hide_widget(k, push_undo=False)
-                for k in self.properties().get("custom", {}).keys()
-                if k != "Add optional property"
-            ]
-        except Exception as e:
-            logging.warning("Failed to hide props: %s", e)
+        for name, value in self.properties().get("custom", {}).items():
+            if name == "Add optional property":
+                continue
+            if self.view.has_widget(name):
+                self.show_widget(name, push_undo=False)
+                continue
+
+            label, default = self.spec.prop(name)
+            if isinstance(default, (list, tuple)):
+                widget = NodeComboBox(self.view, name, label, list(default))
+                widget.set_value(value)
+            else:
+                widget = NodeLineEdit(self.view, name, label, "" if value is None else str(value))
+            widget.value_changed.connect(lambda k, v: self.set_property(k, v))
+            self.view.add_widget(widget)
+
+        self.view.draw_node()
+        self._widgets_expanded = True
+
+    def collapse_widgets(self):
+        """Hides the widgets embedded in the node on the canvas, keeping the model data."""
+        for name in list(self.view.widgets.keys()):
+            self.hide_widget(name, push_undo=False)
+        self.view.draw_node()
+        self._widgets_expanded = False
+
+    def toggle_widgets(self):
+        """Switches the node between its collapsed and expanded canvas display."""
+        if self._widgets_expanded:
+            self.collapse_widgets()
+        else:
+            self.expand_widgets()
+
+    def sync_view(self):
+        """Brings the canvas item of the node up to date with its model, if it is stale.
+
+        Only what differs is touched: the node item is redrawn from the model when its name,
+        colors, state or position differ, embedded widgets showing another value are set
+        (without emitting), and missing widgets are built when the node is expanded.
+
+        Returns:
+            bool: True if anything was stale.
+        """
+        model, view = self.model, self.view
+        stale = False
+        if (
+            view.name != model.name
+            or tuple(view.color) != tuple(model.color)
+            or tuple(view.text_color) != tuple(model.text_color)
+            or tuple(view.border_color) != tuple(model.border_color)
+            or view.disabled != model.disabled
+            or [round(v, 3) for v in view.xy_pos] != [round(v, 3) for v in model.pos]
+        ):
+            self.update()
+            stale = True
+
+        custom = model.custom_properties
+        for name, widget in view.widgets.items():
+            value = custom.get(name)
+            if isinstance(widget, NodeLineEdit):
+                value = "" if value is None else str(value)
+            if widget.get_value() != value:
+                widget.blockSignals(True)
+                widget.set_value(value)
+                widget.blockSignals(False)
+                stale = True
+
+        if self._widgets_expanded and any(
+            k not in view.widgets for k in custom if k != "Add optional property"
+        ):
+            self.expand_widgets()
+            stale = True
+        return stale
 
     def _add_ports(self):
         """Adds input and output ports to the current object.
         
-        This method iterates over the defined input and output ports, creating and 
+        This method iterates over the input and output ports of the node spec, creating and 
         adding them to the object's port collection. It handles any exceptions that 
         may occur during the addition of ports, logging a warning message if an 
         error is encountered.
@@ -146,57 +258,78 @@ class MyBaseNode(BaseNode):
             OUT_PORTS (dict): A dictionary containing output port definitions, where 
                               each key is an identifier and the value is a tuple 
                               containing the port name and port type.
-            all_ports (dict): A dictionary that stores all added ports, indexed by 
-                              their names.
-        
+
         Raises:
             Exception: Logs a warning if there is an error while adding input or 
                        output ports.
         """
         # Retrieves the port (IN/OUT) informations 
         try:
-            for _, (name, port_type, _) in self.IN_PORTS.items():
-                port = self.add_input(name)
-                port.port_type = port_type
-                self.all_ports[port.name()] = port
+            for port_spec in self.spec.in_ports:
+                port = self.add_input(port_spec.name)
+                port.port_type = port_spec.port_type
         except Exception as e:
             logging.warning("Failed to add in port: %s", e)
 
         try:
-            for _, (name, port_type) in self.OUT_PORTS.items():
-                port = self.add_output(name)
-                port.port_type = port_type
-                self.all_ports[port.name()] = port
+            for port_spec in self.spec.out_ports:
+                port = self.add_output(port_spec.name)
+                port.port_type = port_spec.port_type
         except Exception as e:
             logging.warning("Failed to add port: %s", e)
 
-    # For each port, each type ("in", "out") and each node_type = identifier, one may use 'add_accept_port_type'
-    def _manage_accepts(self):
-        """Manage the acceptance of port types for each input port.
-        
-        This method iterates over the input ports defined in `self.IN_PORTS` and for each port, it generates combinations of accepted port names, port types, and node types. It then calls the `add_accept_port_type` method to register these combinations for the corresponding port.
-        
+    # For each port, each type ("in", "out") and each node_type = identifier, an accepted connection
+    @classmethod
+    def register_accepts(cls, node_graph):
+        """Registers the connections accepted by the input ports of the class in a graph.
+
+        NodeGraphQt keeps these constraints in the graph model, keyed by node type, so they are
+        registered once per class and graph rather than by each instance.
+
         Args:
-            self: The instance of the class that contains the method.
-        
-        Returns:
-            None
+            node_graph (NodeGraph): The graph the class is registered in.
         """
-        for _, (name, _, accepts) in self.IN_PORTS.items():
-            for port_name, port_type, node_type in product(accepts, self.PORT_TYPES, self.NODE_TYPES):
-                self.add_accept_port_type(
-                    self.all_ports[name],
-                    dict(
-                        port_name=port_name,
-                        port_type=port_type,
-                        node_type=node_type
-                    ),
+        _ACCEPT_GRAPHS.add(node_graph)
+        cls._add_accepts(node_graph.model, cls.NODE_TYPES)
+
+    @classmethod
+    def _add_accepts(cls, model, node_types):
+        """Adds the connections from the given node types to the input ports of the class.
+
+        Args:
+            model (NodeGraphModel): The graph model.
+            node_types (list): The node types to accept.
+        """
+        for port_spec in NodeSpec.of(cls).in_ports:
+            for port_name, port_type, node_type in product(port_spec.accepts, cls.PORT_TYPES, node_types):
+                model.add_port_accept_connection_type(
+                    port_name=port_spec.name,
+                    port_type="in",
+                    node_type=cls.type_,
+                    accept_pname=port_name,
+                    accept_ptype=port_type,
+                    accept_ntype=node_type,
                 )
 
+    @staticmethod
+    def add_node_type(node_type):
+        """Adds a node type to NODE_TYPES, and to the accepted connections of the classes already registered.
+
+        Args:
+            node_type (str): The node type identifier.
+        """
+        if node_type in MyBaseNode.NODE_TYPES:
+            return
+        MyBaseNode.NODE_TYPES.append(node_type)
+        for node_graph in list(_ACCEPT_GRAPHS):
+            for node_cls in node_graph.node_factory.nodes.values():
+                if issubclass(node_cls, MyBaseNode):
+                    node_cls._add_accepts(node_graph.model, [node_type])
+
     def _auto_setup(self):
         """Automatically sets up the properties and configurations for the instance of a node.
         
-        This method performs a series of setup operations, including adding optional and base properties, hiding all properties, adding ports, and managing accepts. If any step in the setup process fails, a warning is logged with the node name and the exception message.
+        This method performs a series of setup operations, including adding optional and base properties (as model data only) and adding ports. The accepted connections are registered per class, see `register_accepts`. If any step in the setup process fails, a warning is logged with the node name and the exception message.
         
         Raises:
             Exception: If any of the setup operations fail, a warning is logged but the exception is not raised.
@@ -204,9 +337,7 @@ class MyBaseNode(BaseNode):
         try:
             self._add_optional_props()
             self._add_base_props()
-            self._hide_all_props()
             self._add_ports()
-            self._manage_accepts()
         except Exception as e:
             logging.warning(f"Auto setup failed for {self.NODE_NAME}: {e}")
 
@@ -223,9 +354,14 @@ class MyPropEditor(NodePropEditorWidget):
         _browse_file(edit, prop_name):
             Opens a file dialog to select a file and updates the corresponding property of the node with the selected file path.
     
+        mdp_edit_requested (QtCore.Signal):
+            Emitted with the node id and the property name when the "Edit the MDP file" action of an mdp property is triggered.
+    
         _DoubleClickFilter:
             A helper class that filters double-click events on the property editor's widgets to trigger the file browsing functionality.
     """
+    mdp_edit_requested = QtCore.Signal(str, str)
+
     def _read_node(self, node):
         """Reads a node and applies various configurations to its associated widgets.
         
@@ -243,8 +379,9 @@ class MyPropEditor(NodePropEditorWidget):
             Exception: Logs any exceptions that occur during the processing of the node.
         """
         ports = super()._read_node(node)
-        # Retrieve the labels in add_text_input
-        mapping = getattr(node, "_prop_labels", {})
+        # Retrieve the labels, roles and file flags from the shared node spec
+        spec = NodeSpec.of(node)
+        mapping = spec.labels
 
         for prop_name, pretty_label in mapping.items():
             try:
@@ -271,8 +408,8 @@ class MyPropEditor(NodePropEditorWidget):
         
         # Colors by role based on IN_PORT / OUT_PORT mapping
         try:
-            in_flags = set((getattr(node, "IN_PORTS", {}) or {}).keys())
-            out_flags = set((getattr(node, "OUT_PORTS", {}) or {}).keys())
+            in_flags = {p.flag for p in spec.in_ports}
+            out_flags = {p.flag for p in spec.out_ports}
             props = node.properties().get("custom", {})
             for name in props.keys():
                 w = self.get_widget(name)
@@ -295,8 +432,7 @@ class MyPropEditor(NodePropEditorWidget):
 
         # Add file picker icon
         try:
-            file_related_props = {"-f", "-o", "-p", "-c", "-n"} # Needs for more general way to handle them
-            for prop_name in file_related_props:
+            for prop_name in spec.file_flags:
                 w = self.get_widget(prop_name)
                 if not isinstance(w, QtWidgets.QLineEdit):
                     continue
@@ -320,6 +456,18 @@ class MyPropEditor(NodePropEditorWidget):
 
                 # Double-click to open dialog too
                 w.installEventFilter(self._DoubleClickFilter(self, w, prop_name))
+
+                # The mdp files also get their editor (lint and output estimate)
+                if str(spec.defaults.get(prop_name, "")).endswith(".mdp"):
+                    edit_icon = QtGui.QIcon.fromTheme("document-edit")
+                    if edit_icon.isNull():
+                        edit_icon = w.style().standardIcon(QtWidgets.QStyle.SP_FileDialogDetailedView)
+                    edit_action = w.addAction(edit_icon, QtWidgets.QLineEdit.TrailingPosition)
+                    edit_action.setObjectName(f"{prop_name}_mdp_action")
+                    edit_action.setToolTip("Edit the MDP file")
+                    edit_action.triggered.connect(
+                        lambda _, n=prop_name: self.mdp_edit_requested.emit(self.node_id(), n)
+                    )
         except Exception:
             logging.exception("Failed to attach file picker actions")
 
@@ -367,5 +515,44 @@ class MyPropEditor(NodePropEditorWidget):
 
 
 class MyPropertiesBin(PropertiesBinWidget):
+    mdp_edit_requested = QtCore.Signal(object, str)
+
     def create_property_editor(self, node):
-        return MyPropEditor(node=node)
+        editor = MyPropEditor(node=node)
+        editor.mdp_edit_requested.connect(
+            lambda _, prop: self.mdp_edit_requested.emit(node, prop)
+        )
+        return editor
+
+    def sync_node(self, node):
+        """Brings the property editor of a node up to date with its model, if it is shown and stale.
+
+        The editor is rebuilt only when the node has properties it does not show (optional
+        properties added since); otherwise only the widgets showing another value are set.
+
+        Args:
+            node (MyBaseNode): The node.
+
+        Returns:
+            bool: True if the editor was stale.
+        """
+        editor = self.get_property_editor_widget(node)
+        if editor is None:
+            return False
+
+        custom = node.model.custom_properties
+        if any(editor.get_widget(name) is None for name in custom):
+            self.add_node(node)
+            return True
+
+        stale = False
+        for name, value in [("name", node.name()), *custom.items()]:
+            if name == "Add optional property":
+                continue
+            widget = editor.get_widget(name)
+            if widget.get_value() != value:
+                widget.blockSignals(True)
+                widget.set_value(value)
+                widget.blockSignals(False)
+                stale = True
+        return stale
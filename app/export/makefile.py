@@ -0,0 +1,142 @@
+import logging
+import os
+import pathlib
+import re
+import shlex
+
+from app.export.workflow import build_steps
+
+
+"""
+Makefile export of a workflow.
+
+Each step (see `app.export.workflow`) becomes a target whose prerequisites are the steps it
+depends on, so `make -j N` runs independent branches in parallel. Since several steps may
+write the same file (topol.top is updated in place by solvate and genion), targets are
+stamp files (`.grogui/<step>.done`, touched once the command succeeded) rather than the
+outputs themselves. A step is run again when an input file that no step produces is newer
+than its stamp, or when its main output (the file of its first output port) is missing;
+otherwise it is skipped. Other outputs are not checked, as mdrun only writes some of them
+depending on the run (no checkpoint for a minimization).
+
+The commands run with the GROMACS environment: `GMXRC` is sourced in each recipe and
+`GMXLIB` exported when set (both can be overridden on the make command line, as well as
+`GMX`). Interactive prompts (e.g. the genion group) are answered on stdin.
+
+Functions:
+    render_makefile(steps, gmxrc=None, gmxlib=None): Returns the Makefile text of steps.
+    write_makefile(nodes, path, gmxrc=None, gmxlib=None): Writes the Makefile of a group of nodes.
+"""
+
+
+STAMP_DIR = ".grogui"
+
+# Characters make cannot take in a prerequisite name
+_UNSAFE_RE = re.compile(r"[\s:;%|]")
+
+
+def _make_escape(text):
+    return text.replace("$", "$$")
+
+
+def _prerequisite(path):
+    if _UNSAFE_RE.search(path):
+        logging.warning("File '%s' cannot be a make prerequisite: not tracked", path)
+        return None
+    return _make_escape(path).replace("#", "\\#")
+
+
+def _stamp(step):
+    return f"$(STAMPS)/{step.name}.done"
+
+
+def _recipe(step):
+    # Multi-simulations run their MPI launcher rather than $(GMX)
+    prefix = [_make_escape(shlex.quote(a)) for a in step.launcher()] if step.replicas() else ["$(GMX)"]
+    cmd = " ".join(prefix + [_make_escape(shlex.quote(a)) for a in (step.tool, *step.args)])
+    if step.stdin:
+        answers = " ".join(_make_escape(shlex.quote(a)) for a in step.stdin)
+        cmd = f"printf '%s\\n' {answers} | {cmd}"
+    return cmd
+
+
+def render_makefile(steps, gmxrc=None, gmxlib=None):
+    """Returns the Makefile of a list of steps.
+
+    Args:
+        steps (list): The steps, in dependency order (see `build_steps`).
+        gmxrc (str, optional): The default GMXRC to source.
+        gmxlib (str, optional): The default GMXLIB to export.
+
+    Returns:
+        str: The Makefile text.
+    """
+    produced = {path for step in steps for path in step.outputs}
+    lines = [
+        "# Generated by GroGUI: one target per node, prerequisites from the file flow between nodes.",
+        "# Run `make -j N` in the directory of the input files; up-to-date steps are skipped.",
+        "",
+        "SHELL := /bin/bash",
+        ".SHELLFLAGS := -e -o pipefail -c",
+        "",
+        "GMX ?= gmx",
+        f"GMXRC ?= {_make_escape(str(gmxrc or ''))}",
+        f"GMXLIB ?= {_make_escape(str(gmxlib or ''))}",
+        f"STAMPS := {STAMP_DIR}",
+        "",
+        "ifneq ($(GMXLIB),)",
+        "export GMXLIB",
+        "endif",
+        "GMXENV = $(if $(GMXRC),source $(GMXRC) && ,)",
+        "",
+        ".PHONY: all clean FORCE",
+        "",
+        "all: " + " ".join(_stamp(s) for s in steps),
+        "",
+    ]
+
+    by_name = {s.name: s for s in steps}
+    for step in steps:
+        prereqs = [_stamp(by_name[d]) for d in step.deps]
+        sources = [p for p in (_prerequisite(f) for f in step.inputs if f not in produced) if p]
+        if sources:
+            prereqs.append(f"$(wildcard {' '.join(sources)})")
+        main = _prerequisite(step.outputs[0]) if step.outputs else None
+        if main:
+            prereqs.append(f"$(if $(wildcard {main}),,FORCE)")
+
+        lines.append(f"# {step.label}")
+        lines.append(f"{_stamp(step)}: " + " ".join(prereqs + ["|", "$(STAMPS)"]))
+        lines.append(f"\t$(GMXENV){_recipe(step)}")
+        lines.append("\t@touch $@")
+        lines.append("")
+
+    lines += [
+        "$(STAMPS):",
+        "\t@mkdir -p $@",
+        "",
+        "clean:",
+        "\trm -rf $(STAMPS)",
+        "",
+        "FORCE:",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def write_makefile(nodes, path, gmxrc=None, gmxlib=None):
+    """Writes the Makefile of a group of nodes.
+
+    Args:
+        nodes (list): The nodes.
+        path (str | pathlib.Path): The Makefile.
+        gmxrc (str, optional): The default GMXRC to source.
+        gmxlib (str, optional): The default GMXLIB to export. Defaults to `$GMXLIB`.
+
+    Returns:
+        list: The exported steps.
+    """
+    steps = build_steps(nodes)
+    text = render_makefile(steps, gmxrc, gmxlib if gmxlib is not None else os.environ.get("GMXLIB"))
+    pathlib.Path(path).write_text(text, encoding="utf-8")
+    return steps
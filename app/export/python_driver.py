@@ -0,0 +1,365 @@
+import logging
+import pathlib
+import pprint
+import stat
+
+from app.export.workflow import build_steps
+from app.jobs.cost_model import prioritize
+
+
+"""
+Python driver export of a workflow.
+
+The exported script is self-contained (standard library only) and carries the workflow as
+data: one entry per step with its gmx arguments, stdin answers, input and output files and
+dependencies (see `app.export.workflow`). When run, it:
+    - starts every step whose dependencies are done on a `concurrent.futures` thread pool
+      (`-j` steps at a time, each one a gmx subprocess), the step of highest priority first:
+      its predicted time to the end of the workflow (see `app.jobs.cost_model`), so the
+      longest branches start first;
+    - skips the steps that are up to date: same command as the last successful run, outputs
+      still there, no dependency run again and the input files no step produces unchanged
+      (same size and mtime, or else same quick hash, or full SHA-256 with `--full-hash`,
+      kept in the fingerprint index `.grogui/fingerprints.sqlite`: see
+      `app.utils.fingerprints`, whose layout and hashes the script shares);
+    - writes the output of each step to `.grogui/logs/<step>.log` and its wall time to
+      `.grogui/timings.json`;
+    - stops on the first failure: no new step is started, the running ones are waited for
+      and the script exits with status 1.
+
+Functions:
+    render_script(steps, gmxrc=None, script="run_gromacs.py", priorities=None): Returns the driver script of steps.
+    write_python_script(nodes, path, gmxrc=None): Writes the driver script of a group of nodes.
+"""
+
+
+_DRIVER = r'''#!/usr/bin/env python3
+"""GROMACS workflow driver generated by GroGUI.
+
+Runs the steps below in dependency order, independent steps in parallel, skipping the
+steps that are up to date. Run it in the directory of the input files:
+
+    python3 %(script)s -j 4          # run, 4 steps at a time
+    python3 %(script)s --dry-run     # show what would run
+    python3 %(script)s --force       # run every step
+
+State, logs and timings are kept in .grogui/.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+
+GMXRC = %(gmxrc)r
+
+# name, label, gmx arguments, stdin answers, outputs, dependencies, input files no step
+# produces ("sources"), priority (predicted seconds to the end, longest first) and launcher
+# (MPI launcher and gmx of a multi-simulation, None: gmx) of each step
+STEPS = %(steps)s
+
+STATE_DIR = ".grogui"
+STATE_FILE = os.path.join(STATE_DIR, "driver-state.json")
+TIMINGS_FILE = os.path.join(STATE_DIR, "timings.json")
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+INDEX_FILE = os.path.join(STATE_DIR, "fingerprints.sqlite")
+
+# Quick hash: the size, both ends and sampled blocks of a file (all of it up to SMALL_FILE)
+SMALL_FILE = 4 << 20
+EDGE = 1 << 20
+SAMPLES = 16
+BLOCK = 64 << 10
+
+
+def gmx_environment(gmxrc):
+    """Returns the environment after sourcing GMXRC (the current one without GMXRC)."""
+    env = dict(os.environ)
+    if not gmxrc:
+        return env
+    out = subprocess.run(
+        ["bash", "-c", 'source "$0" >/dev/null && env -0', gmxrc],
+        check=True, stdout=subprocess.PIPE,
+    ).stdout
+    for entry in out.split(b"\0"):
+        key, sep, value = entry.decode(errors="replace").partition("=")
+        if sep:
+            env[key] = value
+    return env
+
+
+def quick_hash(path, size):
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= SMALL_FILE:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+            return digest.hexdigest()
+        digest.update(f.read(EDGE))
+        step = (size - 2 * EDGE - BLOCK) // (SAMPLES - 1)
+        for i in range(SAMPLES):
+            f.seek(EDGE + i * step)
+            digest.update(f.read(BLOCK))
+        f.seek(size - EDGE)
+        digest.update(f.read(EDGE))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Fingerprints:
+    """The fingerprint index: hashes of the files, valid while their size, mtime and inode hold."""
+
+    def __init__(self, path=INDEX_FILE):
+        self.db = sqlite3.connect(path, timeout=60.0)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] == 0:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, quick TEXT NOT NULL, full TEXT,"
+                " checked REAL NOT NULL)")
+            self.db.execute("PRAGMA user_version = 1")
+            self.db.commit()
+
+    def get(self, paths, full=False, workers=1):
+        """Returns [size, mtime_ns, hash] of the existing files: the quick hash, or the SHA-256."""
+        result, todo = {}, []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            row = self.db.execute("SELECT size, mtime_ns, inode, quick, full FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+                row = (st.st_size, st.st_mtime_ns, st.st_ino, quick_hash(path, st.st_size), None)
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, NULL, ?)", (path, *row[:4], time.time()))
+            result[path] = list(row)
+            if full and row[4] is None:
+                todo.append(path)
+        if todo:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for path, digest in zip(todo, pool.map(full_hash, todo)):
+                    result[path][4] = digest
+                    self.db.execute("UPDATE files SET full = ? WHERE path = ?", (digest, path))
+        self.db.commit()
+        return {p: [fp[0], fp[1], fp[4] if full else fp[3]] for p, fp in result.items()}
+
+
+def same_file(index, path, known, full=False):
+    """Tells whether a file is the one recorded: same size and mtime, or else same hash.
+
+    The hash is of the recorded kind (a SHA-256 has 64 hex digits, a quick hash 32); a
+    changed file recorded with a quick hash is never the same when `full` is asked.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if [st.st_size, st.st_mtime_ns] == known[:2]:
+        return True
+    recorded_full = len(known[2]) == 64
+    if full and not recorded_full:
+        return False
+    current = index.get([path], full=recorded_full).get(path)
+    return current is not None and current[2] == known[2]
+
+
+def up_to_date(index, step, argv, record, full=False):
+    """Tells whether a step can be skipped, from the record of its last successful run."""
+    if not record or record["argv"] != argv or record.get("stdin") != step["stdin"]:
+        return False
+    if not all(os.path.exists(p) for p in record["outputs"]):
+        return False
+    return all(same_file(index, p, known, full) for p, known in record["sources"].items())
+
+
+def run_step(step, argv, env):
+    """Runs one step, its output going to its log file. Returns (returncode, seconds)."""
+    stdin = "".join(f"{a}\n" for a in step["stdin"])
+    start = time.perf_counter()
+    with open(os.path.join(LOG_DIR, step["name"] + ".log"), "w") as log:
+        log.write("$ " + " ".join(argv) + "\n")
+        log.flush()
+        proc = subprocess.run(
+            argv, input=stdin, text=True, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    return proc.returncode, time.perf_counter() - start
+
+
+def dependents(name):
+    """Returns the steps depending (directly or not) on a step."""
+    found, todo = set(), [name]
+    while todo:
+        current = todo.pop()
+        for step in STEPS:
+            if current in step["deps"] and step["name"] not in found:
+                found.add(step["name"])
+                todo.append(step["name"])
+    return found
+
+
+def load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the GROMACS workflow exported by GroGUI.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="steps run at the same time")
+    parser.add_argument("--gmx", default=os.environ.get("GMX", "gmx"), help="gmx executable (default: $GMX or gmx)")
+    parser.add_argument("--gmxrc", default=os.environ.get("GMXRC", GMXRC), help="GMXRC to source (empty: none)")
+    parser.add_argument("--force", action="store_true", help="run every step, even up-to-date ones")
+    parser.add_argument("--dry-run", action="store_true", help="print the steps that would run")
+    parser.add_argument("--full-hash", action="store_true",
+                        help="record and compare the SHA-256 of the input files rather than their quick hash")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    state = load_json(STATE_FILE)
+    index = Fingerprints()
+    env = None if args.dry_run else gmx_environment(args.gmxrc)
+    by_name = {s["name"]: s for s in STEPS}
+    waiting = {s["name"]: set(s["deps"]) for s in STEPS}
+    rerun = set()
+    timings = {}
+    failed = None
+
+    def ready():
+        names = [name for name, deps in waiting.items() if not deps]
+        return sorted(names, key=lambda name: -by_name[name].get("priority", 0))
+
+    def done(name):
+        for deps in waiting.values():
+            deps.discard(name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        running = {}
+        while waiting or running:
+            while failed is None and ready():
+                name = ready()[0]
+                del waiting[name]
+                step = by_name[name]
+                argv = [*(step.get("launcher") or [args.gmx]), *step["argv"]]
+                record = state.get(name)
+                if not args.force and not rerun & set(step["deps"]) and up_to_date(index, step, argv, record, args.full_hash):
+                    print(f"[skip] {step['label']}", flush=True)
+                    done(name)
+                    continue
+                rerun.add(name)
+                if args.dry_run:
+                    print(f"[run]  {step['label']}: {' '.join(argv)}", flush=True)
+                    done(name)
+                    continue
+                print(f"[run]  {step['label']}", flush=True)
+                sources = index.get(step["sources"], args.full_hash, args.jobs)
+                running[pool.submit(run_step, step, argv, env)] = (name, argv, sources)
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name, argv, sources = running.pop(future)
+                step = by_name[name]
+                try:
+                    code, seconds = future.result()
+                except OSError as e:
+                    code, seconds = str(e), 0.0
+                timings[name] = round(seconds, 3)
+                if code != 0:
+                    print(f"[fail] {step['label']} ({code}), see {LOG_DIR}/{name}.log", file=sys.stderr, flush=True)
+                    failed = failed or name
+                    state.pop(name, None)
+                    continue
+                print(f"[done] {step['label']} in {seconds:.1f} s", flush=True)
+                # Steps after this one must run again, even if this run stops before them
+                for child in dependents(name):
+                    state.pop(child, None)
+                state[name] = {
+                    "argv": argv,
+                    "stdin": step["stdin"],
+                    "sources": sources,
+                    "outputs": [p for p in step["outputs"] if os.path.exists(p)],
+                }
+                save_json(STATE_FILE, state)
+                done(name)
+
+    if not args.dry_run:
+        save_json(STATE_FILE, state)
+        save_json(TIMINGS_FILE, {"steps": timings, "total": round(sum(timings.values()), 3)})
+    if failed is not None or waiting:
+        reason = f"step '{by_name[failed]['label']}' failed" if failed else "dependency cycle"
+        print(f"Stopped: {reason}, {len(waiting)} step(s) not run", file=sys.stderr)
+        return 1
+    for name, seconds in sorted(timings.items(), key=lambda t: -t[1]):
+        print(f"{seconds:10.1f} s  {by_name[name]['label']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+
+def render_script(steps, gmxrc=None, script="run_gromacs.py", priorities=None):
+    """Returns the driver script of a list of steps.
+
+    Args:
+        steps (list): The steps, in dependency order (see `build_steps`).
+        gmxrc (str, optional): The default GMXRC to source.
+        script (str, optional): The script file name, used in its usage notes.
+        priorities (dict, optional): The priority of each step name (see `app.jobs.cost_model`).
+
+    Returns:
+        str: The script text.
+    """
+    produced = {path for s in steps for path in s.outputs}
+    data = []
+    for step in steps:
+        entry = step.to_dict()
+        entry["sources"] = [p for p in entry.pop("inputs") if p not in produced]
+        entry["priority"] = (priorities or {}).get(step.name, 0)
+        entry["launcher"] = step.launcher() if step.replicas() else None
+        data.append(entry)
+    return _DRIVER % {"script": script, "gmxrc": str(gmxrc or ""), "steps": pprint.pformat(data, width=100, sort_dicts=False)}
+
+
+def write_python_script(nodes, path, gmxrc=None):
+    """Writes the driver script of a group of nodes, executable.
+
+    Args:
+        nodes (list): The nodes.
+        path (str | pathlib.Path): The script.
+        gmxrc (str, optional): The default GMXRC to source.
+
+    Returns:
+        list: The exported steps.
+    """
+    path = pathlib.Path(path)
+    steps = build_steps(nodes)
+    try:
+        # Predicted from the files next to the script, where it runs
+        priorities = prioritize(steps, path.resolve().parent, gmxrc)
+    except Exception:
+        logging.exception("Cannot predict the run times of the steps")
+        priorities = {}
+    path.write_text(render_script(steps, gmxrc, path.name, priorities), encoding="utf-8")
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return steps
@@ -0,0 +1,334 @@
+import heapq
+import logging
+import re
+import shlex
+
+from app.nodes.node_spec import MENU_PROP, NodeSpec
+
+
+"""
+Workflow model shared by the exporters.
+
+The nodes of a graph are turned into steps: one gmx command per node (one per inner node
+for a template instance), with its arguments, the answers to its interactive prompts, the
+files it reads and writes, and the steps it depends on.
+
+Dependencies follow the file flow between nodes:
+    - a connection from an output port to an input port makes the downstream step depend
+      on the upstream one;
+    - a step also depends on the last step before it that writes one of its input files,
+      which covers files modified in place (pdb2gmx -> solvate -> genion on topol.top) and
+      inputs set by hand rather than through a connection;
+    - two steps writing the same file run one after the other.
+
+A multi-simulation mdrun step (`-multidir`) runs its replicas in one MPI launch: its
+command starts with the launcher and the MPI-enabled gmx of its options ("mpirun",
+"gmx_mpi"), `MPIRUN` and `GMX_MPI` by default.
+
+Classes:
+    Step:
+        One gmx command of the workflow.
+
+Functions:
+    command_args(spec, values): Returns the gmx arguments and stdin answers of a node.
+    step_files(node_cls, values): Returns the files read and written by a node.
+    build_steps(nodes): Returns the steps of a group of nodes, in dependency order.
+"""
+
+
+# Launcher and gmx binary of the multi-simulation steps ({ranks}: one rank per replica)
+MPIRUN = "mpirun -np {ranks}"
+GMX_MPI = "gmx_mpi"
+
+_YES_NO = {"yes", "no"}
+_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class Step:
+    """Step is one gmx command of an exported workflow.
+
+    Attributes:
+        name (str): Unique step name, safe in file names and make targets.
+        label (str): The node the step comes from (`instance / inner node` for templates).
+        tool (str): The gmx tool.
+        args (list): The arguments following `gmx <tool>`.
+        stdin (list): The answers to the interactive prompts, one per line.
+        inputs (list): The files read by the step.
+        outputs (list): The files written by the step.
+        deps (list): The names of the steps that must run first.
+        options (dict): Settings for the executors, not passed to gmx (`EXECUTOR_PROPS`).
+
+    Methods:
+        replicas(): Returns the replica directories of a multi-simulation (`-multidir`).
+        launcher(gmx="gmx"): Returns the program running the tool: gmx, or MPI and its gmx.
+        argv(gmx="gmx"): Returns the command as an argument list.
+        command(gmx="gmx"): Returns the command as a shell line, stdin answers included.
+        to_dict(): Returns the step as plain data (exported scripts, execution plans).
+        from_dict(data): Builds a step back from `to_dict` data.
+    """
+    def __init__(self, name, label, tool, args, stdin=(), inputs=(), outputs=(), options=None):
+        self.name = name
+        self.label = label
+        self.tool = tool
+        self.args = list(args)
+        self.stdin = list(stdin)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = []
+        self.options = dict(options or {})
+
+    def __repr__(self):
+        return f"Step({self.name!r}, {self.tool!r}, deps={self.deps})"
+
+    def replicas(self):
+        if self.tool != "mdrun" or "-multidir" not in self.args:
+            return []
+        dirs = []
+        for arg in self.args[self.args.index("-multidir") + 1:]:
+            if arg.startswith("-"):
+                break
+            dirs.append(arg)
+        return dirs
+
+    def launcher(self, gmx="gmx"):
+        replicas = self.replicas()
+        if not replicas:
+            return [gmx]
+        mpirun = (self.options.get("mpirun") or MPIRUN).format(ranks=len(replicas))
+        return [*shlex.split(mpirun), self.options.get("gmx_mpi") or GMX_MPI]
+
+    def argv(self, gmx="gmx"):
+        return [*self.launcher(gmx), self.tool, *self.args]
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "label": self.label,
+            "argv": [self.tool, *self.args],
+            "stdin": self.stdin,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "deps": self.deps,
+            "options": self.options,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        tool, *args = data["argv"]
+        step = cls(data["name"], data.get("label", data["name"]), tool, args,
+                   data.get("stdin", ()), data.get("inputs", ()), data.get("outputs", ()), data.get("options"))
+        step.deps = list(data.get("deps", ()))
+        return step
+
+    def command(self, gmx="gmx"):
+        """Returns the shell command line of the step.
+
+        Args:
+            gmx (str, optional): The gmx executable, inserted as is (e.g. a make variable);
+                multi-simulations use their MPI launcher instead.
+
+        Returns:
+            str: The command, piping the stdin answers into gmx when there are any.
+        """
+        prefix = [gmx] if not self.replicas() else [shlex.quote(a) for a in self.launcher()]
+        cmd = " ".join(prefix + [shlex.quote(a) for a in (self.tool, *self.args)])
+        if self.stdin:
+            answers = " ".join(shlex.quote(a) for a in self.stdin)
+            cmd = f"printf '%s\\n' {answers} | {cmd}"
+        return cmd
+
+
+def command_args(spec, values):
+    """Returns the gmx arguments and the stdin answers of a node.
+
+    Empty values are left out, yes/no props become `-flag` / `-noflag`, `RAW_PROPS` are split
+    into arguments, `LIST_PROPS` into values after their flag, `STDIN_PROPS` are answered on
+    stdin, and the other props that are not flags (e.g. the mdrun "out_gro" file names,
+    `EXECUTOR_PROPS`) are not passed.
+
+    Args:
+        spec (NodeSpec): The spec of the node class.
+        values (dict): The node values, by flag.
+
+    Returns:
+        tuple: The arguments (list) and the stdin answers (list).
+    """
+    args = []
+    for flag, value in values.items():
+        if flag == MENU_PROP or flag in spec.stdin_flags or value is None or value == "":
+            continue
+        if flag in spec.raw_flags:
+            args += shlex.split(str(value))
+            continue
+        if not flag.startswith("-"):
+            continue
+        if flag in spec.list_flags:
+            args += [flag, *shlex.split(str(value))]
+            continue
+        prop = spec.props.get(flag)
+        if prop is not None and prop.choices and set(prop.choices) == _YES_NO:
+            args.append(flag if value == "yes" else f"-no{flag[1:]}")
+        else:
+            args += [flag, str(value)]
+
+    answers = [str(values[f]) for f in spec.stdin_flags if values.get(f) not in (None, "")]
+    return args, answers
+
+
+def step_files(node_cls, values):
+    """Returns the files read and written by a node.
+
+    Outputs are the files of the output ports (and, for generated tools, every output file
+    option); every other file prop is an input. A file both read and written (e.g. the
+    topology updated by solvate) is in both lists.
+
+    Args:
+        node_cls (type): The node class.
+        values (dict): The node values, by flag.
+
+    Returns:
+        tuple: The input files (list) and the output files (list).
+    """
+    spec = NodeSpec.of(node_cls)
+    in_flags = {spec.port_props[p.name] for p in spec.in_ports if p.name in spec.port_props}
+    out_flags = {spec.port_props[p.name] for p in spec.out_ports if p.name in spec.port_props}
+    for flag, opt in (getattr(node_cls, "GMX_OPTIONS", None) or {}).items():
+        if opt.get("kind") == "file":
+            if opt.get("direction") in ("in", "inout"):
+                in_flags.add(flag)
+            if opt.get("direction") in ("out", "inout"):
+                out_flags.add(flag)
+
+    inputs, outputs = [], []
+    for flag in values:
+        value = values[flag]
+        if flag not in spec.file_flags and flag not in out_flags or not isinstance(value, str) or not value:
+            continue
+        if flag in in_flags or flag not in out_flags:
+            inputs.append(value)
+        if flag in out_flags:
+            outputs.append(value)
+    return inputs, outputs
+
+
+def _make_step(names, base, label, node_cls, values):
+    spec = NodeSpec.of(node_cls)
+    args, answers = command_args(spec, values)
+    inputs, outputs = step_files(node_cls, values)
+    options = {f: str(values[f]) for f in spec.executor_flags if values.get(f) not in (None, "")}
+
+    name = _NAME_RE.sub("_", base).strip("_") or "step"
+    if name in names:
+        x = 2
+        while f"{name}_{x}" in names:
+            x += 1
+        name = f"{name}_{x}"
+    names.add(name)
+    return Step(name, label, spec.identifier, args, answers, inputs, outputs, options)
+
+
+def build_steps(nodes):
+    """Returns the steps of a group of nodes, in dependency order.
+
+    Steps are first ordered by node position (left to right, as `fill_cmd`), then sorted
+    along the connections; file dependencies are added in that order (see the module
+    docstring), so the result has no cycle. Connections to nodes outside the group are
+    ignored.
+
+    Args:
+        nodes (list): The nodes (template instances are expanded into their inner nodes).
+
+    Returns:
+        list: The steps.
+    """
+    ids = {n.id for n in nodes}
+    names = set()
+    steps = []
+    entry, exit_ = {}, {}
+
+    for node in sorted(nodes, key=lambda n: n.pos()[0]):
+        template = getattr(node, "TEMPLATE", None)
+        if template is None:
+            step = _make_step(names, node.name(), node.name(), type(node), node.model.custom_properties)
+            steps.append(step)
+            for port in node.input_ports():
+                entry[(node.id, port.name())] = [step]
+            for port in node.output_ports():
+                exit_[(node.id, port.name())] = [step]
+            continue
+
+        registry = node.graph._node_factory.nodes
+        values = node.inner_values()
+        inner = {}
+        for key in sorted(template.nodes, key=lambda k: template.nodes[k]["pos"][0]):
+            node_cls = registry.get(template.nodes[key]["type_"])
+            if node_cls is None:
+                logging.warning("Unknown node type in template '%s': %s skipped", template.name, key)
+                continue
+            inner[key] = _make_step(names, f"{node.name()} {key}", f"{node.name()} / {key}", node_cls, values[key])
+            steps.append(inner[key])
+        for out_key, _, in_key, _ in template.connections:
+            if out_key in inner and in_key in inner:
+                _add_dep(inner[in_key], inner[out_key])
+        for port, targets in template.inputs.items():
+            entry[(node.id, port)] = [inner[k] for k, _ in targets if k in inner]
+        for port, targets in template.outputs.items():
+            exit_[(node.id, port)] = [inner[k] for k, _ in targets if k in inner]
+
+    for node in nodes:
+        for port in node.input_ports():
+            for src in port.connected_ports():
+                if src.node().id not in ids:
+                    continue
+                for upstream in exit_.get((src.node().id, src.name()), ()):
+                    for step in entry.get((node.id, port.name()), ()):
+                        _add_dep(step, upstream)
+
+    steps = _topological(steps)
+
+    producers = {}
+    for step in steps:
+        for path in step.inputs:
+            upstream = producers.get(path)
+            if upstream is not None and upstream is not step:
+                _add_dep(step, upstream)
+        for path in step.outputs:
+            # Two steps writing the same file (e.g. two instances of a template left with
+            # the same file names) must not run at the same time
+            upstream = producers.get(path)
+            if upstream is not None and upstream is not step:
+                _add_dep(step, upstream)
+            producers[path] = step
+    return steps
+
+
+def _add_dep(step, upstream):
+    if upstream.name not in step.deps:
+        step.deps.append(upstream.name)
+
+
+def _topological(steps):
+    """Sorts steps along their dependencies, keeping the given order otherwise."""
+    index = {s.name: i for i, s in enumerate(steps)}
+    children = {s.name: [] for s in steps}
+    waiting = {}
+    for step in steps:
+        waiting[step.name] = len(step.deps)
+        for dep in step.deps:
+            children[dep].append(step)
+
+    ready = [index[s.name] for s in steps if not s.deps]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        step = steps[heapq.heappop(ready)]
+        ordered.append(step)
+        for child in children[step.name]:
+            waiting[child.name] -= 1
+            if not waiting[child.name]:
+                heapq.heappush(ready, index[child.name])
+
+    if len(ordered) != len(steps):
+        stuck = next(s for s in steps if waiting[s.name])
+        raise ValueError(f"Dependency cycle through '{stuck.label}'")
+    return ordered
@@ -0,0 +1,238 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from Qt import QtCore # type: ignore
+
+from app.utils.session_format import MENU_PROP, serialize_node
+from app.utils.session_journal import ChangeJournal
+
+
+"""
+Incremental autosave of the node graph.
+
+Every edit (node added / deleted / moved, ports connected / disconnected, property changed)
+is recorded as a small journal record and flushed to disk once per second, so the autosave
+cost follows the size of the edit rather than the size of the graph. The journal is
+periodically compacted into a full snapshot (see `app.utils.session_journal`).
+
+Classes:
+    SessionAutosave:
+        Listens to the NodeGraph signals and feeds the change journal.
+"""
+
+
+# Seconds between two journal flushes (at most this much work is lost on a crash)
+FLUSH_INTERVAL = 1.0
+
+# The journal is compacted into a new snapshot past any of these limits
+COMPACT_RECORDS = 5000
+COMPACT_BYTES = 4 * 1024 * 1024
+COMPACT_SECONDS = 10 * 60
+
+# Node properties that do not need to be autosaved
+_SKIPPED_PROPS = {MENU_PROP, "selected"}
+
+
+class SessionAutosave(QtCore.QObject):
+    """SessionAutosave records the edits of a NodeGraph into a `ChangeJournal`.
+
+    Property changes and moves of the same node are coalesced between two flushes. Changes
+    that do not go through the graph signals (nodes pasted or duplicated, undo / redo) are
+    caught as well: new or vanished nodes are reconciled at each flush, and an undo or redo
+    triggers a compaction, as does a new template instance (templates are only stored in
+    snapshots).
+
+    Attributes:
+        node_graph (NodeGraph): The graph to autosave.
+        journal (ChangeJournal): The snapshot + journal writer.
+        ui_state_provider (callable): Returns the UI state stored with each snapshot, or None.
+        enabled (bool): Whether edits are being recorded.
+
+    Methods:
+        start(): Writes a first snapshot and starts recording.
+        flush(): Writes the pending records (called by the timer).
+        compact(): Writes a new snapshot and starts an empty journal.
+        paused(): Context manager suspending the recording (e.g. while loading a session).
+        discard(): Stops recording and removes the autosave (clean exit).
+    """
+    def __init__(self, node_graph, root=None, ui_state_provider=None, parent=None):
+        super().__init__(parent)
+        self.node_graph = node_graph
+        self.journal = ChangeJournal(root)
+        self.ui_state_provider = ui_state_provider
+        self.enabled = False
+
+        self._known_ids = set()
+        self._pending = {}
+        self._seq = 0
+        self._needs_compact = False
+        self._last_compact = time.monotonic()
+        self._undo_state = (0, 0)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(int(FLUSH_INTERVAL * 1000))
+        self._timer.timeout.connect(self.flush)
+
+        node_graph.node_created.connect(self._on_node_created)
+        node_graph.nodes_deleted.connect(self._on_nodes_deleted)
+        node_graph.port_connected.connect(self._on_port_connected)
+        node_graph.port_disconnected.connect(self._on_port_disconnected)
+        node_graph.property_changed.connect(self._on_property_changed)
+        node_graph.viewer().moved_nodes.connect(self._on_nodes_moved)
+        node_graph.undo_stack().indexChanged.connect(self._on_undo_index_changed)
+
+    # -------------------------
+    # Recording
+    # -------------------------
+    def start(self):
+        self.enabled = True
+        self.compact()
+        self._timer.start()
+
+    @contextmanager
+    def paused(self):
+        """Suspends the recording; a new snapshot is taken afterwards."""
+        was_enabled = self.enabled
+        self.enabled = False
+        try:
+            yield
+        finally:
+            self.enabled = was_enabled
+            if was_enabled:
+                self.compact()
+
+    def discard(self):
+        self.enabled = False
+        self._timer.stop()
+        self._pending = {}
+        self.journal.discard()
+
+    def _record(self, tag, payload, key=None):
+        """Queues one record; records sharing a `key` replace each other until the next flush."""
+        if not self.enabled:
+            return
+        if key is None:
+            self._seq += 1
+            key = self._seq
+        self._pending[key] = (tag, payload)
+
+    def _add_node_record(self, node):
+        node_id, node_dict, add_custom = serialize_node(node)
+        for k in ("inputs", "outputs"):
+            node_dict.pop(k, None)
+        self._known_ids.add(node_id)
+        self._record(b"A", [node_id, node_dict, add_custom])
+        if getattr(node, "TEMPLATE", None) is not None:
+            # The journal does not hold templates: the next snapshot stores it
+            self._needs_compact = True
+
+    def _on_node_created(self, node):
+        if self.enabled:
+            self._add_node_record(node)
+
+    def _on_nodes_deleted(self, node_ids):
+        if not self.enabled:
+            return
+        self._known_ids.difference_update(node_ids)
+        self._record(b"D", list(node_ids))
+
+    def _on_port_connected(self, in_port, out_port):
+        self._record_connection(b"C", in_port, out_port)
+
+    def _on_port_disconnected(self, in_port, out_port):
+        self._record_connection(b"X", in_port, out_port)
+
+    def _record_connection(self, tag, port_a, port_b):
+        if not self.enabled:
+            return
+        # Normalize direction (output -> input)
+        if port_a.type_() == "in":
+            port_a, port_b = port_b, port_a
+        self._record(tag, [port_a.node().id, port_a.name(), port_b.node().id, port_b.name()])
+
+    def _on_property_changed(self, node, name, value):
+        if name in _SKIPPED_PROPS or not self.enabled:
+            return
+        self._record(b"P", [node.id, name, value], key=("P", node.id, name))
+
+    def _on_nodes_moved(self, moved):
+        if not self.enabled:
+            return
+        for view in moved:
+            x, y = view.xy_pos
+            self._record(b"M", [view.id, x, y], key=("M", view.id))
+
+    def _on_undo_index_changed(self, index):
+        if not self.enabled:
+            return
+        state = (index, self.node_graph.undo_stack().count())
+        # Same number of commands but another index: undo or redo, which change the graph
+        # without the signals above. Take a new snapshot instead of guessing the changes
+        if state[1] == self._undo_state[1] and state[0] != self._undo_state[0]:
+            self._needs_compact = True
+        self._undo_state = state
+
+    # -------------------------
+    # Writing
+    # -------------------------
+    def _reconcile(self):
+        """Journals the nodes added or removed without a signal (paste, duplicate, undo)."""
+        nodes = {n.id: n for n in self.node_graph.all_nodes()}
+        added = [n for i, n in nodes.items() if i not in self._known_ids]
+        removed = self._known_ids.difference(nodes)
+        if removed:
+            self._on_nodes_deleted(list(removed))
+        for node in added:
+            self._add_node_record(node)
+        # Connections of the new nodes (made without port_connected signals)
+        for node in added:
+            for port in node.output_ports():
+                for other in port.connected_ports():
+                    self._record(b"C", [node.id, port.name(), other.node().id, other.name()],
+                                 key=("C", node.id, port.name(), other.node().id, other.name()))
+            for port in node.input_ports():
+                for other in port.connected_ports():
+                    self._record(b"C", [other.node().id, other.name(), node.id, port.name()],
+                                 key=("C", other.node().id, other.name(), node.id, port.name()))
+
+    def flush(self):
+        """Writes the pending records, compacting the journal when it has grown too much."""
+        if not self.enabled:
+            return
+        try:
+            # Cheap check: only walk the graph when the node count moved without signals
+            if len(self._known_ids) != len(self.node_graph.model.nodes):
+                self._reconcile()
+
+            journal = self.journal
+            too_big = journal.record_count > COMPACT_RECORDS or journal.size > COMPACT_BYTES
+            too_old = journal.record_count and time.monotonic() - self._last_compact > COMPACT_SECONDS
+            if self._needs_compact or too_big or too_old:
+                self.compact()
+                return
+
+            for tag, payload in self._pending.values():
+                journal.append(tag, payload)
+            self._pending = {}
+            journal.flush()
+        except Exception:
+            logging.exception("Autosave failed")
+
+    def compact(self):
+        self._pending = {}
+        self._needs_compact = False
+        self._last_compact = time.monotonic()
+        ui_data = None
+        if self.ui_state_provider is not None:
+            try:
+                ui_data = self.ui_state_provider()
+            except Exception:
+                logging.exception("Failed to capture the UI state for the autosave")
+        try:
+            self.journal.compact(self.node_graph, ui_data)
+        except Exception:
+            logging.exception("Autosave snapshot failed")
+        self._known_ids = {n.id for n in self.node_graph.all_nodes()}
+        stack = self.node_graph.undo_stack()
+        self._undo_state = (stack.index(), stack.count())
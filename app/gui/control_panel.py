@@ -1,6 +1,10 @@
 from Qt import QtWidgets, QtCore # type: ignore
-import os, logging, pathlib, json, tempfile
-from app.gui.process_runner import ProcessRunner
+import os, logging, pathlib, time
+from contextlib import nullcontext
+from app.utils.session_format import SESSION_SUFFIX, load_session, write_session
+
+
+SESSION_FILTER = f"GroGUI sessions (*{SESSION_SUFFIX});;JSON sessions (*.json);;All Files (*)"
 
 
 def fill_one_cmd(node):
@@ -9,13 +13,21 @@ def fill_one_cmd(node):
     return cmd_tmp
 
 
+def node_cmds(node):
+    """Returns the gmx commands of a node: one per inner node for a template instance."""
+    if hasattr(node, "commands"):
+        return [
+            " ".join(["gmx", tool, " ".join(f"{name} {value}" for name, value in props.items())])
+            for tool, props in node.commands()
+        ]
+    return [" ".join(["gmx", node.__identifier__, fill_one_cmd(node)])]
+
+
 def fill_cmd(nodes=None, preview=False):
 
     # For preview: display props of selected node
     if preview and nodes is not None:
-        cmd_tmp = fill_one_cmd(nodes)
-        cmd = " ".join(["gmx", nodes.__identifier__, cmd_tmp])
-        return cmd
+        return "\n".join(node_cmds(nodes))
 
     # Return gmx_cmd of multiple nodes or all_nodes
     cmds = []
@@ -23,8 +35,7 @@ def fill_cmd(nodes=None, preview=False):
     all_nodes = sorted(nodes, key=lambda n: n.pos()[0])
 
     for node in all_nodes:
-        cmd_tmp = fill_one_cmd(node)
-        cmds.append(" ".join(["gmx", node.__identifier__, cmd_tmp]))
+        cmds.extend(node_cmds(node))
     return cmds
 
 
@@ -37,27 +48,41 @@ class ControlPanel(QtWidgets.QWidget):
         layout (QVBoxLayout): The layout manager for arranging widgets vertically.
         select_all_btn (QPushButton): Button to select all nodes in the node graph.
         generate_bash_script_btn (QPushButton): Button to generate a Bash script from the node graph.
-        generate_python_script_btn (QPushButton): Button to generate a Python script from the node graph.
+        generate_python_script_btn (QPushButton): Button to export the node graph as a parallel Python driver script.
+        generate_makefile_btn (QPushButton): Button to export the node graph as a Makefile (parallel `make -j`).
+        submit_queue_btn (QPushButton): Button to add the node graph to a shared-filesystem work queue.
         save_session (QPushButton): Button to save the current session of the UI and node graph.
         load_session (QPushButton): Button to load a previously saved session of the UI and node graph.
         refresh_session (QPushButton): Button to refresh the current session of the UI and node graph.
+        autosave (SessionAutosave): The autosave, paused while a session is loaded (set by MainWindow).
+        props_bin (MyPropertiesBin): The properties bin once built, refreshed by `_refresh_ui` (set by MainWindow).
+        templates (TemplateLibrary): Receives the templates of the loaded sessions (set by MainWindow).
+        workdir_provider (callable): Returns the working directory recorded in the saved sessions (set by MainWindow).
     
     Methods:
         select_all_nodes(): Returns a list of all nodes in the node graph.
-        _save_ui(): Saves the current UI state and node graph session to a JSON file.
-        _load_ui(): Loads a UI state and node graph session from a JSON file.
-        _refresh_ui(): Saves the current UI state and then loads it back.
+        _save_ui(): Saves the current UI state and node graph session to a compact session file.
+        _load_ui(): Loads a UI state and node graph session from a compact (or former JSON) session file.
+        _refresh_ui(): Updates the stale node items and property editors from the graph model.
         generate_bash_script(): Generates a Bash script based on the current node graph.
-        generate_python_script(): Generates a Python script based on the current node graph.
+        generate_python_script(): Exports the node graph as a runnable Python driver script.
+        generate_makefile(): Exports the node graph as a Makefile with one target per node.
+        submit_to_queue(): Adds the node graph as tasks of a shared-filesystem work queue.
     """
     def __init__(self, node_graph, ui_state):
         super().__init__()
         self.node_graph = node_graph
         self.ui_state = ui_state
+        self.autosave = None
+        self.props_bin = None
+        self.templates = None
+        self.workdir_provider = None
         self.layout = QtWidgets.QVBoxLayout(self)
         self.select_all_btn = QtWidgets.QPushButton("Select all nodes")
         self.generate_bash_script_btn = QtWidgets.QPushButton("Generate Bash Script")
         self.generate_python_script_btn = QtWidgets.QPushButton("Generate Python Script")
+        self.generate_makefile_btn = QtWidgets.QPushButton("Generate Makefile (make -j)")
+        self.submit_queue_btn = QtWidgets.QPushButton("Submit to work queue")
         self.save_session = QtWidgets.QPushButton("Save session (UI + NodeGraph)")
         self.load_session = QtWidgets.QPushButton("Load session (UI + NodeGraph)")
         self.refresh_session = QtWidgets.QPushButton("Refresh session (UI + NodeGraph)")
@@ -65,6 +90,8 @@ class ControlPanel(QtWidgets.QWidget):
         self.layout.addWidget(self.select_all_btn)
         self.layout.addWidget(self.generate_bash_script_btn)
         self.layout.addWidget(self.generate_python_script_btn)
+        self.layout.addWidget(self.generate_makefile_btn)
+        self.layout.addWidget(self.submit_queue_btn)
         self.layout.addWidget(self.save_session)
         self.layout.addWidget(self.load_session)
         self.layout.addWidget(self.refresh_session)
@@ -85,7 +112,7 @@ class ControlPanel(QtWidgets.QWidget):
     def _save_ui(self, save_path=None):
         """Saves the current UI state and NodeGraph session to a specified file.
         
-        This method allows the user to save the current state of the UI and the NodeGraph session either to a user-defined path or through a file dialog. It serializes the session data, cleans up temporary properties, and writes the data to a JSON file.
+        This method allows the user to save the current state of the UI and the NodeGraph session either to a user-defined path or through a file dialog. The session is written in the compact format (see `app.utils.session_format`), node by node.
         
         Args:
             save_path (str, optional): The path where the UI state and session should be saved. If not provided, a file dialog will be opened for the user to select a save location.
@@ -104,88 +131,33 @@ class ControlPanel(QtWidgets.QWidget):
                 parent=self,
                 caption="Save session",
                 directory=os.getcwd(),
-                filter="JSON Files (*.json);;All Files (*)",
+                filter=SESSION_FILTER,
             )
             if not path:
-                logging.warning("Could not save the session into a json file")
+                logging.warning("Could not save the session file")
                 return
 
             path = pathlib.Path(path)
+            if not path.suffix:
+                path = path.with_suffix(SESSION_SUFFIX)
 
-        # 1) Save graph
-        # Use serialize instead of save_session here because we need to modify the json
-        try:
-            # temporarily hide any transient menu to prevent NodeGraphQt error
-            for node in self.node_graph.all_nodes():
-                if "Add optional property" in node.properties().get("custom", {}):
-                    node.set_property("Add optional property", None)
-        except Exception:
-            logging.warning("Failed to clean temporary Add_Props before serialize")
-        
-        # Safe serialization
+        # Graph, UI state and optional props ('add_custom') are written in a single pass
         try:
-            graph_data = self.node_graph.serialize_session()
+            ui_data = self.ui_state.capture(self.window())
+            if self.workdir_provider is not None:
+                # Tells the artifact store which working directory the session uses
+                ui_data["workdir"] = self.workdir_provider()
+            writer = write_session(self.node_graph, path, ui_data)
         except Exception as e:
-            logging.exception(f"Failed to serialize session safely: {e}")
+            logging.exception(f"Failed to save session: {e}")
             return
-        
-        for n in graph_data.get("nodes", {}).values():
-            n.pop("accept_connection_types", None)
-            n.pop("reject_connection_types", None)
-
-        graph_data.get("graph", {}).pop("accept_connection_types", None)
-        graph_data.get("graph", {}).pop("reject_connection_types", None)
-        for n in graph_data.get("nodes", {}).values():
-            n.pop("accept_connection_types", None)
-            n.pop("reject_connection_types", None)
 
-        # 2) Save UI state
-        ui_data = self.ui_state.capture(self.window())
-
-        # 3) Save custom_props in specific json key
-        added_by_name = {}
-
-        # 3.1) Collect optional props (by FLAG) present in custom
-        for node in self.node_graph.all_nodes():
-            optional_flags = set(getattr(node, "OPTIONAL_PROPS", {}).keys())
-            custom_src = node.properties().get("custom", {})
-
-            # We only move the optional flags present in custom
-            moved = {k: v for k, v in custom_src.items() if k in optional_flags}
-            if moved:
-                added_by_name[node.name()] = moved
-
-        # 3.2) Write add_custom and purge custom to avoid deserialize errors
-        for node_dict in graph_data.get("nodes", {}).values():
-            name = node_dict.get("name")
-            moved = added_by_name.get(name)
-            if not moved:
-
-                # At least we purge the menu key is present
-                custom_json = node_dict.setdefault("custom", {})
-                custom_json.pop("Add optional property", None)
-                custom_json.pop("Add optional property", None)
-                continue
-
-            node_dict["add_custom"] = moved
-
-            custom_json = node_dict.setdefault("custom", {})
-            # Delete the moved optional flags 
-            for k in moved.keys():
-                custom_json.pop(k, None)
-
-            # Delete the additional property menu in the json
-            custom_json.pop("Add optional property", None)
-            custom_json.pop("Add optional property", None)
-
-        bundle = {"graph": graph_data, "ui": ui_data}
-        path.write_text(json.dumps(bundle, indent=2), encoding="utf-8")
-        logging.info("UI state saved at %s", path)
+        logging.info("UI state saved at %s (%d nodes, %d connections)", path, writer.node_count, writer.connection_count)
 
     def _load_ui(self, save_path=None):
         """Load the user interface (UI) state from a specified session file or prompt the user to select one.
         
-        This method attempts to load the UI state and node graph session from a JSON file. If a save path is provided, it will load from that path; otherwise, it will open a file dialog for the user to select a session file. The method also restores any custom properties for nodes in the graph and updates the UI state accordingly.
+        This method loads the node graph session and UI state from a compact session file, or from a JSON file saved by former versions. Nodes are created (with their optional properties) as the file is read, and the canvas is repainted once they are all loaded.
         
         Args:
             save_path (str, optional): The path to the session file to load. If not provided, a file dialog will be opened.
@@ -194,7 +166,7 @@ class ControlPanel(QtWidgets.QWidget):
             Exception: If there is an error during the loading process, including issues with deserializing the session or restoring UI state.
         
         Logging:
-            Logs information about the loading process, warnings for missing nodes, and exceptions if any errors occur.
+            Logs information about the loading process, warnings for unknown nodes, and exceptions if any errors occur.
         """
         if save_path:
             path = pathlib.Path(save_path)
@@ -204,7 +176,7 @@ class ControlPanel(QtWidgets.QWidget):
                 parent=self,
                 caption="Load session file",
                 directory=os.getcwd(),
-                filter="JSON Files (*.json);;All Files (*)",
+                filter=SESSION_FILTER,
             )
             if not path_str:
                 logging.warning("Could not find session file to load")
@@ -212,62 +184,46 @@ class ControlPanel(QtWidgets.QWidget):
             path = pathlib.Path(path_str)
             logging.info(f"Loading UI state + NodeGraph session from: {path}")
 
-        # Load json
-        data = json.loads(path.read_text(encoding="utf-8"))
-        graph_data = data.get("graph", {})
-
-        # 1) Deserialize the node graph safely
-        try:
-            self.node_graph.deserialize_session(graph_data)
-        except Exception:
-            logging.exception("Failed to load UI session")
-            return
-
-        # 2) Restore optional properties stored in 'add_custom'
-        for node_dict in graph_data.get("nodes", {}).values():
-            node_name = node_dict.get("name")
-            add_customs = node_dict.get("add_custom", {})
-
-            if not add_customs:
-                continue
+        from app.nodes.gmx_catalog import get_catalog
+        from app.nodes.templates import SubgraphTemplate
 
-            node = self.node_graph.get_node_by_name(node_name)
-            if not node:
-                logging.warning(f"Node '{node_name}' not found while loading add_custom")
-                continue
+        # 1) Stream the nodes into the graph
+        # Generated node types used by the session must be registered first
+        catalog = get_catalog()
 
-            for flag, value in add_customs.items():
-                try:
-                    # Combine all possible props (BASE + OPTIONAL)
-                    base = getattr(node, "BASE_PROPS", {})
-                    opt = getattr(node, "OPTIONAL_PROPS", {})
-                    all_props = {**base, **opt}  # flag -> (label, default)
+        def register_type(node_type):
+            if node_type and not catalog.ensure_registered(self.node_graph, node_type):
+                if node_type not in self.node_graph.registered_nodes():
+                    logging.warning("Unknown node type '%s' in session", node_type)
 
-                    # Retrieve label + default value
-                    label, default_val = all_props.get(flag, (flag, ""))
+        def show_progress(count):
+            # Keep the window responsive while the file is read (user input is held back)
+            QtWidgets.QApplication.processEvents(QtCore.QEventLoop.ExcludeUserInputEvents)
 
-                    # Create widget according to type
-                    if isinstance(default_val, list):
-                        node.add_combo_menu(name=flag, label=label, items=default_val)
-                    else:
-                        node.add_text_input(name=flag, label=label, text=value)
+        def register_template(data):
+            if self.templates is not None:
+                self.templates.add(SubgraphTemplate.from_dict(data))
 
-                    # Hide widget and reset Add optional property dropdown
-                    node.hide_widget(name=flag, push_undo=False)
-                    node.set_property("Add optional property", None)
-
-                    logging.info(f"Restored custom property '{flag}' for node '{node_name}'")
-
-                except Exception:
-                    logging.exception(f"Failed to restore property '{flag}' on node '{node_name}'")
+        # The autosave takes a single snapshot once the session is loaded
+        paused = self.autosave.paused() if self.autosave is not None else nullcontext()
+        try:
+            with paused:
+                nodes, ui_data = load_session(
+                    self.node_graph, path,
+                    on_type=register_type, on_template=register_template, on_progress=show_progress,
+                )
+        except Exception:
+            logging.exception("Failed to load UI session")
+            return
+        logging.info("Loaded %d nodes", len(nodes))
 
-        # 3) Restore the UI layout and state
+        # 2) Restore the UI layout and state
         try:
-            self.ui_state.restore(self.parent(), data.get("ui", {}))
+            self.ui_state.restore(self.parent(), ui_data)
         except Exception:
             logging.exception("Failed to restore UI state")
 
-        # 4) Bring the main window to focus
+        # 3) Bring the main window to focus
         main_window = self.window()
         main_window.showNormal()
         main_window.setWindowState(main_window.windowState() | QtCore.Qt.WindowMaximized)
@@ -276,7 +232,7 @@ class ControlPanel(QtWidgets.QWidget):
 
         logging.info("UI state loaded successfully")
 
-        # 5)  Force refresh ControlPanel layout
+        # 4)  Force refresh ControlPanel layout
         try:
             self.setVisible(True)
             self.updateGeometry()
@@ -285,24 +241,32 @@ class ControlPanel(QtWidgets.QWidget):
             logging.exception("Failed to refresh ControlPanel UI after load")
 
     def _refresh_ui(self):
-        """Refreshes the user interface by saving and loading the UI state.
+        """Refreshes the display of the node graph from its model, in memory.
         
-        This method creates a temporary JSON file to store the current UI state, 
-        saves the UI to this file, and then loads the UI from the file. The 
-        temporary file is deleted after the operation.
-        
-        Args:
-            None
+        The live graph model is compared with what is displayed, and only the stale parts
+        are updated: node items and embedded widgets (`MyBaseNode.sync_view`) and the
+        property editors shown in the properties bin (`MyPropertiesBin.sync_node`).
+        Nothing is written to disk.
         
         Returns:
-            None
+            tuple: The number of stale nodes and of stale property editors.
         """
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-            save_path = tmp.name
-            self._save_ui(save_path=save_path)
-            self._load_ui(save_path=save_path)
-            os.remove(save_path)
-
+        start = time.perf_counter()
+        stale_nodes = stale_editors = 0
+        for node in self.node_graph.all_nodes():
+            try:
+                if hasattr(node, "sync_view") and node.sync_view():
+                    stale_nodes += 1
+                if self.props_bin is not None and self.props_bin.sync_node(node):
+                    stale_editors += 1
+            except Exception:
+                logging.exception(f"Failed to refresh node '{node.name()}'")
+
+        logging.info(
+            "Refresh UI: %d stale nodes, %d stale property editors (%.1f ms)",
+            stale_nodes, stale_editors, (time.perf_counter() - start) * 1e3,
+        )
+        return stale_nodes, stale_editors
 
     def generate_bash_script(self):
         """Generates a Bash script to run GROMACS commands.
@@ -330,95 +294,117 @@ class ControlPanel(QtWidgets.QWidget):
 
         with open("run_gromacs.sh", "w") as f:
             f.write("".join(script))
-            print(f"Bash script generated at {"run_gromacs.sh"}")
+            print("Bash script generated at run_gromacs.sh")
 
 
-    def generate_python_script(self):
-        """Generates a Python script to run GROMACS commands.
-        
-        This method creates a Python script named `run_gromacs.py` that includes
-        the necessary commands to execute GROMACS simulations. The commands are
-        generated based on the nodes in the node graph.
-        
-        The generated script imports the `subprocess` module and writes the
-        commands to the file. After successfully creating the script, a message
-        is printed to indicate the location of the generated file.
-        
-        Attributes:
-            node_graph (NodeGraph): An object containing all nodes for command
-            generation.
-        
+    def generate_python_script(self, path=None):
+        """Exports the nodes of the graph as a runnable Python driver script.
+
+        The script is self-contained and carries the workflow as data: it runs independent
+        steps in parallel, skips the up-to-date ones, records the time of each step and stops
+        on the first failure (see `app.export.python_driver`). The GMXRC of the gmx
+        installation is used as the default environment.
+
+        Args:
+            path (str, optional): The script to write. If not provided, a file dialog is opened.
+
         Returns:
-            None
+            list: The exported steps, or None if nothing was written.
         """
-        script = []
-        cmds = fill_cmd(nodes=self.node_graph.all_nodes())
+        if not path:
+            path, _ = QtWidgets.QFileDialog.getSaveFileName(
+                parent=self,
+                caption="Export Python driver",
+                directory=os.path.join(os.getcwd(), "run_gromacs.py"),
+                filter="Python scripts (*.py);;All Files (*)",
+            )
+            if not path:
+                return None
+        from app.export.python_driver import write_python_script
+        from app.nodes.gmx_catalog import find_gmxrc
 
-        script.append("import subprocess\n\n")
-        script.append("\n\n".join(cmds))
+        try:
+            steps = write_python_script(self.node_graph.all_nodes(), path, gmxrc=find_gmxrc())
+        except Exception:
+            logging.exception("Failed to export the Python script")
+            return None
+        logging.info("Python driver with %d steps generated at %s", len(steps), path)
+        return steps
 
-        with open("run_gromacs.py", "w") as f:
-            f.write("".join(script))
-            print(f"Python script generated at {"run_gromacs.py"}")
+    def generate_makefile(self, path=None):
+        """Exports the nodes of the graph as a Makefile.
 
+        Each node becomes a target depending on the nodes that produce its input files, so
+        `make -j N` runs independent branches in parallel and skips the steps whose outputs
+        are up to date (see `app.export.makefile`). The GMXRC of the gmx installation is
+        used as the default environment.
 
+        Args:
+            path (str, optional): The Makefile to write. If not provided, a file dialog is opened.
 
+        Returns:
+            list: The exported steps, or None if nothing was written.
+        """
+        if not path:
+            path, _ = QtWidgets.QFileDialog.getSaveFileName(
+                parent=self,
+                caption="Export Makefile",
+                directory=os.path.join(os.getcwd(), "Makefile"),
+                filter="Makefile (Makefile *.mk);;All Files (*)",
+            )
+            if not path:
+                return None
+        from app.export.makefile import write_makefile
+        from app.nodes.gmx_catalog import find_gmxrc
 
-class GromacsPanel(QtWidgets.QWidget):
-    """GromacsPanel is a QWidget that provides a user interface for running Gromacs commands on selected nodes in a node graph.
-    
-    Attributes:
-        node_graph (NodeGraph): The graph containing nodes to be processed.
-        process_runner (ProcessRunner): An instance responsible for executing commands.
-        layout (QVBoxLayout): The layout manager for arranging widgets vertically.
-        run_selected_nodes (QPushButton): Button to run the selected nodes.
-        run_all (QPushButton): Button to run all nodes in the graph.
-        stop_btn (QPushButton): Button to stop the currently running command.
-        text (QPlainTextEdit): Text area for displaying command output and status messages.
-    
-    Methods:
-        __init__(node_graph): Initializes the GromacsPanel with the given node graph.
-        _update_preview(text): Updates the text area with the output of the command or a default message if no command is available.
-    """
-    def __init__(self, node_graph):
-        super().__init__()
-        self.node_graph = node_graph
-        self.process_runner = ProcessRunner()
-        
-        self.layout = QtWidgets.QVBoxLayout(self)
-        self.run_selected_nodes = QtWidgets.QPushButton("Run the selected nodes")
-        self.run_all = QtWidgets.QPushButton("Run all nodes")
-        self.stop_btn = QtWidgets.QPushButton("Stop the run")
-        self.text = QtWidgets.QPlainTextEdit(readOnly=True)
-        self.text.setPlainText("Waiting for a gromacs command to be executed...")
-        self.text.setMinimumHeight(100)
-        # No line wrap
-        self.text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
-
-
-        self.layout.addWidget(self.run_selected_nodes)
-        self.layout.addWidget(self.run_all)
-        self.layout.addWidget(self.stop_btn)
-        self.layout.addStretch(1)
-        self.layout.addWidget(self.text)
-
-        self.run_all.clicked.connect(lambda: self.process_runner.run(cmds=fill_cmd(nodes=node_graph.all_nodes())))
-        self.stop_btn.clicked.connect(self.process_runner.stop)
-        # self.run_selected_nodes.clicked.connect(self.process_runner._run_selected_nodes)
-        # self.run_selected_nodes.clicked.connect(self.process_runner._run_all)
-        # self.run_selected_nodes.clicked.connect(self.process_runner._stop_run)
-
-        self.process_runner.command_started.connect(self._update_preview)
-        self.process_runner.command_output.connect(self._update_preview)
+        try:
+            steps = write_makefile(self.node_graph.all_nodes(), path, gmxrc=find_gmxrc())
+        except Exception:
+            logging.exception("Failed to export the Makefile")
+            return None
+        logging.info("Makefile with %d targets generated at %s", len(steps), path)
+        return steps
+
+    def submit_to_queue(self, queue_path=None, workdir=None):
+        """Adds the nodes of the graph as tasks of a work queue.
+
+        The queue is an SQLite file on a shared filesystem, run by workers started on any
+        number of hosts (`python -m app.jobs.work_queue QUEUE worker`, see
+        `app.jobs.work_queue`). Each node becomes a task, claimed once its inputs are done.
 
-    
-    def _update_preview(self, text):
-        """Updates the preview display with the given text.
-        
-        If the provided text is None or an empty string, it displays a default message.
-        
         Args:
-            text (str): The text to display in the preview. If None or empty, defaults to "No command to display".
+            queue_path (str, optional): The queue file, created if needed. If not provided, a file dialog is opened.
+            workdir (str, optional): The directory the tasks run in, seen by every worker host.
+                If not provided, a directory dialog is opened.
+
+        Returns:
+            str: The job id of the tasks, or None if nothing was submitted.
         """
-        # self.text.setPlainText(text or "No command to display")
-        self.text.appendPlainText(text or "No command to display")
\ No newline at end of file
+        if not queue_path:
+            queue_path, _ = QtWidgets.QFileDialog.getSaveFileName(
+                parent=self,
+                caption="Work queue",
+                directory=os.path.join(os.getcwd(), "grogui-queue.sqlite"),
+                filter="Work queues (*.sqlite *.db);;All Files (*)",
+                options=QtWidgets.QFileDialog.DontConfirmOverwrite,
+            )
+            if not queue_path:
+                return None
+        if not workdir:
+            workdir = QtWidgets.QFileDialog.getExistingDirectory(
+                self, "Directory the tasks run in", os.path.dirname(queue_path)
+            )
+            if not workdir:
+                return None
+        from app.jobs.plan import make_plan
+        from app.jobs.work_queue import WorkQueue
+        from app.nodes.gmx_catalog import find_gmxrc
+
+        try:
+            plan = make_plan(self.node_graph.all_nodes(), workdir, pathlib.Path(workdir).name, gmxrc=find_gmxrc())
+            job = WorkQueue(queue_path).enqueue(plan)
+        except Exception:
+            logging.exception("Failed to submit the work queue tasks")
+            return None
+        logging.info("Job %s: %d tasks added to %s", job, len(plan["steps"]), queue_path)
+        return job
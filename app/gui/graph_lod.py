@@ -0,0 +1,199 @@
+import logging
+
+from Qt import QtCore, QtGui, QtWidgets # type: ignore
+from NodeGraphQt.constants import NodeEnum # type: ignore
+from NodeGraphQt.qgraphics.node_abstract import AbstractNodeItem # type: ignore
+from NodeGraphQt.qgraphics.node_base import NodeItem # type: ignore
+
+
+"""
+Level-of-detail rendering for large graphs.
+
+When the canvas is zoomed out below `LOD_ZOOM_THRESHOLD`, every `LodNodeItem` is drawn as a
+plain colored box (no name, icon, port labels nor ports), and the individual pipes are hidden
+and replaced by one batched path drawn in a single call. Items outside the exposed area are
+not painted at all.
+
+Classes:
+    LodNodeItem:
+        NodeItem used by `MyBaseNode`, with a cheap shared proxy-mode switch and a simplified paint.
+
+    GraphLodController:
+        Watches the viewer zoom and switches the whole scene between full and low detail.
+"""
+
+
+# Below this view scale, nodes are drawn as simplified boxes
+LOD_ZOOM_THRESHOLD = 0.45
+
+
+class LodNodeItem(NodeItem):
+    """NodeItem drawing a simplified box when the graph is in low-detail mode.
+
+    The low-detail state is shared by every item (`LodNodeItem.low_detail`) and switched by
+    `GraphLodController`, instead of being computed per item and per paint from the screen
+    geometry as NodeItem does. It is not laid out before it is added to the scene, where
+    `post_init` draws it.
+    """
+    low_detail = False
+
+    def __init__(self, name="node", parent=None):
+        super().__init__(name, parent)
+        # Needed for option.exposedRect to be filled in paint()
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    @NodeItem.layout_direction.setter
+    def layout_direction(self, value=0):
+        # NodeItem draws the item on each change, including while it is built
+        AbstractNodeItem.layout_direction.fset(self, value)
+        if self.scene():
+            self.draw_node()
+
+    def auto_switch_mode(self):
+        self.set_proxy_mode(LodNodeItem.low_detail)
+
+    def set_proxy_mode(self, mode):
+        if mode is self._proxy_mode:
+            return
+        super().set_proxy_mode(mode)
+        # Ports (and their labels) are not drawn in low detail
+        for port in list(self._input_items) + list(self._output_items):
+            port.setVisible(not mode)
+
+    def paint(self, painter, option, widget):
+        # Viewport culling: nothing to draw outside the exposed area
+        if not option.exposedRect.intersects(self.boundingRect()):
+            return
+
+        if not LodNodeItem.low_detail:
+            super().paint(painter, option, widget)
+            return
+
+        self.auto_switch_mode()
+        if self.selected:
+            color = QtGui.QColor(*NodeEnum.SELECTED_BORDER_COLOR.value)
+        else:
+            color = QtGui.QColor(*self.color)
+        painter.fillRect(self.boundingRect(), color)
+
+
+class GraphLodController(QtCore.QObject):
+    """GraphLodController switches a NodeGraph between full and low-detail rendering.
+
+    It listens to the viewer zoom (wheel, mouse release, resize) and, when the view scale
+    crosses `threshold`, toggles `LodNodeItem.low_detail` and swaps the individual pipes for a
+    single batched path item. In low detail, the batched path is also rebuilt when nodes or
+    pipes are added or removed, or a session is loaded.
+
+    Attributes:
+        node_graph (NodeGraph): The graph to control.
+        threshold (float): The view scale below which low detail is used.
+        enabled (bool): Whether low detail may be used at all.
+
+    Methods:
+        update_lod(force=False): Re-evaluates the detail level from the current zoom.
+        set_enabled(enabled): Enables or disables low-detail rendering.
+    """
+    def __init__(self, node_graph, threshold=LOD_ZOOM_THRESHOLD):
+        super().__init__(node_graph.viewer())
+        self.node_graph = node_graph
+        self.threshold = threshold
+        self.enabled = True
+        self._batched_pipes = None
+        self._pending = False
+
+        viewer = node_graph.viewer()
+        viewer.viewport().installEventFilter(self)
+
+        node_graph.node_created.connect(self._on_graph_changed)
+        node_graph.nodes_deleted.connect(self._on_graph_changed)
+        node_graph.port_connected.connect(self._on_graph_changed)
+        node_graph.port_disconnected.connect(self._on_graph_changed)
+        node_graph.session_changed.connect(self._on_graph_changed)
+
+    def eventFilter(self, obj, ev):
+        if ev.type() in (QtCore.QEvent.Wheel, QtCore.QEvent.MouseButtonRelease, QtCore.QEvent.Resize):
+            # Evaluate once the viewer has applied the zoom / move
+            self._schedule_update()
+        return False
+
+    def _on_graph_changed(self, *args):
+        # New pipes must be hidden and the batched path must follow the graph
+        if LodNodeItem.low_detail:
+            self._schedule_update()
+
+    def _schedule_update(self):
+        # One update for a burst of events (e.g. a pasted or deleted selection)
+        if not self._pending:
+            self._pending = True
+            QtCore.QTimer.singleShot(0, self.update_lod)
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        self.update_lod(force=True)
+
+    def update_lod(self, force=False):
+        """Re-evaluates the detail level from the current view scale.
+
+        Args:
+            force (bool, optional): Re-apply the level (and rebuild the batched pipes)
+                even if it did not change. Defaults to False.
+        """
+        self._pending = False
+        try:
+            scale = self.node_graph.viewer().transform().m11()
+        except Exception:
+            logging.exception("Failed to read the viewer zoom")
+            return
+
+        low = self.enabled and scale < self.threshold
+        if low == LodNodeItem.low_detail and not force:
+            # Same level: only refresh the batched pipes (nodes may have moved)
+            if low:
+                self._rebuild_batched_pipes()
+            return
+
+        LodNodeItem.low_detail = low
+        viewer = self.node_graph.viewer()
+        for item in viewer.all_nodes():
+            if isinstance(item, LodNodeItem):
+                item.set_proxy_mode(low)
+
+        pipes = viewer.all_pipes()
+        for pipe in pipes:
+            pipe.setVisible(not low)
+        if low:
+            self._rebuild_batched_pipes(pipes)
+        elif self._batched_pipes is not None:
+            self._batched_pipes.setVisible(False)
+
+        viewer.scene().update()
+
+    def _rebuild_batched_pipes(self, pipes=None):
+        """Draws every pipe as a straight segment of one path item (a single paint call)."""
+        viewer = self.node_graph.viewer()
+        scene = viewer.scene()
+        if pipes is None:
+            pipes = viewer.all_pipes()
+
+        path = QtGui.QPainterPath()
+        for pipe in pipes:
+            pipe.setVisible(False)
+            in_port, out_port = pipe.input_port, pipe.output_port
+            if in_port is None or out_port is None:
+                continue
+            start = out_port.scenePos() + out_port.boundingRect().center()
+            end = in_port.scenePos() + in_port.boundingRect().center()
+            path.moveTo(start)
+            path.lineTo(end)
+
+        if self._batched_pipes is None or self._batched_pipes.scene() is not scene:
+            self._batched_pipes = QtWidgets.QGraphicsPathItem()
+            pen = QtGui.QPen(QtGui.QColor(175, 95, 30, 200), 1.0)
+            pen.setCosmetic(True)
+            self._batched_pipes.setPen(pen)
+            self._batched_pipes.setZValue(-1)
+            self._batched_pipes.setAcceptedMouseButtons(QtCore.Qt.NoButton)
+            scene.addItem(self._batched_pipes)
+        self._batched_pipes.setPath(path)
+        self._batched_pipes.setVisible(True)
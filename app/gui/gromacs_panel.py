@@ -0,0 +1,301 @@
+import logging
+import os
+import threading
+
+from Qt import QtWidgets, QtCore # type: ignore
+
+from app.export.workflow import build_steps
+from app.jobs import mdrun_tuning
+from app.jobs.batch import BatchExecutor
+from app.jobs.cost_model import report as cost_report
+from app.jobs.executors import DaemonExecutor
+from app.jobs.plan import make_plan
+from app.nodes.gmx_catalog import find_gmxrc
+from app.utils.mdp import check_free_space, format_size
+
+
+# Batch schedulers offered in the GROMACS tab, by `app.jobs.batch.SCHEDULERS` preset
+BATCH_SCHEDULERS = {
+    "slurm": "Slurm cluster",
+    "pbs": "PBS cluster",
+    "fake": "Local test scheduler",
+}
+
+
+class GromacsPanel(QtWidgets.QWidget):
+    """GromacsPanel is a QWidget that provides a user interface for running Gromacs commands on selected nodes in a node graph.
+    
+    Attributes:
+        node_graph (NodeGraph): The graph containing nodes to be processed.
+        process_runner (ProcessRunner): Client of the job daemon running the workflows, created on first use.
+        layout (QVBoxLayout): The layout manager for arranging widgets vertically.
+        backend (QComboBox): Where the runs go: the job daemon or a batch scheduler.
+        run_selected_nodes (QPushButton): Button to run the selected nodes.
+        run_all (QPushButton): Button to run all nodes in the graph.
+        stop_btn (QPushButton): Button to stop the currently running command.
+        tune_btn (QPushButton): Button to benchmark the mdrun thread layouts of the selected mdrun node.
+        tuning_output (QtCore.Signal): Emitted with the progress of the tuning (background thread).
+        tuning_finished (QtCore.Signal): Emitted at the end of the tuning.
+        estimate_btn (QPushButton): Button to predict the wall time, core-hours and output of the workflow.
+        text (QPlainTextEdit): Text area for displaying command output and status messages.
+        batch_output (QtCore.Signal): Emitted with the messages of the scheduler commands (background thread).
+        batch_submitted (QtCore.Signal): Emitted with the id of a submitted batch run.
+        batch_polled (QtCore.Signal): Emitted with the states of the batch runs (dict by run id).
+        batch_runs (dict): Last known state of the batch runs submitted, by run id.
+    
+    Methods:
+        __init__(node_graph): Initializes the GromacsPanel with the given node graph.
+        _run(nodes, label): Submits the workflow of nodes to the selected backend.
+        _check_free_space(nodes): Asks for confirmation when the run output may not fit on disk.
+        _submit_batch(nodes, label, scheduler): Submits the workflow of nodes to a batch scheduler.
+        _poll_batch_runs(): Reads the state of the batch runs in a background thread.
+        _on_batch_polled(states): Reports the state changes of the batch runs.
+        _tune_mdrun(): Tunes mdrun on this machine for the tpr of the selected mdrun node.
+        _estimate(): Shows the predicted time, cores and output of the selected nodes (all by default).
+        _on_job_finished(job_id, state): Reports the end of a followed job.
+        _update_preview(text): Updates the text area with the output of the command or a default message if no command is available.
+    """
+    tuning_output = QtCore.Signal(str)
+    tuning_finished = QtCore.Signal()
+    batch_output = QtCore.Signal(str)
+    batch_submitted = QtCore.Signal(str)
+    batch_polled = QtCore.Signal(dict)
+
+    def __init__(self, node_graph):
+        super().__init__()
+        self.node_graph = node_graph
+        self._process_runner = None
+        
+        self.batch_runs = {}
+        self._batch_polling = False
+
+        self.layout = QtWidgets.QVBoxLayout(self)
+        self.backend = QtWidgets.QComboBox()
+        self.backend.addItem(DaemonExecutor.label, None)
+        for scheduler, name in BATCH_SCHEDULERS.items():
+            self.backend.addItem(name, scheduler)
+        self.run_selected_nodes = QtWidgets.QPushButton("Run the selected nodes")
+        self.run_all = QtWidgets.QPushButton("Run all nodes")
+        self.stop_btn = QtWidgets.QPushButton("Stop the runs")
+        self.tune_btn = QtWidgets.QPushButton("Tune mdrun on this machine")
+        self.tune_btn.setToolTip("Benchmarks thread layouts on the tpr of the selected mdrun node;\n"
+                                 "later runs of similar systems on this machine use the fastest one")
+        self.estimate_btn = QtWidgets.QPushButton("Estimate runtime and cost")
+        self.estimate_btn.setToolTip("Predicts the wall time, core-hours and output of the selected nodes\n"
+                                     "(all nodes if none is selected) from the past runs on this machine")
+        self.text = QtWidgets.QPlainTextEdit(readOnly=True)
+        self.text.setPlainText("Waiting for a gromacs command to be executed...")
+        self.text.setMinimumHeight(100)
+        # No line wrap
+        self.text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+
+
+        self.layout.addWidget(QtWidgets.QLabel("Run on:"))
+        self.layout.addWidget(self.backend)
+        self.layout.addWidget(self.run_selected_nodes)
+        self.layout.addWidget(self.run_all)
+        self.layout.addWidget(self.stop_btn)
+        self.layout.addWidget(self.tune_btn)
+        self.layout.addWidget(self.estimate_btn)
+        self.layout.addStretch(1)
+        self.layout.addWidget(self.text)
+
+        self.run_all.clicked.connect(lambda: self._run(node_graph.all_nodes(), "All nodes"))
+        self.run_selected_nodes.clicked.connect(lambda: self._run(node_graph.selected_nodes(), "Selected nodes"))
+        self.stop_btn.clicked.connect(self._stop)
+        self.tune_btn.clicked.connect(self._tune_mdrun)
+        self.tuning_output.connect(self._update_preview)
+        self.tuning_finished.connect(lambda: self.tune_btn.setEnabled(True))
+        self.estimate_btn.clicked.connect(self._estimate)
+
+        self._batch_timer = QtCore.QTimer(self)
+        self._batch_timer.setInterval(5000)
+        self._batch_timer.timeout.connect(self._poll_batch_runs)
+        self.batch_output.connect(self._update_preview)
+        self.batch_submitted.connect(self._on_batch_submitted)
+        self.batch_polled.connect(self._on_batch_polled)
+
+    @property
+    def process_runner(self):
+        return self._ensure_process_runner()
+
+    def _ensure_process_runner(self):
+        # Built on first use: it queries the gmx installation when created
+        if self._process_runner is None:
+            from app.gui.process_runner import ProcessRunner
+            from app.utils.startup_profiler import PROFILER
+
+            with PROFILER.section("GromacsPanel: ProcessRunner"):
+                self._process_runner = ProcessRunner()
+            self._process_runner.command_started.connect(self._update_preview)
+            self._process_runner.command_output.connect(self._update_preview)
+            self._process_runner.job_finished.connect(self._on_job_finished)
+            # Runs started before the GUI was (re)opened keep going in the job daemon
+            self._process_runner.reattach()
+        return self._process_runner
+
+    def _run(self, nodes, label):
+        if not nodes:
+            self._update_preview("No node to run")
+            return
+        if not self._check_free_space(nodes):
+            return
+        scheduler = self.backend.currentData()
+        if scheduler:
+            self._submit_batch(nodes, label, scheduler)
+        else:
+            self.process_runner.run(nodes, label)
+
+    def _check_free_space(self, nodes):
+        """Asks for confirmation when the estimated output of the runs exceeds the free space."""
+        workdir = self.process_runner.get_workdir()
+        try:
+            total, free, estimates = check_free_space(build_steps(nodes), workdir)
+        except (OSError, ValueError) as e:
+            logging.warning("Cannot estimate the output of the run: %s", e)
+            return True
+        for step, sizes, note in estimates:
+            if sizes is None:
+                self._update_preview(f"Output of {step.label} not estimated: {note}")
+        if total <= free:
+            return True
+        message = (f"The mdrun steps may write {format_size(total)}, but {workdir} only has "
+                   f"{format_size(free)} free.\nRun anyway?")
+        logging.warning(message.replace("\n", " "))
+        answer = QtWidgets.QMessageBox.question(self, "Not enough disk space", message)
+        return answer == QtWidgets.QMessageBox.Yes
+
+    def _submit_batch(self, nodes, label, scheduler):
+        try:
+            plan = make_plan(nodes, self.process_runner.get_workdir(), label, gmxrc=find_gmxrc(),
+                             gmxlib=os.environ.get("GMXLIB"))
+        except (OSError, RuntimeError, ValueError) as e:
+            logging.error("Cannot submit the run to %s: %s", scheduler, e)
+            self._update_preview(f"Cannot submit the run to {scheduler}: {e}")
+            return
+        if not plan["steps"]:
+            self._update_preview("No gromacs commands to run")
+            return
+
+        def submit():
+            # sbatch and co. may hang on a busy scheduler: not on the GUI thread
+            try:
+                run_id = BatchExecutor(scheduler).submit(plan)
+            except (OSError, RuntimeError, ValueError) as e:
+                logging.error("Cannot submit the run to %s: %s", scheduler, e)
+                self.batch_output.emit(f"Cannot submit the run to {scheduler}: {e}")
+                return
+            self.batch_output.emit(f"Batch run submitted to {scheduler}: {run_id}")
+            self.batch_submitted.emit(run_id)
+
+        self._update_preview(f"Submitting the run to {scheduler}...")
+        threading.Thread(target=submit, daemon=True).start()
+
+    def _on_batch_submitted(self, run_id):
+        self.batch_runs[run_id] = "queued"
+        self._batch_timer.start()
+
+    def _poll_batch_runs(self):
+        # A poll still waiting for the scheduler is not doubled
+        if self._batch_polling or not self.batch_runs:
+            return
+        run_ids = list(self.batch_runs)
+
+        def poll():
+            executor = BatchExecutor()
+            states = {}
+            for run_id in run_ids:
+                try:
+                    states[run_id] = executor.status(run_id)["state"]
+                except (OSError, ValueError) as e:
+                    # Unreadable for now (e.g. a network filesystem): still followed, read again next time
+                    logging.warning("Cannot read batch run %s: %s", run_id, e)
+                    states[run_id] = "unknown"
+            self.batch_polled.emit(states)
+
+        self._batch_polling = True
+        threading.Thread(target=poll, daemon=True).start()
+
+    def _on_batch_polled(self, states):
+        self._batch_polling = False
+        for run_id, state in states.items():
+            last = self.batch_runs.get(run_id)
+            if last is None:
+                continue
+            if state != last:
+                self._update_preview(f"Batch run {run_id} {state}")
+            if state in ("queued", "running", "unknown"):
+                self.batch_runs[run_id] = state
+            else:
+                del self.batch_runs[run_id]
+        if not self.batch_runs:
+            self._batch_timer.stop()
+
+    def _tune_mdrun(self):
+        node = next((n for n in self.node_graph.selected_nodes() if n.__identifier__ == "mdrun"), None)
+        if node is None:
+            self._update_preview("Select an mdrun node to tune")
+            return
+        tpr = os.path.join(self.process_runner.get_workdir(), node.get_property("-s"))
+        if not os.path.isfile(tpr):
+            self._update_preview(f"Run the steps producing {tpr} first")
+            return
+
+        def tune():
+            try:
+                mdrun_tuning.tune(tpr, gmxrc=find_gmxrc(), output=self.tuning_output.emit)
+            except (OSError, RuntimeError) as e:
+                self.tuning_output.emit(f"mdrun tuning failed: {e}")
+            finally:
+                self.tuning_finished.emit()
+
+        self.tune_btn.setEnabled(False)
+        self._update_preview(f"Tuning mdrun on {tpr}...")
+        threading.Thread(target=tune, daemon=True).start()
+
+    def _estimate(self):
+        nodes = self.node_graph.selected_nodes() or self.node_graph.all_nodes()
+        steps = build_steps(nodes)
+        if not steps:
+            self._update_preview("No gromacs commands to estimate")
+            return
+        try:
+            text = cost_report(steps, self.process_runner.get_workdir(), find_gmxrc())
+        except (OSError, ValueError) as e:
+            logging.error("Cannot estimate the run: %s", e)
+            self._update_preview(f"Cannot estimate the run: {e}")
+            return
+        self._update_preview(text)
+
+    def _on_job_finished(self, job_id, state):
+        self._update_preview(f"Job {job_id} {state}")
+
+    def _stop(self):
+        if self._process_runner is not None:
+            self._process_runner.stop()
+        if not self.batch_runs:
+            return
+        run_ids = list(self.batch_runs)
+
+        def cancel():
+            executor = BatchExecutor()
+            for run_id in run_ids:
+                try:
+                    executor.cancel(run_id)
+                except (OSError, RuntimeError, ValueError) as e:
+                    logging.warning("Cannot cancel batch run %s: %s", run_id, e)
+                    self.batch_output.emit(f"Cannot cancel batch run {run_id}: {e}")
+
+        threading.Thread(target=cancel, daemon=True).start()
+
+    
+    def _update_preview(self, text):
+        """Updates the preview display with the given text.
+        
+        If the provided text is None or an empty string, it displays a default message.
+        
+        Args:
+            text (str): The text to display in the preview. If None or empty, defaults to "No command to display".
+        """
+        # self.text.setPlainText(text or "No command to display")
+        self.text.appendPlainText(text or "No command to display")
\ No newline at end of file
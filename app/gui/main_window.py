@@ -1,16 +1,21 @@
 import inspect
 import logging
+import os
 
 from Qt import QtWidgets, QtCore, QtGui # type: ignore
 from NodeGraphQt import NodeGraph, BaseNode # type: ignore
 
 # from app.gui import ui_state
+# The panels, node classes and job modules not needed for the first paint are imported
+# where they are built (see _ensure_props_bin, _ensure_gromacs_panel, _finish_startup)
 from app.gui.node_library import NodeLibrary
-from app.nodes import node_types
-from app.gui.control_panel import ControlPanel, GromacsPanel, fill_cmd
+from app.gui.control_panel import ControlPanel, fill_cmd
 from app.gui.cmd_preview import CmdPreview
-from app.assets.my_prop_bin import MyPropertiesBin
 from app.gui.ui_state import UiStateManager
+from app.nodes.node_spec import NodeSpec
+from app.utils.startup_profiler import PROFILER
+from app.gui.graph_lod import GraphLodController
+from app.gui.autosave import SessionAutosave
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -31,6 +36,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         props_bin (MyPropertiesBin):
             The dynamic property editor showing editable parameters for the selected node.
+            Built the first time a node is shown in it.
 
         control_panel (ControlPanel):
             The panel providing workflow-level actions such as save/load, script generation, and refresh.
@@ -40,11 +46,44 @@ class MainWindow(QtWidgets.QMainWindow):
 
         gromacs_panel (GromacsPanel):
             Reserved extension panel for simulation-related tasks.
+            Built the first time its tab is opened (or a run is requested).
+
+        lod_controller (GraphLodController):
+            Switches the canvas to simplified node boxes and batched pipes when zoomed out.
+
+        autosave (SessionAutosave):
+            Journals every graph edit to disk, so a crash loses at most a second of work.
+
+        host_profile (dict):
+            The hardware of this machine and what gmx can do with it (see `app.nodes.host_profile`),
+            used for the mdrun defaults of new nodes and the warnings of the command preview.
+            None until the window is shown.
+
+        gmx_catalog (GmxCatalog):
+            The cached catalog of the other gmx tools, whose node classes are generated on first use.
+            None until the window is shown.
+
+        templates (TemplateLibrary):
+            The subgraph templates (built-in and loaded with sessions), listed in the node library.
+            None until the window is shown.
 
         ui_state (UiStateManager):
             Manages window layout, splitter geometry, and UI restoration between sessions.
 
     Methods:
+        build_deferred():
+            Builds the components that are otherwise only constructed on first use.
+
+        _finish_startup():
+            Once the window is shown: detects the host, registers the node classes, loads the
+            gmx catalog and the templates, then starts the autosave.
+
+        _start_autosave():
+            Offers to restore the autosave left by a crashed run, then starts the autosave.
+
+        _reattach_jobs():
+            Opens the GROMACS panel on the runs still going on in the job daemon.
+
         _init_ui():
             Assembles the main window layout, including the node graph canvas, property bin, 
             and bottom control tabs. Handles splitter proportions and visibility rules.
@@ -56,13 +95,31 @@ class MainWindow(QtWidgets.QMainWindow):
         _show_props(node):
             Displays the property editor for the specified node on the right-hand side panel.
 
+        _toggle_node_widgets():
+            Expands or collapses the property widgets embedded in the selected nodes on the canvas.
+            They are only built the first time a node is expanded.
+
+        _collapse_selection():
+            Collapses the selected nodes into a template instance: back into the instance they
+            were expanded from (as overrides, or updating the template), or into a new template.
+
+        _expand_selection():
+            Replaces the selected template instances by their inner nodes.
+
+        _refresh_node_library():
+            Lists the node types, generated tools and templates in the node library.
+
         _on_port_connected(port_a, port_b):
             Handles the event when two ports are connected.
             Normalizes direction (output → input) and propagates properties between nodes 
             based on declared port types and mappings in `IN_PORTS` / `OUT_PORTS`.
 
+        _edit_mdp(node, prop_name):
+            Opens the mdp file of a node in the MDP editor (lint pass and output estimate).
+
         _display_preview(node):
-            Updates the live command preview corresponding to the currently selected or edited node.
+            Updates the live command preview corresponding to the currently selected or edited node,
+            with the mdrun flags the host cannot honour.
 
         _on_prop_changed(node, menu_prop_name, prop_value):
             Handles property changes within a node.
@@ -88,45 +145,45 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ui_state = UiStateManager(include_geometry=True, include_state=True)
 
+        # Rarely used panels are built on first use (see props_bin / gromacs_panel)
+        self._props_bin = None
+        self._gromacs_panel = None
+
         # Create core widgets
         # Create the central windows to manage nodes
-        self.node_graph = NodeGraph()
+        with PROFILER.section("MainWindow: NodeGraph"):
+            self.node_graph = NodeGraph()
         self.node_graph.port_connected.connect(self._on_port_connected)
 
-        # Automatically retrieves all the class nodes
-        # Attention detect only in it inherits from BaseNode
-        node_types_list = [
-            obj for name, obj in inspect.getmembers(node_types, inspect.isclass)
-            if issubclass(obj, BaseNode)
-            and obj is not BaseNode
-            and obj.__module__ == node_types.__name__
-        ]
-
-        # Register the nodes in the graph canva
-        for node in node_types_list:
-            self.node_graph.register_node(node)
+        # Simplified drawing of nodes and pipes when zoomed out on large graphs
+        self.lod_controller = GraphLodController(self.node_graph)
 
+        # Set up by _finish_startup once the window is shown: the host profile runs
+        # `gmx --version`, and the node classes, catalog and templates are not needed to paint
+        self.host_profile = None
+        self.gmx_catalog = None
+        self.templates = None
+        self._node_types_list = []
+        self._started = False
 
         # -------------------------
         # Create the main panel
         # -------------------------
-        # Create the right list panel
-        self.node_list = NodeLibrary(node_types_list)
-
-        # Create the left properties panel
-        self.props_bin = MyPropertiesBin(node_graph=self.node_graph)
+        # Create the right list panel (filled once the node classes are registered)
+        with PROFILER.section("MainWindow: node library"):
+            self.node_list = NodeLibrary()
 
         # Add control panel
-        self.control_panel = ControlPanel(self.node_graph, self.ui_state)
+        with PROFILER.section("MainWindow: control panel"):
+            self.control_panel = ControlPanel(self.node_graph, self.ui_state)
 
         # Add command preview
-        self.cmd_preview = CmdPreview(self.node_graph)
-
-        # Add a gromacs panel (to be added later)
-        self.gromacs_panel = GromacsPanel(self.node_graph)
+        with PROFILER.section("MainWindow: command preview"):
+            self.cmd_preview = CmdPreview(self.node_graph)
 
         # Set the main window layout
-        self._init_ui()
+        with PROFILER.section("MainWindow: layout"):
+            self._init_ui()
 
 
         # -------------------------
@@ -151,12 +208,23 @@ class MainWindow(QtWidgets.QMainWindow):
         # Generate scripts (bash, python)
         self.control_panel.generate_bash_script_btn.clicked.connect(self.control_panel.generate_bash_script)
         self.control_panel.generate_python_script_btn.clicked.connect(self.control_panel.generate_python_script)
+        self.control_panel.generate_makefile_btn.clicked.connect(self.control_panel.generate_makefile)
+        self.control_panel.submit_queue_btn.clicked.connect(self.control_panel.submit_to_queue)
 
         # Save and Load session (UI + NodeGraph)
         self.control_panel.save_session.clicked.connect(self.control_panel._save_ui)
         self.control_panel.load_session.clicked.connect(self.control_panel._load_ui)
         self.control_panel.refresh_session.clicked.connect(self.control_panel._refresh_ui)
 
+        # Incremental autosave (started once the window is shown)
+        self.autosave = SessionAutosave(
+            self.node_graph,
+            ui_state_provider=lambda: self.ui_state.capture(self),
+            parent=self,
+        )
+        self.control_panel.autosave = self.autosave
+        self.control_panel.workdir_provider = lambda: self.gromacs_panel.process_runner.get_workdir()
+
 
         # -------------------------
         # Add shortcuts
@@ -174,12 +242,94 @@ class MainWindow(QtWidgets.QMainWindow):
             activated=lambda: self._display_preview()
         )
 
+        # Expand / collapse the property widgets embedded in the selected nodes
+        QtWidgets.QShortcut(
+            QtGui.QKeySequence("E"),
+            self,
+            activated=self._toggle_node_widgets
+        )
+
+        # Collapse the selected nodes into a template instance / expand the selected instances
+        QtWidgets.QShortcut(
+            QtGui.QKeySequence("Ctrl+G"),
+            self,
+            activated=self._collapse_selection
+        )
+        QtWidgets.QShortcut(
+            QtGui.QKeySequence("Ctrl+Shift+G"),
+            self,
+            activated=self._expand_selection
+        )
+
 
         # -------------------------
         # Add Menu Overview
         # -------------------------
 
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self._started:
+            self._started = True
+            # Runs once the window is painted
+            QtCore.QTimer.singleShot(0, self._finish_startup)
+
+    def _finish_startup(self):
+        """Sets up what the first paint does not need, then starts the autosave and follows the runs."""
+        PROFILER.mark("window shown")
+        with PROFILER.section("MainWindow: deferred startup"):
+            from app.nodes import node_types
+            from app.nodes.gmx_catalog import get_catalog
+            from app.nodes.host_profile import apply_mdrun_defaults, load_profile, profile_warnings
+            from app.nodes.templates import TemplateLibrary, equilibration_template
+
+            # Host defaults of the mdrun nodes (GPU offload only where it can run), set before
+            # any node is created
+            with PROFILER.section("MainWindow: host profile"):
+                self.host_profile = load_profile()
+                apply_mdrun_defaults(node_types.Mdrun, self.host_profile)
+                apply_mdrun_defaults(node_types.MdrunMulti, self.host_profile)
+                for warning in profile_warnings(self.host_profile):
+                    logging.warning(warning)
+
+            with PROFILER.section("MainWindow: register nodes"):
+                # Automatically retrieves all the class nodes
+                # Attention detect only in it inherits from BaseNode
+                self._node_types_list = [
+                    obj for name, obj in inspect.getmembers(node_types, inspect.isclass)
+                    if issubclass(obj, BaseNode)
+                    and obj is not BaseNode
+                    and obj.__module__ == node_types.__name__
+                ]
+
+                # Register the nodes in the graph canva
+                for node in self._node_types_list:
+                    self.node_graph.register_node(node)
+                    node.register_accepts(self.node_graph)
+
+            # Generated nodes for the other gmx tools (read from the cache, created on first use)
+            with PROFILER.section("MainWindow: gmx catalog"):
+                self.gmx_catalog = get_catalog()
+                self.node_list.gmx_tools = self.gmx_catalog.tools()
+
+            # Subgraph templates (node classes generated per template)
+            with PROFILER.section("MainWindow: templates"):
+                self.templates = TemplateLibrary(
+                    self.node_graph,
+                    on_type=lambda t: self.gmx_catalog.ensure_registered(self.node_graph, t),
+                )
+                try:
+                    self.templates.add(equilibration_template())
+                except Exception:
+                    logging.exception("Failed to add the built-in templates")
+                self.control_panel.templates = self.templates
+
+            self._refresh_node_library()
+            self.templates.on_change = lambda name: self._refresh_node_library()
+
+        self._start_autosave()
+        self._reattach_jobs()
+
     def _init_ui(self):
         main_splitter = QtWidgets.QSplitter()
         main_splitter.setObjectName("main_splitter")
@@ -195,11 +345,14 @@ class MainWindow(QtWidgets.QMainWindow):
         center_splitter.addWidget(self.cmd_preview)           # Preview of node command
 
         # Bottom: tabs area (Preview, Commands, Gromacs, ...)
+        # The GROMACS tab holds a placeholder until it is first opened
         bottom_tabs = QtWidgets.QTabWidget()
         bottom_tabs.setObjectName("bottom_tabs")
         bottom_tabs.addTab(self.control_panel, "Controls")
-        bottom_tabs.addTab(self.gromacs_panel, "GROMACS")
+        bottom_tabs.addTab(QtWidgets.QWidget(), "GROMACS")
+        bottom_tabs.currentChanged.connect(self._on_bottom_tab_changed)
         center_splitter.addWidget(bottom_tabs)
+        self._bottom_tabs = bottom_tabs
 
         # Prevent collapse
         center_splitter.setCollapsible(0, False)
@@ -217,8 +370,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # Add center splitter to main splitter
         main_splitter.addWidget(center_splitter)
 
-        # Right: props
-        main_splitter.addWidget(self.props_bin)
+        # Right: props (placeholder until a node is first shown in the properties bin)
+        main_splitter.addWidget(QtWidgets.QWidget())
+        self._main_splitter = main_splitter
 
         # Global layout sizes (left / center / right)
         main_splitter.setSizes([200, 900, 320])
@@ -229,8 +383,120 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setCentralWidget(main_splitter)
 
 
+    @property
+    def props_bin(self):
+        return self._ensure_props_bin()
+
+    def _ensure_props_bin(self):
+        """Builds the properties bin on first use (in place of its placeholder), returns it."""
+        if self._props_bin is None:
+            with PROFILER.section("MainWindow: props bin"):
+                from app.assets.my_prop_bin import MyPropertiesBin
+
+                self._props_bin = MyPropertiesBin(node_graph=self.node_graph)
+                self.control_panel.props_bin = self._props_bin
+                self._props_bin.mdp_edit_requested.connect(self._edit_mdp)
+                placeholder = self._main_splitter.replaceWidget(2, self._props_bin)
+                if placeholder is not None:
+                    placeholder.deleteLater()
+        return self._props_bin
+
+    @property
+    def gromacs_panel(self):
+        return self._ensure_gromacs_panel()
+
+    def _ensure_gromacs_panel(self):
+        """Builds the GROMACS panel on first use (in place of its placeholder tab), returns it."""
+        if self._gromacs_panel is None:
+            with PROFILER.section("MainWindow: GROMACS panel"):
+                from app.gui.gromacs_panel import GromacsPanel
+
+                tabs = self._bottom_tabs
+                current = tabs.currentIndex()
+                self._gromacs_panel = GromacsPanel(self.node_graph)
+                placeholder = tabs.widget(1)
+                tabs.blockSignals(True)
+                tabs.removeTab(1)
+                tabs.insertTab(1, self._gromacs_panel, "GROMACS")
+                tabs.setCurrentIndex(current)
+                tabs.blockSignals(False)
+                placeholder.deleteLater()
+        return self._gromacs_panel
+
+    def _on_bottom_tab_changed(self, index):
+        if index == 1:
+            self._ensure_gromacs_panel()
+
+    def _start_autosave(self):
+        from app.nodes.templates import SubgraphTemplate
+        from app.utils.session_journal import ChangeJournal, find_autosave, recover
+
+        # An autosave whose lock is free was left by a run that did not exit cleanly
+        # (the ones of the other running windows stay locked)
+        orphans = ChangeJournal.orphans(self.autosave.journal.root)
+        if orphans:
+            orphan = orphans[0]
+            answer = QtWidgets.QMessageBox.question(
+                self,
+                "Restore session",
+                "GroGUI did not exit cleanly. Restore the autosaved session?",
+            )
+            if answer == QtWidgets.QMessageBox.Yes:
+                snapshot, journal = find_autosave(orphan.directory)
+                try:
+                    replayed, ui_data = recover(
+                        self.node_graph, snapshot, journal,
+                        on_type=lambda t: self.gmx_catalog.ensure_registered(self.node_graph, t),
+                        on_template=lambda data: self.templates.add(SubgraphTemplate.from_dict(data)),
+                    )
+                    self.ui_state.restore(self, ui_data)
+                    logging.info("Autosave restored (%d journal records replayed)", replayed)
+                except Exception:
+                    logging.exception("Failed to restore the autosave")
+            # Restored into the snapshot of this run, or declined
+            orphan.discard()
+            # Older crashes are offered at the next start
+            for older in orphans[1:]:
+                older.close()
+
+        self.autosave.start()
+
+    def _reattach_jobs(self):
+        from app.jobs.client import JobClient
+
+        # Runs survive the GUI in the job daemon: show the ones still going on
+        active = JobClient().active_jobs()
+        if active:
+            logging.info("%d run(s) still going on in the job daemon", len(active))
+            self._bottom_tabs.setCurrentIndex(1)
+            self._ensure_gromacs_panel()
+
+    def closeEvent(self, event):
+        # Clean exit: the autosave is only kept after a crash
+        self.autosave.discard()
+        super().closeEvent(event)
+
+    def build_deferred(self):
+        """Builds the components that are otherwise only constructed on first use.
+
+        Used by `main.py --profile-startup` to time them.
+        """
+        self._ensure_props_bin()
+        self._ensure_gromacs_panel()._ensure_process_runner()
+
+
     def _add_node_on_click(self, item):
         node_class = item.data(QtCore.Qt.UserRole) # Retrieves the class of the selected node
+
+        # Generated tool: create and register its class on first use
+        if isinstance(node_class, str):
+            try:
+                node_class = self.gmx_catalog.node_class(node_class)
+                self.gmx_catalog.ensure_registered(self.node_graph, f"{node_class.__identifier__}.{node_class.__name__}")
+            except Exception:
+                logging.exception("Failed to create node class for gmx tool %r", node_class)
+                return
+
         node = self.node_graph.create_node(
             f"{node_class.__identifier__}.{node_class.__name__}",
             name=f"{node_class.NODE_NAME}",
@@ -242,6 +508,84 @@ class MainWindow(QtWidgets.QMainWindow):
         self.props_bin.add_node(node)
 
 
+    def _edit_mdp(self, node, prop_name):
+        from app.gui.mdp_editor import MdpEditor
+        from app.utils.mdp import count_atoms
+
+        # Relative paths are relative to the directory the runs use
+        workdir = self.gromacs_panel.process_runner.get_workdir()
+        path = os.path.join(workdir, node.get_property(prop_name))
+        structure = node.get_property("-c") if "-c" in node.properties().get("custom", {}) else None
+        natoms = count_atoms(os.path.join(workdir, structure)) if structure else None
+        MdpEditor(path, natoms=natoms, workdir=workdir, parent=self).exec_()
+
+    def _toggle_node_widgets(self):
+        for node in self.node_graph.selected_nodes():
+            if hasattr(node, "toggle_widgets"):
+                node.toggle_widgets()
+
+
+    def _collapse_selection(self):
+        nodes = self.node_graph.selected_nodes()
+        if not nodes:
+            return
+
+        group = self.templates.expanded_group(nodes)
+        if group is not None:
+            # Nodes expanded from an instance: the changes apply to it, or to the template
+            name, keys = group
+            answer = QtWidgets.QMessageBox.question(
+                self,
+                "Collapse template",
+                f"Apply the changes to the template '{name}' and all its instances?\n"
+                "(No keeps them as overrides of this instance only.)",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Cancel,
+                QtWidgets.QMessageBox.No,
+            )
+            if answer == QtWidgets.QMessageBox.Cancel:
+                return
+            update = answer == QtWidgets.QMessageBox.Yes
+        else:
+            name, ok = QtWidgets.QInputDialog.getText(self, "New template", "Template name:")
+            name = name.strip()
+            if not ok or not name:
+                return
+            if name in self.templates.names():
+                answer = QtWidgets.QMessageBox.question(
+                    self,
+                    "Replace template",
+                    f"A template '{name}' already exists. Replace it (and update all its instances)?",
+                )
+                if answer != QtWidgets.QMessageBox.Yes:
+                    return
+            keys, update = None, True
+
+        # The autosave takes a single snapshot once the nodes are replaced
+        try:
+            with self.autosave.paused():
+                if update:
+                    self.templates.capture(name, nodes, keys)
+                self.templates.collapse(nodes, name, keys)
+        except Exception:
+            logging.exception("Failed to collapse the selection into template '%s'", name)
+
+    def _expand_selection(self):
+        instances = [n for n in self.node_graph.selected_nodes() if hasattr(n, "TEMPLATE")]
+        if not instances:
+            return
+        self.node_graph.clear_selection()
+        try:
+            with self.autosave.paused():
+                for node in instances:
+                    self.templates.expand(node)
+        except Exception:
+            logging.exception("Failed to expand the template instances")
+
+    def _refresh_node_library(self):
+        self.node_list.node_types = self._node_types_list + self.templates.node_classes()
+        self.node_list.populate_list()
+
+
     def _on_port_connected(self, port_a, port_b): # Callback when two ports get connected
         """
         Called by NodeGraphQt when two ports get connected.
@@ -310,15 +654,10 @@ class MainWindow(QtWidgets.QMainWindow):
                 logging.debug("Missing port_type on ports; skip propagation")
                 return
 
-            # Map the IN_PORTS/OUT_PORTS declared on each node
-            src_out_ports = getattr(src.node(), "OUT_PORTS", {}) or {}
-            dst_in_ports = getattr(dst.node(), "IN_PORTS", {}) or {}
-
-            dst_map = {port_type: flag for flag, (_name, port_type, *_rest) in dst_in_ports.items()}
-            src_map = {port_type: flag for flag, (_name, port_type) in src_out_ports.items()}
-
-            src_flag = src_map.get(src_type)
-            dst_flag = dst_map.get(dst_type)
+            # Map the IN_PORTS/OUT_PORTS declared on each node (port name -> property): by name,
+            # as the replica slots of a multi-simulation share their port type
+            src_flag = NodeSpec.of(src.node()).port_props.get(src.name())
+            dst_flag = NodeSpec.of(dst.node()).port_props.get(dst.name())
             if not src_flag or not dst_flag:
                 logging.debug("No mapping for %s -> %s; skip propagation", src_type, dst_type)
                 return
@@ -341,6 +680,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def _display_preview(self, node):
         text = fill_cmd(nodes=node, preview=True)
+        # Flags of the mdrun nodes this machine cannot honour
+        if getattr(node, "__identifier__", None) == "mdrun" and self.host_profile is not None:
+            from app.export.workflow import command_args
+            from app.nodes.host_profile import check_mdrun_args
+
+            args, _ = command_args(NodeSpec.of(node), node.properties().get("custom", {}))
+            warnings = check_mdrun_args(self.host_profile, args)
+            if warnings:
+                text += "\n\n" + "\n".join(f"Warning: {w}" for w in warnings)
         self.cmd_preview.update_preview(text)
 
 
@@ -351,19 +699,21 @@ class MainWindow(QtWidgets.QMainWindow):
                 self._propagate_props(node, menu_prop_name, prop_value)
             except Exception:
                 logging.exception("Propagation failed in _on_prop_changed")
+            if node.__identifier__ == "mdrun" and node.selected():
+                self._display_preview(node)
             return
 
         # 2) If optional_props selected → add the optional property
         try:
-            label_to_key = getattr(node, "_opt_label_to_key", {})
-            key = label_to_key.get(prop_value) 
+            spec = NodeSpec.of(node)
+            key = spec.opt_label_to_key.get(prop_value)
 
-            if not key or not hasattr(node, "OPTIONAL_PROPS"):
+            if not key:
                 logging.warning("Invalid optional prop selection: %r", prop_value)
                 node.set_property("Add optional property", None)
                 return
 
-            label, default = node.OPTIONAL_PROPS[key]
+            label, default = spec.prop(key)
 
             # Avoid double
             if key in node.properties().get("custom", {}):
@@ -371,19 +721,15 @@ class MainWindow(QtWidgets.QMainWindow):
                 node.set_property("Add optional property", None)
                 return
 
-            # Add the correct widget
-            if isinstance(default, (list, tuple)):
-                node.add_combo_menu(name=key, label=label, items=default)
-            else:
-                node._add_text_input(name=key, label=label, text=default) # Use homemade _add_text_input
-            
-            node.hide_widget(key, push_undo=False)
-            node.set_property("Added optional property", None)
+            # Add the property as model data (widgets are built by the properties bin)
+            node._add_prop(name=key, label=label, default=default)
+            node.set_property("Add optional property", None)
             logging.info("Added optional property '%s' on %s", key, node)
 
-            # Refresh the panel view
-            self.props_bin.remove_node(node)
-            self.props_bin.add_node(node)
+            # Refresh the panel view (if it was built)
+            if self._props_bin is not None:
+                self._props_bin.remove_node(node)
+                self._props_bin.add_node(node)
             self._display_preview(node=node)
 
         except Exception:
@@ -394,10 +740,10 @@ class MainWindow(QtWidgets.QMainWindow):
     def _propagate_props(self, node, menu_prop_name, prop_value):
 
         try:
-            src_dict = getattr(node, "OUT_PORT", {})
-            src_prop_name = next((k for k, v in src_dict.items() if v == menu_prop_name), None)
-            if not src_prop_name:
-                logging.debug("No OUT_PORT mapping for menu '%s' on %s", menu_prop_name, node)
+            # Output port fed by the changed flag (OUT_PORTS of the node spec)
+            src_port_spec = next((p for p in NodeSpec.of(node).out_ports if p.flag == menu_prop_name), None)
+            if not src_port_spec:
+                logging.debug("No OUT_PORTS mapping for menu '%s' on %s", menu_prop_name, node)
                 return
         except Exception:
             logging.exception("Failed to resolve source mapping in _propagate_props")
@@ -414,6 +760,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # Iterate over each output port of the source node
         for port_name, port in src_outputs.items():
+            if port_name != src_port_spec.name:
+                continue
             try:
                 dst_ports = port.connected_ports() # List of connected ports
             except Exception as e:
@@ -425,10 +773,11 @@ class MainWindow(QtWidgets.QMainWindow):
                 # Retrieve corresponding node from the port
                 try:
                     dst_node = dst_port.node()
-                    dst_dict = getattr(dst_node, "IN_PORT", {})
-                    dst_prop_name = dst_dict.get(src_prop_name)
+                    dst_prop_name = next(
+                        (p.flag for p in NodeSpec.of(dst_node).in_ports if p.name == dst_port.name()), None
+                    )
                     if not dst_prop_name:
-                        logging.debug("No IN_PORT mapping for '%s' on %s", src_prop_name, dst_node)
+                        logging.debug("No IN_PORTS mapping for '%s' on %s", dst_port.name(), dst_node)
                         continue
                 except Exception:
                     logging.exception("Failed to retrieve port of %s", dst_node)
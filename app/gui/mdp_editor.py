@@ -0,0 +1,162 @@
+import logging
+import os
+import shutil
+
+from Qt import QtWidgets, QtCore # type: ignore
+
+from app.utils.mdp import MdpFile, estimate_output, format_size, lint
+
+
+class MdpEditor(QtWidgets.QDialog):
+    """MdpEditor is a dialog editing the mdp file of a grompp node, with the lint pass and output estimate.
+
+    The parameters are listed in a table; comments, line order and untouched lines are kept
+    on save. The lint list (see `app.utils.mdp.lint`) and the output estimate follow the edits;
+    the estimate turns red when it exceeds the free space of the working directory.
+
+    Attributes:
+        path (str): The mdp file.
+        mdp (MdpFile): The edited file.
+        natoms (int): The number of atoms of the system, None if unknown.
+        workdir (str): The directory the run writes to (free space check).
+        table (QTableWidget): The parameters and their values.
+        issues (QListWidget): The lint results.
+        estimate (QLabel): The estimated output volume.
+
+    Methods:
+        __init__(path, natoms=None, workdir=None, parent=None): Reads the file and builds the dialog.
+        refresh(): Updates the lint list and the estimate from the table.
+        save(): Writes the file.
+    """
+    def __init__(self, path, natoms=None, workdir=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"MDP: {os.path.basename(path)}")
+        self.resize(620, 640)
+        self.path = path
+        self.natoms = natoms
+        self.workdir = workdir or os.path.dirname(os.path.abspath(path))
+        self.mdp = MdpFile.read(path) if os.path.exists(path) else MdpFile()
+
+        self.table = QtWidgets.QTableWidget(0, 2)
+        self.table.setHorizontalHeaderLabels(["Parameter", "Value"])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.verticalHeader().setVisible(False)
+        for key, value in self.mdp.items():
+            self._add_row(key, value)
+        self.table.resizeColumnToContents(0)
+
+        add_btn = QtWidgets.QPushButton("Add parameter")
+        remove_btn = QtWidgets.QPushButton("Remove parameter")
+        rows = QtWidgets.QHBoxLayout()
+        rows.addWidget(add_btn)
+        rows.addWidget(remove_btn)
+        rows.addStretch(1)
+
+        self.issues = QtWidgets.QListWidget()
+        self.issues.setMaximumHeight(140)
+        self.estimate = QtWidgets.QLabel()
+        self.estimate.setWordWrap(True)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Save | QtWidgets.QDialogButtonBox.Close)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(rows)
+        layout.addWidget(QtWidgets.QLabel("Throughput issues:"))
+        layout.addWidget(self.issues)
+        layout.addWidget(self.estimate)
+        layout.addWidget(buttons)
+
+        add_btn.clicked.connect(self._new_row)
+        remove_btn.clicked.connect(self._remove_row)
+        self.issues.itemActivated.connect(self._select_issue)
+        self.table.itemChanged.connect(lambda _: self.refresh())
+        buttons.accepted.connect(self.save)
+        buttons.rejected.connect(self.reject)
+        self.refresh()
+
+    def _add_row(self, key, value):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(key))
+        self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(value))
+        return row
+
+    def _new_row(self):
+        row = self._add_row("", "")
+        self.table.setCurrentCell(row, 0)
+        self.table.editItem(self.table.item(row, 0))
+
+    def _remove_row(self):
+        row = self.table.currentRow()
+        if row >= 0:
+            self.table.removeRow(row)
+            self.refresh()
+
+    def _select_issue(self, item):
+        key = item.data(QtCore.Qt.UserRole)
+        for row in range(self.table.rowCount()):
+            if self.table.item(row, 0) and self.table.item(row, 0).text() == key:
+                self.table.setCurrentCell(row, 1)
+                return
+        # Issue about a default value: add the parameter, starting from the GROMACS default
+        row = self._add_row(key, self.mdp.get(key) or "")
+        self.table.setCurrentCell(row, 1)
+
+    def _sync(self):
+        """Applies the table to the edited file.
+
+        Rows without a value are left out: `key = ` is not a valid mdp setting.
+        """
+        values = {}
+        for row in range(self.table.rowCount()):
+            key = self.table.item(row, 0).text().strip() if self.table.item(row, 0) else ""
+            value = self.table.item(row, 1).text().strip() if self.table.item(row, 1) else ""
+            if key and value:
+                values[key] = value
+        for key, _ in self.mdp.items():
+            if key not in values:
+                self.mdp.remove(key)
+        for key, value in values.items():
+            self.mdp.set(key, value)
+
+    def refresh(self):
+        """Updates the lint list and the output estimate from the table."""
+        self._sync()
+        self.issues.clear()
+        for key, message in lint(self.mdp):
+            item = QtWidgets.QListWidgetItem(f"{key}: {message}")
+            item.setData(QtCore.Qt.UserRole, key)
+            self.issues.addItem(item)
+        if not self.issues.count():
+            self.issues.addItem("No known throughput issue")
+
+        if not self.natoms:
+            self.estimate.setText("Output estimate: unknown number of atoms (the input structure does not exist yet)")
+            return
+        sizes = estimate_output(self.mdp, self.natoms)
+        if sizes is None:
+            self.estimate.setText("Output estimate: nsteps = -1, the run has no end")
+            return
+        details = ", ".join(f"{kind} {format_size(size)}" for kind, size in sizes.items() if kind != "total" and size)
+        text = f"Output estimate for {self.natoms} atoms: {format_size(sizes['total'])} ({details})"
+        try:
+            free = shutil.disk_usage(self.workdir).free
+        except OSError:
+            free = None
+        if free is not None:
+            text += f"\nFree space in {self.workdir}: {format_size(free)}"
+        self.estimate.setText(text)
+        self.estimate.setStyleSheet("color: red" if free is not None and sizes["total"] > free else "")
+
+    def save(self):
+        """Writes the file and closes the dialog."""
+        self._sync()
+        try:
+            self.mdp.write(self.path)
+        except OSError as e:
+            logging.error("Cannot write %s: %s", self.path, e)
+            QtWidgets.QMessageBox.warning(self, "MDP", f"Cannot write {self.path}: {e}")
+            return
+        logging.info("MDP saved: %s", self.path)
+        self.accept()
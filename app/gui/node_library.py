@@ -7,15 +7,18 @@ class NodeLibrary():
     
     Attributes:
         node_types (list): A list of node types to be displayed in the widget.
+        gmx_tools (dict): The generated GROMACS tools (name -> description), listed after the
+            hand-written nodes. Their node class is only created when the tool is first used.
         widget (QListWidget): The widget that displays the node types in icon mode.
     
     Methods:
         populate_list(): Populates the QListWidget with the names of the node classes.
     """
-    def __init__(self, node_types=None):
+    def __init__(self, node_types=None, gmx_tools=None):
 
         # List of nodes
         self.node_types = node_types or []
+        self.gmx_tools = gmx_tools or {}
 
         # Creates an instance of QtListWidget for the list
         self.widget = QtWidgets.QListWidget()
@@ -38,8 +41,9 @@ class NodeLibrary():
         """Populate the list widget with node class names.
         
         This method clears the existing items in the list widget and populates it with
-        the names of the node classes defined in `self.node_types`. Each item in the
-        list is associated with its corresponding node class for later retrieval.
+        the names of the node classes defined in `self.node_types`, then with the names
+        of the generated tools in `self.gmx_tools`. Each item in the list is associated
+        with its corresponding node class (or tool name) for later retrieval.
         
         It handles exceptions that may occur during the addition of items to the list,
         logging any errors encountered.
@@ -57,3 +61,10 @@ class NodeLibrary():
             except Exception:
                 logging.exception("Failed to add node class to library: %r", node_class)
                 continue
+
+        # Generated tools only store their name: the class is created on first use
+        for tool, description in self.gmx_tools.items():
+            item = QtWidgets.QListWidgetItem(tool)
+            item.setToolTip(description)
+            item.setData(QtCore.Qt.UserRole, tool)
+            self.widget.addItem(item)
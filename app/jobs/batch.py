@@ -0,0 +1,533 @@
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+
+from app.export.workflow import Step
+from app.jobs.executors import Executor
+from app.jobs.plan import check_plan, plan_steps
+from app.jobs.segments import PACKAGE_ROOT, runner_command
+
+
+"""
+Batch-scheduler executor: each node (or chain of nodes) becomes a scheduler job.
+
+The steps of a plan are grouped into jobs: one job per step, or (`group="chain"`) one job
+per chain of steps where each step only feeds the next one, which saves queue waits on
+the linear parts of a pipeline. Each job gets a bash script with the resource requests of
+its steps and is submitted with a dependency on the jobs it needs (`afterok`), so the
+whole pipeline is queued at once and the scheduler can backfill it.
+
+Resource requests:
+    - cores: `-nt`, or `-ntmpi` x `-ntomp`, of the mdrun steps; 1 for the other tools
+      (unless the `cores` option asks for more);
+    - walltime: `-maxh` of mdrun plus a margin (mdrun stops itself at 99 % of it), else
+      the `walltime` option (minutes), summed over the steps of a chain;
+      a segmented mdrun step (see `app.jobs.segments`) becomes a chain of jobs of one
+      segment each (`split_segments`), asking for the segment length plus the margin;
+    - memory: `memory_per_core` MB per core;
+    - gpus: 1 when a step offloads to the GPU (`-nb gpu`, ...).
+
+Schedulers are described by a command set (`SCHEDULERS` presets, or a JSON file with the
+same keys). Commands are argument lists whose `{field}` placeholders are filled in; an
+argument that comes out empty is dropped:
+
+    submit        submits {script} with the {dependency} argument; prints the job id
+    dependency    the dependency argument, {job_ids} joined with `dependency_sep`
+    job_id        regular expression extracting the job id from the submit output
+    status        prints the scheduler state of {job_id} (nothing once it left the queue)
+    states        scheduler state -> queued / running
+    cancel        cancels {job_id}
+    directive     prefix of the resource lines in the script (e.g. "#SBATCH")
+    resources     directive arguments: {name}, {cores}, {walltime}, {memory}, {log}, and
+                  `gpus` (only when the job uses a GPU)
+
+The scripts write their exit status to `<job>.exit` on exit (143 when the scheduler kills
+them), so the final state of a job does not depend on the scheduler accounting. Scripts, logs and the run record
+(`run.json`) are kept in `<workdir>/.grogui/batch/<run id>/`, which must be on a
+filesystem the compute nodes see.
+
+Classes:
+    BatchExecutor:
+        Submits plans as dependent scheduler jobs.
+
+Functions:
+    load_scheduler(name): Returns a scheduler command set, by preset name or JSON file.
+    step_resources(step, options): Returns the resource requests of one step.
+    split_segments(steps, plan): Replaces the segmented mdrun steps by one step per segment job.
+    group_steps(steps, group="node"): Splits steps into the jobs to submit.
+"""
+
+
+# Run as a script: it does not need the app package on the path of the scheduler commands
+_FAKE_SCHEDULER = str(pathlib.Path(__file__).with_name("fake_scheduler.py"))
+
+SCHEDULERS = {
+    "slurm": {
+        "submit": ["sbatch", "--parsable", "--kill-on-invalid-dep=yes", "{dependency}", "{script}"],
+        "dependency": "--dependency=afterok:{job_ids}",
+        "dependency_sep": ":",
+        "job_id": r"^(\d+)",
+        "status": ["squeue", "-h", "-j", "{job_id}", "-o", "%T"],
+        "states": {
+            "PENDING": "queued", "CONFIGURING": "queued", "REQUEUED": "queued",
+            "RUNNING": "running", "COMPLETING": "running", "SUSPENDED": "running",
+        },
+        "cancel": ["scancel", "{job_id}"],
+        "directive": "#SBATCH",
+        "resources": {
+            "name": "--job-name={name}",
+            "cores": "--cpus-per-task={cores}",
+            "walltime": "--time={walltime}",
+            "memory": "--mem={memory}M",
+            "log": "--output={log}",
+            "gpus": "--gres=gpu:{gpus}",
+        },
+    },
+    "pbs": {
+        "submit": ["qsub", "{dependency}", "{script}"],
+        "dependency": "-Wdepend=afterok:{job_ids}",
+        "dependency_sep": ":",
+        "job_id": r"^(\S+)",
+        "status": ["qstat", "-f", "-F", "json", "{job_id}"],
+        "states": {"Q": "queued", "H": "queued", "W": "queued", "R": "running", "E": "running"},
+        "state_pattern": r'"job_state"\s*:\s*"(\w)"',
+        "cancel": ["qdel", "{job_id}"],
+        "directive": "#PBS",
+        "resources": {
+            "name": "-N {name}",
+            "cores": "-l select=1:ncpus={cores}:mem={memory}mb",
+            "walltime": "-l walltime={walltime}",
+            "log": "-j oe -o {log}",
+        },
+    },
+    # Local stand-in (see app.jobs.fake_scheduler), for tests and machines without a scheduler
+    "fake": {
+        "submit": [sys.executable, _FAKE_SCHEDULER, "submit", "{dependency}", "{script}"],
+        "dependency": "--dependency={job_ids}",
+        "dependency_sep": ":",
+        "job_id": r"^(\S+)",
+        "status": [sys.executable, _FAKE_SCHEDULER, "status", "{job_id}"],
+        "states": {"PENDING": "queued", "RUNNING": "running"},
+        "cancel": [sys.executable, _FAKE_SCHEDULER, "cancel", "{job_id}"],
+        "directive": "#FAKE",
+        "resources": {
+            "name": "--job-name={name}",
+            "cores": "--cpus={cores}",
+            "walltime": "--time={walltime}",
+            "memory": "--mem={memory}M",
+            "log": "--output={log}",
+            "gpus": "--gpus={gpus}",
+        },
+    },
+}
+
+# Margin added to the -maxh of mdrun, in minutes
+_MAXH_MARGIN = 10
+# Segment jobs of a segmented mdrun step whose run time cannot be predicted
+_DEFAULT_SEGMENT_JOBS = 4
+_GPU_FLAGS = {"-nb", "-pme", "-pmefft", "-bonded", "-update"}
+# Exit status of the scripts stopped by the scheduler (see the TERM and INT traps)
+_KILLED = {"143", "130"}
+_FIELD_RE = re.compile(r"\{(\w+)\}")
+
+
+def load_scheduler(name):
+    """Returns a scheduler command set.
+
+    Args:
+        name (str): A preset name (`SCHEDULERS`) or the path of a JSON file with the same keys.
+
+    Returns:
+        dict: The command set.
+
+    Raises:
+        KeyError: If the name is neither a preset nor a file.
+    """
+    if name in SCHEDULERS:
+        return SCHEDULERS[name]
+    path = pathlib.Path(name)
+    if path.is_file():
+        return json.loads(path.read_text(encoding="utf-8"))
+    raise KeyError(f"Unknown scheduler: {name}")
+
+
+def _flag_value(args, flag):
+    for i, arg in enumerate(args[:-1]):
+        if arg == flag:
+            return args[i + 1]
+    return None
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def step_resources(step, options):
+    """Returns the resource requests of a step.
+
+    Args:
+        step (Step): The step.
+        options (dict): The executor defaults (`cores`, `walltime` in minutes, `memory_per_core` in MB).
+
+    Returns:
+        dict: `cores`, `minutes`, `gpus`.
+    """
+    cores = options["cores"]
+    minutes = options["walltime"]
+    gpus = 0
+    if step.tool == "mdrun":
+        nt = _int(_flag_value(step.args, "-nt"), 0)
+        if not nt:
+            # A multi-simulation has one rank per replica
+            ranks = _int(_flag_value(step.args, "-ntmpi"), len(step.replicas()) or 1)
+            nt = ranks * _int(_flag_value(step.args, "-ntomp"), 0)
+        cores = max(cores, nt or options["mdrun_cores"])
+        try:
+            maxh = float(_flag_value(step.args, "-maxh"))
+        except (TypeError, ValueError):
+            maxh = 0
+        if step.options.get("segment_jobs"):
+            # One segment per job (see split_segments)
+            maxh = float(step.options["segment_hours"])
+        if maxh > 0:
+            minutes = math.ceil(maxh * 60) + _MAXH_MARGIN
+        if any(_flag_value(step.args, flag) == "gpu" for flag in _GPU_FLAGS):
+            gpus = 1
+    return {"cores": cores, "minutes": minutes, "gpus": gpus}
+
+
+def split_segments(steps, plan):
+    """Replaces each segmented mdrun step by a chain of steps of one segment job each.
+
+    The number of jobs covers the predicted run time (see `app.jobs.cost_model`) plus one
+    spare, `_DEFAULT_SEGMENT_JOBS` when it cannot be predicted. Each job runs the segment
+    runner for one segment length; the last one fails if the run is still not complete.
+
+    Args:
+        steps (list): The steps, in dependency order.
+        plan (dict): The plan of the steps.
+
+    Returns:
+        list: The steps, in dependency order, the steps of the segment jobs named `<step>.<n>`.
+
+    Raises:
+        ValueError: If a segment length is not a positive number.
+    """
+    segmented = {s.name for s in steps if s.tool == "mdrun" and s.options.get("segment_hours")}
+    if not segmented:
+        return steps
+    from app.jobs.cost_model import predict_steps
+
+    try:
+        predictions = predict_steps(steps, plan["workdir"], plan.get("gmxrc") or None)
+    except Exception:
+        logging.exception("Cannot predict the run times of the segmented steps")
+        predictions = {}
+    result, last = [], {}
+    for step in steps:
+        deps = [last.get(dep, dep) for dep in step.deps]
+        if step.name not in segmented:
+            step.deps = deps
+            result.append(step)
+            continue
+        hours = float(step.options["segment_hours"])
+        if hours <= 0:
+            raise ValueError(f"{step.label}: invalid segment length {hours}")
+        seconds = (predictions.get(step.name) or {}).get("seconds")
+        if seconds:
+            count = math.ceil(seconds / 3600 / hours) + 1
+        else:
+            count = _DEFAULT_SEGMENT_JOBS
+            logging.warning("%s: run time unknown, %d segment jobs", step.label, count)
+        for n in range(1, count + 1):
+            part = Step(f"{step.name}.{n}", f"{step.label} [segment job {n}/{count}]", step.tool, step.args,
+                        step.stdin, step.inputs, step.outputs, dict(step.options, segment_job=n, segment_jobs=count))
+            part.deps = deps if n == 1 else [result[-1].name]
+            result.append(part)
+        last[step.name] = result[-1].name
+    return result
+
+
+def group_steps(steps, group="node"):
+    """Splits steps into the jobs to submit.
+
+    Args:
+        steps (list): The steps, in dependency order.
+        group (str, optional): "node" for one job per step, "chain" to put in one job each
+            step whose only dependency only feeds it.
+
+    Returns:
+        list: The groups (lists of steps), in dependency order.
+    """
+    if group != "chain":
+        return [[step] for step in steps]
+    children = {step.name: 0 for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            children[dep] += 1
+    groups, by_last = [], {}
+    for step in steps:
+        if step.options.get("segment_jobs"):
+            # Segment jobs are sized for one segment
+            groups.append([step])
+            continue
+        if len(step.deps) == 1 and children[step.deps[0]] == 1 and step.deps[0] in by_last:
+            chain = by_last.pop(step.deps[0])
+            chain.append(step)
+        else:
+            chain = [step]
+            groups.append(chain)
+        by_last[step.name] = chain
+    return groups
+
+
+def _walltime(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def _fill(template, fields):
+    """Fills an argument template; None if a field is missing or empty."""
+    names = _FIELD_RE.findall(template)
+    if any(fields.get(n) in (None, "", 0) for n in names):
+        return None
+    return template.format(**fields)
+
+
+class BatchExecutor(Executor):
+    """BatchExecutor submits plans as dependent jobs of a batch scheduler.
+
+    The run id is the run directory, holding the job scripts, logs and `run.json`.
+
+    Attributes:
+        scheduler (dict): The scheduler command set.
+        group (str): "node" (one job per step) or "chain" (see `group_steps`).
+        options (dict): The resource defaults: `cores`, `mdrun_cores`, `walltime` (minutes)
+            and `memory_per_core` (MB).
+
+    Methods:
+        submit(plan): Writes and submits the job scripts, returns the run directory.
+        status(run_id): Returns the state of the run and of each job.
+        cancel(run_id): Cancels the jobs not finished.
+        write_scripts(plan, run_dir): Writes the job scripts of a plan, returns the groups.
+    """
+    name = "batch"
+    label = "Batch scheduler"
+
+    def __init__(self, scheduler="slurm", group="node", cores=1, mdrun_cores=8, walltime=60, memory_per_core=1000):
+        self.scheduler = load_scheduler(scheduler) if isinstance(scheduler, str) else scheduler
+        self.group = group
+        self.options = {
+            "cores": cores,
+            "mdrun_cores": mdrun_cores,
+            "walltime": walltime,
+            "memory_per_core": memory_per_core,
+        }
+
+    def _run(self, command, fields):
+        argv = [a for a in (_fill(t, fields) for t in command) if a is not None]
+        result = subprocess.run(argv, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(argv)} failed ({result.returncode}): {result.stderr.strip()}")
+        return result.stdout
+
+    def _command(self, step, plan):
+        if not step.options.get("segment_jobs"):
+            return step.command()
+        # The runner of the compute nodes: the package must be on a shared filesystem
+        argv = runner_command(step, plan, "python3", float(step.options["segment_hours"]),
+                              step.options["segment_job"] == step.options["segment_jobs"])
+        return f"PYTHONPATH={shlex.quote(PACKAGE_ROOT)}${{PYTHONPATH:+:$PYTHONPATH}} {shlex.join(argv)}"
+
+    def write_scripts(self, plan, run_dir):
+        """Writes the job script of each group of steps.
+
+        Args:
+            plan (dict): The plan.
+            run_dir (pathlib.Path): The run directory.
+
+        Returns:
+            list: One dict per job (`name`, `steps`, `deps`, `script`, `log`, `exit`), in dependency order.
+        """
+        steps = split_segments(plan_steps(plan), plan)
+        groups = group_steps(steps, self.group)
+        group_of = {step.name: i for i, g in enumerate(groups) for step in g}
+        directive = self.scheduler["directive"]
+        jobs = []
+        for i, group in enumerate(groups):
+            name = group[0].name if len(group) == 1 else f"{group[0].name}--{group[-1].name}"
+            resources = [step_resources(step, self.options) for step in group]
+            cores = max(r["cores"] for r in resources)
+            gpus = max(r["gpus"] for r in resources)
+            fields = {
+                "name": name[:64],
+                "cores": cores,
+                "walltime": _walltime(sum(r["minutes"] for r in resources)),
+                "memory": cores * self.options["memory_per_core"],
+                "log": str(run_dir / f"{name}.log"),
+                "gpus": gpus,
+            }
+            lines = ["#!/bin/bash"]
+            for key, template in self.scheduler["resources"].items():
+                value = _fill(template, fields)
+                if value is not None:
+                    lines.append(f"{directive} {value}")
+            exit_file = run_dir / f"{name}.exit"
+            lines += [
+                f"trap 'echo $? > {shlex.quote(str(exit_file))}' EXIT",
+                # Killed by the scheduler: exit with the signal status, not the last one
+                "trap 'exit 143' TERM",
+                "trap 'exit 130' INT",
+                "set -e -o pipefail",
+                f"cd {shlex.quote(plan['workdir'])}",
+            ]
+            if plan.get("gmxrc"):
+                lines.append(f"source {shlex.quote(plan['gmxrc'])}")
+            if plan.get("gmxlib"):
+                lines.append(f"export GMXLIB={shlex.quote(plan['gmxlib'])}")
+            for step in group:
+                lines += [f"echo {shlex.quote('== ' + step.label)}", self._command(step, plan)]
+            script = run_dir / f"{name}.sh"
+            script.write_text("\n".join(lines) + "\n", encoding="utf-8")
+            script.chmod(0o755)
+
+            deps = sorted({group_of[d] for step in group for d in step.deps} - {i})
+            jobs.append({
+                "name": name,
+                "steps": [step.name for step in group],
+                "deps": deps,
+                "script": str(script),
+                "log": fields["log"],
+                "exit": str(exit_file),
+                "job_id": None,
+            })
+        return jobs
+
+    def submit(self, plan):
+        """Writes the job scripts of a plan and submits them, each after the jobs it needs.
+
+        If a submission fails, the jobs already submitted are cancelled.
+
+        Args:
+            plan (dict): The plan.
+
+        Returns:
+            str: The run id (the run directory).
+
+        Raises:
+            ValueError: If the plan is invalid.
+            RuntimeError: If the scheduler refuses a job.
+        """
+        check_plan(plan)
+        run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        run_dir = pathlib.Path(plan["workdir"]) / ".grogui" / "batch" / run_id
+        run_dir.mkdir(parents=True)
+        jobs = self.write_scripts(plan, run_dir)
+        record = {"scheduler": self.scheduler, "label": plan.get("label", ""), "jobs": jobs}
+
+        sep = self.scheduler.get("dependency_sep", ":")
+        try:
+            for job in jobs:
+                job_ids = sep.join(jobs[d]["job_id"] for d in job["deps"])
+                dependency = self.scheduler["dependency"].format(job_ids=job_ids) if job_ids else ""
+                out = self._run(self.scheduler["submit"], {"script": job["script"], "dependency": dependency})
+                m = re.search(self.scheduler["job_id"], out.strip(), re.MULTILINE)
+                if m is None:
+                    raise RuntimeError(f"No job id in the submit output: {out.strip()!r}")
+                job["job_id"] = m.group(1)
+                logging.info("Batch job %s submitted: %s", job["job_id"], job["name"])
+        except (OSError, RuntimeError):
+            for job in jobs:
+                if job["job_id"]:
+                    self._cancel_job(job)
+            raise
+        finally:
+            (run_dir / "run.json").write_text(json.dumps(record, indent=1), encoding="utf-8")
+        return str(run_dir)
+
+    def _job_state(self, job):
+        exit_file = pathlib.Path(job["exit"])
+        if exit_file.exists():
+            status = exit_file.read_text().strip()
+            return "done" if status == "0" else "cancelled" if status in _KILLED else "failed"
+        if not job["job_id"]:
+            return "cancelled"
+        try:
+            out = self._run(self.scheduler["status"], {"job_id": job["job_id"]}).strip()
+        except (OSError, RuntimeError) as e:
+            # A scheduler not answering says nothing about the job: still followed
+            logging.warning("Cannot get the state of batch job %s: %s", job["job_id"], e)
+            return "unknown"
+        pattern = self.scheduler.get("state_pattern")
+        if pattern:
+            m = re.search(pattern, out)
+            out = m.group(1) if m else ""
+        state = out.split()[0] if out else ""
+        if not state:
+            # Left the queue without running its script to the end
+            return "done" if exit_file.exists() else "cancelled"
+        return self.scheduler["states"].get(state, "running")
+
+    def status(self, run_id):
+        """Returns the state of a run.
+
+        Args:
+            run_id (str): The run directory.
+
+        Returns:
+            dict: `state` (see `app.jobs.executors`) and `jobs`, the state of each job by name.
+        """
+        record = json.loads((pathlib.Path(run_id) / "run.json").read_text(encoding="utf-8"))
+        self.scheduler = record.get("scheduler", self.scheduler)
+        states = {job["name"]: self._job_state(job) for job in record["jobs"]}
+        values = set(states.values())
+        if "failed" in values:
+            state = "failed"
+        elif "unknown" in values:
+            state = "unknown"
+        elif values <= {"queued"}:
+            state = "queued"
+        elif values <= {"done"}:
+            state = "done"
+        elif values & {"queued", "running"}:
+            state = "running"
+        else:
+            state = "cancelled"
+        return {"state": state, "jobs": states}
+
+    def cancel(self, run_id):
+        """Cancels the jobs of a run not finished yet.
+
+        Args:
+            run_id (str): The run directory.
+
+        Raises:
+            RuntimeError: If the scheduler could not cancel some of them (the others are cancelled).
+        """
+        record = json.loads((pathlib.Path(run_id) / "run.json").read_text(encoding="utf-8"))
+        self.scheduler = record.get("scheduler", self.scheduler)
+        failed = []
+        for job in record["jobs"]:
+            if job["job_id"] and not os.path.exists(job["exit"]):
+                if not self._cancel_job(job):
+                    failed.append(job["job_id"])
+        if failed:
+            raise RuntimeError(f"Cannot cancel batch job(s) {', '.join(failed)}")
+
+    def _cancel_job(self, job):
+        try:
+            self._run(self.scheduler["cancel"], {"job_id": job["job_id"]})
+        except (OSError, RuntimeError) as e:
+            logging.warning("Cannot cancel batch job %s: %s", job["job_id"], e)
+            return False
+        return True
@@ -0,0 +1,166 @@
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+
+from app.jobs.daemon import ACTIVE_STATES, default_jobs_dir, socket_path
+
+
+"""
+Client of the local job daemon (see `app.jobs.daemon`).
+
+Classes:
+    JobClient:
+        Sends requests to the daemon, starting it when needed, and follows job output.
+"""
+
+
+# Directory holding the `app` package, so the daemon can be started from anywhere
+_PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[2]
+
+
+class JobClient:
+    """JobClient talks to the job daemon of a state directory.
+
+    Every method opens its own connection, so a client can be shared between threads.
+    Methods raise `OSError` when the daemon cannot be reached and `RuntimeError` when it
+    refuses a request.
+
+    Attributes:
+        directory (pathlib.Path): The daemon state directory.
+        path (pathlib.Path): The daemon socket.
+
+    Methods:
+        request(op, **fields): Sends a request, returns the reply.
+        is_alive(): Tells whether the daemon answers.
+        ensure_daemon(timeout=10.0): Starts the daemon in the background if it is not running.
+        submit(plan): Submits an execution plan, returns the job record.
+        jobs(): Returns the job records.
+        active_jobs(): Returns the queued and running jobs, or [] if no daemon runs.
+        cancel(job_id): Cancels a job.
+        shutdown(force=False): Stops the daemon.
+        attach(job_id, offset=0): Yields the output events of a job until it ends.
+    """
+    def __init__(self, directory=None):
+        self.directory = pathlib.Path(directory or default_jobs_dir())
+        self.path = socket_path(self.directory)
+
+    def _connect(self, timeout=10.0):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(self.path))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def request(self, op, **fields):
+        """Sends a request to the daemon.
+
+        Args:
+            op (str): The request (see `app.jobs.daemon`).
+            **fields: The request fields.
+
+        Returns:
+            dict: The reply.
+
+        Raises:
+            OSError: If the daemon cannot be reached.
+            RuntimeError: If the daemon refuses the request.
+        """
+        with self._connect() as sock:
+            sock.sendall(json.dumps({"op": op, **fields}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise ConnectionError("The job daemon closed the connection")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error") or "Request refused")
+        return reply
+
+    def is_alive(self):
+        try:
+            self.request("ping")
+        except (OSError, RuntimeError, ValueError):
+            return False
+        return True
+
+    def ensure_daemon(self, timeout=10.0):
+        """Starts the daemon, detached from the calling process, if it is not running.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the daemon to answer.
+
+        Raises:
+            TimeoutError: If the daemon does not answer in time.
+        """
+        if self.is_alive():
+            return
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(_PROJECT_ROOT), env.get("PYTHONPATH")]))
+        subprocess.Popen(
+            [sys.executable, "-m", "app.jobs.daemon", "--dir", str(self.directory)],
+            cwd=str(_PROJECT_ROOT),
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.is_alive():
+                return
+            time.sleep(0.1)
+        raise TimeoutError(f"The job daemon did not start (see {self.directory / 'daemon.log'})")
+
+    def submit(self, plan):
+        return self.request("submit", plan=plan)["job"]
+
+    def jobs(self):
+        return self.request("jobs")["jobs"]
+
+    def active_jobs(self):
+        if not self.path.exists():
+            return []
+        try:
+            return [job for job in self.jobs() if job["state"] in ACTIVE_STATES]
+        except (OSError, RuntimeError, ValueError):
+            return []
+
+    def cancel(self, job_id):
+        return self.request("cancel", job=job_id)["job"]
+
+    def shutdown(self, force=False):
+        self.request("shutdown", force=force)
+
+    def attach(self, job_id, offset=0):
+        """Follows the output of a job.
+
+        Args:
+            job_id (str): The job.
+            offset (int, optional): The byte offset of the job log to start from.
+
+        Yields:
+            dict: `{"event": "output", "data", "offset"}` events, then one `{"event": "end", "job"}`.
+
+        Raises:
+            OSError: If the connection to the daemon is lost.
+            RuntimeError: If the job does not exist.
+        """
+        with self._connect(timeout=None) as sock:
+            sock.sendall(json.dumps({"op": "attach", "job": job_id, "offset": offset}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event.get("ok") is False:
+                        raise RuntimeError(event.get("error"))
+                    yield event
+                    if event.get("event") == "end":
+                        return
+        raise ConnectionError("The job daemon closed the connection")
@@ -0,0 +1,264 @@
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from app.jobs.plan import gmx_command, mdrun_file
+
+
+"""
+Convergence monitor: stops an equilibration mdrun once its energy terms have settled.
+
+The criterion is the "converge" option of an mdrun step (`EXECUTOR_PROPS` of the node):
+`term tolerance` pairs separated by commas, e.g. "Temperature 2, Pressure 20, Density 3",
+with the term names of `gmx energy` (case does not matter) and tolerances in their units.
+Over a sliding window of the last "converge_window" ps (`DEFAULT_WINDOW` by default), a
+term has converged when the means of the first and second halves of the window differ by
+less than its tolerance: its drift has flattened out at the scale asked for.
+
+While mdrun runs, the monitor reads the growing energy file every `POLL_SECONDS` with
+`gmx energy`. Once every term has converged, mdrun gets SIGINT: it stops at the next
+neighbour-search step, writing its checkpoint and final structure, and exits with status
+0, so the next steps start early. The executors running steps on this host (job daemon,
+work queue workers) start a monitor for each step with a criterion (see `start_step`).
+
+Classes:
+    ConvergenceMonitor:
+        Thread watching the energy file of a running mdrun step.
+
+Functions:
+    parse_criterion(text): Returns the terms and tolerances of a criterion.
+    read_energy(edr, terms, gmxrc=None, env=None): Returns the time series of energy terms.
+    check_convergence(series, criterion, window): Tells whether the terms have converged.
+    start_monitor(step, plan, proc, log): Starts the monitor of a step, if it has a criterion.
+"""
+
+
+# ps of simulation the criterion is tested over, by default
+DEFAULT_WINDOW = 20.0
+# Seconds between two reads of the energy file
+POLL_SECONDS = 60.0
+# Points needed in each half of the window
+_MIN_POINTS = 3
+
+_LEGEND_RE = re.compile(r'^@\s+s(\d+)\s+legend\s+"(.*)"')
+
+
+def parse_criterion(text):
+    """Returns the terms and tolerances of a convergence criterion.
+
+    Args:
+        text (str): The criterion, e.g. "Temperature 2, Density 5".
+
+    Returns:
+        list: The `(term, tolerance)` pairs.
+
+    Raises:
+        ValueError: If the criterion is malformed.
+    """
+    criterion = []
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        term, _, tolerance = part.strip().rpartition(" ")
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            raise ValueError(f"'{part.strip()}': expected a term and a tolerance") from None
+        if not term.strip() or tolerance <= 0:
+            raise ValueError(f"'{part.strip()}': expected a term and a positive tolerance")
+        criterion.append((term.strip(), tolerance))
+    if not criterion:
+        raise ValueError("No term to converge on")
+    return criterion
+
+
+def read_energy(edr, terms, gmxrc=None, env=None):
+    """Returns the time series of energy terms, from `gmx energy`.
+
+    Args:
+        edr (str): The energy file (absolute, it may still be written).
+        terms (list): The term names.
+        gmxrc (str, optional): The GMXRC to source.
+        env (dict, optional): The environment of gmx.
+
+    Returns:
+        dict: `(times, values)` of each term found, by lower-case name.
+
+    Raises:
+        RuntimeError: If gmx energy fails.
+    """
+    tmp = tempfile.mkdtemp(prefix="grogui-energy-")
+    try:
+        res = subprocess.run(gmx_command(["energy", "-f", edr, "-o", "energy.xvg"], gmxrc), cwd=tmp, env=env,
+                             input="".join(f"{t}\n" for t in terms) + "0\n", capture_output=True, text=True,
+                             timeout=300)
+        xvg = os.path.join(tmp, "energy.xvg")
+        if res.returncode != 0 or not os.path.exists(xvg):
+            lines = (res.stderr or res.stdout).strip().splitlines()
+            raise RuntimeError(f"gmx energy failed ({res.returncode}): {lines[-1] if lines else ''}")
+        legends, rows = {}, []
+        with open(xvg, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                m = _LEGEND_RE.match(line)
+                if m:
+                    legends[int(m.group(1))] = m.group(2).lower()
+                elif line.strip() and not line.startswith(("#", "@")):
+                    try:
+                        rows.append([float(v) for v in line.split()])
+                    except ValueError:
+                        # The last frame of a file being written may be cut
+                        continue
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise RuntimeError(f"gmx energy failed: {e}") from None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    series = {}
+    for column, name in legends.items():
+        points = [(row[0], row[column + 1]) for row in rows if len(row) > column + 1]
+        series[name] = ([t for t, _ in points], [v for _, v in points])
+    return series
+
+
+def check_convergence(series, criterion, window):
+    """Tells whether the terms have converged over the last `window` ps.
+
+    Args:
+        series (dict): The time series of `read_energy`.
+        criterion (list): The `(term, tolerance)` pairs of `parse_criterion`.
+        window (float): The window, in ps.
+
+    Returns:
+        tuple: Whether every term has converged (bool), and the state of each term (list of str).
+    """
+    converged, states = True, []
+    for term, tolerance in criterion:
+        times, values = series.get(term.lower(), ((), ()))
+        if not times or times[-1] - times[0] < window:
+            converged = False
+            states.append(f"{term}: {times[-1] - times[0] if times else 0:g} of {window:g} ps")
+            continue
+        middle, start = times[-1] - window / 2, times[-1] - window
+        first = [v for t, v in zip(times, values) if start <= t < middle]
+        second = [v for t, v in zip(times, values) if t >= middle]
+        if len(first) < _MIN_POINTS or len(second) < _MIN_POINTS:
+            converged = False
+            states.append(f"{term}: too few frames in {window:g} ps")
+            continue
+        drift = abs(sum(second) / len(second) - sum(first) / len(first))
+        converged = converged and drift < tolerance
+        states.append(f"{term}: drift {drift:.3g} {'<' if drift < tolerance else '>='} {tolerance:g}")
+    return converged, states
+
+
+class ConvergenceMonitor(threading.Thread):
+    """ConvergenceMonitor watches the energy file of a running mdrun step and stops it once converged.
+
+    Errors reading the energy file (not written yet, gmx energy failing) are reported once
+    in the step log; the monitor keeps trying until mdrun ends.
+
+    Attributes:
+        step (Step): The mdrun step.
+        plan (dict): The plan of the step (directory, GMXRC and GMXLIB).
+        proc (subprocess.Popen): The mdrun process, stopped with SIGINT.
+        log (file): The binary file of the step output, told about the monitor.
+        criterion (list): The `(term, tolerance)` pairs.
+        window (float): The window, in ps.
+        poll (float): Seconds between two reads of the energy file.
+        converged (bool): Whether the monitor stopped mdrun.
+
+    Methods:
+        __init__(step, plan, proc, log, poll=None): Reads the criterion of the step.
+        run(): Polls the energy file until mdrun ends or the terms converge.
+    """
+    def __init__(self, step, plan, proc, log, poll=None):
+        super().__init__(name=f"convergence-{step.name}", daemon=True)
+        self.step = step
+        self.plan = plan
+        self.proc = proc
+        self.log = log
+        self.criterion = parse_criterion(step.options.get("converge", ""))
+        self.window = float(step.options.get("converge_window") or DEFAULT_WINDOW)
+        if self.window <= 0:
+            raise ValueError("The convergence window must be positive")
+        self.poll = POLL_SECONDS if poll is None else poll
+        self.converged = False
+
+    def _note(self, text):
+        try:
+            self.log.write(f"[convergence] {text}\n".encode())
+            self.log.flush()
+        except (OSError, ValueError):
+            # The log is closed once the step is over
+            pass
+
+    def _wait(self):
+        """Sleeps for a poll interval, tells whether mdrun is still running."""
+        end = time.monotonic() + self.poll
+        while time.monotonic() < end:
+            if self.proc.poll() is not None:
+                return False
+            time.sleep(min(1.0, self.poll))
+        return self.proc.poll() is None
+
+    def run(self):
+        edr = os.path.join(self.plan["workdir"], mdrun_file(self.step, "-e", ".edr", "ener.edr"))
+        env = dict(os.environ)
+        if self.plan.get("gmxlib"):
+            env["GMXLIB"] = self.plan["gmxlib"]
+        terms = [term for term, _ in self.criterion]
+        error = None
+        while self._wait():
+            if not os.path.exists(edr):
+                continue
+            try:
+                series = read_energy(edr, terms, self.plan.get("gmxrc") or None, env)
+            except RuntimeError as e:
+                if str(e) != error:
+                    self._note(str(e))
+                error = str(e)
+                continue
+            converged, states = check_convergence(series, self.criterion, self.window)
+            if not converged:
+                continue
+            if self.proc.poll() is not None:
+                return
+            self._note(f"converged ({'; '.join(states)}): stopping mdrun at its next checkpoint")
+            logging.info("%s converged, stopping mdrun", self.step.label)
+            self.converged = True
+            try:
+                os.kill(self.proc.pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+            return
+
+
+def start_monitor(step, plan, proc, log):
+    """Starts the convergence monitor of a step, if it has a criterion.
+
+    A malformed criterion is reported in the log and the step runs to its end.
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step.
+        proc (subprocess.Popen): The process of the step.
+        log (file): The binary file of the step output.
+
+    Returns:
+        ConvergenceMonitor: The started monitor, or None.
+    """
+    if step.tool != "mdrun" or not step.options.get("converge"):
+        return None
+    try:
+        monitor = ConvergenceMonitor(step, plan, proc, log)
+    except ValueError as e:
+        log.write(f"[convergence] not monitored: {e}\n".encode())
+        return None
+    log.write(f"[convergence] stopping when {step.options['converge']} over {monitor.window:g} ps\n".encode())
+    monitor.start()
+    return monitor
@@ -0,0 +1,448 @@
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import statistics
+import time
+
+from app.jobs.plan import mdrun_file
+from app.jobs.mdrun_tuning import build_key, cached_tunings, host_key, parse_build, parse_performance
+from app.jobs.staging import wait_for
+from app.utils.mdp import DYNAMICS, estimate_output, format_size, replicas_output, run_inputs
+
+
+"""
+Runtime and cost model of planned workflows.
+
+Each step gets a predicted wall time, number of cores and output size:
+    mdrun      steps (mdp `nsteps`, or `-nsteps`) x atoms (structure of the grompp step writing
+               the tpr) / throughput in atom-steps per second. The throughput comes from the
+               history of the runs on this host with this GROMACS build (median of the runs of
+               the closest sizes, scaled by the cores), else from the mdrun tuning cache, else
+               from a conservative default. Energy minimisations count `nsteps` up to
+               `EM_STEPS`; `-maxh` caps the time. The output is `estimate_output`.
+               A multi-simulation (`-multidir`) counts the steps of all its replicas, at the
+               throughput of the multi-simulations of the history, else of the separate runs.
+    others     median wall time and output of the last runs of the tool on this host (one
+               core), else `DEFAULT_SECONDS` and no output.
+
+The schedule of the predictions gives each step its rank, the longest path from its start
+to the end of the workflow: the critical path starts with the highest rank, and parallel
+executors (work queue, Python driver) start the ready step of highest rank first, the
+longest branches first. The makespan assumes as many cores as the steps ask; the core-hours
+are those booked by the steps.
+
+The history is fed by the executors running steps on this host (job daemon, work queue
+workers) through `record_step`, after each successful step. Concurrent writers may drop a
+record, never corrupt the file. A multi-simulation is recorded with its total throughput
+(the logs of its replicas) and that of separate runs of the same size on this host, from
+the history, so `compare_multidir` tells whether sharing one launch paid off.
+
+History layout (`$XDG_STATE_HOME/grogui/throughput.json`, `~/.local/state/...` by default):
+    {
+        "mdrun": {"<host>|<build>": [{"natoms": ..., "cores": ..., "atom_steps_per_s": ..., "time": ...}]},
+        "multidir": {"<host>|<build>": [{"natoms": ..., "replicas": ..., "cores": ..., "atom_steps_per_s": ...,
+                                         "separate_atom_steps_per_s": ... (None: no separate run), "time": ...}]},
+        "tools": {"<host>": {"<tool>": [{"seconds": ..., "bytes": ..., "time": ...}]}}
+    }
+
+Functions:
+    history_path(): Returns the path of the throughput history.
+    step_cores(step): Returns the cores an mdrun step asks for.
+    record_step(step, plan, seconds): Adds a finished step to the history.
+    compare_multidir(): Returns the throughput of the multi-simulations against separate runs.
+    predict_steps(steps, workdir, gmxrc=None): Returns the prediction of each step.
+    schedule(steps, predictions): Returns the ranks, critical path, makespan and core-hours.
+    prioritize(steps, workdir, gmxrc=None): Returns the scheduling priority of each step.
+    format_duration(seconds): Returns a duration in human-readable units.
+    report(steps, workdir, gmxrc=None): Returns the prediction of a workflow as text.
+"""
+
+
+# Steps of an energy minimisation usually run before it converges
+EM_STEPS = 5000
+# Wall time of a tool with no history (grompp, solvate, genion...)
+DEFAULT_SECONDS = 10.0
+# Atom-steps per second and core with no history: a slow CPU core
+DEFAULT_THROUGHPUT = 1.0e6
+# Records kept per history entry, and used per prediction
+_KEEP = 50
+_NEAREST = 5
+
+_ATOMS_RE = re.compile(r"There are:\s+(\d+)\s+Atoms")
+_DT_RE = re.compile(r"^\s*dt\s*=\s*([0-9.eE+-]+)\s*$", re.MULTILINE)
+_MPI_RE = re.compile(r"^Using (\d+) MPI (?:threads?|process(?:es)?)", re.MULTILINE)
+_OMP_RE = re.compile(r"^Using (\d+) OpenMP threads", re.MULTILINE)
+
+
+def history_path():
+    """Returns the path of the throughput history."""
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return pathlib.Path(base) / "grogui" / "throughput.json"
+
+
+def _read_history():
+    try:
+        return json.loads(history_path().read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logging.warning("Ignoring unreadable throughput history %s", history_path())
+        return {}
+
+
+def _write_history(data):
+    path = history_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _value(args, flag):
+    return next((args[i + 1] for i, arg in enumerate(args[:-1]) if arg == flag), None)
+
+
+def step_cores(step):
+    """Returns the cores an mdrun step asks for (-nt, -ntmpi or replicas x -ntomp), all the cores by default."""
+    try:
+        if _value(step.args, "-nt"):
+            return max(int(_value(step.args, "-nt")), 1)
+        if _value(step.args, "-ntomp"):
+            ranks = int(_value(step.args, "-ntmpi") or len(step.replicas()) or 1)
+            return max(ranks * int(_value(step.args, "-ntomp")), 1)
+    except ValueError:
+        pass
+    return os.cpu_count() or 1
+
+
+def _mdrun_record(step, workdir, seconds):
+    """Returns the build and throughput record of a finished mdrun step from its log, or (None, None)."""
+    wait_for(workdir, [mdrun_file(step, "-g", ".log", "md.log")])
+    log = pathlib.Path(workdir) / mdrun_file(step, "-g", ".log", "md.log")
+    build, record = _log_record(log, seconds)
+    if record is not None and record["cores"] is None:
+        record["cores"] = step_cores(step)
+    return build, record
+
+
+def _multidir_record(step, workdir, seconds, history):
+    """Returns the build and record of a finished multi-simulation from the logs of its replicas, or (None, None)."""
+    name = mdrun_file(step, "-g", ".log", "md.log")
+    wait_for(workdir, [os.path.join(folder, name) for folder in step.replicas()])
+    records, build = [], None
+    for folder in step.replicas():
+        build, record = _log_record(pathlib.Path(workdir) / folder / name, seconds)
+        if record is None:
+            return None, None
+        records.append(record)
+    replicas = len(records)
+    cores = sum(r["cores"] for r in records) if all(r["cores"] for r in records) else step_cores(step)
+    natoms = round(statistics.mean(r["natoms"] for r in records))
+    rate = sum(r["atom_steps_per_s"] for r in records)
+    separate = _history_rate(history, "mdrun", build, natoms)[0]
+    record = {"natoms": natoms, "replicas": replicas, "cores": cores, "atom_steps_per_s": round(rate, 1),
+              "separate_atom_steps_per_s": round(separate * cores, 1) if separate else None,
+              "time": round(time.time())}
+    if separate:
+        logging.info("%s: %d replicas at %.3g atom-steps/s, %+.0f%% against separate runs", step.label,
+                     replicas, rate, (rate / (separate * cores) - 1) * 100)
+    return build, record
+
+
+def _log_record(log, seconds):
+    """Returns the build and throughput record of an mdrun log, its cores None if unsaid, or (None, None)."""
+    try:
+        # A log older than the step is not the log of this run
+        if log.stat().st_mtime < time.time() - seconds - 60:
+            return None, None
+        text = log.read_text(errors="replace")
+    except OSError:
+        return None, None
+    perf = parse_performance(text)
+    atoms = _ATOMS_RE.search(text)
+    dt = _DT_RE.search(text)
+    if not perf or not atoms or not dt or float(dt.group(1)) <= 0:
+        # Minimisations print no performance
+        return None, None
+    mpi, omp = _MPI_RE.search(text), _OMP_RE.search(text)
+    cores = int(mpi.group(1)) * int(omp.group(1)) if mpi and omp else None
+    # ns/day -> steps per second
+    steps_per_s = perf * 1000 / float(dt.group(1)) / 86400
+    record = {"natoms": int(atoms.group(1)), "cores": cores,
+              "atom_steps_per_s": round(steps_per_s * int(atoms.group(1)), 1), "time": round(time.time())}
+    return parse_build(text), record
+
+
+def _output_bytes(step, workdir):
+    wait_for(workdir, step.outputs)
+    total = 0
+    for path in step.outputs:
+        try:
+            total += os.path.getsize(os.path.join(workdir, path))
+        except OSError:
+            pass
+    return total
+
+
+def record_step(step, plan, seconds):
+    """Adds a successful step to the history of this host.
+
+    mdrun steps add their throughput, read from their log (multi-simulations: from the logs
+    of their replicas, with the throughput of separate runs to compare with); the other tools
+    add their wall time and output size. Errors are logged, never raised.
+
+    Args:
+        step (Step): The step, as run.
+        plan (dict): The plan of the step (directory).
+        seconds (float): The wall time of the step.
+    """
+    try:
+        history = _read_history()
+        if step.tool == "mdrun":
+            section = "multidir" if step.replicas() else "mdrun"
+            if step.replicas():
+                build, record = _multidir_record(step, plan["workdir"], seconds, history)
+            else:
+                build, record = _mdrun_record(step, plan["workdir"], seconds)
+            if record is None:
+                return
+            records = history.setdefault(section, {}).setdefault(f"{host_key()}|{build}", [])
+        else:
+            record = {"seconds": round(seconds, 3), "bytes": _output_bytes(step, plan["workdir"]),
+                      "time": round(time.time())}
+            records = history.setdefault("tools", {}).setdefault(host_key(), {}).setdefault(step.tool, [])
+        records.append(record)
+        del records[:-_KEEP]
+        _write_history(history)
+    except Exception:
+        logging.exception("Cannot record the run of %s", step.label)
+
+
+def _history_rate(history, section, build, natoms):
+    """Returns the atom-steps per second and core of the closest sizes in a history section, and the runs used."""
+    prefix = f"{host_key()}|"
+    keys = [f"{prefix}{build}"] if build else [k for k in history.get(section, {}) if k.startswith(prefix)]
+    # Sizes are compared by ratio: an unknown (0) atom count cannot be placed
+    records = [r for k in keys for r in history.get(section, {}).get(k, ()) if r.get("natoms", 0) > 0]
+    if not records or natoms <= 0:
+        return None, 0
+    # Closest sizes first (ratio), per core: the cost per atom-step changes with the size
+    records.sort(key=lambda r: abs(math.log(r["natoms"] / natoms)))
+    return statistics.median(r["atom_steps_per_s"] / r["cores"] for r in records[:_NEAREST]), min(len(records), _NEAREST)
+
+
+def _throughput(natoms, cores, history, build, multidir=False):
+    """Returns the atom-steps per second of a system on this host and where it comes from."""
+    if multidir:
+        rate, count = _history_rate(history, "multidir", build, natoms)
+        if rate:
+            return rate * cores, f"history of {count} multi-simulation(s)"
+    rate, count = _history_rate(history, "mdrun", build, natoms)
+    if rate:
+        return rate * cores, f"history of {count} run(s)"
+
+    prefix = f"{host_key()}|"
+    tuned = []
+    for key, entry in cached_tunings().items():
+        host, _, rest = key.partition("|")
+        entry_build, _, size = rest.rpartition("|")
+        if f"{host}|" != prefix or (build and entry_build != build) or not entry.get("ns_per_day"):
+            continue
+        flags = entry.get("flags", [])
+        try:
+            used = int(_value(flags, "-ntmpi") or 1) * int(_value(flags, "-ntomp") or os.cpu_count() or 1)
+            if int(size) <= 0 or natoms <= 0:
+                continue
+            # Tuning trials do not say their time step: assume 2 fs
+            tuned.append((abs(math.log(int(size) / natoms)), entry["ns_per_day"] * 1000 / 0.002 / 86400 * int(size) / used))
+        except ValueError:
+            continue
+    if tuned:
+        return min(tuned)[1] * cores, "mdrun tuning"
+    return DEFAULT_THROUGHPUT * cores, "default throughput"
+
+
+def _predict_mdrun(step, steps, workdir, history, build):
+    cores = step_cores(step)
+    try:
+        inputs = run_inputs(step, steps, workdir)
+    except ValueError as e:
+        return {"seconds": None, "cores": cores, "bytes": None, "basis": str(e)}
+    mdp, natoms, replicas = inputs["mdp"], inputs["natoms"], inputs["replicas"]
+    # mdrun -nsteps -2 keeps the mdp value, -1 runs with no end
+    nsteps = inputs["nsteps"] if inputs["nsteps"] not in (None, -2) else mdp.get_int("nsteps")
+    dynamics = mdp.get("integrator").lower() in DYNAMICS
+    if not dynamics:
+        nsteps = EM_STEPS if nsteps < 0 else min(nsteps, EM_STEPS)
+    sizes = replicas_output(estimate_output(mdp, natoms, nsteps), replicas)
+    rate, basis = _throughput(natoms, cores, history, build, bool(step.replicas()))
+    seconds = nsteps * natoms * replicas / rate if nsteps >= 0 else None
+    notes = [f"{natoms} atoms", f"{nsteps} steps" if nsteps >= 0 else "no end (nsteps = -1)", basis]
+    if step.replicas():
+        notes.insert(0, f"{replicas} replicas")
+    maxh = _value(step.args, "-maxh")
+    try:
+        if maxh and float(maxh) > 0 and (seconds is None or seconds > float(maxh) * 3600):
+            seconds = float(maxh) * 3600
+            notes.append(f"-maxh {maxh}")
+    except ValueError:
+        pass
+    if step.options.get("converge"):
+        notes.append("less if it converges early")
+    if inputs["lower_bound"]:
+        notes.append(f"at least: atoms counted in {inputs['atoms_from']}")
+    return {"seconds": seconds, "cores": cores, "bytes": sizes["total"] if sizes else None,
+            "basis": ", ".join(notes)}
+
+
+def compare_multidir():
+    """Returns the throughput of the multi-simulations run on this host against separate runs.
+
+    Returns:
+        list: One line (str) per recorded multi-simulation, latest last, `_NEAREST` at most.
+    """
+    prefix = f"{host_key()}|"
+    records = [r for k, rs in _read_history().get("multidir", {}).items() if k.startswith(prefix) for r in rs]
+    lines = []
+    for r in sorted(records, key=lambda r: r["time"])[-_NEAREST:]:
+        line = (f"{r['replicas']} replicas of {r['natoms']} atoms on {r['cores']} core(s): "
+                f"{r['atom_steps_per_s'] / r['cores']:.3g} atom-steps/s per core")
+        if r.get("separate_atom_steps_per_s"):
+            line += f", {(r['atom_steps_per_s'] / r['separate_atom_steps_per_s'] - 1) * 100:+.0f}% against separate runs"
+        else:
+            line += ", no separate run to compare with"
+        lines.append(line)
+    return lines
+
+
+def predict_steps(steps, workdir, gmxrc=None):
+    """Returns the predicted wall time, cores and output of each step (see the module docstring).
+
+    Args:
+        steps (list): The steps (`Step`), in dependency order.
+        workdir (str): The directory the steps run in.
+        gmxrc (str, optional): The GMXRC to source to read the GROMACS build.
+
+    Returns:
+        dict: By step name, `seconds` (None if unknown), `cores`, `bytes` (None if unknown)
+        and `basis`, what the prediction rests on.
+    """
+    history = _read_history()
+    tools = history.get("tools", {}).get(host_key(), {})
+    build = build_key(gmxrc or None) if any(s.tool == "mdrun" for s in steps) else None
+    predictions = {}
+    for step in steps:
+        if step.tool == "mdrun":
+            predictions[step.name] = _predict_mdrun(step, steps, workdir, history, build)
+            continue
+        records = tools.get(step.tool, [])[-_NEAREST:]
+        if records:
+            predictions[step.name] = {
+                "seconds": statistics.median(r["seconds"] for r in records), "cores": 1,
+                "bytes": int(statistics.median(r["bytes"] for r in records)),
+                "basis": f"history of {len(records)} run(s)"}
+        else:
+            predictions[step.name] = {"seconds": DEFAULT_SECONDS, "cores": 1, "bytes": 0, "basis": "default"}
+    return predictions
+
+
+def schedule(steps, predictions):
+    """Returns the schedule of predicted steps with no limit on the cores.
+
+    Unknown times count as 0: the results are then lower bounds.
+
+    Args:
+        steps (list): The steps (`Step`), in dependency order.
+        predictions (dict): The predictions of `predict_steps`.
+
+    Returns:
+        dict: `rank` (seconds from the start of each step to the end of the workflow),
+        `critical_path` (step names), `makespan` and `core_hours`.
+    """
+    seconds = {s.name: predictions[s.name]["seconds"] or 0.0 for s in steps}
+    finish, before = {}, {}
+    for step in steps:
+        dep = max(step.deps, key=lambda d: finish.get(d, 0.0), default=None)
+        before[step.name] = dep
+        finish[step.name] = seconds[step.name] + (finish.get(dep, 0.0) if dep else 0.0)
+    rank = {}
+    for step in reversed(steps):
+        children = [rank[s.name] for s in steps if step.name in s.deps and s.name in rank]
+        rank[step.name] = seconds[step.name] + max(children, default=0.0)
+
+    path = []
+    name = max(finish, key=finish.get, default=None)
+    while name:
+        path.append(name)
+        name = before[name]
+    return {
+        "rank": rank,
+        "critical_path": path[::-1],
+        "makespan": max(finish.values(), default=0.0),
+        "core_hours": sum(seconds[s.name] * predictions[s.name]["cores"] for s in steps) / 3600,
+    }
+
+
+def prioritize(steps, workdir, gmxrc=None):
+    """Returns the scheduling priority of each step: its rank, in seconds.
+
+    Args:
+        steps (list): The steps (`Step`), in dependency order.
+        workdir (str): The directory the steps run in.
+        gmxrc (str, optional): The GMXRC to source to read the GROMACS build.
+
+    Returns:
+        dict: The priority of each step name, highest first.
+    """
+    ranks = schedule(steps, predict_steps(steps, workdir, gmxrc))["rank"]
+    return {name: round(rank, 1) for name, rank in ranks.items()}
+
+
+def format_duration(seconds):
+    """Returns a duration in human-readable units."""
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+def report(steps, workdir, gmxrc=None):
+    """Returns the predicted time, cores and output of each step and of the workflow, as text.
+
+    Args:
+        steps (list): The steps (`Step`), in dependency order.
+        workdir (str): The directory the steps run in.
+        gmxrc (str, optional): The GMXRC to source to read the GROMACS build.
+
+    Returns:
+        str: The report.
+    """
+    predictions = predict_steps(steps, workdir, gmxrc)
+    plan = schedule(steps, predictions)
+    labels = {s.name: s.label for s in steps}
+    lines = []
+    for step in steps:
+        p = predictions[step.name]
+        time_ = format_duration(p["seconds"]) if p["seconds"] is not None else "unknown"
+        size = format_size(p["bytes"]) if p["bytes"] is not None else "unknown"
+        lines.append(f"{step.label}: {time_} on {p['cores']} core(s), output {size} ({p['basis']})")
+    unknown = [labels[n] for n, p in predictions.items() if p["seconds"] is None]
+    total = sum(p["bytes"] or 0 for p in predictions.values())
+    lines.append("")
+    lines.append("Critical path: " + " -> ".join(labels[n] for n in plan["critical_path"]))
+    lines.append(f"Predicted wall time: {format_duration(plan['makespan'])}, "
+                 f"{plan['core_hours']:.2f} core-hours, output {format_size(total)}")
+    if unknown:
+        lines.append("At least: no prediction for " + ", ".join(unknown))
+    if any(step.replicas() for step in steps):
+        comparison = compare_multidir()
+        lines.append("")
+        lines.append("Multi-simulations on this host: " + ("" if comparison else "none recorded yet"))
+        lines += [f"  {line}" for line in comparison]
+    return "\n".join(lines)
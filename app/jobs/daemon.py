@@ -0,0 +1,420 @@
+import argparse
+import codecs
+import json
+import logging
+import os
+import pathlib
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from app.jobs.cost_model import record_step
+from app.jobs.plan import check_plan, plan_steps, start_step, wait_step
+from app.jobs.staging import wait_for
+from app.utils.artifacts import store_step
+
+
+"""
+Local job daemon: runs execution plans (see `app.jobs.plan`) outside of the GUI.
+
+The daemon listens on a Unix domain socket only its user can connect to. Each request is
+one line of JSON, answered by one line of JSON (`{"ok": true, ...}` or
+`{"ok": false, "error": ...}`):
+
+    {"op": "ping"}                          -> {"ok": true, "pid": ...}
+    {"op": "submit", "plan": {...}}         -> {"ok": true, "job": {...}}
+    {"op": "jobs"}                          -> {"ok": true, "jobs": [{...}, ...]}
+    {"op": "cancel", "job": id}             -> {"ok": true, "job": {...}}
+    {"op": "shutdown", "force": false}      -> {"ok": true}   (refused while jobs are active)
+    {"op": "attach", "job": id, "offset": 0}
+
+`attach` streams the output of a job from a byte offset of its log: one
+`{"event": "output", "data": ..., "offset": ...}` line per chunk, then
+`{"event": "end", "job": {...}}` once the job is over, so a client connecting late (a
+reopened GUI) gets the whole output and then the live one.
+
+Jobs run `max_jobs` at a time, their steps one after the other in the plan order, each in
+its own session so that nothing but a cancel request stops them. A failing step ends its
+job. Successful steps feed the throughput history of the cost model (`app.jobs.cost_model`).
+The job list is saved in `jobs.json` at each change and the output of each job in
+`logs/<job>.log`; a daemon restarted after a crash re-queues the queued jobs and marks the
+jobs it was running as interrupted.
+
+Classes:
+    JobDaemon:
+        Job queue, execution and persistence.
+
+Functions:
+    default_jobs_dir(): Returns the directory of the daemon state.
+    socket_path(directory=None): Returns the socket of the daemon of a directory.
+    main(argv=None): Runs the daemon (`python -m app.jobs.daemon`).
+"""
+
+
+ACTIVE_STATES = ("queued", "running")
+_STATE_FILE = "jobs.json"
+# Keys of a job record sent to the clients (the plan stays in the daemon)
+_PUBLIC_KEYS = (
+    "id", "label", "workdir", "state", "step", "step_label", "steps", "pid",
+    "returncode", "created", "started", "ended",
+)
+
+
+def default_jobs_dir():
+    """Returns the directory holding the job daemon socket, state and logs."""
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return pathlib.Path(base) / "grogui" / "jobs"
+
+
+def socket_path(directory=None):
+    """Returns the socket of the daemon of a state directory.
+
+    Args:
+        directory (str | pathlib.Path, optional): The state directory. Defaults to `default_jobs_dir()`.
+
+    Returns:
+        pathlib.Path: The socket path (in the temporary directory when the state directory
+            is too deep for a Unix socket name).
+    """
+    path = pathlib.Path(directory or default_jobs_dir()) / "daemon.sock"
+    if len(os.fsencode(str(path))) > 100:
+        path = pathlib.Path(tempfile.gettempdir()) / f"grogui-jobs-{os.getuid()}.sock"
+    return path
+
+
+def _public(job):
+    return {key: job.get(key) for key in _PUBLIC_KEYS}
+
+
+class JobDaemon:
+    """JobDaemon queues, runs and persists the jobs submitted by the clients.
+
+    Attributes:
+        directory (pathlib.Path): The state directory (`jobs.json`, `logs/`).
+        max_jobs (int): The number of jobs run at the same time.
+
+    Methods:
+        submit(plan): Queues a plan, returns the job record.
+        cancel(job_id): Cancels a queued or running job.
+        jobs(): Returns the job records, oldest first.
+        job(job_id): Returns a job record.
+        log_path(job_id): Returns the log file of a job.
+        is_busy(): Tells whether a job is queued or running.
+        serve(path=None): Listens on the socket until shut down.
+        shutdown(): Stops listening.
+    """
+    def __init__(self, directory=None, max_jobs=1):
+        self.directory = pathlib.Path(directory or default_jobs_dir())
+        self.max_jobs = max(1, int(max_jobs))
+        self._logs = self.directory / "logs"
+        self._logs.mkdir(parents=True, exist_ok=True)
+        os.chmod(self.directory, 0o700)
+
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._queue = []
+        self._procs = {}
+        self._server = None
+        self._load()
+
+    # --- State ---
+
+    def _load(self):
+        path = self.directory / _STATE_FILE
+        try:
+            jobs = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logging.exception("Unreadable job state %s: starting empty", path)
+            return
+        for job in jobs:
+            if job["state"] == "running":
+                job["state"] = "interrupted"
+                job["ended"] = time.time()
+                logging.warning("Job %s was running when the daemon stopped: marked interrupted", job["id"])
+            elif job["state"] == "queued":
+                self._queue.append(job["id"])
+            self._jobs[job["id"]] = job
+
+    def _save(self):
+        # Called with the lock held
+        path = self.directory / _STATE_FILE
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(list(self._jobs.values())), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def submit(self, plan):
+        """Queues a plan.
+
+        Args:
+            plan (dict): The execution plan.
+
+        Returns:
+            dict: The job record.
+
+        Raises:
+            ValueError: If the plan is invalid.
+        """
+        check_plan(plan)
+        job = {
+            "id": time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6],
+            "label": plan.get("label") or "",
+            "workdir": plan["workdir"],
+            "state": "queued",
+            "step": None,
+            "step_label": None,
+            "steps": len(plan["steps"]),
+            "pid": None,
+            "returncode": None,
+            "created": time.time(),
+            "started": None,
+            "ended": None,
+            "cancel": False,
+            "plan": plan,
+        }
+        with self._cond:
+            self._jobs[job["id"]] = job
+            self._queue.append(job["id"])
+            self._save()
+            self._cond.notify_all()
+        logging.info("Job %s queued (%d steps)", job["id"], job["steps"])
+        return _public(job)
+
+    def cancel(self, job_id):
+        """Cancels a job: a queued job is dropped, the running step of a running job is killed.
+
+        Args:
+            job_id (str): The job.
+
+        Returns:
+            dict: The job record.
+
+        Raises:
+            KeyError: If the job does not exist.
+        """
+        with self._cond:
+            job = self._jobs[job_id]
+            if job["state"] == "queued":
+                self._queue.remove(job_id)
+                job["state"] = "cancelled"
+                job["ended"] = time.time()
+                self._save()
+            elif job["state"] == "running":
+                job["cancel"] = True
+                proc = self._procs.get(job_id)
+                if proc is not None:
+                    try:
+                        os.killpg(proc.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+            return _public(job)
+
+    def jobs(self):
+        with self._cond:
+            return [_public(job) for job in self._jobs.values()]
+
+    def job(self, job_id):
+        with self._cond:
+            return _public(self._jobs[job_id])
+
+    def log_path(self, job_id):
+        return self._logs / f"{job_id}.log"
+
+    def is_busy(self):
+        with self._cond:
+            return any(job["state"] in ACTIVE_STATES for job in self._jobs.values())
+
+    # --- Execution ---
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self._jobs[self._queue.pop(0)]
+                job["state"] = "running"
+                job["started"] = time.time()
+                self._save()
+            try:
+                state, returncode = self._run(job)
+            except Exception:
+                logging.exception("Job %s crashed", job["id"])
+                state, returncode = "failed", None
+            with self._cond:
+                job.update(state=state, returncode=returncode, pid=None, ended=time.time())
+                self._procs.pop(job["id"], None)
+                self._save()
+            logging.info("Job %s %s", job["id"], state)
+
+    def _run(self, job):
+        plan = job["plan"]
+        with open(self.log_path(job["id"]), "ab", buffering=0) as log:
+            try:
+                return self._run_steps(job, log)
+            finally:
+                # The job is over once the outputs of its staged steps are back
+                wait_for(plan["workdir"])
+
+    def _run_steps(self, job, log):
+        plan = job["plan"]
+        for index, step in enumerate(plan_steps(plan)):
+            with self._cond:
+                if job["cancel"]:
+                    return "cancelled", None
+            log.write(f"\n[{index + 1}/{job['steps']}] {step.label}\n$ {step.command()}\n".encode())
+            start = time.time()
+            proc = start_step(step, plan, log)
+            with self._cond:
+                self._procs[job["id"]] = proc
+                job.update(step=index, step_label=step.label, pid=proc.pid)
+                self._save()
+            returncode = wait_step(proc, step)
+            if returncode == 0:
+                record_step(step, plan, time.time() - start)
+                store_step(step, plan, log)
+            if returncode != 0:
+                with self._cond:
+                    cancelled = job["cancel"]
+                log.write(f"Exited with status {returncode}\n".encode())
+                return ("cancelled" if cancelled else "failed"), returncode
+        return "done", 0
+
+    # --- Server ---
+
+    def serve(self, path=None):
+        """Listens on the daemon socket and runs the queued jobs until `shutdown`.
+
+        Args:
+            path (str | pathlib.Path, optional): The socket. Defaults to `socket_path(directory)`.
+
+        Raises:
+            RuntimeError: If another daemon already listens on the socket.
+        """
+        path = pathlib.Path(path or socket_path(self.directory))
+        if path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(path))
+            except OSError:
+                path.unlink()  # Left by a daemon that did not exit cleanly
+            else:
+                raise RuntimeError(f"A job daemon already listens on {path}")
+            finally:
+                probe.close()
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _Server(str(path), _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.job_daemon = self
+        for _ in range(self.max_jobs):
+            threading.Thread(target=self._worker, daemon=True).start()
+        logging.info("Job daemon listening on %s", path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.job_daemon
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                if op == "attach":
+                    self._attach(daemon, request["job"], int(request.get("offset", 0)))
+                    return
+                reply = self._dispatch(daemon, op, request)
+            except (KeyError, ValueError, TypeError) as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            self._send(reply)
+
+    def _dispatch(self, daemon, op, request):
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op == "submit":
+            return {"ok": True, "job": daemon.submit(request["plan"])}
+        if op == "jobs":
+            return {"ok": True, "jobs": daemon.jobs()}
+        if op == "cancel":
+            return {"ok": True, "job": daemon.cancel(request["job"])}
+        if op == "shutdown":
+            if daemon.is_busy() and not request.get("force"):
+                return {"ok": False, "error": "Jobs are still queued or running"}
+            daemon.shutdown()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown request: {op}"}
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def _attach(self, daemon, job_id, offset):
+        daemon.job(job_id)  # KeyError for an unknown job
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        path = daemon.log_path(job_id)
+        while True:
+            # Read the state first: output written before the job ended is then always sent
+            job = daemon.job(job_id)
+            data = b""
+            if path.exists():
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(1 << 16)
+            if data:
+                offset += len(data)
+                self._send({"event": "output", "data": decoder.decode(data), "offset": offset})
+                continue
+            if job["state"] not in ACTIVE_STATES:
+                self._send({"event": "end", "job": job})
+                return
+            time.sleep(0.25)
+
+
+def main(argv=None):
+    """Runs the job daemon in the foreground (clients start it in the background)."""
+    parser = argparse.ArgumentParser(description="GroGUI job daemon")
+    parser.add_argument("--dir", default=None, help="state directory (default: $XDG_STATE_HOME/grogui/jobs)")
+    parser.add_argument("--max-jobs", type=int, default=1, help="jobs run at the same time")
+    args = parser.parse_args(argv)
+
+    daemon = JobDaemon(args.dir, args.max_jobs)
+    logging.basicConfig(
+        filename=daemon.directory / "daemon.log",
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+    )
+    signal.signal(signal.SIGTERM, lambda *_: daemon.shutdown())
+    try:
+        daemon.serve()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
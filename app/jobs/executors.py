@@ -0,0 +1,158 @@
+import abc
+
+
+"""
+Executor interface: where the execution plans (see `app.jobs.plan`) run.
+
+An executor takes a plan and returns a run id, then reports the state of the run and
+cancels it. Run states are the same for every backend:
+
+    queued      nothing started yet
+    running     some steps started, none failed
+    done        every step exited with status 0
+    failed      a step failed (the steps after it are not run)
+    cancelled   cancelled, or lost by the backend
+    unknown     the backend could not be asked (try again later)
+
+Backends are registered by name in `EXECUTORS` and built with `get_executor`; the
+options of each backend are the keyword arguments of its class.
+
+Classes:
+    Executor:
+        Base class of the backends.
+
+    DaemonExecutor:
+        The local job daemon (`app.jobs.daemon`).
+
+    QueueExecutor:
+        A shared-filesystem work queue (`app.jobs.work_queue`).
+
+Functions:
+    get_executor(name, **options): Returns a backend by name.
+"""
+
+
+RUN_STATES = ("queued", "running", "done", "failed", "cancelled", "unknown")
+
+
+class Executor(abc.ABC):
+    """Executor is the base class of the execution backends.
+
+    Attributes:
+        name (str): The backend name, in `EXECUTORS`.
+        label (str): The backend name shown in the GUI.
+
+    Methods:
+        submit(plan): Starts running a plan, returns the run id.
+        status(run_id): Returns the state of a run (`{"state": ..., ...}`).
+        cancel(run_id): Cancels a run.
+    """
+    name = ""
+    label = ""
+
+    @abc.abstractmethod
+    def submit(self, plan):
+        ...
+
+    @abc.abstractmethod
+    def status(self, run_id):
+        ...
+
+    @abc.abstractmethod
+    def cancel(self, run_id):
+        ...
+
+
+class DaemonExecutor(Executor):
+    """DaemonExecutor runs plans in the local job daemon, started when needed.
+
+    Attributes:
+        client (JobClient): The daemon client.
+    """
+    name = "daemon"
+    label = "This machine (job daemon)"
+    _STATES = {"interrupted": "cancelled"}
+
+    def __init__(self, directory=None):
+        from app.jobs.client import JobClient
+
+        self.client = JobClient(directory)
+
+    def submit(self, plan):
+        self.client.ensure_daemon()
+        return self.client.submit(plan)["id"]
+
+    def status(self, run_id):
+        job = next((j for j in self.client.jobs() if j["id"] == run_id), None)
+        if job is None:
+            raise KeyError(run_id)
+        return {"state": self._STATES.get(job["state"], job["state"]), "job": job}
+
+    def cancel(self, run_id):
+        self.client.cancel(run_id)
+
+
+class QueueExecutor(Executor):
+    """QueueExecutor adds plans to a shared-filesystem work queue run by its workers.
+
+    Attributes:
+        queue (WorkQueue): The queue.
+    """
+    name = "queue"
+    label = "Work queue (shared filesystem)"
+
+    def __init__(self, path):
+        from app.jobs.work_queue import WorkQueue
+
+        self.queue = WorkQueue(path)
+
+    def submit(self, plan):
+        return self.queue.enqueue(plan)
+
+    def status(self, run_id):
+        counts = self.queue.status(run_id)
+        if not any(counts.values()):
+            raise KeyError(run_id)
+        if counts["failed"]:
+            state = "failed"
+        elif counts["claimed"] or counts["done"] and counts["queued"]:
+            state = "running"
+        elif counts["queued"]:
+            state = "queued"
+        elif counts["skipped"]:
+            state = "cancelled"
+        else:
+            state = "done"
+        return {"state": state, "tasks": counts}
+
+    def cancel(self, run_id):
+        self.queue.cancel(run_id)
+
+
+def _batch_executor(**options):
+    from app.jobs.batch import BatchExecutor
+
+    return BatchExecutor(**options)
+
+
+EXECUTORS = {
+    DaemonExecutor.name: DaemonExecutor,
+    QueueExecutor.name: QueueExecutor,
+    "batch": _batch_executor,
+}
+
+
+def get_executor(name, **options):
+    """Returns an execution backend.
+
+    Args:
+        name (str): The backend name, in `EXECUTORS`.
+        **options: The options of the backend.
+
+    Returns:
+        Executor: The backend.
+
+    Raises:
+        KeyError: If no backend has this name.
+    """
+    return EXECUTORS[name](**options)
@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+
+"""
+Local stand-in for a batch scheduler, to test the batch executor without a cluster.
+
+It has the shape of a small Slurm: `submit` queues a job script and prints its id,
+`status` prints PENDING or RUNNING (nothing once the job is over), `cancel` stops a job.
+Each job is watched by a detached process that waits for the queue delay, for its
+dependencies (`--dependency=ID:ID`, i.e. afterok: a failed dependency cancels the job)
+and for a free slot, then runs the script with bash. `#FAKE --output=PATH` in the script
+sets the log file, other directives are ignored. State changes of a job are made under
+an flock on `<id>.lock`, so a cancel cannot be lost between the start check and the launch.
+
+Environment:
+    GROGUI_FAKE_SCHEDULER_DIR     job records (default: $XDG_STATE_HOME/grogui/fake-scheduler)
+    GROGUI_FAKE_SCHEDULER_DELAY   queue delay in seconds (default: 2)
+    GROGUI_FAKE_SCHEDULER_SLOTS   jobs running at the same time (default: the number of CPUs)
+
+The module only uses the standard library, so it can also be run as a script.
+
+Usage:
+    python -m app.jobs.fake_scheduler submit [--dependency=ID:ID] SCRIPT
+    python -m app.jobs.fake_scheduler status ID
+    python -m app.jobs.fake_scheduler cancel ID
+
+Functions:
+    main(argv=None): Command line.
+"""
+
+
+def _state_dir():
+    path = os.environ.get("GROGUI_FAKE_SCHEDULER_DIR")
+    if not path:
+        base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+        path = os.path.join(base, "grogui", "fake-scheduler")
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _read(job_id):
+    try:
+        return json.loads((_state_dir() / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write(job):
+    path = _state_dir() / f"{job['id']}.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(job), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@contextlib.contextmanager
+def _locked(job_id):
+    """Holds the lock of a job: its state is read, checked and written under it."""
+    with open(_state_dir() / f"{job_id}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _update(job_id, **fields):
+    job = _read(job_id)
+    job.update(fields)
+    _write(job)
+    return job
+
+
+def _output(script):
+    for line in pathlib.Path(script).read_text(encoding="utf-8").splitlines():
+        if line.startswith("#FAKE --output="):
+            return line.split("=", 1)[1].strip()
+    return None
+
+
+def _submit(script, dependency):
+    job = {
+        "id": uuid.uuid4().hex[:8],
+        "script": str(pathlib.Path(script).resolve()),
+        "cwd": os.getcwd(),
+        "deps": [d for d in (dependency or "").split(":") if d],
+        "state": "PENDING",
+        "returncode": None,
+        "pid": None,
+        "submitted": time.time(),
+    }
+    _write(job)
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "_watch", job["id"]],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    print(job["id"])
+
+
+def _acquire_slot():
+    slots = int(os.environ.get("GROGUI_FAKE_SCHEDULER_SLOTS") or os.cpu_count() or 1)
+    while True:
+        for i in range(slots):
+            f = open(_state_dir() / f"slot-{i}.lock", "w")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f  # Held until this process exits
+            except BlockingIOError:
+                f.close()
+        time.sleep(0.2)
+
+
+def _watch(job_id):
+    delay = float(os.environ.get("GROGUI_FAKE_SCHEDULER_DELAY") or 2)
+    job = _read(job_id)
+    time.sleep(delay)
+    while True:
+        job = _read(job_id)
+        if job["state"] != "PENDING":
+            return
+        deps = [_read(d) for d in job["deps"]]
+        if any(d is None or d["state"] in ("FAILED", "CANCELLED") for d in deps):
+            with _locked(job_id):
+                if _read(job_id)["state"] == "PENDING":
+                    _update(job_id, state="CANCELLED")
+            return
+        if all(d["state"] == "COMPLETED" for d in deps):
+            break
+        time.sleep(0.2)
+
+    slot = _acquire_slot()
+    output = _output(job["script"]) or os.path.join(job["cwd"], f"fake-{job_id}.out")
+    # Checked and launched under the job lock: a cancel is either seen here or finds the pid
+    with _locked(job_id):
+        if _read(job_id)["state"] != "PENDING":
+            slot.close()
+            return
+        with open(output, "ab") as log:
+            proc = subprocess.Popen(["bash", job["script"]], cwd=job["cwd"], stdout=log, stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        _update(job_id, state="RUNNING", pid=proc.pid)
+    returncode = proc.wait()
+    with _locked(job_id):
+        if _read(job_id)["state"] != "CANCELLED":
+            _update(job_id, state="COMPLETED" if returncode == 0 else "FAILED", returncode=returncode)
+    slot.close()
+
+
+def _cancel(job_id):
+    job = _read(job_id)
+    if job is None:
+        print(f"Unknown job {job_id}", file=sys.stderr)
+        return 1
+    with _locked(job_id):
+        job = _read(job_id)
+        if job["state"] not in ("PENDING", "RUNNING"):
+            return 0
+        _update(job_id, state="CANCELLED")
+    if job["pid"]:
+        try:
+            os.killpg(job["pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    return 0
+
+
+def main(argv=None):
+    """Command line of the fake scheduler (see the module docstring)."""
+    parser = argparse.ArgumentParser(description="Local stand-in for a batch scheduler")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("submit")
+    p.add_argument("--dependency", default="")
+    p.add_argument("script")
+    sub.add_parser("status").add_argument("job")
+    sub.add_parser("cancel").add_argument("job")
+    sub.add_parser("_watch").add_argument("job")
+    args = parser.parse_args(argv)
+
+    if args.command == "submit":
+        _submit(args.script, args.dependency)
+    elif args.command == "status":
+        job = _read(args.job)
+        if job is None:
+            print(f"Unknown job {args.job}", file=sys.stderr)
+            return 1
+        if job["state"] in ("PENDING", "RUNNING"):
+            print(job["state"])
+    elif args.command == "cancel":
+        return _cancel(args.job)
+    elif args.command == "_watch":
+        _watch(args.job)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
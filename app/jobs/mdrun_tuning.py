@@ -0,0 +1,385 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from app.export.workflow import Step
+from app.jobs.plan import gmx_command
+from app.nodes.host_profile import load_profile
+
+
+"""
+mdrun auto-tuning: benchmarks the thread layouts of mdrun on a CPU host and remembers the fastest.
+
+A tuning run takes a `.tpr` and runs a grid of short trials
+(`mdrun -nsteps N -resethway -nb cpu -ntmpi X -ntomp Y -npme Z`): every split of the cores
+into thread-MPI ranks and OpenMP threads, and for 4 ranks or more a few PME rank counts.
+The performance (ns/day, counted after the half-way reset) is read from the log of each
+trial, and the fastest layout is cached.
+
+The cache is keyed by host, GROMACS build and system size, so the result is reused for
+the other runs of similar systems on the same machine: `apply_tuned_flags` gives the tuned
+flags to an mdrun step with no thread layout of its own (-nt, -ntmpi, -ntomp, -npme) and
+no GPU offload, on a host with no usable GPU. Executors running steps on this host (job
+daemon, work queue workers) call it when they start a step.
+
+Cache layout (`$XDG_CACHE_HOME/grogui/mdrun-tuning.json`, `~/.cache/...` by default):
+    {"<host>|<build>|<size>": {"flags": [...], "ns_per_day": ..., "trials": [...], "tpr": ..., "tuned": ...}}
+
+    host: the host name and the number of cores;
+    build: the GROMACS version, precision and SIMD level of `gmx --version`;
+    size: the number of atoms of the system, rounded to 2 significant digits.
+
+Usage:
+    python -m app.jobs.mdrun_tuning TPR [--cores N] [--nsteps N] [--gmxrc GMXRC]
+
+Functions:
+    tuning_cache_path(): Returns the path of the tuning cache.
+    host_key(): Returns the host part of the cache keys.
+    build_key(gmxrc=None, gmx="gmx"): Returns the GROMACS build part of the cache keys.
+    parse_build(text): Returns the build key of a `gmx --version` output or mdrun log.
+    count_atoms(tpr, gmxrc=None, gmx="gmx"): Returns the number of atoms of a tpr.
+    tuning_key(tpr, gmxrc=None, gmx="gmx"): Returns the cache key of a system on this host.
+    layouts(cores): Returns the thread layouts to try.
+    parse_performance(text): Returns the ns/day of an mdrun log.
+    tune(tpr, cores=None, nsteps=2000, gmxrc=None, gmx="gmx", output=None): Benchmarks the layouts, caches the fastest.
+    cached_tunings(): Returns the tuning cache.
+    tuned_flags(tpr, gmxrc=None, gmx="gmx"): Returns the cached flags of a system, or None.
+    apply_tuned_flags(step, plan, log=None): Returns an mdrun step using the tuned flags.
+"""
+
+
+# Flags of the thread layout: a step setting one of them is not tuned
+LAYOUT_FLAGS = ("-nt", "-ntmpi", "-ntomp", "-npme")
+# GPU offload flags: a step offloading to the GPU is not tuned, the others get `-nb cpu`
+_OFFLOAD_FLAGS = ("-nb", "-pme", "-pmefft", "-bonded", "-update")
+_PERF_RE = re.compile(r"^Performance:\s+([0-9.]+)", re.MULTILINE)
+_NATOMS_RE = re.compile(r"^\s*natoms\s*=\s*(\d+)")
+_BUILD_FIELDS = ("GROMACS version", "Precision", "SIMD instructions")
+
+_build_keys = {}
+
+
+def tuning_cache_path():
+    """Returns the path of the tuning cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "grogui" / "mdrun-tuning.json"
+
+
+def _read_cache():
+    try:
+        return json.loads(tuning_cache_path().read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logging.warning("Ignoring unreadable mdrun tuning cache %s", tuning_cache_path())
+        return {}
+
+
+def _write_cache(data):
+    path = tuning_cache_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def host_key():
+    """Returns the host part of the cache keys: host name and number of cores."""
+    return f"{socket.gethostname()}:{os.cpu_count()}"
+
+
+def build_key(gmxrc=None, gmx="gmx"):
+    """Returns the GROMACS build part of the cache keys, from `gmx --version`.
+
+    Args:
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        str: The version, precision and SIMD level, or None if gmx cannot be run.
+    """
+    if (gmxrc, gmx) in _build_keys:
+        return _build_keys[gmxrc, gmx]
+    try:
+        res = subprocess.run(gmx_command(["--version"], gmxrc, gmx), capture_output=True, text=True,
+                             stdin=subprocess.DEVNULL, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning("Impossible to execute '%s --version': %s", gmx, e)
+        return None
+    key = parse_build(res.stdout + res.stderr)
+    if key is not None:
+        _build_keys[gmxrc, gmx] = key
+    return key
+
+
+def parse_build(text):
+    """Returns the build key of a `gmx --version` output or of an mdrun log header.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The version, precision and SIMD level, or None if the text has no version.
+    """
+    fields = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(":")
+        if name.strip() in _BUILD_FIELDS:
+            fields.setdefault(name.strip(), value.strip())
+        if len(fields) == len(_BUILD_FIELDS):
+            break
+    if "GROMACS version" not in fields:
+        return None
+    return "/".join(fields.get(n, "?") for n in _BUILD_FIELDS)
+
+
+def count_atoms(tpr, gmxrc=None, gmx="gmx"):
+    """Returns the number of atoms of a run input, from the header of `gmx dump`.
+
+    Args:
+        tpr (str): The tpr file.
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        int: The number of atoms, or None if it cannot be read.
+    """
+    try:
+        proc = subprocess.Popen(gmx_command(["dump", "-s", str(tpr)], gmxrc, gmx), stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError as e:
+        logging.warning("Impossible to execute '%s dump': %s", gmx, e)
+        return None
+    natoms = None
+    try:
+        # The count is in the header: no need to read the whole topology
+        for line in proc.stdout:
+            m = _NATOMS_RE.match(line)
+            if m:
+                natoms = int(m.group(1))
+                break
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+    return natoms
+
+
+def _size_class(natoms):
+    digits = max(len(str(natoms)) - 2, 0)
+    return round(natoms, -digits)
+
+
+def tuning_key(tpr, gmxrc=None, gmx="gmx"):
+    """Returns the cache key of a system on this host.
+
+    Args:
+        tpr (str): The tpr file.
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        str: The key, or None if the build or the size cannot be read.
+    """
+    build = build_key(gmxrc, gmx)
+    natoms = count_atoms(tpr, gmxrc, gmx) if build else None
+    if natoms is None:
+        return None
+    return f"{host_key()}|{build}|{_size_class(natoms)}"
+
+
+def layouts(cores):
+    """Returns the thread layouts to try on a number of cores.
+
+    Args:
+        cores (int): The cores to use.
+
+    Returns:
+        list: The mdrun flags of each layout.
+    """
+    result = []
+    for ntmpi in (n for n in range(1, cores + 1) if cores % n == 0):
+        npmes = {0}
+        if ntmpi >= 4:
+            npmes |= {ntmpi // 4, ntmpi // 3}
+        for npme in sorted(npmes):
+            result.append(["-ntmpi", str(ntmpi), "-ntomp", str(cores // ntmpi), "-npme", str(npme)])
+    return result
+
+
+def parse_performance(text):
+    """Returns the performance (ns/day) of an mdrun log, or None if the run did not finish."""
+    m = _PERF_RE.search(text)
+    return float(m.group(1)) if m else None
+
+
+def tune(tpr, cores=None, nsteps=2000, gmxrc=None, gmx="gmx", output=None):
+    """Benchmarks the thread layouts of mdrun on a system and caches the fastest.
+
+    The trials run one after the other in a temporary directory next to the tpr.
+
+    Args:
+        tpr (str): The tpr file.
+        cores (int, optional): The cores to use. Defaults to all the cores of the host.
+        nsteps (int, optional): The steps of each trial (timed over the second half).
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+        output (callable, optional): Receives a progress message per trial.
+
+    Returns:
+        dict: The cache entry: `flags`, `ns_per_day` and `trials`.
+
+    Raises:
+        RuntimeError: If the key of the system cannot be read or no trial finished.
+    """
+    output = output or logging.info
+    tpr = Path(tpr).resolve()
+    key = tuning_key(tpr, gmxrc, gmx)
+    if key is None:
+        raise RuntimeError(f"Cannot read the GROMACS build or the size of {tpr}")
+    cores = cores or os.cpu_count() or 1
+    trials = []
+    tmp = tempfile.mkdtemp(prefix=".grogui-tuning-", dir=tpr.parent)
+    try:
+        for i, layout in enumerate(layouts(cores)):
+            flags = ["-nb", "cpu", *layout, "-pin", "on"]
+            args = ["mdrun", "-s", str(tpr), "-deffnm", f"trial{i}", "-nsteps", str(nsteps),
+                    "-resethway", "-noconfout", *flags]
+            start = time.time()
+            res = subprocess.run(gmx_command(args, gmxrc, gmx), cwd=tmp, stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            log = Path(tmp) / f"trial{i}.log"
+            perf = parse_performance(log.read_text(errors="replace")) if res.returncode == 0 and log.exists() else None
+            trials.append({"flags": flags, "ns_per_day": perf})
+            output(f"{' '.join(layout)}: " + (f"{perf} ns/day" if perf else "failed")
+                   + f" ({time.time() - start:.0f} s)")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    done = [t for t in trials if t["ns_per_day"]]
+    if not done:
+        raise RuntimeError("No mdrun trial finished")
+    best = max(done, key=lambda t: t["ns_per_day"])
+    entry = {"flags": best["flags"], "ns_per_day": best["ns_per_day"], "trials": trials, "tpr": str(tpr),
+             "tuned": time.strftime("%Y-%m-%d %H:%M:%S")}
+    cache = _read_cache()
+    cache[key] = entry
+    _write_cache(cache)
+    output(f"Fastest: {' '.join(best['flags'])} ({best['ns_per_day']} ns/day), cached for {key}")
+    return entry
+
+
+def cached_tunings():
+    """Returns the tuning cache: the entry of each key (see the module docstring)."""
+    return _read_cache()
+
+
+def tuned_flags(tpr, gmxrc=None, gmx="gmx"):
+    """Returns the tuned flags cached for a system on this host.
+
+    Args:
+        tpr (str): The tpr file.
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        list: The flags, or None if this host has no tuning for the system.
+    """
+    cache = _read_cache()
+    # Only run gmx when this host has tuned something
+    prefix = host_key() + "|"
+    if not any(k.startswith(prefix) for k in cache):
+        return None
+    key = tuning_key(tpr, gmxrc, gmx)
+    entry = cache.get(key) if key else None
+    return list(entry["flags"]) if entry else None
+
+
+def _drop_flags(args, flags):
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in flags:
+            skip = True
+        else:
+            result.append(arg)
+    return result
+
+
+def apply_tuned_flags(step, plan, log=None):
+    """Returns an mdrun step using the flags tuned on this host, or the step unchanged.
+
+    Steps other than mdrun, steps setting their own thread layout, multi-simulations (tuned
+    for one system alone, the flags would not fit the replicas sharing the cores) and systems
+    with no tuning are returned as is. So are steps offloading to a GPU, and every step on a
+    host with a usable GPU (see `app.nodes.host_profile`): the tuning is a CPU-only one, its
+    `-nb cpu` would move them off the GPU. Errors are logged, never raised.
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step (directory and GMXRC).
+        log (file, optional): A binary file told about the tuned flags.
+
+    Returns:
+        Step: The step to run.
+    """
+    if step.tool != "mdrun" or step.replicas() or any(flag in step.args for flag in LAYOUT_FLAGS):
+        return step
+    if any(arg in _OFFLOAD_FLAGS and value == "gpu" for arg, value in zip(step.args, step.args[1:])):
+        return step
+    try:
+        if load_profile().get("gpu_usable"):
+            return step
+    except Exception:
+        logging.exception("Cannot read the host profile")
+        return step
+    tpr = next((step.args[i + 1] for i, arg in enumerate(step.args[:-1]) if arg == "-s"), None)
+    if not tpr:
+        return step
+    try:
+        flags = tuned_flags(os.path.join(plan["workdir"], tpr), plan.get("gmxrc") or None)
+    except Exception:
+        logging.exception("Cannot read the mdrun tuning of %s", tpr)
+        return step
+    if not flags:
+        return step
+    tuned = Step(step.name, step.label, step.tool, _drop_flags(step.args, _OFFLOAD_FLAGS) + flags,
+                 step.stdin, step.inputs, step.outputs, step.options)
+    tuned.deps = list(step.deps)
+    if log is not None:
+        log.write(f"Using the mdrun flags tuned on this host: {' '.join(flags)}\n".encode())
+        log.flush()
+    return tuned
+
+
+def main(argv=None):
+    """Command line: tunes mdrun for a tpr on this host."""
+    parser = argparse.ArgumentParser(description="Benchmark the mdrun thread layouts on this host")
+    parser.add_argument("tpr")
+    parser.add_argument("--cores", type=int, default=None)
+    parser.add_argument("--nsteps", type=int, default=2000)
+    parser.add_argument("--gmxrc", default=None)
+    parser.add_argument("--gmx", default="gmx")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        tune(args.tpr, args.cores, args.nsteps, args.gmxrc, args.gmx)
+    except RuntimeError as e:
+        logging.error("%s", e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import logging
+import os
+import pathlib
+import subprocess
+
+from app.export.workflow import Step, build_steps
+
+
+"""
+Execution plans: what an executor needs to run a workflow without the GUI.
+
+A plan is plain JSON-compatible data, so it can be sent to the job daemon, stored in a
+queue or written next to a batch script:
+
+    {
+        "label": "Run all nodes",
+        "workdir": "/path/to/system",          directory the steps run in
+        "gmxrc": "/opt/gromacs/bin/GMXRC",     sourced before each step ("" for none)
+        "gmxlib": "",                          exported as GMXLIB when set
+        "steps": [Step.to_dict(), ...],        in dependency order
+    }
+
+Steps built by `make_plan` also carry a "priority": their predicted time to the end of
+the workflow (see `app.jobs.cost_model`), used by the executors that run steps in parallel.
+
+Functions:
+    make_plan(nodes, workdir, label="", gmxrc=None, gmxlib=None): Returns the plan of a group of nodes.
+    check_plan(plan): Validates a plan received from a client.
+    plan_steps(plan): Returns the steps of a plan.
+    gmx_command(args, gmxrc=None, gmx="gmx"): Returns the argument list running gmx with its environment.
+    step_command(step, gmxrc=None, gmx="gmx"): Returns the argument list running a step with its environment.
+    mdrun_file(step, flag, suffix, default): Returns a file written by an mdrun step.
+    start_step(step, plan, log): Starts the process of a step.
+    wait_step(proc, step): Answers the prompts of a started step and waits for it.
+"""
+
+
+def make_plan(nodes, workdir, label="", gmxrc=None, gmxlib=None):
+    """Returns the execution plan of a group of nodes.
+
+    Args:
+        nodes (list): The nodes.
+        workdir (str | pathlib.Path): The directory the steps run in.
+        label (str, optional): A name shown in the job lists.
+        gmxrc (str | pathlib.Path, optional): The GMXRC to source before each step.
+        gmxlib (str, optional): The GMXLIB to export. Defaults to `$GMXLIB`.
+
+    Returns:
+        dict: The plan.
+    """
+    from app.jobs.cost_model import prioritize
+
+    if gmxlib is None:
+        gmxlib = os.environ.get("GMXLIB", "")
+    workdir = str(pathlib.Path(workdir).resolve())
+    steps = build_steps(nodes)
+    try:
+        priorities = prioritize(steps, workdir, gmxrc)
+    except Exception:
+        logging.exception("Cannot predict the run times of the plan")
+        priorities = {}
+    data = []
+    for step in steps:
+        entry = step.to_dict()
+        entry["priority"] = priorities.get(step.name, 0)
+        data.append(entry)
+    return {
+        "label": label,
+        "workdir": workdir,
+        "gmxrc": str(gmxrc or ""),
+        "gmxlib": gmxlib or "",
+        "steps": data,
+    }
+
+
+def check_plan(plan):
+    """Validates a plan received from a client.
+
+    Args:
+        plan (dict): The plan.
+
+    Raises:
+        ValueError: If the plan is malformed, has no step or its directory does not exist.
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get("steps"), list):
+        raise ValueError("Malformed plan")
+    if not plan["steps"]:
+        raise ValueError("The plan has no step")
+    names = set()
+    for step in plan["steps"]:
+        argv = step.get("argv") if isinstance(step, dict) else None
+        if not argv or not all(isinstance(a, str) for a in argv) or not isinstance(step.get("name"), str):
+            raise ValueError("Malformed plan step")
+        if any(dep not in names for dep in step.get("deps", ())):
+            raise ValueError(f"Step '{step['name']}' depends on a later or unknown step")
+        names.add(step["name"])
+    if not os.path.isdir(plan.get("workdir") or ""):
+        raise ValueError(f"Working directory not found: {plan.get('workdir')}")
+
+
+def plan_steps(plan):
+    """Returns the steps of a plan.
+
+    Args:
+        plan (dict): The plan.
+
+    Returns:
+        list: The steps (`Step`), in dependency order.
+    """
+    return [Step.from_dict(data) for data in plan["steps"]]
+
+
+def gmx_command(args, gmxrc=None, gmx="gmx"):
+    """Returns the argument list running `gmx args`, after sourcing GMXRC if any.
+
+    The gmx arguments are passed to bash as positional parameters, never parsed by the
+    shell.
+
+    Args:
+        args (list): The arguments following gmx.
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        list: The arguments of the process to start.
+    """
+    if not gmxrc:
+        return [gmx, *args]
+    return ["bash", "-c", 'source "$0" >/dev/null && exec "$@"', str(gmxrc), gmx, *args]
+
+
+def step_command(step, gmxrc=None, gmx="gmx"):
+    """Returns the argument list running a step, after sourcing GMXRC if any (see `gmx_command`).
+
+    A multi-simulation starts its MPI launcher instead of gmx (see `Step.launcher`).
+
+    Args:
+        step (Step): The step.
+        gmxrc (str, optional): The GMXRC to source.
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        list: The arguments of the process to start.
+    """
+    program, *launch = step.launcher(gmx)
+    return gmx_command([*launch, step.tool, *step.args], gmxrc, program)
+
+
+def mdrun_file(step, flag, suffix, default):
+    """Returns a file written by an mdrun step: its option, else `-deffnm`, else the gmx default.
+
+    Args:
+        step (Step): The mdrun step.
+        flag (str): The option of the file (e.g. "-e").
+        suffix (str): The extension added to `-deffnm` (e.g. ".edr").
+        default (str): The file mdrun writes with neither (e.g. "ener.edr").
+
+    Returns:
+        str: The file, relative to the directory of the step.
+    """
+    values = {step.args[i]: step.args[i + 1] for i in range(len(step.args) - 1) if step.args[i].startswith("-")}
+    if values.get(flag):
+        return values[flag]
+    if values.get("-deffnm"):
+        return values["-deffnm"] + suffix
+    return default
+
+
+def start_step(step, plan, log):
+    """Starts the process of a step in the directory and environment of its plan.
+
+    The process gets its own session, so it does not receive the signals of the terminal
+    or of the process that started it, and can be stopped as a whole with `os.killpg`.
+
+    An mdrun step with no thread layout of its own gets the flags tuned on this host for
+    its system, if any (see `app.jobs.mdrun_tuning`); one with a convergence criterion is
+    watched, and stopped once converged (see `app.jobs.convergence`); one with a segment
+    length runs as checkpointed segments (see `app.jobs.segments`). A step with a scratch
+    directory runs there, its inputs staged in (see `app.jobs.staging`); any step first
+    waits for its input files still being copied back from the scratch of another. The
+    files a step writes get their own copy back if they are linked to the artifact store
+    (see `app.utils.artifacts`).
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step.
+        log (file): The binary file receiving the step output.
+
+    Returns:
+        subprocess.Popen: The process, its stdin still open (see `wait_step`).
+    """
+    from app.jobs.convergence import start_monitor
+    from app.jobs.mdrun_tuning import apply_tuned_flags
+    from app.jobs.segments import runner_command, runner_env
+    from app.jobs.staging import stage_step, wait_for
+    from app.utils.artifacts import unshare_step
+
+    env = dict(os.environ)
+    if plan.get("gmxlib"):
+        env["GMXLIB"] = plan["gmxlib"]
+    wait_for(plan["workdir"], [*step.inputs, *step.args])
+    unshare_step(step, plan)
+    step = apply_tuned_flags(step, plan, log)
+    stage = stage_step(step, plan, log)
+    if stage is not None:
+        # The step, its segment runner and its monitor see the scratch directory only
+        plan = dict(plan, workdir=stage.directory)
+    segmented = step.tool == "mdrun" and step.options.get("segment_hours")
+    proc = subprocess.Popen(
+        runner_command(step, plan) if segmented else step_command(step, plan.get("gmxrc")),
+        cwd=plan["workdir"],
+        env=runner_env(env) if segmented else env,
+        stdin=subprocess.PIPE,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+    )
+    if not segmented:
+        # The segment runner watches each segment itself
+        start_monitor(step, plan, proc, log)
+    if stage is not None:
+        stage.watch(proc)
+        proc.stage = stage
+    return proc
+
+
+def wait_step(proc, step):
+    """Sends the stdin answers of a step to its process and waits for it.
+
+    The files written by a staged step are then copied back in the background (see
+    `app.jobs.staging.wait_for`).
+
+    Args:
+        proc (subprocess.Popen): The process started by `start_step`.
+        step (Step): The step.
+
+    Returns:
+        int: The exit status.
+    """
+    try:
+        proc.communicate("".join(f"{a}\n" for a in step.stdin).encode())
+    except BrokenPipeError:
+        proc.wait()
+    if getattr(proc, "stage", None) is not None:
+        proc.stage.stage_out()
+    return proc.returncode
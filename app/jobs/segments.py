@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import pathlib
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from app.export.workflow import Step
+from app.jobs.plan import gmx_command, mdrun_file, step_command
+
+
+"""
+Segmented mdrun: a long run as consecutive `-maxh` slices continued from its checkpoint.
+
+An mdrun step with the "segment_hours" option (`EXECUTOR_PROPS` of the node) is not run as
+one mdrun call: the segment runner starts mdrun with `-maxh <hours> -cpo <checkpoint>`
+and, once there is a checkpoint, `-cpi <checkpoint> -append`. Each slice stops itself at
+99 % of its time, writing the checkpoint, and the next one continues the same trajectory,
+energy and log files. The checkpoint is the one of the node (`-cpo`, else its `.cpt`
+output, else `-deffnm`.cpt); one older than the tpr is left over from another run and is
+not continued.
+
+Before each segment the checkpoint is verified with `gmx check`; a damaged one is set
+aside (`.corrupt`) and replaced by the previous one mdrun keeps (`<name>_prev.cpt`) when
+that one is sound. A failing segment (crash, lost node) is retried from the last
+checkpoint, up to "segment_retries" times in a row (`SEGMENT_RETRIES` by default). The
+run is complete when a segment ends without being stopped by its time limit or a signal
+(nothing about it in the new part of the log), or when the convergence monitor stops it
+(see `app.jobs.convergence`); `<checkpoint>.done` then marks it, so that later runners of
+the same tpr (spare batch jobs) stop at once.
+
+The job daemon and the work queue workers run segmented steps through this module (see
+`start_step`): a worker taking over the task of a lost one continues from the checkpoint.
+The batch executor submits a run as a chain of jobs of one segment each (`--budget`), so
+it fits any scheduler time limit longer than a segment.
+
+Usage (the step and the plan as JSON, see `app.jobs.plan`):
+    python -m app.jobs.segments STEP PLAN [--budget HOURS] [--not-final]
+
+Classes:
+    SegmentedRun:
+        Runs the segments of an mdrun step until the run is complete.
+
+Functions:
+    checkpoint_file(step): Returns the checkpoint an mdrun step continues from.
+    segment_args(step, checkpoint, hours, resume): Returns the mdrun arguments of a segment.
+    verify_checkpoint(path, gmxrc=None, env=None): Tells whether a checkpoint can be read.
+    runner_command(step, plan, python=None, budget=None, final=True): Returns the argument list running a step in segments.
+    runner_env(env): Returns an environment where the runner finds the app package.
+    main(argv=None): Command line (`python -m app.jobs.segments`).
+"""
+
+
+# Failed segments retried in a row, by default
+SEGMENT_RETRIES = 3
+# Seconds before a failed segment is retried
+RETRY_DELAY = 10.0
+# A segment shorter than this is not started after the first one (batch budget)
+_MIN_HOURS = 5 / 60
+# Options replaced by those of the segments
+_SEGMENT_FLAGS = {"-cpi", "-cpo", "-maxh"}
+_APPEND_FLAGS = {"-append", "-noappend"}
+_STOPPED_RE = re.compile(r"Run time exceeded|Received the \w+ signal")
+# The directory holding the app package, for the runner processes
+PACKAGE_ROOT = str(pathlib.Path(__file__).resolve().parents[2])
+
+
+def checkpoint_file(step):
+    """Returns the checkpoint an mdrun step writes and continues from (see the module docstring)."""
+    values = {step.args[i]: step.args[i + 1] for i in range(len(step.args) - 1) if step.args[i].startswith("-")}
+    if values.get("-cpo"):
+        return values["-cpo"]
+    cpt = next((path for path in step.outputs if path.endswith(".cpt")), None)
+    return cpt or mdrun_file(step, "-cpo", ".cpt", "state.cpt")
+
+
+def segment_args(step, checkpoint, hours, resume):
+    """Returns the mdrun arguments of a segment.
+
+    Args:
+        step (Step): The mdrun step.
+        checkpoint (str): The checkpoint file.
+        hours (float): The time limit of the segment.
+        resume (bool): Whether to continue from the checkpoint.
+
+    Returns:
+        list: The arguments following `gmx mdrun`.
+    """
+    args, skip = [], False
+    for arg in step.args:
+        if skip:
+            skip = False
+        elif arg in _SEGMENT_FLAGS:
+            skip = True
+        elif arg not in _APPEND_FLAGS:
+            args.append(arg)
+    args += ["-cpo", checkpoint, "-maxh", f"{hours:.4g}"]
+    if resume:
+        args += ["-cpi", checkpoint, "-append"]
+    return args
+
+
+def verify_checkpoint(path, gmxrc=None, env=None):
+    """Tells whether a checkpoint can be read through, with `gmx check`.
+
+    Args:
+        path (str): The checkpoint.
+        gmxrc (str, optional): The GMXRC to source.
+        env (dict, optional): The environment of gmx.
+
+    Returns:
+        bool: True if gmx check reads it without error.
+    """
+    try:
+        res = subprocess.run(gmx_command(["check", "-f", str(path)], gmxrc), env=env, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=600)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return res.returncode == 0
+
+
+def runner_command(step, plan, python=None, budget=None, final=True):
+    """Returns the argument list running a step in segments.
+
+    The process needs the app package on its `PYTHONPATH` (see `runner_env`).
+
+    Args:
+        step (Step): The mdrun step.
+        plan (dict): The plan of the step (its steps are not passed).
+        python (str, optional): The Python interpreter. Defaults to the current one.
+        budget (float, optional): Hours the runner may use, then it stops (batch jobs).
+        final (bool, optional): Whether an incomplete run at the end of the budget is a failure.
+
+    Returns:
+        list: The arguments.
+    """
+    argv = [python or sys.executable, "-m", "app.jobs.segments", json.dumps(step.to_dict()),
+            json.dumps({k: v for k, v in plan.items() if k != "steps"})]
+    if budget is not None:
+        argv += ["--budget", f"{budget:g}"]
+    if not final:
+        argv.append("--not-final")
+    return argv
+
+
+def runner_env(env):
+    """Returns a copy of an environment with the app package first on the `PYTHONPATH`."""
+    env = dict(env)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (PACKAGE_ROOT, env.get("PYTHONPATH")) if p)
+    return env
+
+
+class SegmentedRun:
+    """SegmentedRun runs the segments of an mdrun step until the run is complete.
+
+    SIGTERM and SIGINT stop the runner once the running segment is over: they reach mdrun
+    too (same process group), which writes its checkpoint and stops.
+
+    Attributes:
+        step (Step): The mdrun step.
+        plan (dict): The plan of the step (directory, GMXRC and GMXLIB).
+        log (file): The binary file receiving the output of the segments.
+        hours (float): The time limit of each segment.
+        retries (int): The failed segments retried in a row.
+        budget (float): Hours the runner may use, None for no limit.
+        final (bool): Whether an incomplete run at the end of the budget is a failure.
+        checkpoint (str): The checkpoint, absolute.
+        segments (int): The segments run so far.
+
+    Methods:
+        __init__(step, plan, log, budget=None, final=True): Reads the options of the step.
+        run(): Runs the segments, returns the exit status.
+    """
+    def __init__(self, step, plan, log, budget=None, final=True):
+        self.step = step
+        self.plan = plan
+        self.log = log
+        self.hours = float(step.options.get("segment_hours") or 0)
+        if self.hours <= 0:
+            raise ValueError(f"Invalid segment length: {step.options.get('segment_hours')!r}")
+        self.retries = int(step.options.get("segment_retries") or SEGMENT_RETRIES)
+        self.budget = budget
+        self.final = final
+        self.checkpoint = os.path.join(plan["workdir"], checkpoint_file(step))
+        self.segments = 0
+        self._signal = None
+        self._env = dict(os.environ)
+        if plan.get("gmxlib"):
+            self._env["GMXLIB"] = plan["gmxlib"]
+
+    def _note(self, text):
+        self.log.write(f"[segments] {text}\n".encode())
+        self.log.flush()
+
+    def _stop(self, signum, _frame):
+        self._signal = signum
+
+    def _tpr_time(self):
+        tpr = next((self.step.args[i + 1] for i, a in enumerate(self.step.args[:-1]) if a == "-s"), None)
+        try:
+            return os.path.getmtime(os.path.join(self.plan["workdir"], tpr)) if tpr else 0
+        except OSError:
+            return 0
+
+    def _complete(self):
+        """Tells whether the run of the current tpr was completed before (spare batch jobs)."""
+        marker = self.checkpoint + ".done"
+        try:
+            return os.path.getmtime(marker) >= max(os.path.getmtime(self.checkpoint), self._tpr_time())
+        except OSError:
+            return False
+
+    def _resume(self):
+        """Tells whether to continue from the checkpoint, replacing a damaged one by the previous one."""
+        cpt = self.checkpoint
+        if not os.path.exists(cpt):
+            return False
+        if os.path.getmtime(cpt) < self._tpr_time():
+            self._note(f"{cpt} is older than the tpr: starting a new run")
+            return False
+        gmxrc = self.plan.get("gmxrc") or None
+        if verify_checkpoint(cpt, gmxrc, self._env):
+            return True
+        os.replace(cpt, cpt + ".corrupt")
+        prev = cpt[:-len(".cpt")] + "_prev.cpt"
+        if os.path.exists(prev) and verify_checkpoint(prev, gmxrc, self._env):
+            shutil.copy2(prev, cpt)
+            self._note(f"{cpt} is damaged (kept as {cpt}.corrupt): continuing from {prev}")
+            return True
+        self._note(f"{cpt} is damaged (kept as {cpt}.corrupt) and there is no sound previous one: starting over")
+        return False
+
+    def _stopped_early(self, log_path, offset):
+        """Tells whether the segment was stopped by its time limit or a signal, from its log."""
+        try:
+            with open(log_path, "rb") as f:
+                f.seek(offset)
+                text = f.read().decode(errors="replace")
+        except OSError:
+            self._note(f"Cannot read {log_path}: the run is taken as complete")
+            return False
+        return bool(_STOPPED_RE.search(text))
+
+    def run(self):
+        """Runs the segments until the run is complete, the retries are used up or the budget is spent.
+
+        Returns:
+            int: The exit status: 0 when complete (or stopped at the end of a non-final
+            budget), the status of the last failed segment, 1 for an incomplete final budget,
+            128 + the signal when stopped.
+        """
+        from app.jobs.convergence import start_monitor
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        started = time.monotonic()
+        log_path = os.path.join(self.plan["workdir"], mdrun_file(self.step, "-g", ".log", "md.log"))
+        if self._complete():
+            self._note("the run is already complete")
+            return 0
+        failures = 0
+        while True:
+            hours = self.hours
+            if self.budget is not None:
+                left = self.budget - (time.monotonic() - started) / 3600
+                if self.segments and left < _MIN_HOURS:
+                    if self.final:
+                        self._note("time budget used up, the run is not complete")
+                        return 1
+                    self._note("time budget used up, the run continues in the next job")
+                    return 0
+                hours = min(hours, left)
+            resume = self._resume()
+            offset = os.path.getsize(log_path) if resume and os.path.exists(log_path) else 0
+            segment = Step(self.step.name, self.step.label, "mdrun",
+                           segment_args(self.step, self.checkpoint, hours, resume), (), self.step.inputs,
+                           self.step.outputs, self.step.options)
+            self._note(f"segment {self.segments + 1} ({hours:.4g} h, "
+                       f"{'continuing from ' + self.checkpoint if resume else 'new run'})")
+            proc = subprocess.Popen(step_command(segment, self.plan.get("gmxrc")), cwd=self.plan["workdir"],
+                                    env=self._env, stdin=subprocess.DEVNULL, stdout=self.log,
+                                    stderr=subprocess.STDOUT)
+            monitor = start_monitor(segment, self.plan, proc, self.log)
+            returncode = proc.wait()
+            self.segments += 1
+            if self._signal is not None:
+                self._note(f"stopped by signal {self._signal}")
+                return 128 + self._signal
+            if returncode != 0:
+                failures += 1
+                if failures > self.retries:
+                    self._note(f"segment failed ({returncode}), {self.retries} retries used up")
+                    return returncode
+                self._note(f"segment failed ({returncode}), retry {failures}/{self.retries}")
+                time.sleep(RETRY_DELAY)
+                if self._signal is not None:
+                    return 128 + self._signal
+                continue
+            failures = 0
+            if (monitor is not None and monitor.converged) or not self._stopped_early(log_path, offset):
+                self._note(f"run complete after {self.segments} segment(s)")
+                pathlib.Path(self.checkpoint + ".done").touch()
+                return 0
+
+
+def main(argv=None):
+    """Command line: runs an mdrun step in segments, its output on stdout."""
+    parser = argparse.ArgumentParser(description="Run an mdrun step as checkpointed segments")
+    parser.add_argument("step", help="the step, as JSON")
+    parser.add_argument("plan", help="the plan (directory, GMXRC, GMXLIB), as JSON")
+    parser.add_argument("--budget", type=float, default=None, help="hours to use, then stop")
+    parser.add_argument("--not-final", action="store_true", help="an incomplete run at the end of the budget is not a failure")
+    args = parser.parse_args(argv)
+    try:
+        run = SegmentedRun(Step.from_dict(json.loads(args.step)), json.loads(args.plan), sys.stdout.buffer,
+                           args.budget, not args.not_final)
+    except (ValueError, KeyError) as e:
+        print(f"Invalid segmented step: {e}", file=sys.stderr)
+        return 2
+    return run.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
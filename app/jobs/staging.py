@@ -0,0 +1,305 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from app.jobs.plan import mdrun_file
+from app.utils.artifacts import place
+
+
+"""
+Local scratch staging: runs I/O-heavy steps on a fast local disk rather than in the
+working directory, often on a slow shared filesystem.
+
+A step with the "scratch" option (`EXECUTOR_PROPS` of the mdrun and trjconv nodes) is run
+in a private directory created under it (e.g. /tmp, /dev/shm, `$TMPDIR` of a compute node;
+environment variables are expanded):
+    stage-in    its input files, the files named in its arguments and, for an mdrun step
+                with a checkpoint to continue from, the checkpoint and the files mdrun
+                appends to, are copied there, under their relative paths (read-only
+                files are hard-linked when the scratch is on the same filesystem, the
+                others cloned where it supports reflinks);
+    run         the tool runs there; the checkpoints (`*.cpt`) are copied back every
+                `SYNC_SECONDS` while it runs, so a lost node loses at most that much work;
+    stage-out   once the tool exits (successfully or not), every file it wrote is copied
+                back by a background thread, smallest first (logs and structures before
+                trajectories), each file written aside and renamed into place; the scratch
+                directory is then removed, or kept and reported if a copy failed.
+
+Steps with absolute inputs read them in place; steps reading files outside the working
+directory (`../x`) are run in place. The executors running steps on this host (job
+daemon, work queue workers) stage through `start_step` and `wait_step`; they wait, with
+`wait_for`, for the files still being copied back before a step reading them starts,
+before a step is recorded in the run history and before a job or task is reported over.
+
+Classes:
+    Stage:
+        The scratch directory of one step: stage-in, checkpoint sync and stage-out.
+
+Functions:
+    stage_step(step, plan, log): Stages the inputs of a step, if it asks for scratch.
+    appended_files(step): Returns the files an mdrun step appends to when continuing.
+    wait_for(workdir, paths=None): Waits for the files of a directory still being copied back.
+"""
+
+
+# Seconds between two copies of the checkpoints back to the working directory
+SYNC_SECONDS = 300.0
+# Files of the working directory being copied back, by absolute path (count of copies);
+# the working directory itself (with a trailing separator) until the stage-out is over
+_PENDING = {}
+_PENDING_COND = threading.Condition()
+# Files mdrun appends to when continuing from a checkpoint: (option, -deffnm suffix, default)
+_APPENDED = (("-g", ".log", "md.log"), ("-e", ".edr", "ener.edr"), ("-x", ".xtc", "traj_comp.xtc"),
+             ("-o", ".trr", "traj.trr"))
+
+
+class Stage:
+    """Stage is the scratch directory of one step.
+
+    Attributes:
+        step (Step): The step.
+        workdir (str): The working directory of the plan (absolute).
+        directory (str): The scratch directory the step runs in.
+        log (file): The binary file of the step output, told about the staging.
+        staged (dict): The `(size, mtime_ns)` of each staged-in file, by relative path.
+        sync_seconds (float): Seconds between two checkpoint syncs.
+
+    Methods:
+        __init__(step, workdir, root, log, sync_seconds=None): Creates the scratch directory.
+        stage_in(files): Copies files of the working directory into the scratch directory.
+        watch(proc): Copies the checkpoints back while the process runs.
+        stage_out(): Copies the written files back in a background thread.
+    """
+    def __init__(self, step, workdir, root, log, sync_seconds=None):
+        self.step = step
+        self.workdir = workdir
+        self.log = log
+        os.makedirs(root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix=f"grogui-{step.name}-", dir=root)
+        self.staged = {}
+        self.sync_seconds = SYNC_SECONDS if sync_seconds is None else sync_seconds
+        self._synced = {}
+        self._sync_lock = threading.Lock()
+
+    def _note(self, text):
+        try:
+            self.log.write(f"[scratch] {text}\n".encode())
+            self.log.flush()
+        except (OSError, ValueError):
+            # The log is closed once the job is over
+            pass
+
+    def stage_in(self, files):
+        """Copies (or links, see `app.utils.artifacts.place`) files of the working directory into the scratch directory.
+
+        Args:
+            files (list): The paths, relative to the working directory; missing ones are skipped.
+        """
+        total = 0
+        for path in files:
+            source = os.path.join(self.workdir, path)
+            if path in self.staged or not os.path.isfile(source):
+                continue
+            target = os.path.join(self.directory, path)
+            # A read-only file (linked from the artifact store) is not written by the step
+            place(source, target, hard=not os.stat(source).st_mode & 0o222)
+            st = os.stat(target)
+            self.staged[path] = (st.st_size, st.st_mtime_ns)
+            total += st.st_size
+        self._note(f"running in {self.directory} ({len(self.staged)} file(s), {total / 1e6:.1f} MB staged in)")
+
+    def _written(self, suffix=None):
+        """Returns the files written in the scratch directory, by relative path, with their stat."""
+        written = {}
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if suffix and not name.endswith(suffix):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                rel = os.path.relpath(path, self.directory)
+                if self.staged.get(rel) != (st.st_size, st.st_mtime_ns):
+                    written[rel] = st
+        return written
+
+    def _copy_back(self, rel):
+        """Copies a file back into the working directory, written aside then renamed into place."""
+        target = os.path.join(self.workdir, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.grogui-{os.getpid()}.tmp"
+        try:
+            shutil.copy2(os.path.join(self.directory, rel), tmp)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _sync_checkpoints(self):
+        with self._sync_lock:
+            for rel, st in self._written(".cpt").items():
+                if self._synced.get(rel) == (st.st_size, st.st_mtime_ns):
+                    continue
+                try:
+                    self._copy_back(rel)
+                except OSError as e:
+                    self._note(f"cannot sync {rel}: {e}")
+                    continue
+                self._synced[rel] = (st.st_size, st.st_mtime_ns)
+
+    def watch(self, proc):
+        """Copies the checkpoints back every `sync_seconds` while the process runs.
+
+        Args:
+            proc (subprocess.Popen): The process of the step.
+        """
+        def sync():
+            while True:
+                end = time.monotonic() + self.sync_seconds
+                while time.monotonic() < end:
+                    if proc.poll() is not None:
+                        return
+                    time.sleep(min(1.0, self.sync_seconds))
+                self._sync_checkpoints()
+
+        threading.Thread(target=sync, name=f"scratch-sync-{self.step.name}", daemon=True).start()
+
+    def stage_out(self):
+        """Copies the files written by the step back, smallest first, in a background thread.
+
+        The files are pending (see `wait_for`) from this call until they are back.
+
+        Returns:
+            threading.Thread: The started thread.
+        """
+        with self._sync_lock:
+            written = sorted(self._written().items(), key=lambda item: item[1].st_size)
+        targets = [os.path.join(self.workdir, rel) for rel, _ in written]
+        for target in [os.path.join(self.workdir, ""), *targets]:
+            _hold(target)
+
+        def copy():
+            failed = []
+            start = time.monotonic()
+            try:
+                for (rel, st), target in zip(written, targets):
+                    try:
+                        if self._synced.get(rel) != (st.st_size, st.st_mtime_ns):
+                            self._copy_back(rel)
+                    except OSError as e:
+                        failed.append(rel)
+                        logging.error("Cannot copy %s back from %s: %s", rel, self.directory, e)
+                    finally:
+                        _release(target)
+                if failed:
+                    self._note(f"{len(failed)} file(s) not copied back, kept in {self.directory}: {', '.join(failed)}")
+                    return
+                shutil.rmtree(self.directory, ignore_errors=True)
+                total = sum(st.st_size for _, st in written)
+                self._note(f"{len(written)} file(s), {total / 1e6:.1f} MB copied back in {time.monotonic() - start:.1f} s")
+            finally:
+                _release(os.path.join(self.workdir, ""))
+
+        thread = threading.Thread(target=copy, name=f"scratch-out-{self.step.name}", daemon=True)
+        thread.start()
+        return thread
+
+
+def _hold(path):
+    with _PENDING_COND:
+        _PENDING[path] = _PENDING.get(path, 0) + 1
+
+
+def _release(path):
+    with _PENDING_COND:
+        _PENDING[path] -= 1
+        if not _PENDING[path]:
+            del _PENDING[path]
+        _PENDING_COND.notify_all()
+
+
+def _stage_files(step, workdir):
+    """Returns the files to stage in for a step, relative to the working directory."""
+    from app.jobs.segments import checkpoint_file
+
+    files = list(step.inputs)
+    # Files named in the arguments but not declared as inputs (-cpi, -n...)
+    files += [a for a in step.args if not a.startswith("-") and os.path.isfile(os.path.join(workdir, a))]
+    if step.tool == "mdrun":
+        checkpoints = [checkpoint_file(step)] + [p for p in step.outputs if p.endswith(".cpt")]
+        if any(os.path.isfile(os.path.join(workdir, p)) for p in checkpoints):
+            # A continuation appends to the outputs of the previous part
+            for cpt in checkpoints:
+                files += [cpt, cpt[:-len(".cpt")] + "_prev.cpt", f"{cpt}.done"]
+            files += appended_files(step)
+    return [p for p in dict.fromkeys(files) if p]
+
+
+def appended_files(step):
+    """Returns the files an mdrun step appends to when continuing from a checkpoint.
+
+    Args:
+        step (Step): The step.
+
+    Returns:
+        list: The paths, relative to the working directory (none for other tools).
+    """
+    if step.tool != "mdrun":
+        return []
+    files = list(step.outputs)
+    files += [mdrun_file(step, flag, suffix, default) for flag, suffix, default in _APPENDED]
+    for folder in step.replicas():
+        files += [os.path.join(folder, mdrun_file(step, flag, suffix, default))
+                  for flag, suffix, default in _APPENDED]
+    return files
+
+
+def stage_step(step, plan, log):
+    """Stages the inputs of a step in a scratch directory, if the step asks for one.
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step.
+        log (file): The binary file of the step output.
+
+    Returns:
+        Stage: The stage the step runs in, or None to run it in the working directory.
+    """
+    root = step.options.get("scratch")
+    if not root:
+        return None
+    workdir = plan["workdir"]
+    files = _stage_files(step, workdir)
+    outside = [p for p in files if not os.path.isabs(p) and os.path.normpath(p).startswith("..")]
+    if outside:
+        log.write(f"[scratch] reads {outside[0]} outside the working directory: run in place\n".encode())
+        return None
+    stage = Stage(step, workdir, os.path.expanduser(os.path.expandvars(root)), log)
+    try:
+        stage.stage_in([p for p in files if not os.path.isabs(p)])
+    except OSError:
+        shutil.rmtree(stage.directory, ignore_errors=True)
+        raise
+    return stage
+
+
+def wait_for(workdir, paths=None):
+    """Waits until the files of a working directory being copied back are there.
+
+    Args:
+        workdir (str): The working directory.
+        paths (list, optional): The files waited for, relative to it. Defaults to all.
+    """
+    if paths is None:
+        prefix = os.path.join(workdir, "")
+        blocking = lambda: any(p.startswith(prefix) for p in _PENDING)
+    else:
+        targets = {os.path.join(workdir, p) for p in paths}
+        blocking = lambda: any(p in _PENDING for p in targets)
+    with _PENDING_COND:
+        _PENDING_COND.wait_for(lambda: not blocking())
@@ -0,0 +1,591 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from app.export.workflow import Step
+from app.jobs.cost_model import record_step
+from app.jobs.plan import check_plan, start_step, wait_step
+from app.jobs.staging import wait_for
+from app.utils.artifacts import store_step
+
+
+"""
+Work queue stored in an SQLite file on a shared filesystem.
+
+Plans (see `app.jobs.plan`) are enqueued as one task per step, with the step dependencies.
+Any number of workers, on any host that sees the file, claim the tasks whose dependencies
+are done, one at a time, in a transaction that locks the database (`BEGIN IMMEDIATE`), so
+a task is never given to two workers. The ready task of highest priority goes first: plans
+built by `make_plan` give each step its predicted time to the end of the workflow (see
+`app.jobs.cost_model`), so the longest branches start first.
+
+A claimed task is leased: its worker renews the lease (heartbeat) while the step runs,
+and until its outputs are back from scratch and recorded. A worker that dies stops
+renewing; once the lease has expired, the next claim puts the task back in the queue (up
+to `max_attempts` claims, then it fails). The step runs in its own session and outlives
+its worker: the lease row records the host and process group of the step, which the claim
+kills (when on the same host) before the task is queued again. A worker whose lease was
+taken over kills its step and drops its result.
+
+Task states:
+    queued     waiting for its dependencies or a worker
+    claimed    running on a worker
+    done       exited with status 0: its dependents can be claimed
+    failed     exited with an error (or lost by too many workers): its dependents are skipped
+    skipped    not run because a dependency failed or the job was cancelled
+
+The step output goes to `<queue>.logs/<job>/<task>.log`, next to the queue file. SQLite
+relies on the file locks of the filesystem: NFS needs working locks (NFSv4, or lockd
+for v3); the rollback journal is used, as WAL does not work on network filesystems.
+
+Usage (one worker per process, start as many as wanted on each host):
+
+    python -m app.jobs.work_queue QUEUE submit plan.json
+    python -m app.jobs.work_queue QUEUE worker [--drain] [--max-tasks N]
+    python -m app.jobs.work_queue QUEUE status [JOB]
+    python -m app.jobs.work_queue QUEUE cancel JOB
+    python -m app.jobs.work_queue QUEUE retry JOB
+
+Classes:
+    WorkQueue:
+        The tasks of the queue file: enqueue, claim, heartbeat, completion.
+
+    Worker:
+        Claims and runs tasks until the queue is drained or it is stopped.
+
+Functions:
+    main(argv=None): Command line (`python -m app.jobs.work_queue`).
+"""
+
+
+SCHEMA_VERSION = 3
+DEFAULT_LEASE = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    step TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    deps_left INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    host TEXT,
+    pgid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    returncode INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    ended REAL,
+    UNIQUE (job, name)
+);
+CREATE TABLE IF NOT EXISTS deps (
+    task INTEGER NOT NULL REFERENCES tasks(id),
+    dep INTEGER NOT NULL REFERENCES tasks(id),
+    PRIMARY KEY (task, dep)
+);
+CREATE INDEX IF NOT EXISTS deps_dep ON deps (dep);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (state, deps_left);
+"""
+
+# Tasks depending, directly or not, on the task bound to the query
+_DOWNSTREAM = """
+WITH RECURSIVE down(id) AS (
+    SELECT task FROM deps WHERE dep = ?
+    UNION SELECT deps.task FROM deps JOIN down ON deps.dep = down.id
+)
+SELECT id FROM down
+"""
+
+STATES = ("queued", "claimed", "done", "failed", "skipped")
+
+
+class WorkQueue:
+    """WorkQueue holds the tasks of an SQLite queue file.
+
+    Each method uses its own connection, so a queue can be shared between threads.
+
+    Attributes:
+        path (pathlib.Path): The queue file.
+        lease (float): Seconds a claim lasts without a heartbeat.
+        log_dir (pathlib.Path): The directory of the task logs.
+
+    Methods:
+        enqueue(plan, max_attempts=3): Adds the steps of a plan as tasks, returns the job id.
+        claim(worker): Claims a ready task, returns it or None.
+        heartbeat(task_id, worker): Renews a lease, tells whether the worker still owns the task.
+        set_process(task_id, worker, pgid): Records the process group of the step of a claimed task.
+        complete(task_id, worker, returncode): Records the end of a task.
+        release(task_id, worker): Puts a claimed task back in the queue, attempt not counted.
+        requeue_expired(): Puts the tasks whose lease expired back in the queue.
+        has_work(): Tells whether a task is claimed or could be claimed.
+        status(job=None): Returns the number of tasks in each state.
+        tasks(job=None): Returns the task rows.
+        cancel(job): Skips the queued tasks of a job.
+        retry(job): Re-queues the failed and skipped tasks of a job.
+        log_path(task): Returns the log file of a task.
+    """
+    def __init__(self, path, lease=DEFAULT_LEASE):
+        self.path = pathlib.Path(path)
+        self.lease = float(lease)
+        self.log_dir = self.path.with_name(self.path.name + ".logs")
+        with self._transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"Queue {self.path} was created by a newer version (schema {version})")
+            if version == 0:
+                # Not executescript(): it would commit the transaction
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        db.execute(statement)
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            elif version < SCHEMA_VERSION:
+                if version < 2:
+                    db.execute("ALTER TABLE tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+                if version < 3:
+                    db.execute("ALTER TABLE tasks ADD COLUMN host TEXT")
+                    db.execute("ALTER TABLE tasks ADD COLUMN pgid INTEGER")
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        db = sqlite3.connect(str(self.path), timeout=60.0, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock first: two claims cannot read the same task
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def enqueue(self, plan, max_attempts=3):
+        """Adds the steps of a plan as tasks.
+
+        Args:
+            plan (dict): The execution plan.
+            max_attempts (int, optional): How many workers may claim a task before it fails.
+
+        Returns:
+            str: The job id of the tasks.
+
+        Raises:
+            ValueError: If the plan is invalid.
+        """
+        check_plan(plan)
+        job = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        stored = json.dumps({k: v for k, v in plan.items() if k != "steps"})
+        now = time.time()
+        with self._transaction() as db:
+            ids = {}
+            for step in plan["steps"]:
+                cursor = db.execute(
+                    "INSERT INTO tasks (job, name, label, step, plan, deps_left, max_attempts, priority, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job, step["name"], step.get("label") or step["name"], json.dumps(step), stored,
+                     len(step.get("deps", ())), max_attempts, step.get("priority", 0), now),
+                )
+                ids[step["name"]] = cursor.lastrowid
+                db.executemany(
+                    "INSERT INTO deps (task, dep) VALUES (?, ?)",
+                    [(cursor.lastrowid, ids[dep]) for dep in step.get("deps", ())],
+                )
+        logging.info("Job %s: %d tasks enqueued in %s", job, len(ids), self.path)
+        return job
+
+    def claim(self, worker):
+        """Claims the ready task of highest priority (the oldest of equal ones).
+
+        Expired leases are reclaimed first.
+
+        Args:
+            worker (str): The worker name.
+
+        Returns:
+            dict: The task (`id`, `job`, `name`, `label`, `step`, `plan`, `attempts`), or None.
+        """
+        with self._transaction() as db:
+            self._requeue_expired(db)
+            row = db.execute(
+                "SELECT * FROM tasks WHERE state = 'queued' AND deps_left = 0"
+                " ORDER BY priority DESC, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            db.execute(
+                "UPDATE tasks SET state = 'claimed', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                " started = ?, host = NULL, pgid = NULL WHERE id = ?",
+                (worker, now + self.lease, now, row["id"]),
+            )
+        return {
+            "id": row["id"],
+            "job": row["job"],
+            "name": row["name"],
+            "label": row["label"],
+            "step": json.loads(row["step"]),
+            "plan": json.loads(row["plan"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, task_id, worker):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'claimed'",
+                (time.time() + self.lease, task_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def set_process(self, task_id, worker, pgid):
+        """Records the process group of the step of a claimed task, killed if its lease expires.
+
+        Args:
+            task_id (int): The task.
+            worker (str): The worker that runs it.
+            pgid (int): The process group of the step.
+        """
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET host = ?, pgid = ? WHERE id = ? AND worker = ? AND state = 'claimed'",
+                (socket.gethostname(), pgid, task_id, worker),
+            )
+
+    def complete(self, task_id, worker, returncode):
+        """Records the end of a claimed task.
+
+        On success the dependents of the task lose one pending dependency; on failure they
+        are skipped.
+
+        Args:
+            task_id (int): The task.
+            worker (str): The worker that ran it.
+            returncode (int): The exit status of the step.
+
+        Returns:
+            bool: False if the worker no longer owned the task (the result is dropped).
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET state = ?, returncode = ?, ended = ?, lease_until = NULL"
+                " WHERE id = ? AND worker = ? AND state = 'claimed'",
+                ("done" if returncode == 0 else "failed", returncode, time.time(), task_id, worker),
+            )
+            if cursor.rowcount != 1:
+                return False
+            if returncode == 0:
+                db.execute(
+                    "UPDATE tasks SET deps_left = deps_left - 1 WHERE id IN (SELECT task FROM deps WHERE dep = ?)",
+                    (task_id,),
+                )
+            else:
+                self._skip_downstream(db, task_id)
+        return True
+
+    def release(self, task_id, worker):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET state = 'queued', worker = NULL, lease_until = NULL, attempts = attempts - 1"
+                " WHERE id = ? AND worker = ? AND state = 'claimed'",
+                (task_id, worker),
+            )
+
+    def requeue_expired(self):
+        with self._transaction() as db:
+            return self._requeue_expired(db)
+
+    def _requeue_expired(self, db):
+        now = time.time()
+        expired = db.execute(
+            "SELECT id, worker, attempts, max_attempts, host, pgid FROM tasks"
+            " WHERE state = 'claimed' AND lease_until < ?",
+            (now,),
+        ).fetchall()
+        for row in expired:
+            _kill_orphan(row)
+            if row["attempts"] >= row["max_attempts"]:
+                logging.warning("Task %d lost by worker %s, %d attempts: failed", row["id"], row["worker"], row["attempts"])
+                db.execute("UPDATE tasks SET state = 'failed', ended = ? WHERE id = ?", (now, row["id"]))
+                self._skip_downstream(db, row["id"])
+            else:
+                logging.warning("Task %d lost by worker %s: queued again", row["id"], row["worker"])
+                db.execute(
+                    "UPDATE tasks SET state = 'queued', worker = NULL, lease_until = NULL, host = NULL, pgid = NULL"
+                    " WHERE id = ?",
+                    (row["id"],),
+                )
+        return len(expired)
+
+    def _skip_downstream(self, db, task_id):
+        db.execute(
+            f"UPDATE tasks SET state = 'skipped' WHERE state = 'queued' AND id IN ({_DOWNSTREAM})", (task_id,)
+        )
+
+    def has_work(self):
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT 1 FROM tasks WHERE state = 'claimed' OR (state = 'queued' AND deps_left = 0) LIMIT 1"
+            ).fetchone()
+        finally:
+            db.close()
+        return row is not None
+
+    def status(self, job=None):
+        """Returns the number of tasks in each state.
+
+        Args:
+            job (str, optional): Only count the tasks of a job.
+
+        Returns:
+            dict: The count of each state (all states present).
+        """
+        counts = dict.fromkeys(STATES, 0)
+        for row in self.tasks(job):
+            counts[row["state"]] += 1
+        return counts
+
+    def tasks(self, job=None):
+        db = self._connect()
+        try:
+            query = "SELECT id, job, name, label, state, worker, attempts, returncode, started, ended FROM tasks"
+            rows = db.execute(query + (" WHERE job = ? ORDER BY id" if job else " ORDER BY id"), (job,) if job else ())
+            return [dict(row) for row in rows]
+        finally:
+            db.close()
+
+    def cancel(self, job):
+        """Skips the queued tasks of a job (claimed tasks finish)."""
+        with self._transaction() as db:
+            return db.execute("UPDATE tasks SET state = 'skipped' WHERE job = ? AND state = 'queued'", (job,)).rowcount
+
+    def retry(self, job):
+        """Re-queues the failed and skipped tasks of a job.
+
+        Returns:
+            int: The number of tasks re-queued.
+        """
+        with self._transaction() as db:
+            count = db.execute(
+                "UPDATE tasks SET state = 'queued', worker = NULL, attempts = 0, returncode = NULL, ended = NULL"
+                " WHERE job = ? AND state IN ('failed', 'skipped')",
+                (job,),
+            ).rowcount
+            # Pending dependencies are the ones not done
+            db.execute(
+                "UPDATE tasks SET deps_left = (SELECT COUNT(*) FROM deps JOIN tasks AS d ON d.id = deps.dep"
+                " WHERE deps.task = tasks.id AND d.state != 'done') WHERE job = ? AND state = 'queued'",
+                (job,),
+            )
+        return count
+
+    def log_path(self, task):
+        return self.log_dir / task["job"] / f"{task['name']}.log"
+
+
+class Worker:
+    """Worker claims the tasks of a queue and runs them, one at a time.
+
+    Attributes:
+        queue (WorkQueue): The queue.
+        name (str): The worker name (`host:pid:suffix`), recorded with its claims.
+        poll (float): Seconds between claims when no task is ready.
+
+    Methods:
+        run(max_tasks=None, drain=False): Runs tasks until stopped; returns the number run.
+        stop(): Kills the running step, releases its task and stops the worker.
+    """
+    def __init__(self, queue, name=None, poll=5.0):
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:4]}"
+        self.poll = poll
+        self._stopping = threading.Event()
+        self._proc = None
+
+    def run(self, max_tasks=None, drain=False):
+        """Claims and runs tasks.
+
+        Args:
+            max_tasks (int, optional): Stop after this many tasks.
+            drain (bool, optional): Stop when no task is claimed or ready (rather than waiting
+                for new jobs).
+
+        Returns:
+            int: The number of tasks run.
+        """
+        count = 0
+        while not self._stopping.is_set() and (max_tasks is None or count < max_tasks):
+            task = self.queue.claim(self.name)
+            if task is None:
+                if drain and not self.queue.has_work():
+                    break
+                self._stopping.wait(self.poll)
+                continue
+            self._execute(task)
+            count += 1
+        return count
+
+    def stop(self):
+        self._stopping.set()
+        proc = self._proc
+        if proc is not None:
+            _kill(proc)
+
+    def _execute(self, task):
+        step = Step.from_dict(task["step"])
+        log_path = self.queue.log_path(task)
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        logging.info("%s: running %s / %s", self.name, task["job"], task["label"])
+
+        lost, over = threading.Event(), threading.Event()
+        with open(log_path, "ab", buffering=0) as log:
+            log.write(f"\n[{self.name}, attempt {task['attempts']}] {step.label}\n$ {step.command()}\n".encode())
+            start = time.time()
+            try:
+                self._proc = proc = start_step(step, task["plan"], log)
+            except Exception as e:
+                # Staging, a missing gmx...: the task fails rather than the worker
+                logging.exception("%s: cannot start task %d", self.name, task["id"])
+                log.write(f"Cannot start the step: {e}\n".encode())
+                if not self.queue.complete(task["id"], self.name, None):
+                    logging.warning("%s: task %d was taken over, result dropped", self.name, task["id"])
+                return
+            try:
+                # start_step gives the step its own session: its process group is its pid
+                self.queue.set_process(task["id"], self.name, proc.pid)
+            except sqlite3.Error as e:
+                logging.warning("%s: cannot record the process of task %d: %s", self.name, task["id"], e)
+            # The lease is kept until the outputs are back and recorded, not only while the tool runs
+            beat = threading.Thread(target=self._heartbeat, args=(task, proc, lost, over), daemon=True)
+            beat.start()
+            returncode = wait_step(proc, step)
+            if returncode == 0:
+                record_step(step, task["plan"], time.time() - start)
+            self._proc = None
+            # Other workers read the outputs once the task is complete
+            wait_for(task["plan"]["workdir"])
+            if returncode == 0 and not lost.is_set():
+                # Hashing large outputs takes a while: still under the lease, and only if it was kept
+                store_step(step, task["plan"], log)
+            over.set()
+            beat.join()
+            log.write(f"Exited with status {returncode}\n".encode())
+
+        if lost.is_set():
+            logging.warning("%s: lease of task %d lost, result dropped", self.name, task["id"])
+        elif self._stopping.is_set():
+            self.queue.release(task["id"], self.name)
+        elif not self.queue.complete(task["id"], self.name, returncode):
+            logging.warning("%s: task %d was taken over, result dropped", self.name, task["id"])
+
+    def _heartbeat(self, task, proc, lost, over):
+        interval = self.queue.lease / 3
+        next_beat = time.monotonic() + interval
+        while not over.wait(0.2):
+            if time.monotonic() < next_beat:
+                continue
+            next_beat = time.monotonic() + interval
+            try:
+                owned = self.queue.heartbeat(task["id"], self.name)
+            except sqlite3.Error as e:
+                # A busy or unreachable filesystem: retry until the lease runs out
+                logging.warning("%s: heartbeat failed: %s", self.name, e)
+                continue
+            if not owned:
+                lost.set()
+                if proc.poll() is None:
+                    _kill(proc)
+                return
+
+
+def _kill_orphan(row):
+    """Kills the step of an expired lease, left running by its dead worker, if it can be reached."""
+    if row["pgid"] is None:
+        return
+    if row["host"] != socket.gethostname():
+        logging.warning("Task %d: its step may still run on %s (process group %d)", row["id"], row["host"], row["pgid"])
+        return
+    try:
+        os.killpg(row["pgid"], signal.SIGKILL)
+        logging.warning("Task %d: killed the step left by worker %s", row["id"], row["worker"])
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        logging.warning("Task %d: cannot kill process group %d", row["id"], row["pgid"])
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def main(argv=None):
+    """Command line of the work queue (see the module docstring)."""
+    parser = argparse.ArgumentParser(description="GroGUI shared-filesystem work queue")
+    parser.add_argument("queue", help="the SQLite queue file (created if needed)")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE, help="seconds a claim lasts without heartbeat")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("submit", help="enqueue an execution plan (JSON file)")
+    p.add_argument("plan")
+    p.add_argument("--max-attempts", type=int, default=3)
+    p = sub.add_parser("worker", help="claim and run tasks")
+    p.add_argument("--drain", action="store_true", help="exit when no task is left to claim")
+    p.add_argument("--max-tasks", type=int, default=None)
+    p.add_argument("--poll", type=float, default=5.0, help="seconds between claims when idle")
+    p = sub.add_parser("status", help="count the tasks in each state")
+    p.add_argument("job", nargs="?")
+    p.add_argument("--tasks", action="store_true", help="list the tasks")
+    for command in ("cancel", "retry"):
+        sub.add_parser(command).add_argument("job")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    queue = WorkQueue(args.queue, lease=args.lease)
+
+    if args.command == "submit":
+        with open(args.plan, encoding="utf-8") as f:
+            print(queue.enqueue(json.load(f), args.max_attempts))
+    elif args.command == "worker":
+        worker = Worker(queue, poll=args.poll)
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        count = worker.run(args.max_tasks, args.drain)
+        logging.info("%s: %d task(s) run", worker.name, count)
+    elif args.command == "status":
+        if args.tasks:
+            for task in queue.tasks(args.job):
+                print(f"{task['id']:6d} {task['job']} {task['state']:8s} {task['worker'] or '':30s} {task['label']}")
+        print(" ".join(f"{state}={count}" for state, count in queue.status(args.job).items()))
+    elif args.command == "cancel":
+        print(f"{queue.cancel(args.job)} task(s) skipped")
+    elif args.command == "retry":
+        print(f"{queue.retry(args.job)} task(s) queued again")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
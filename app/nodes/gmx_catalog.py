@@ -0,0 +1,507 @@
+"""
+GmxCatalog exposes every GROMACS tool as a node type, from the output of `gmx help commands`
+and `gmx <tool> -h`.
+
+The help output is parsed into typed option specs (file options with their extensions and
+in/out direction, enums, numbers, booleans, strings) which are cached on disk once per
+GROMACS version. Startup only reads the cache: the spec of a tool is introspected the first
+time it is needed, and its node class is only created when the tool is first used.
+
+Cache layout (under `$XDG_CACHE_HOME/grogui/gmx`, `~/.cache/grogui/gmx` by default):
+    index.json:
+        Maps a gmx binary (resolved path + mtime) to its GROMACS version, so startup does
+        not need to run `gmx --version`.
+    <version>.json:
+        {"version": ..., "tools": {tool: description}, "specs": {tool: {flag: option}}}
+
+Option spec (one per flag):
+    kind (str): "file", "enum", "int", "real", "time", "vector", "bool" or "string".
+    direction (str): "in", "out" or "inout" for file options, None otherwise.
+    extensions (list): Accepted file extensions (file options).
+    default (str): Default value as printed by gmx ("" when none).
+    choices (list): Accepted values (enum and bool options).
+    optional (bool): False for the file options gmx requires.
+    description (str): The help text of the option.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.assets.my_prop_bin import MyBaseNode
+
+
+# Hand-written nodes in app.nodes.node_types take precedence over the generated ones
+HANDWRITTEN_TOOLS = {"pdb2gmx", "editconf", "solvate", "genion", "grompp", "mdrun", "trjconv"}
+
+_SECTION_DIRECTIONS = {
+    "Options to specify input files:": "in",
+    "Options to specify output files:": "out",
+    "Options to specify input/output files:": "inout",
+    "Other options:": None,
+}
+_OPTION_RE = re.compile(r"^ (-\S+)\s*(.*)$")
+_COMMAND_RE = re.compile(r"^  ([a-z0-9][a-z0-9_-]*)\s{2,}(\S.*)$")
+_PAREN_RE = re.compile(r"\(([^)]*)\)")
+
+
+def default_cache_dir():
+    """Returns the directory holding the cached gmx option specs."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "grogui" / "gmx"
+
+
+def gmx_version(gmx="gmx"):
+    """Returns the GROMACS version reported by `gmx --version`, or None."""
+    try:
+        res = subprocess.run([gmx, "--version"], capture_output=True, text=True, timeout=30)
+    except Exception as e:
+        logging.warning("Impossible to execute '%s --version': %s", gmx, e)
+        return None
+    for line in (res.stdout + res.stderr).splitlines():
+        if line.strip().startswith("GROMACS version:"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+
+def find_gmxrc(gmx="gmx"):
+    """Returns the GMXRC of the gmx installation (from the "Data prefix" of `gmx --version`), or None."""
+    try:
+        res = subprocess.run([gmx, "--version"], capture_output=True, text=True, timeout=30)
+    except Exception as e:
+        logging.warning("Impossible to execute '%s --version': %s", gmx, e)
+        return None
+    for line in (res.stdout + res.stderr).splitlines():
+        if line.strip().startswith("Data prefix:"):
+            gmxrc = Path(line.split(":", 1)[1].strip()) / "bin" / "GMXRC"
+            return gmxrc if gmxrc.exists() else None
+    return None
+
+
+def parse_commands(text):
+    """Parses the output of `gmx help commands`.
+
+    Args:
+        text (str): The help output.
+
+    Returns:
+        dict: The description of each tool, by tool name.
+    """
+    tools = {}
+    started = False
+    for line in text.splitlines():
+        if line.startswith("Available commands"):
+            started = True
+            continue
+        if not started:
+            continue
+        m = _COMMAND_RE.match(line)
+        if m:
+            tools[m.group(1)] = m.group(2).strip()
+    return tools
+
+
+def parse_tool_help(text):
+    """Parses the OPTIONS part of `gmx <tool> -h` into typed option specs.
+
+    Args:
+        text (str): The help output.
+
+    Returns:
+        dict: The option spec of each flag, by flag (see the module documentation).
+    """
+    options = {}
+    direction = None
+    in_options = False
+    current = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped in _SECTION_DIRECTIONS:
+            direction = _SECTION_DIRECTIONS[stripped]
+            in_options = True
+            current = None
+            continue
+        if not in_options:
+            continue
+
+        m = _OPTION_RE.match(line)
+        if m:
+            current = _parse_option_line(m.group(1), m.group(2), direction)
+            options[current["flag"]] = current
+            continue
+
+        # Description lines are indented below their option
+        if current is not None and line.startswith("   ") and stripped:
+            current["description"] = (current["description"] + " " + stripped).strip()
+        elif not stripped:
+            continue
+        else:
+            # End of the OPTIONS part (e.g. KNOWN ISSUES)
+            current = None
+            if not line.startswith(" "):
+                in_options = False
+
+    for opt in options.values():
+        _finish_option(opt)
+        opt.pop("flag", None)
+    return options
+
+
+def _parse_option_line(raw_flag, rest, direction):
+    """Parses the first line of an option ("-f [<.gro/...>] (conf.gro) (Opt.)")."""
+    opt = {
+        "flag": raw_flag,
+        "kind": "string",
+        "direction": None,
+        "extensions": [],
+        "default": "",
+        "choices": [],
+        "optional": True,
+        "description": "",
+    }
+
+    if raw_flag.startswith("-[no]"):
+        opt["flag"] = "-" + raw_flag[len("-[no]"):]
+        opt["kind"] = "bool"
+        opt["choices"] = ["no", "yes"]
+
+    type_token = rest.split("  ")[0].strip() if rest else ""
+    if type_token.startswith("[<") or type_token.startswith("<."):
+        opt["kind"] = "file"
+        opt["direction"] = direction or "in"
+        opt["extensions"] = [e.strip(".") for e in type_token.strip("[]<>").split("/") if e.strip(".") and e != "..."]
+        opt["optional"] = False
+    elif type_token.startswith("<") and opt["kind"] != "bool":
+        opt["kind"] = {
+            "int": "int", "real": "real", "time": "time", "vector": "vector", "enum": "enum",
+            "string": "string", "int64": "int",
+        }.get(type_token.strip("<>"), "string")
+
+    parens = _PAREN_RE.findall(rest)
+    flags_in_parens = {"Opt.", "Lib.", "Mult."}
+    defaults = [p for p in parens if p not in flags_in_parens]
+    if defaults:
+        opt["default"] = defaults[0].strip()
+    if opt["kind"] == "file" and ("Opt." in parens):
+        opt["optional"] = True
+    return opt
+
+
+def _finish_option(opt):
+    """Completes an option spec once its full description is known."""
+    desc = opt["description"]
+    if opt["kind"] == "file" and ":" in desc:
+        # "Structure file: gro g96 pdb brk ent esp tpr" lists every extension
+        exts = desc.split(":", 1)[1].split()
+        if exts and all(re.fullmatch(r"[a-z0-9]+", e) for e in exts):
+            opt["extensions"] = exts
+    elif opt["kind"] == "enum" and ":" in desc:
+        # "Box type for -box and -d: triclinic, cubic, dodecahedron, octahedron"
+        choices = [c.strip().rstrip(".") for c in desc.rsplit(":", 1)[1].split(",")]
+        choices = [c for c in choices if c and " " not in c]
+        default = opt["default"]
+        if default in choices:
+            choices.remove(default)
+            choices.insert(0, default)
+        opt["choices"] = choices
+    elif opt["kind"] == "bool" and opt["default"] == "yes":
+        opt["choices"] = ["yes", "no"]
+
+
+def class_name_for(tool):
+    """Returns the node class name of a tool ("make_ndx" -> "MakeNdx")."""
+    return "".join(part.capitalize() for part in re.split(r"[^A-Za-z0-9]+", tool) if part) or "Tool"
+
+
+def make_node_class(tool, options, description=""):
+    """Creates a MyBaseNode subclass from the option specs of a tool.
+
+    Required file options become base properties with a port each (typed `<ext>_file`,
+    accepting the `out_<ext>` outputs of other nodes). When a tool has no required input
+    (or output) file, its first optional one is used as the main port instead. Every other
+    option is offered as an optional property.
+
+    Args:
+        tool (str): The gmx tool name.
+        options (dict): The option specs of the tool, by flag.
+        description (str, optional): The one-line description of the tool.
+
+    Returns:
+        type: The node class.
+    """
+    base_props, optional_props, in_ports, out_ports = {}, {}, {}, {}
+    file_flags = set()
+    used_port_names = set()
+
+    # Flags that get a port: required files, else the first file of each direction
+    files = [(flag, opt) for flag, opt in options.items() if opt.get("kind") == "file"]
+    port_flags = {flag for flag, opt in files if not opt.get("optional", True)}
+    for side in ("in", "out"):
+        sided = [flag for flag, opt in files if opt.get("direction") in (side, "inout")]
+        if sided and not port_flags.intersection(sided):
+            port_flags.add(sided[0])
+
+    for flag, opt in options.items():
+        if flag in ("-h", "-hidden", "-quiet", "-version", "-copyright", "-nice", "-xvg", "-w"):
+            continue
+        kind = opt.get("kind")
+        label = (opt.get("description") or flag).split(". ")[0]
+        if kind == "file":
+            # "Structure file: gro g96 pdb" -> "Structure file"
+            label = label.split(":")[0]
+        if len(label) > 40:
+            label = label[:37] + "..."
+        label = f"{label} ({flag})"
+
+        if kind in ("enum", "bool") and opt.get("choices"):
+            default = list(opt["choices"])
+        else:
+            default = opt.get("default", "")
+
+        if kind == "file":
+            file_flags.add(flag)
+
+        if flag in port_flags:
+            base_props[flag] = (label, default)
+            ext = (opt.get("extensions") or ["file"])[0]
+            direction = opt.get("direction") or "in"
+            for side, ports in (("in", in_ports), ("out", out_ports)):
+                if direction not in (side, "inout"):
+                    continue
+                name = f"{side}_{ext}"
+                if name in used_port_names:
+                    name = f"{side}_{ext}_{flag.lstrip('-')}"
+                used_port_names.add(name)
+                if side == "in":
+                    accepts = [f"out_{e}" for e in (opt.get("extensions") or [ext])]
+                    ports[flag] = (name, f"{ext}_file", accepts)
+                else:
+                    ports[flag] = (name, f"{ext}_file")
+        else:
+            optional_props[flag] = (label, default)
+
+    attrs = {
+        "__identifier__": tool,
+        "NODE_NAME": tool,
+        "__doc__": description or f"Generated node for gmx {tool}.",
+        "BASE_PROPS": base_props,
+        "OPTIONAL_PROPS": optional_props,
+        "IN_PORTS": in_ports,
+        "OUT_PORTS": out_ports,
+        "FILE_FLAGS": frozenset(file_flags),
+        "GMX_OPTIONS": options,
+    }
+    return type(class_name_for(tool), (MyBaseNode,), attrs)
+
+
+class GmxCatalog:
+    """GmxCatalog lists the GROMACS tools and creates their node classes on first use.
+
+    Attributes:
+        gmx (str): The gmx executable.
+        cache_dir (Path): The directory holding the cached specs.
+        version (str): The GROMACS version, or None if gmx is not available.
+
+    Methods:
+        load(): Reads (or builds) the tool list of the current GROMACS version.
+        tools(): Returns the generated tools and their descriptions.
+        options(tool): Returns the option specs of a tool, introspecting it if needed.
+        node_class(tool): Returns the node class of a tool, creating it on first use.
+        ensure_registered(node_graph, node_type): Registers a generated node type in a graph.
+        build_all(workers): Introspects every tool in parallel and writes the cache.
+    """
+    def __init__(self, gmx="gmx", cache_dir=None):
+        self.gmx = gmx
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.version = None
+        self._data = {"version": None, "tools": {}, "specs": {}}
+        self._classes = {}
+        self._loaded = False
+
+    def load(self):
+        """Reads the cached catalog of the current GROMACS version, building the tool list if missing.
+
+        Returns:
+            GmxCatalog: The catalog itself.
+        """
+        if self._loaded:
+            return self
+        self._loaded = True
+
+        exe = shutil.which(self.gmx)
+        if not exe:
+            logging.info("No '%s' executable found, generated nodes are disabled", self.gmx)
+            return self
+
+        index_path = self.cache_dir / "index.json"
+        index = self._read_json(index_path) or {}
+        binary_key = self._binary_key(exe)
+        self.version = index.get(binary_key)
+
+        if self.version:
+            data = self._read_json(self._cache_path())
+            if data:
+                self._data = data
+                return self
+
+        # Unknown binary or missing cache: ask gmx once
+        self.version = self.version or gmx_version(self.gmx)
+        if not self.version:
+            return self
+        index[binary_key] = self.version
+        self._write_json(index_path, index)
+
+        data = self._read_json(self._cache_path())
+        if data:
+            self._data = data
+            return self
+
+        try:
+            res = subprocess.run([self.gmx, "-quiet", "help", "commands"], capture_output=True, text=True, timeout=60)
+            tools = parse_commands(res.stdout + res.stderr)
+        except Exception:
+            logging.exception("Failed to list the gmx commands")
+            tools = {}
+        self._data = {"version": self.version, "tools": tools, "specs": {}}
+        self._save()
+        return self
+
+    def tools(self):
+        """Returns the description of the tools without a hand-written node, by tool name."""
+        self.load()
+        return {k: v for k, v in sorted(self._data["tools"].items()) if k not in HANDWRITTEN_TOOLS}
+
+    def options(self, tool):
+        """Returns the option specs of a tool, introspecting `gmx <tool> -h` once if needed.
+
+        Args:
+            tool (str): The gmx tool name.
+
+        Returns:
+            dict: The option specs, by flag.
+        """
+        self.load()
+        specs = self._data["specs"]
+        if tool not in specs:
+            specs[tool] = self._introspect(tool)
+            self._save()
+        return specs[tool]
+
+    def node_class(self, tool):
+        """Returns the node class of a tool, creating it the first time it is requested.
+
+        Args:
+            tool (str): The gmx tool name.
+
+        Returns:
+            type: The node class.
+        """
+        cls = self._classes.get(tool)
+        if cls is None:
+            cls = make_node_class(tool, self.options(tool), self._data["tools"].get(tool, ""))
+            self._classes[tool] = cls
+            MyBaseNode.add_node_type(f"{cls.__identifier__}.{cls.__name__}")
+        return cls
+
+    def ensure_registered(self, node_graph, node_type):
+        """Registers the generated node class of a `tool.ClassName` type in a graph, if needed.
+
+        Args:
+            node_graph (NodeGraph): The graph.
+            node_type (str): The node type identifier.
+
+        Returns:
+            bool: True if the type is (now) registered in the graph.
+        """
+        if node_type in node_graph.registered_nodes():
+            return True
+        tool = node_type.split(".", 1)[0]
+        if tool in HANDWRITTEN_TOOLS or tool not in self.tools():
+            return False
+        cls = self.node_class(tool)
+        node_graph.register_node(cls)
+        cls.register_accepts(node_graph)
+        return True
+
+    def build_all(self, workers=8):
+        """Introspects every tool not cached yet, in parallel, and writes the cache.
+
+        Args:
+            workers (int, optional): Number of concurrent `gmx <tool> -h` processes. Defaults to 8.
+        """
+        self.load()
+        missing = [t for t in self._data["tools"] if t not in self._data["specs"]]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for tool, spec in zip(missing, pool.map(self._introspect, missing)):
+                self._data["specs"][tool] = spec
+        self._save()
+
+    def _introspect(self, tool):
+        try:
+            res = subprocess.run([self.gmx, "-quiet", tool, "-h"], capture_output=True, text=True, timeout=60)
+            return parse_tool_help(res.stdout + "\n" + res.stderr)
+        except Exception:
+            logging.exception("Failed to introspect 'gmx %s -h'", tool)
+            return {}
+
+    def _cache_path(self):
+        safe = re.sub(r"[^A-Za-z0-9._-]+", "_", self.version or "unknown")
+        return self.cache_dir / f"{safe}.json"
+
+    def _save(self):
+        if self.version:
+            self._write_json(self._cache_path(), self._data)
+
+    @staticmethod
+    def _binary_key(exe):
+        path = os.path.realpath(exe)
+        try:
+            return f"{path}:{os.stat(path).st_mtime_ns}"
+        except OSError:
+            return path
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            return json.loads(Path(path).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.warning("Ignoring unreadable gmx cache file %s", path)
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        try:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception:
+            logging.exception("Failed to write gmx cache file %s", path)
+
+
+_catalog = None
+
+
+def get_catalog():
+    """Returns the shared GmxCatalog of the application."""
+    global _catalog
+    if _catalog is None:
+        _catalog = GmxCatalog()
+    return _catalog
+
+
+if __name__ == "__main__":
+    # python -m app.nodes.gmx_catalog: fill the cache for the gmx found in PATH
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    catalog = get_catalog()
+    catalog.build_all()
+    logging.info("Cached %d gmx tools for GROMACS %s in %s", len(catalog.tools()), catalog.version, catalog.cache_dir)
@@ -0,0 +1,320 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+from pathlib import Path
+
+
+"""
+Host profile: the hardware of this machine and what the gmx binary can do with it.
+
+The profile gathers the CPU topology (logical CPUs, physical cores, sockets, SMT), the NUMA
+nodes, the SIMD level the CPU supports, the GPUs found, and from `gmx --version` the SIMD
+level and GPU support GROMACS was built with. It is used to fill the mdrun defaults of new
+nodes (no GPU offload on hosts that cannot run it) and to flag mdrun flags the host cannot
+honour.
+
+Detecting the profile runs `gmx --version`, so it is cached per host name (the cache may
+be on a home directory shared by several machines) with a fingerprint of the hardware and
+of the gmx binary: the cache is only refreshed when one of them changes.
+
+Cache layout (`$XDG_CACHE_HOME/grogui/host-profile.json`, `~/.cache/...` by default):
+    {"<host name>": {"fingerprint": {...}, "profile": {...}}}
+
+Profile keys:
+    logical_cpus (int), cores (int), sockets (int), smt (bool), numa_nodes (list of CPU lists),
+    cpu_model (str), cpu_simd (str): the best GROMACS SIMD level of the CPU,
+    gpus (list): the GPUs found (NVIDIA driver entries and DRI render nodes),
+    gmx_version, gmx_simd, gmx_gpu_support (str or None): from `gmx --version`,
+    gpu_usable (bool): a GPU is found and gmx is built to use it.
+
+Functions:
+    default_cache_path(): Returns the path of the profile cache.
+    fingerprint(gmx="gmx"): Returns what invalidates the cached profile.
+    detect_profile(gmx="gmx"): Detects the profile of this host.
+    load_profile(gmx="gmx", cache_path=None): Returns the cached profile, detecting it if needed.
+    profile_warnings(profile): Returns the problems of the gmx build on this host.
+    mdrun_defaults(profile): Returns the mdrun property defaults suited to the host.
+    apply_mdrun_defaults(node_cls, profile): Sets the host defaults on an mdrun node class.
+    check_mdrun_args(profile, args): Returns the mdrun arguments the host cannot honour.
+"""
+
+
+# GROMACS SIMD levels, by CPU flag of /proc/cpuinfo (best first)
+_X86_SIMD = (
+    ("avx512f", "AVX_512"),
+    ("avx2", "AVX2_256"),
+    ("avx", "AVX_256"),
+    ("sse4_1", "SSE4.1"),
+    ("sse2", "SSE2"),
+)
+_ARM_SIMD = (("sve", "ARM_SVE"), ("asimd", "ARM_NEON_ASIMD"))
+# Lowest to highest, to compare the build with the CPU
+_SIMD_ORDER = ["None", "SSE2", "SSE4.1", "AVX_128_FMA", "AVX_256", "AVX2_128", "AVX2_256", "AVX_512", "AVX_512_KNL"]
+_GPU_VALUES = {"-nb", "-pme", "-pmefft", "-bonded", "-update"}
+GPU_OFFLOAD = "-bonded gpu -nb gpu -pmefft gpu -pme gpu"
+
+
+def default_cache_path():
+    """Returns the path of the profile cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "grogui" / "host-profile.json"
+
+
+def _read(path):
+    try:
+        return Path(path).read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
+def _cpuinfo():
+    """Parses /proc/cpuinfo into one dict per logical CPU."""
+    cpus, cpu = [], {}
+    for line in _read("/proc/cpuinfo").splitlines():
+        if not line.strip():
+            if cpu:
+                cpus.append(cpu)
+            cpu = {}
+            continue
+        name, _, value = line.partition(":")
+        cpu[name.strip()] = value.strip()
+    if cpu:
+        cpus.append(cpu)
+    return [c for c in cpus if "processor" in c]
+
+
+def _gpus():
+    gpus = []
+    for path in sorted(glob.glob("/proc/driver/nvidia/gpus/*/information")):
+        model = next((line.split(":", 1)[1].strip() for line in _read(path).splitlines()
+                      if line.startswith("Model:")), "NVIDIA GPU")
+        gpus.append(f"nvidia:{model}")
+    for path in sorted(glob.glob("/dev/dri/renderD*")):
+        gpus.append(f"dri:{os.path.basename(path)}")
+    return gpus
+
+
+def _numa_nodes():
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*"), key=lambda p: int(p.rsplit("node", 1)[1])):
+        nodes.append(_read(os.path.join(path, "cpulist")).strip())
+    return nodes
+
+
+def _gmx_binary(gmx):
+    exe = shutil.which(gmx)
+    if not exe:
+        return None
+    path = os.path.realpath(exe)
+    try:
+        return f"{path}:{os.stat(path).st_mtime_ns}"
+    except OSError:
+        return path
+
+
+def fingerprint(gmx="gmx"):
+    """Returns what invalidates the cached profile: the CPUs, NUMA nodes, GPUs and gmx binary.
+
+    Reading it does not start any process.
+
+    Args:
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        dict: The fingerprint.
+    """
+    cpus = _cpuinfo()
+    return {
+        "cpu_model": cpus[0].get("model name", "") if cpus else "",
+        "logical_cpus": len(cpus) or os.cpu_count(),
+        "numa_nodes": _numa_nodes(),
+        "gpus": _gpus(),
+        "gmx": _gmx_binary(gmx),
+    }
+
+
+def _gmx_build(gmx):
+    try:
+        res = subprocess.run([gmx, "--version"], capture_output=True, text=True, stdin=subprocess.DEVNULL, timeout=30)
+    except Exception as e:
+        logging.warning("Impossible to execute '%s --version': %s", gmx, e)
+        return {}
+    fields = {}
+    for line in (res.stdout + res.stderr).splitlines():
+        name, _, value = line.partition(":")
+        fields.setdefault(name.strip(), value.strip())
+    return fields
+
+
+def detect_profile(gmx="gmx"):
+    """Detects the profile of this host (see the module docstring).
+
+    Args:
+        gmx (str, optional): The gmx executable.
+
+    Returns:
+        dict: The profile.
+    """
+    cpus = _cpuinfo()
+    logical = len(cpus) or os.cpu_count() or 1
+    sockets = len({c.get("physical id", "0") for c in cpus}) or 1
+    cores = len({(c.get("physical id", "0"), c.get("core id", c["processor"])) for c in cpus}) or logical
+    flags = set((cpus[0].get("flags") or cpus[0].get("Features") or "").split()) if cpus else set()
+    cpu_simd = next((level for flag, level in _X86_SIMD + _ARM_SIMD if flag in flags), "None")
+
+    build = _gmx_build(gmx)
+    gpu_support = build.get("GPU support")
+    gpus = _gpus()
+    if not gpu_support or gpu_support.lower() == "disabled":
+        gpu_usable = False
+    elif gpu_support.upper() == "CUDA":
+        gpu_usable = any(g.startswith("nvidia:") for g in gpus)
+    else:
+        gpu_usable = bool(gpus)
+    return {
+        "logical_cpus": logical,
+        "cores": cores,
+        "sockets": sockets,
+        "smt": logical > cores,
+        "numa_nodes": _numa_nodes(),
+        "cpu_model": cpus[0].get("model name", "") if cpus else "",
+        "cpu_simd": cpu_simd,
+        "gpus": gpus,
+        "gmx_version": build.get("GROMACS version"),
+        "gmx_simd": build.get("SIMD instructions"),
+        "gmx_gpu_support": gpu_support,
+        "gpu_usable": gpu_usable,
+    }
+
+
+def load_profile(gmx="gmx", cache_path=None):
+    """Returns the profile of this host, from the cache when the hardware and gmx did not change.
+
+    Args:
+        gmx (str, optional): The gmx executable.
+        cache_path (str | Path, optional): The cache file. Defaults to `default_cache_path()`.
+
+    Returns:
+        dict: The profile.
+    """
+    path = Path(cache_path) if cache_path else default_cache_path()
+    host = socket.gethostname()
+    current = fingerprint(gmx)
+    try:
+        cache = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        cache = {}
+    except Exception:
+        logging.warning("Ignoring unreadable host profile cache %s", path)
+        cache = {}
+    entry = cache.get(host)
+    if entry and entry.get("fingerprint") == current:
+        return entry["profile"]
+
+    profile = detect_profile(gmx)
+    logging.info("Host profile detected: %d cores, %d socket(s), GPU usable: %s",
+                 profile["cores"], profile["sockets"], profile["gpu_usable"])
+    cache[host] = {"fingerprint": current, "profile": profile}
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(cache, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+    except Exception:
+        logging.exception("Failed to write the host profile cache %s", path)
+    return profile
+
+
+def profile_warnings(profile):
+    """Returns the problems of the gmx build on this host.
+
+    Args:
+        profile (dict): The host profile.
+
+    Returns:
+        list: The warnings (str).
+    """
+    warnings = []
+    build, cpu = profile.get("gmx_simd"), profile.get("cpu_simd")
+    if build in _SIMD_ORDER and cpu in _SIMD_ORDER:
+        if _SIMD_ORDER.index(build) > _SIMD_ORDER.index(cpu):
+            warnings.append(f"gmx is built for {build} but this CPU only supports {cpu}: mdrun will not start")
+        elif _SIMD_ORDER.index(build) < _SIMD_ORDER.index(cpu):
+            warnings.append(f"gmx is built for {build} but this CPU supports {cpu}: mdrun runs slower than it could")
+    return warnings
+
+
+def mdrun_defaults(profile):
+    """Returns the mdrun property defaults suited to the host.
+
+    Args:
+        profile (dict): The host profile.
+
+    Returns:
+        dict: The default value of each property, by flag.
+    """
+    return {
+        # mdrun falls back to the CPU by itself when nothing is offloaded
+        "gpu_flags": GPU_OFFLOAD if profile.get("gpu_usable") else "",
+        # One thread per physical core is usually faster than filling the SMT threads
+        "-nt": str(profile["cores"]) if profile.get("smt") else "",
+    }
+
+
+def apply_mdrun_defaults(node_cls, profile):
+    """Sets the host defaults on an mdrun node class (Mdrun, MdrunMulti), for the nodes created afterwards.
+
+    Existing nodes and loaded sessions keep their values (sessions store every value).
+
+    Args:
+        node_cls (type): The mdrun node class.
+        profile (dict): The host profile.
+    """
+    from app.nodes.node_spec import NodeSpec
+
+    defaults = mdrun_defaults(profile)
+    for table in ("BASE_PROPS", "OPTIONAL_PROPS"):
+        props = dict(getattr(node_cls, table))
+        for flag, value in defaults.items():
+            if flag in props:
+                props[flag] = (props[flag][0], value)
+        setattr(node_cls, table, props)
+    NodeSpec.invalidate(node_cls)
+
+
+def check_mdrun_args(profile, args):
+    """Returns the mdrun arguments the host cannot honour.
+
+    Args:
+        profile (dict): The host profile.
+        args (list): The mdrun arguments.
+
+    Returns:
+        list: The warnings (str), the problems of the gmx build included.
+    """
+    warnings = profile_warnings(profile)
+    values = {args[i]: args[i + 1] for i in range(len(args) - 1) if args[i].startswith("-")}
+    offload = [flag for flag, value in values.items() if flag in _GPU_VALUES and value == "gpu"]
+    if offload and not profile.get("gpu_usable"):
+        if not profile.get("gmx_gpu_support") or profile["gmx_gpu_support"].lower() == "disabled":
+            reason = "gmx is built without GPU support"
+        else:
+            reason = f"no GPU usable by the {profile['gmx_gpu_support']} build of gmx was found"
+        warnings.append(f"{' '.join(f'{f} gpu' for f in offload)}: {reason}")
+    threads = 0
+    try:
+        if "-nt" in values:
+            threads = int(values["-nt"])
+        elif "-ntomp" in values:
+            threads = int(values.get("-ntmpi", 1)) * int(values["-ntomp"])
+    except ValueError:
+        warnings.append("The thread counts are not numbers")
+    if threads > profile["logical_cpus"]:
+        warnings.append(f"{threads} threads asked, this host has {profile['logical_cpus']} logical CPUs")
+    if values.get("-gpu_id") and not profile.get("gpus"):
+        warnings.append(f"-gpu_id {values['-gpu_id']}: no GPU found on this host")
+    return warnings
@@ -0,0 +1,234 @@
+import re
+from types import MappingProxyType
+from typing import Dict, Tuple
+
+
+"""
+NodeSpec is the immutable, per-class description of a node type.
+
+It is built once from the class-level `BASE_PROPS`, `OPTIONAL_PROPS`, `IN_PORTS` and
+`OUT_PORTS` dictionaries and shared by every instance of that class, so nodes do not
+carry their own copies of labels, port maps or option lookups. Every subsystem (node
+setup, properties bin, port propagation, session save/load) reads node metadata from
+here. Property values are not part of the spec: NodeGraphQt keeps all of them in the
+model of each node, and `MyBaseNode.changed_props` only computes which ones differ from
+the defaults, for display.
+
+Classes:
+    PropSpec:
+        One property (flag): label, default value, choices, file-ness and whether it is optional.
+
+    PortSpec:
+        One port: flag, port name, port type, direction and accepted output names.
+
+    NodeSpec:
+        The full description of a node class, obtained with `NodeSpec.of(node_cls)`.
+"""
+
+
+# Extensions of the files handled by GROMACS tools, used to tell file props apart
+FILE_EXTENSIONS = {
+    "pdb", "gro", "g96", "brk", "ent", "esp", "tpr", "top", "itp", "rtp", "ndx", "mdp",
+    "xtc", "trr", "tng", "cpt", "edr", "log", "xvg", "dat", "xpm", "eps", "mtx", "pqr",
+}
+_FILE_RE = re.compile(r"\.([A-Za-z0-9]+)$")
+
+# The transient optional-property menu prop: never saved nor passed to gmx
+MENU_PROP = "Add optional property"
+
+# Replica slots of the multi-simulation nodes: their ports are the single-run port names
+# numbered `<port>_1` to `<port>_<REPLICA_SLOTS>`, accepted wherever the single-run one is
+REPLICA_SLOTS = 4
+
+
+class _Frozen:
+    """Base class for the spec objects: attributes are set once in `__init__`."""
+    __slots__ = ()
+
+    def _init(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class PropSpec(_Frozen):
+    """Description of one node property (command-line flag)."""
+    __slots__ = ("flag", "label", "default", "choices", "is_file", "optional")
+
+    def __init__(self, flag: str, label: str, default, is_file: bool, optional: bool):
+        choices = tuple(default) if isinstance(default, (list, tuple)) else None
+        self._init(
+            flag=flag,
+            label=label,
+            default=choices[0] if choices else default,
+            choices=choices,
+            is_file=is_file,
+            optional=optional,
+        )
+
+    def __repr__(self):
+        return f"PropSpec({self.flag!r}, {self.label!r}, {self.default!r})"
+
+
+class PortSpec(_Frozen):
+    """Description of one node port."""
+    __slots__ = ("flag", "name", "port_type", "direction", "accepts")
+
+    def __init__(self, flag: str, name: str, port_type: str, direction: str, accepts: Tuple[str, ...] = ()):
+        self._init(flag=flag, name=name, port_type=port_type, direction=direction, accepts=tuple(accepts))
+
+    def __repr__(self):
+        return f"PortSpec({self.flag!r}, {self.name!r}, {self.port_type!r}, {self.direction!r})"
+
+
+class NodeSpec(_Frozen):
+    """Immutable description of a node class, shared by all its instances.
+
+    Attributes:
+        identifier (str): The node `__identifier__` (the gmx tool name).
+        node_name (str): The human-readable node name.
+        props (Mapping[str, PropSpec]): Base and optional properties, by flag.
+        base_flags (tuple): Flags of the base properties, in declaration order.
+        optional_flags (frozenset): Flags of the optional properties.
+        labels (Mapping[str, str]): Pretty label of each property, by flag.
+        defaults (Mapping[str, object]): Default value of each property, by flag.
+        opt_label_to_key (Mapping[str, str]): Optional property flag, by label.
+        file_flags (frozenset): Flags whose value is a file path.
+        in_ports (tuple[PortSpec]): Input ports, in declaration order.
+        out_ports (tuple[PortSpec]): Output ports, in declaration order.
+        in_flag_by_type (Mapping[str, str]): Input flag, by port type.
+        out_flag_by_type (Mapping[str, str]): Output flag, by port type.
+        port_props (Mapping[str, str]): The property holding the file of each port, by port
+            name: the port flag, or else the property named after the port (mdrun outputs).
+        stdin_flags (tuple): Properties answered on stdin rather than passed as arguments
+            (interactive group selections), from `STDIN_PROPS`.
+        raw_flags (frozenset): Properties whose value is passed as raw arguments, from `RAW_PROPS`.
+        list_flags (frozenset): Flags taking several values, split into arguments after the
+            flag, from `LIST_PROPS`.
+        executor_flags (tuple): Properties read by the executors rather than passed to gmx,
+            from `EXECUTOR_PROPS`.
+    """
+    __slots__ = (
+        "identifier", "node_name", "props", "base_flags", "optional_flags", "labels",
+        "defaults", "opt_label_to_key", "file_flags", "in_ports", "out_ports",
+        "in_flag_by_type", "out_flag_by_type", "port_props", "stdin_flags", "raw_flags",
+        "list_flags", "executor_flags",
+    )
+
+    _CACHE: Dict[type, "NodeSpec"] = {}
+
+    def __init__(self, node_cls):
+        base = getattr(node_cls, "BASE_PROPS", {}) or {}
+        optional = getattr(node_cls, "OPTIONAL_PROPS", {}) or {}
+        in_ports_def = getattr(node_cls, "IN_PORTS", {}) or {}
+        out_ports_def = getattr(node_cls, "OUT_PORTS", {}) or {}
+        explicit_files = getattr(node_cls, "FILE_FLAGS", None)
+        port_flags = set(in_ports_def) | set(out_ports_def)
+
+        props = {}
+        for is_optional, table in ((False, base), (True, optional)):
+            for flag, (label, default) in table.items():
+                if explicit_files is not None:
+                    is_file = flag in explicit_files
+                else:
+                    is_file = flag in port_flags or _looks_like_file(default)
+                props[flag] = PropSpec(flag, label, default, is_file, is_optional)
+
+        in_ports = tuple(
+            PortSpec(flag, name, port_type, "in", _with_replicas(accepts))
+            for flag, (name, port_type, accepts) in in_ports_def.items()
+        )
+        out_ports = tuple(
+            PortSpec(flag, name, port_type, "out")
+            for flag, (name, port_type) in out_ports_def.items()
+        )
+        port_props = {}
+        for p in in_ports + out_ports:
+            if p.flag in props:
+                port_props[p.name] = p.flag
+            elif p.name in props:
+                port_props[p.name] = p.name
+
+        self._init(
+            identifier=getattr(node_cls, "__identifier__", ""),
+            node_name=getattr(node_cls, "NODE_NAME", node_cls.__name__),
+            props=MappingProxyType(props),
+            base_flags=tuple(base),
+            optional_flags=frozenset(optional),
+            labels=MappingProxyType({k: p.label for k, p in props.items()}),
+            defaults=MappingProxyType({k: p.default for k, p in props.items()}),
+            opt_label_to_key=MappingProxyType({optional[k][0]: k for k in optional}),
+            file_flags=frozenset(k for k, p in props.items() if p.is_file),
+            in_ports=in_ports,
+            out_ports=out_ports,
+            in_flag_by_type=MappingProxyType({p.port_type: p.flag for p in in_ports}),
+            out_flag_by_type=MappingProxyType({p.port_type: p.flag for p in out_ports}),
+            port_props=MappingProxyType(port_props),
+            stdin_flags=tuple(getattr(node_cls, "STDIN_PROPS", ()) or ()),
+            raw_flags=frozenset(getattr(node_cls, "RAW_PROPS", ()) or ()),
+            list_flags=frozenset(getattr(node_cls, "LIST_PROPS", ()) or ()),
+            executor_flags=tuple(getattr(node_cls, "EXECUTOR_PROPS", ()) or ()),
+        )
+
+    @classmethod
+    def of(cls, node_cls) -> "NodeSpec":
+        """Returns the spec of a node class, building it on first use.
+
+        Args:
+            node_cls (type): The node class (or an instance of it).
+
+        Returns:
+            NodeSpec: The shared spec of the class.
+        """
+        if not isinstance(node_cls, type):
+            node_cls = type(node_cls)
+        spec = cls._CACHE.get(node_cls)
+        if spec is None:
+            spec = cls._CACHE[node_cls] = cls(node_cls)
+        return spec
+
+    @classmethod
+    def invalidate(cls, node_cls):
+        """Drops the cached spec of a node class whose declarations were changed.
+
+        Args:
+            node_cls (type): The node class.
+        """
+        cls._CACHE.pop(node_cls, None)
+
+    def prop(self, flag: str, fallback_default=""):
+        """Returns the (label, default) of a flag, falling back to the flag itself.
+
+        Args:
+            flag (str): The property flag.
+            fallback_default (object, optional): Default used for unknown flags.
+
+        Returns:
+            tuple: The label and the default value (the list of choices for combo props).
+        """
+        p = self.props.get(flag)
+        if p is None:
+            return flag, fallback_default
+        return p.label, list(p.choices) if p.choices else p.default
+
+    def __repr__(self):
+        return f"NodeSpec({self.identifier!r}, props={len(self.props)}, ports={len(self.in_ports) + len(self.out_ports)})"
+
+
+def _with_replicas(accepts) -> Tuple[str, ...]:
+    """Returns accepted output names with their replica slots (`out_gro` -> `out_gro_1`...)."""
+    accepts = tuple(accepts)
+    return accepts + tuple(f"{name}_{i}" for name in accepts for i in range(1, REPLICA_SLOTS + 1))
+
+
+def _looks_like_file(default) -> bool:
+    """Tells whether a default value looks like a GROMACS file name."""
+    if not isinstance(default, str):
+        return False
+    m = _FILE_RE.search(default.strip())
+    return bool(m) and m.group(1).lower() in FILE_EXTENSIONS
@@ -1,4 +1,5 @@
 from app.assets.my_prop_bin import MyBaseNode
+from app.nodes.node_spec import REPLICA_SLOTS
 
 
 """
@@ -26,6 +27,22 @@ Attributes:
         Maps output connection flags to port metadata (port_name, port_type).
         Determines which properties can be sent to downstream nodes.
 
+    STDIN_PROPS (tuple, optional): 
+        Properties answering the interactive prompts of the tool (group selections), written
+        to its stdin by the exporters instead of being passed as arguments.
+
+    RAW_PROPS (tuple, optional): 
+        Properties whose value is a string of extra arguments, passed as is.
+
+    LIST_PROPS (tuple, optional): 
+        Flags taking several values (e.g. the replica directories of `-multidir`), given as
+        one space-separated string and passed after the flag.
+
+    EXECUTOR_PROPS (tuple, optional): 
+        Properties read by the executors running the step rather than passed to the tool
+        (e.g. the convergence monitor and the segments of mdrun, the local scratch of I/O-heavy
+        steps, see `app.jobs.convergence`, `app.jobs.segments` and `app.jobs.staging`).
+
     __identifier__ (str): 
         Internal namespace identifier used by the node factory to register and restore nodes.
 
@@ -169,6 +186,7 @@ class Genion(MyBaseNode):
         "-o": ("out_gro", "gro_file"),
         "-p": ("out_top", "top_file"),
     }
+    STDIN_PROPS = ("group",)
 
     def __init__(self):
         super().__init__()
@@ -221,6 +239,11 @@ class Mdrun(MyBaseNode):
         "-pin": ("Pin strategy (-pin)", ""),
         "-maxh": ("Maxh (-maxh)", ""),
         "-rcon": ("Restrain groups (-rcon)", ""),
+        "converge": ("Stop when converged (e.g. Temperature 2, Density 5)", ""),
+        "converge_window": ("Convergence window (ps)", ""),
+        "segment_hours": ("Run in segments of (hours)", ""),
+        "segment_retries": ("Retries of a failed segment", ""),
+        "scratch": ("Run in local scratch (e.g. /tmp, $TMPDIR)", ""),
     }
     IN_PORTS = { "-s": ("in_tpr", "tpr_file", ["out_tpr"]) }
     OUT_PORTS = {
@@ -229,11 +252,132 @@ class Mdrun(MyBaseNode):
         "-p": ("out_xtc", "xtc_file"),
         "-f": ("out_edr", "edr_file"),
     }
+    RAW_PROPS = ("gpu_flags",)
+    EXECUTOR_PROPS = ("converge", "converge_window", "segment_hours", "segment_retries", "scratch")
 
     def __init__(self):
         super().__init__()
 
 
+# Files of each replica of a multi-simulation, by port kind: the single-run Mdrun outputs
+_REPLICA_OUTPUTS = ("gro", "cpt", "xtc", "edr")
+
+
+def _replica_props(dirs, tpr, deffnm):
+    """Returns the file props of the replica slots of a multi-simulation.
+
+    Each slot holds the tpr and outputs of one replica directory, named as mdrun does with
+    `-multidir`: `<dir>/<tpr>` and `<dir>/<deffnm>.<ext>`; slots with no directory are empty.
+
+    Args:
+        dirs (list): The replica directories.
+        tpr (str): The `-s` file, read in each directory.
+        deffnm (str): The `-deffnm` of the outputs.
+
+    Returns:
+        dict: The file of each slot prop (`tpr_<n>`, `out_<kind>_<n>`).
+    """
+    props = {}
+    for i in range(1, REPLICA_SLOTS + 1):
+        folder = dirs[i - 1] if i <= len(dirs) else None
+        props[f"tpr_{i}"] = f"{folder}/{tpr}" if folder else ""
+        for kind in _REPLICA_OUTPUTS:
+            props[f"out_{kind}_{i}"] = f"{folder}/{deffnm}.{kind}" if folder else ""
+    return props
+
+
+def _replica_table(dirs, tpr, deffnm):
+    """Returns the `BASE_PROPS` entries of the replica slots."""
+    props = _replica_props(dirs, tpr, deffnm)
+    table = {}
+    for i in range(1, REPLICA_SLOTS + 1):
+        table[f"tpr_{i}"] = (f"Replica {i} TPR", props[f"tpr_{i}"])
+        for kind in _REPLICA_OUTPUTS:
+            table[f"out_{kind}_{i}"] = (f"Replica {i} output {kind.upper()}", props[f"out_{kind}_{i}"])
+    return table
+
+
+class MdrunMulti(MyBaseNode):
+    """Multi-simulation: one `mdrun -multidir` run of replicas (different seeds or structures).
+
+    The replicas share one MPI launch, so small systems fill the cores together and are
+    pinned once, rather than competing as separate mdrun processes. Each replica directory
+    holds its own tpr; the files of the first `REPLICA_SLOTS` replicas have their own ports,
+    filled from the directories, `-s` and `-deffnm` (see `set_property`). The step runs with
+    an MPI build, `mpirun -np {ranks} gmx_mpi` by default ({ranks}: one per replica).
+    """
+    __identifier__ = "mdrun"
+    NODE_NAME = "Replicas (mdrun)"
+
+    BASE_PROPS = {
+        "-multidir": ("Replica directories", "rep1 rep2"),
+        "-s": ("Input (TPR, in each directory)", "md.tpr"),
+        "-deffnm": ("Deffnm", "md"),
+        **_replica_table(["rep1", "rep2"], "md.tpr", "md"),
+        "gpu_flags": ("GPU opts", "-bonded gpu -nb gpu -pmefft gpu -pme gpu"),
+    }
+    OPTIONAL_PROPS = {
+        "-ntomp": ("OpenMP threads per replica (-ntomp)", ""),
+        "-pin": ("Pin strategy (-pin)", ""),
+        "-maxh": ("Maxh (-maxh)", ""),
+        "-nsteps": ("Steps (-nsteps)", ""),
+        "mpirun": ("MPI launcher ({ranks}: replicas)", "mpirun -np {ranks}"),
+        "gmx_mpi": ("MPI-enabled gmx", "gmx_mpi"),
+        "scratch": ("Run in local scratch (e.g. /tmp, $TMPDIR)", ""),
+    }
+    IN_PORTS = {f"tpr_{i}": (f"in_tpr_{i}", "tpr_file", ["out_tpr"]) for i in range(1, REPLICA_SLOTS + 1)}
+    OUT_PORTS = {
+        f"out_{kind}_{i}": (f"out_{kind}_{i}", f"{kind}_file")
+        for i in range(1, REPLICA_SLOTS + 1) for kind in _REPLICA_OUTPUTS
+    }
+    # The files of the slots; -s and -deffnm are names within each replica directory
+    FILE_FLAGS = frozenset(_replica_props([], "", ""))
+    RAW_PROPS = ("gpu_flags",)
+    LIST_PROPS = ("-multidir",)
+    EXECUTOR_PROPS = ("mpirun", "gmx_mpi", "scratch")
+
+    def __init__(self):
+        super().__init__()
+
+    def set_property(self, name, value, push_undo=True):
+        """Sets a property, keeping the replica directories and the slot files in step.
+
+        The replica directories, `-s` and `-deffnm` set the slot files; a slot tpr in a
+        directory (e.g. `rep2/md.tpr`, propagated from a connected grompp) sets the directory
+        of its replica and `-s`. The derived props are set within the same undo step.
+        """
+        graph = self.graph if push_undo else None
+        if graph is None:
+            self._set_replica_property(name, value, push_undo)
+            return
+        graph.begin_undo(f"Set {name} of {self.name()}")
+        try:
+            self._set_replica_property(name, value, push_undo)
+        finally:
+            graph.end_undo()
+
+    def _set_replica_property(self, name, value, push_undo):
+        super().set_property(name, value, push_undo)
+        custom = self.model.custom_properties
+        if name.startswith("tpr_") and "/" in str(value or ""):
+            dirs = str(custom.get("-multidir") or "").split()
+            slot = int(name[len("tpr_"):])
+            folder, _, tpr = str(value).rpartition("/")
+            if slot <= len(dirs) + 1 and folder and " " not in folder:
+                dirs[slot - 1:slot] = [folder]
+                if custom.get("-s") != tpr:
+                    super().set_property("-s", tpr, push_undo)
+                name, value = "-multidir", " ".join(dirs)
+                super().set_property(name, value, push_undo)
+        if name not in ("-multidir", "-s", "-deffnm"):
+            return
+        dirs = str(custom.get("-multidir") or "").split()
+        props = _replica_props(dirs, custom.get("-s") or "topol.tpr", custom.get("-deffnm") or "md")
+        for flag, path in props.items():
+            if custom.get(flag) != path:
+                super().set_property(flag, path, push_undo)
+
+
 class Trjconv(MyBaseNode):
     __identifier__ = "trjconv"
     NODE_NAME = "Post (trjconv)"
@@ -251,12 +395,14 @@ class Trjconv(MyBaseNode):
         "-dt": ("Dt output ps (-dt)", ""),
         "-fit": ("Fit selection (-fit)", ""),
         "-n": ("Index file (-n)", ""),
+        "scratch": ("Run in local scratch (e.g. /tmp, $TMPDIR)", ""),
     }
     IN_PORTS = {
         "-s": ("in_tpr", "tpr_file", ["out_tpr"]),
         "-f": ("in_xtc", "xtc_file", ["out_xtc"]),
     }
     OUT_PORTS = { "-o": ("out_xtc", "xtc_file") }
+    EXECUTOR_PROPS = ("scratch",)
 
     def __init__(self):
         super().__init__()
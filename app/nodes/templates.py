@@ -0,0 +1,715 @@
+import copy
+import logging
+
+from app.assets.my_prop_bin import MyBaseNode
+from app.nodes import node_types
+from app.nodes.gmx_catalog import class_name_for
+from app.nodes.node_spec import NodeSpec
+from app.utils.session_format import serialize_node
+
+
+"""
+Subgraph templates: groups of nodes defined once and instantiated by reference.
+
+A template holds a group of nodes (e.g. the EM -> NVT -> NPT -> production chain of
+Grompp + Mdrun pairs): the type, relative position and values of each inner node, the
+connections between them, and the inner ports exposed to the rest of the graph.
+
+Each template gets a generated node class (type `template.<ClassName>`), in the same way
+as the generated gmx tools. An instance is a single collapsed node:
+    - its ports are the exposed inner ports, and each port has a property (named after the
+      port) holding the file it carries, so values propagate as for any other node;
+    - the inner properties the template declares as parameters are offered as optional
+      properties named `<inner node> <flag>`: adding one overrides that value for this
+      instance only. Templates saved before parameters were declared offer every property
+      of every inner node.
+
+Instances only store their overrides, so a session stores each template once (see
+`app.utils.session_format`), and editing a template changes the commands of all its
+instances. An instance can be expanded back into editable nodes, then collapsed again,
+either keeping the changes as overrides of that instance or updating the template.
+
+Template layout (`SubgraphTemplate.to_dict`):
+    name (str): The template name (also the instance node name).
+    nodes (dict): By inner node name: {"type_", "pos" (relative), "custom", "add_custom"}.
+    connections (list): [out node, out port, in node, in port] between inner nodes.
+    inputs (dict): Exposed input port name -> [[inner node, inner port], ...].
+    outputs (dict): Exposed output port name -> [[inner node, inner port], ...].
+    parameters (list): [inner node, flag] of the values an instance may override (None: all).
+
+Classes:
+    SubgraphTemplate:
+        The definition of a group of nodes.
+
+    TemplateNode:
+        Base class of the generated instance node classes.
+
+    TemplateLibrary:
+        Registers templates in a NodeGraph, and creates, expands and collapses instances.
+
+Functions:
+    equilibration_template(): The built-in EM -> NVT -> NPT -> production template.
+"""
+
+
+class SubgraphTemplate:
+    """SubgraphTemplate is the definition of a reusable group of nodes.
+
+    Attributes:
+        name (str): The template name.
+        nodes (dict): The inner nodes, by name (see the module docstring).
+        connections (list): The connections between inner nodes.
+        inputs (dict): The inner input ports exposed by the instances, by port name.
+        outputs (dict): The inner output ports exposed by the instances, by port name.
+        parameters (list): The `[inner node, flag]` an instance may override, or None for all.
+
+    Methods:
+        values(key): Returns the values of an inner node.
+        to_dict(): Returns the template as plain data.
+        from_dict(data): Builds a template from plain data.
+        from_nodes(name, nodes, keys=None): Captures a group of graph nodes as a template.
+    """
+    def __init__(self, name, nodes, connections=(), inputs=None, outputs=None, parameters=None):
+        self.name = name
+        self.nodes = nodes
+        self.connections = [list(c) for c in connections]
+        self.inputs = inputs or {}
+        self.outputs = outputs or {}
+        self.parameters = None if parameters is None else [list(p) for p in parameters]
+
+    def values(self, key):
+        """Returns the values of an inner node (base and optional props), by flag."""
+        node = self.nodes[key]
+        return {**(node.get("custom") or {}), **(node.get("add_custom") or {})}
+
+    def to_dict(self):
+        return copy.deepcopy({
+            "name": self.name,
+            "nodes": self.nodes,
+            "connections": self.connections,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "parameters": self.parameters,
+        })
+
+    @classmethod
+    def from_dict(cls, data):
+        data = copy.deepcopy(data)
+        return cls(data["name"], data["nodes"], data.get("connections", ()), data.get("inputs"), data.get("outputs"),
+                   data.get("parameters"))
+
+    @classmethod
+    def from_nodes(cls, name, nodes, keys=None):
+        """Captures a group of graph nodes, with their current values, as a template.
+
+        Inputs that are not fed from inside the group are exposed; inputs fed by the same
+        outside port (e.g. one topology for every grompp) share one exposed port. Outputs
+        connected outside the group are exposed, as well as every output of the nodes that
+        feed nothing inside the group. The values set on the nodes (optional props, and base
+        props other than files that differ from their default) become the parameters.
+
+        Args:
+            name (str): The template name.
+            nodes (list): The nodes of the group.
+            keys (dict, optional): The inner name of each node, by node id. Defaults to the node names.
+
+        Returns:
+            SubgraphTemplate: The template.
+        """
+        keys = keys or {n.id: n.name() for n in nodes}
+        inside = set(keys)
+        x0 = min(n.pos()[0] for n in nodes)
+        y0 = min(n.pos()[1] for n in nodes)
+
+        tpl_nodes, parameters = {}, []
+        for node in nodes:
+            _, node_dict, add_custom = serialize_node(node)
+            spec = node.spec
+            parameters += [[keys[node.id], flag] for flag in add_custom]
+            parameters += [[keys[node.id], flag] for flag, value in node_dict["custom"].items()
+                           if flag not in spec.file_flags and value != spec.defaults.get(flag)]
+            x, y = node.pos()
+            tpl_nodes[keys[node.id]] = {
+                "type_": node.type_,
+                "pos": [x - x0, y - y0],
+                "custom": node_dict["custom"],
+                "add_custom": add_custom,
+            }
+
+        connections, inputs, outputs = [], {}, {}
+        fed = {}
+        for node in nodes:
+            key = keys[node.id]
+            for port in node.input_ports():
+                sources = port.connected_ports()
+                internal = [p for p in sources if p.node().id in inside]
+                for src in internal:
+                    connections.append([keys[src.node().id], src.name(), key, port.name()])
+                if internal:
+                    continue
+                group = (sources[0].node().id, sources[0].name()) if sources else (node.id, port.name())
+                fed.setdefault(group, []).append([key, port.name()])
+
+            feeds_inside = any(
+                p.node().id in inside for port in node.output_ports() for p in port.connected_ports()
+            )
+            for port in node.output_ports():
+                targets = port.connected_ports()
+                if any(p.node().id not in inside for p in targets) or not feeds_inside:
+                    outputs[_unique(port.name(), outputs)] = [[key, port.name()]]
+
+        for targets in fed.values():
+            inputs[_unique(targets[0][1], inputs)] = targets
+        return cls(name, tpl_nodes, connections, inputs, outputs, parameters)
+
+
+def _unique(name, taken):
+    if name not in taken:
+        return name
+    x = 2
+    while f"{name} {x}" in taken:
+        x += 1
+    return f"{name} {x}"
+
+
+class TemplateNode(MyBaseNode):
+    """TemplateNode is the base class of the instance nodes generated for each template.
+
+    Attributes:
+        TEMPLATE (SubgraphTemplate): The template of the class (shared by its instances).
+        PORT_TARGETS (dict): The inner (node, flag) set by each port property, by port name.
+
+    Methods:
+        inner_values(): Returns the values of each inner node for this instance.
+        commands(): Returns the (gmx tool, values) of each inner node, left to right.
+    """
+    TEMPLATE = None
+    PORT_TARGETS = {}
+
+    def inner_values(self):
+        """Returns the values of each inner node: template values, then port props, then overrides.
+
+        Returns:
+            dict: The values of each inner node (by flag), by inner node name.
+        """
+        template = self.TEMPLATE
+        custom = self.model.custom_properties
+        values = {key: template.values(key) for key in template.nodes}
+
+        for port_name, targets in self.PORT_TARGETS.items():
+            if port_name not in custom:
+                continue
+            for key, flag in targets:
+                if flag in values[key]:
+                    values[key][flag] = custom[port_name]
+
+        optional = self.spec.optional_flags
+        for name, value in custom.items():
+            if name in optional:
+                key, _, flag = name.rpartition(" ")
+                values[key][flag] = value
+        return values
+
+    def commands(self):
+        """Returns the command of each inner node, ordered from left to right.
+
+        Returns:
+            list: The (gmx tool, values by flag) of each inner node.
+        """
+        template = self.TEMPLATE
+        values = self.inner_values()
+        order = sorted(template.nodes, key=lambda k: template.nodes[k]["pos"][0])
+        return [(template.nodes[k]["type_"].split(".", 1)[0], values[k]) for k in order]
+
+
+def template_class_attrs(template, inner_classes):
+    """Returns the class attributes of the instance node class of a template.
+
+    Args:
+        template (SubgraphTemplate): The template.
+        inner_classes (dict): The node class of each inner node, by inner node name.
+
+    Returns:
+        dict: The class attributes (props, ports, file flags, template).
+    """
+    base_props, optional_props, in_ports, out_ports = {}, {}, {}, {}
+    file_flags, port_targets = set(), {}
+
+    for side, exposed in (("in", template.inputs), ("out", template.outputs)):
+        for port_name, inner in exposed.items():
+            targets = []
+            first = None
+            for key, inner_port in inner:
+                spec = NodeSpec.of(inner_classes[key])
+                port_spec = next(
+                    (p for p in (spec.in_ports if side == "in" else spec.out_ports) if p.name == inner_port), None
+                )
+                if port_spec is None:
+                    logging.warning("Template '%s': no port '%s' on '%s'", template.name, inner_port, key)
+                    continue
+                flag = spec.port_props.get(port_spec.name, port_spec.flag)
+                targets.append((key, flag))
+                first = first or (key, spec, flag, port_spec)
+            if first is None:
+                continue
+
+            key, spec, flag, port_spec = first
+            label = spec.labels.get(flag, port_name)
+            label = f"{label} ({key})" if len(targets) == 1 else f"{label} ({len(targets)} nodes)"
+            base_props[port_name] = (label, template.values(key).get(flag, ""))
+            file_flags.add(port_name)
+            port_targets[port_name] = targets
+            if side == "in":
+                in_ports[port_name] = (port_name, port_spec.port_type, list(port_spec.accepts))
+            else:
+                out_ports[port_name] = (port_name, port_spec.port_type)
+
+    # The declared parameters can be overridden per instance, as optional properties
+    declared = None if template.parameters is None else {tuple(p) for p in template.parameters}
+    for key in template.nodes:
+        spec = NodeSpec.of(inner_classes[key])
+        values = template.values(key)
+        for flag, prop in spec.props.items():
+            if declared is not None and (key, flag) not in declared:
+                continue
+            value = values.get(flag, prop.default)
+            if prop.choices:
+                default = [value] + [c for c in prop.choices if c != value]
+            else:
+                default = value
+            name = f"{key} {flag}"
+            optional_props[name] = (f"{key}: {prop.label}", default)
+            if prop.is_file:
+                file_flags.add(name)
+
+    return {
+        "__identifier__": "template",
+        "NODE_NAME": template.name,
+        "__doc__": f"Instance of the '{template.name}' subgraph template.",
+        "BASE_PROPS": base_props,
+        "OPTIONAL_PROPS": optional_props,
+        "IN_PORTS": in_ports,
+        "OUT_PORTS": out_ports,
+        "FILE_FLAGS": frozenset(file_flags),
+        "TEMPLATE": template,
+        "PORT_TARGETS": port_targets,
+    }
+
+
+class TemplateLibrary:
+    """TemplateLibrary holds the templates of a NodeGraph and manages their instances.
+
+    Attributes:
+        node_graph (NodeGraph): The graph.
+        on_type (callable): Called with each inner node type before it is used, e.g. to
+            register generated node classes.
+        on_change (callable): Called with the template name when a template is added or updated.
+
+    Methods:
+        add(template): Adds a template (or updates the one with the same name).
+        update(template): Replaces a template and rebuilds its instances.
+        get(name): Returns a template.
+        names(): Returns the template names.
+        node_class(name): Returns the instance node class of a template.
+        node_classes(): Returns every instance node class.
+        instances(name): Returns the instance nodes of a template in the graph.
+        instantiate(name, pos=None): Creates an instance node.
+        expand(node): Replaces an instance by its inner nodes.
+        expanded_group(nodes): Tells whether nodes are exactly one expanded instance.
+        capture(name, nodes, keys=None): Adds (or updates) a template from graph nodes.
+        collapse(nodes, name, keys=None): Replaces graph nodes by an instance of a template.
+    """
+    def __init__(self, node_graph, on_type=None):
+        self.node_graph = node_graph
+        self.on_type = on_type
+        self.on_change = None
+        self._templates = {}
+        self._classes = {}
+        # Node id -> (expansion id, template name, inner node name)
+        self._expanded = {}
+        self._expansions = 0
+
+    def get(self, name):
+        return self._templates[name]
+
+    def names(self):
+        return list(self._templates)
+
+    def node_class(self, name):
+        return self._classes[name]
+
+    def node_classes(self):
+        return list(self._classes.values())
+
+    def _node_type(self, name):
+        return f"template.{self._classes[name].__name__}"
+
+    def _inner_classes(self, template):
+        classes = {}
+        registered = self.node_graph._node_factory.nodes
+        for key, node in template.nodes.items():
+            node_type = node.get("type_")
+            if node_type not in registered and self.on_type is not None:
+                self.on_type(node_type)
+            cls = registered.get(node_type)
+            if cls is None:
+                raise ValueError(f"Template '{template.name}': unknown node type '{node_type}'")
+            classes[key] = cls
+        return classes
+
+    def add(self, template):
+        """Adds a template and registers its instance node class in the graph.
+
+        A template with the same name is replaced (see `update`) unless it is identical.
+
+        Args:
+            template (SubgraphTemplate): The template.
+
+        Returns:
+            type: The instance node class.
+        """
+        existing = self._templates.get(template.name)
+        if existing is not None:
+            if existing.to_dict() != template.to_dict():
+                self.update(template)
+            return self._classes[template.name]
+
+        attrs = template_class_attrs(template, self._inner_classes(template))
+        class_name = class_name_for(template.name)
+        taken = {c.__name__ for c in self._classes.values()}
+        if class_name in taken:
+            class_name = _unique(class_name, taken).replace(" ", "")
+        cls = type(class_name, (TemplateNode,), attrs)
+
+        self._templates[template.name] = template
+        self._classes[template.name] = cls
+        self.node_graph.register_node(cls)
+        cls.register_accepts(self.node_graph)
+        MyBaseNode.add_node_type(self._node_type(template.name))
+        if self.on_change is not None:
+            self.on_change(template.name)
+        return cls
+
+    def update(self, template):
+        """Replaces a template: its instances follow, keeping their overrides.
+
+        The instance class is updated in place, then each instance is rebuilt (its ports
+        may have changed) with its name, connections and overrides. Port values left at
+        the former template value take the new one.
+
+        Args:
+            template (SubgraphTemplate): The new definition.
+        """
+        cls = self._classes[template.name]
+        attrs = template_class_attrs(template, self._inner_classes(template))
+        for name, value in attrs.items():
+            setattr(cls, name, value)
+        NodeSpec.invalidate(cls)
+        cls.register_accepts(self.node_graph)
+        self._templates[template.name] = template
+
+        instances = self.instances(template.name)
+        if instances:
+            self.node_graph.begin_undo(f"Update template {template.name}")
+            try:
+                for node in instances:
+                    self._rebuild(node)
+            finally:
+                self.node_graph.end_undo()
+        if self.on_change is not None:
+            self.on_change(template.name)
+
+    def _rebuild(self, node):
+        old_spec, custom = node.spec, dict(node.model.custom_properties)
+        name, pos, node_type = node.name(), list(node.pos()), node.type_
+        links = [
+            (src, "in", port.name()) for port in node.input_ports() for src in port.connected_ports()
+        ] + [
+            (dst, "out", port.name()) for port in node.output_ports() for dst in port.connected_ports()
+        ]
+        self.node_graph.delete_node(node, push_undo=True)
+
+        new = self.node_graph.create_node(node_type, name=name, pos=pos, selected=False, push_undo=True)
+        spec = new.spec
+        for prop, value in custom.items():
+            if prop in spec.base_flags and value != old_spec.defaults.get(prop):
+                new.model.set_property(prop, value)
+            elif prop in spec.optional_flags:
+                label, default = spec.prop(prop)
+                new._add_prop(name=prop, label=label, default=default)
+                new.model.set_property(prop, value)
+        _reconnect(new, links)
+
+    def instances(self, name):
+        cls = self._classes.get(name)
+        return [n for n in self.node_graph.all_nodes() if type(n) is cls]
+
+    def instantiate(self, name, pos=None):
+        """Creates an instance node of a template.
+
+        Args:
+            name (str): The template name.
+            pos (list, optional): The node position.
+
+        Returns:
+            TemplateNode: The instance.
+        """
+        return self.node_graph.create_node(self._node_type(name), name=name, pos=pos, push_undo=True)
+
+    def expand(self, node):
+        """Replaces an instance by its inner nodes, with the instance values and connections.
+
+        Args:
+            node (TemplateNode): The instance.
+
+        Returns:
+            list: The inner nodes (selected).
+        """
+        template = node.TEMPLATE
+        values = node.inner_values()
+        x0, y0 = node.pos()
+        graph = self.node_graph
+
+        graph.begin_undo(f"Expand {node.name()}")
+        try:
+            created = {}
+            for key, inner in template.nodes.items():
+                dx, dy = inner.get("pos", (0, 0))
+                created[key] = graph.create_node(
+                    inner["type_"], name=key, pos=[x0 + dx, y0 + dy], selected=True, push_undo=True
+                )
+                _apply_values(created[key], values[key])
+
+            for out_key, out_port, in_key, in_port in template.connections:
+                _connect(created[out_key].outputs().get(out_port), created[in_key].inputs().get(in_port))
+            for port in node.input_ports():
+                for src in port.connected_ports():
+                    for key, inner_port in template.inputs.get(port.name(), ()):
+                        _connect(src, created[key].inputs().get(inner_port))
+            for port in node.output_ports():
+                for dst in port.connected_ports():
+                    for key, inner_port in template.outputs.get(port.name(), ()):
+                        _connect(created[key].outputs().get(inner_port), dst)
+
+            graph.delete_node(node, push_undo=True)
+        finally:
+            graph.end_undo()
+
+        self._expansions += 1
+        for key, inner in created.items():
+            self._expanded[inner.id] = (self._expansions, template.name, key)
+        return list(created.values())
+
+    def expanded_group(self, nodes):
+        """Tells whether nodes are exactly the inner nodes of one expanded instance.
+
+        Args:
+            nodes (list): The nodes.
+
+        Returns:
+            tuple: The template name and the inner name of each node (by node id), or None.
+        """
+        entries = [self._expanded.get(n.id) for n in nodes]
+        if not entries or None in entries or len({e[0] for e in entries}) != 1:
+            return None
+        name = entries[0][1]
+        keys = {n.id: e[2] for n, e in zip(nodes, entries)}
+        template = self._templates.get(name)
+        if template is None or set(keys.values()) != set(template.nodes):
+            return None
+        return name, keys
+
+    def capture(self, name, nodes, keys=None):
+        """Adds a template made of graph nodes, or updates the template with that name.
+
+        Args:
+            name (str): The template name.
+            nodes (list): The nodes.
+            keys (dict, optional): The inner name of each node, by node id.
+
+        Returns:
+            SubgraphTemplate: The template.
+        """
+        template = SubgraphTemplate.from_nodes(name, nodes, keys)
+        existing = self._templates.get(name)
+        if existing is not None and template.parameters is not None:
+            # An update keeps the parameters of the template
+            if existing.parameters is None:
+                template.parameters = None
+            else:
+                template.parameters += [p for p in existing.parameters if p not in template.parameters]
+        self.add(template)
+        return template
+
+    def collapse(self, nodes, name, keys=None):
+        """Replaces graph nodes by an instance of a template.
+
+        The values of the nodes that differ from the template are kept as overrides of the
+        instance, and the connections to the rest of the graph go through its ports.
+
+        Args:
+            nodes (list): The nodes (the inner nodes of the template).
+            name (str): The template name.
+            keys (dict, optional): The inner name of each node, by node id. Defaults to the node names.
+
+        Returns:
+            TemplateNode: The instance.
+        """
+        template = self._templates[name]
+        keys = keys or {n.id: n.name() for n in nodes}
+        inside = set(keys)
+        graph = self.node_graph
+        x0 = min(n.pos()[0] for n in nodes)
+        y0 = min(n.pos()[1] for n in nodes)
+
+        node_values = {}
+        for node in nodes:
+            _, node_dict, add_custom = serialize_node(node)
+            node_values[keys[node.id]] = {**node_dict["custom"], **add_custom}
+
+        in_by_target = {(k, p): port for port, targets in template.inputs.items() for k, p in targets}
+        out_by_target = {(k, p): port for port, targets in template.outputs.items() for k, p in targets}
+        links = []
+        for node in nodes:
+            key = keys[node.id]
+            for port in node.input_ports():
+                exposed = in_by_target.get((key, port.name()))
+                for src in port.connected_ports():
+                    if exposed and src.node().id not in inside:
+                        links.append((src, "in", exposed))
+            for port in node.output_ports():
+                exposed = out_by_target.get((key, port.name()))
+                for dst in port.connected_ports():
+                    if exposed and dst.node().id not in inside:
+                        links.append((dst, "out", exposed))
+
+        graph.begin_undo(f"Collapse into {name}")
+        try:
+            instance = graph.create_node(self._node_type(name), name=name, pos=[x0, y0], push_undo=True)
+            spec = instance.spec
+
+            expected = {key: template.values(key) for key in template.nodes}
+            for port_name, targets in instance.PORT_TARGETS.items():
+                key, flag = targets[0]
+                value = node_values.get(key, {}).get(flag)
+                if value is None:
+                    continue
+                if value != spec.defaults.get(port_name):
+                    instance.model.set_property(port_name, value)
+                for key, flag in targets:
+                    if flag in expected[key]:
+                        expected[key][flag] = value
+
+            for key, values in node_values.items():
+                for flag, value in values.items():
+                    prop = f"{key} {flag}"
+                    if key not in expected or expected[key].get(flag) == value:
+                        continue
+                    if prop not in spec.optional_flags:
+                        logging.warning("%s: '%s' is not a parameter of template '%s', change dropped", key, flag, name)
+                        continue
+                    label, default = spec.prop(prop)
+                    instance._add_prop(name=prop, label=label, default=default)
+                    instance.model.set_property(prop, value)
+
+            graph.delete_nodes(nodes, push_undo=True)
+            _reconnect(instance, links)
+        finally:
+            graph.end_undo()
+
+        for node_id in inside:
+            self._expanded.pop(node_id, None)
+        return instance
+
+
+def _apply_values(node, values):
+    """Writes values to a node model, adding the optional props it does not have yet."""
+    spec = node.spec
+    for flag, value in values.items():
+        if not node.has_property(flag):
+            if flag not in spec.props:
+                logging.warning("Unknown property '%s' on %s skipped", flag, node.name())
+                continue
+            label, default = spec.prop(flag)
+            node._add_prop(name=flag, label=label, default=default)
+        node.model.set_property(flag, value)
+
+
+def _reconnect(node, links):
+    """Connects the ports of a node to outside ports, given as (outside port, side, port name)."""
+    for other, side, port_name in links:
+        if side == "in":
+            port = node.inputs().get(port_name)
+            if port is not None and other not in port.connected_ports():
+                _connect(other, port)
+        else:
+            port = node.outputs().get(port_name)
+            if port is not None and other not in port.connected_ports():
+                _connect(port, other)
+
+
+def _connect(out_port, in_port):
+    # Values already match across the connection: no property propagation
+    if out_port is not None and in_port is not None:
+        out_port.connect_to(in_port, push_undo=True, emit_signal=False)
+
+
+def equilibration_template():
+    """Returns the built-in EM -> NVT -> NPT -> production template (Grompp + Mdrun pairs).
+
+    The structure enters through `in_gro` (into the EM grompp) and the topology through
+    `in_top` (shared by every grompp); the production run outputs are exposed. The mdrun
+    stages take the GPU offload flags of the Mdrun node defaults, so the template must be
+    built once the host defaults are set (see `app.nodes.host_profile.apply_mdrun_defaults`).
+    The parameters are the mdp, warnings, offload, threads and time limit of each stage,
+    the convergence criterion of NVT and NPT, and the segments and scratch of the production.
+    """
+    gpu_flags = NodeSpec.of(node_types.Mdrun).defaults["gpu_flags"]
+    stages = [("EM", "em"), ("NVT", "nvt"), ("NPT", "npt"), ("Production", "md")]
+    nodes, connections, parameters = {}, [], []
+    previous_gro = "ions.gro"
+    previous_mdrun = None
+    for i, (label, stem) in enumerate(stages):
+        grompp, mdrun = f"{label} (grompp)", f"{label} (mdrun)"
+        add_custom = {"-r": previous_gro} if stem in ("nvt", "npt") else {}
+        if stem in ("nvt", "npt"):
+            add_custom["-D"] = "-DPOSRES"
+        nodes[grompp] = {
+            "type_": "grompp.Grompp",
+            "pos": [i * 500, 0],
+            "custom": {"-f": f"{stem}.mdp", "-c": previous_gro, "-p": "topol.top",
+                       "-o": f"{stem}.tpr", "-maxwarn": "1"},
+            "add_custom": add_custom,
+        }
+        nodes[mdrun] = {
+            "type_": "mdrun.Mdrun",
+            "pos": [i * 500 + 250, 0],
+            "custom": {"-s": f"{stem}.tpr", "-deffnm": stem, "out_gro": f"{stem}.gro",
+                       "out_cpt": f"{stem}.cpt", "out_xtc": f"{stem}.xtc", "out_edr": f"{stem}.edr",
+                       "gpu_flags": gpu_flags},
+            "add_custom": {},
+        }
+        connections.append([grompp, "out_tpr", mdrun, "in_tpr"])
+        # What is tuned per system: parameters, run length and resources
+        parameters += [[grompp, "-f"], [grompp, "-maxwarn"], [mdrun, "gpu_flags"], [mdrun, "-nt"], [mdrun, "-maxh"]]
+        if stem in ("nvt", "npt"):
+            parameters += [[mdrun, "converge"]]
+        elif stem == "md":
+            parameters += [[mdrun, "segment_hours"], [mdrun, "scratch"]]
+        if previous_mdrun is not None:
+            connections.append([previous_mdrun, "out_gro", grompp, "in_gro"])
+        previous_gro, previous_mdrun = f"{stem}.gro", mdrun
+
+    return SubgraphTemplate(
+        "Equilibration chain",
+        nodes,
+        connections,
+        inputs={
+            "in_gro": [["EM (grompp)", "in_gro"]],
+            "in_top": [[f"{label} (grompp)", "in_top"] for label, _ in stages],
+        },
+        outputs={
+            port: [["Production (mdrun)", port]] for port in ("out_gro", "out_cpt", "out_xtc", "out_edr")
+        },
+        parameters=parameters,
+    )
@@ -0,0 +1,675 @@
+import argparse
+import contextlib
+import logging
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import stat
+import sys
+import time
+
+from app.utils.fingerprints import STATE_DIR, FingerprintIndex
+
+
+"""
+Content-addressed artifact store: the files shared by several working directories (the
+variants of a parameter sweep copy the same topology, position restraints, force field
+includes and equilibrated structures and checkpoints) are kept once, by SHA-256.
+
+Layout of the store (`$GROGUI_ARTIFACTS`, `$XDG_STATE_HOME/grogui/artifacts` by default):
+
+    objects/ab/abcdef...        one file per content, read-only
+    store.sqlite                the objects and where they are linked:
+        objects(digest, size, added)
+        links(workdir, path, digest, root, inode)
+                                `root` is the step file (or the file given to `add`) that
+                                brought the file in: itself, or the topology including it
+
+A file is added by hard-linking it into the store, or by hard-linking the object already
+holding its content in its place; where hard links cannot be made (another filesystem,
+one refusing them), a reflink (copy-on-write clone) is tried. A file that can be neither
+linked nor cloned stays as it is: copying it into the store would only add to the disk
+used. The store must then sit on the filesystem of the working directories to dedupe
+them. Files linked out of the store (`link`) fall back to a plain copy.
+
+A hard-linked file shares its inode with the object: it is read-only, and keeps the
+modification time of the first copy stored. `unshare` gives a file its own writable
+copy back (or, for a file linked nowhere else, hands it the object). The executors
+running steps on this host (job daemon, work queue workers) use the store when
+`$GROGUI_ARTIFACTS` is set: before a step runs, the files it writes or appends to are
+unshared (see `unshare_step`); once it succeeded, its input and output files (and the
+files included by its topologies) are added (see `store_step`). Parameter files,
+logs, energies and trajectories (`SKIPPED_SUFFIXES`) are left out: they are edited, or
+differ from a run to the next.
+
+Reachability follows the saved sessions: a link is alive while a session names its root
+file (in a node property) and was saved for its working directory, or does not record one
+(sessions of former versions). `gc` removes the objects no live link uses, and the links
+to files rewritten since. Removing an object frees no disk while working directories
+still link it, and loses nothing: it only stops new copies from being deduped against it.
+
+Usage:
+    python -m app.utils.artifacts add WORKDIR [FILE ...]
+    python -m app.utils.artifacts link SOURCE_WORKDIR WORKDIR [FILE ...]
+    python -m app.utils.artifacts unshare WORKDIR FILE ...
+    python -m app.utils.artifacts gc SESSION_OR_DIR ... [--dry-run]
+    python -m app.utils.artifacts stats
+
+Classes:
+    ArtifactStore:
+        The objects, and the working directory files linked to them.
+
+Functions:
+    store_root(): Returns the directory of the store.
+    enabled_store(): Returns the store used by the executors, if enabled.
+    reflink(source, target): Clones a file, sharing its blocks.
+    place(source, target, hard=True): Links, clones or copies a file.
+    session_refs(path): Returns the working directory and the file names of a session.
+    store_step(step, plan, log): Adds the files of a successful step to the store.
+    unshare_step(step, plan): Unshares the files a step is about to write.
+    main(argv=None): Command line (`python -m app.utils.artifacts`).
+"""
+
+
+SCHEMA_VERSION = 1
+# Files never added by the executors: edited, appended to, or different from a run to the next
+SKIPPED_SUFFIXES = (".mdp", ".log", ".edr", ".xtc", ".trr", ".xvg")
+# ioctl cloning a file (Linux, on btrfs, XFS and others)
+FICLONE = 0x40049409
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    workdir TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    root TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    PRIMARY KEY (workdir, path)
+);
+CREATE INDEX IF NOT EXISTS links_digest ON links (digest);
+"""
+
+_INCLUDE_RE = re.compile(r'^\s*#\s*include\s+"([^"]+)"')
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def store_root():
+    """Returns the directory of the store: `$GROGUI_ARTIFACTS`, or the default one."""
+    path = os.environ.get("GROGUI_ARTIFACTS")
+    if not path:
+        base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+        path = os.path.join(base, "grogui", "artifacts")
+    return pathlib.Path(path)
+
+
+def enabled_store():
+    """Returns the store the executors add the files of their steps to, or None if `$GROGUI_ARTIFACTS` is not set."""
+    if not os.environ.get("GROGUI_ARTIFACTS"):
+        return None
+    return ArtifactStore()
+
+
+def reflink(source, target):
+    """Clones a file, sharing its blocks until one copy is written (copy-on-write).
+
+    Args:
+        source (str): The file.
+        target (str): The clone, created.
+
+    Raises:
+        OSError: If the filesystem cannot clone (or the platform has no `FICLONE`).
+    """
+    import fcntl
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+    shutil.copystat(source, target)
+
+
+def place(source, target, hard=True):
+    """Puts a file at `target`: hard link, else reflink, else copy.
+
+    Args:
+        source (str): The file.
+        target (str): The new file (replaced if it exists).
+        hard (bool, optional): Whether a hard link may be made: only for a file none of
+            its users writes to.
+
+    Returns:
+        str: How the file was placed: "link", "reflink" or "copy".
+    """
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp = f"{target}.grogui-{os.getpid()}.tmp"
+    try:
+        method = None
+        if hard:
+            try:
+                os.link(source, tmp)
+                method = "link"
+            except OSError:
+                pass
+        if method is None:
+            try:
+                reflink(source, tmp)
+                method = "reflink"
+            except OSError:
+                shutil.copy2(source, tmp)
+                method = "copy"
+        os.replace(tmp, target)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    return method
+
+
+def _includes(workdir, rel, seen):
+    """Returns the files included by a topology, found in the working directory, recursively."""
+    found = []
+    try:
+        with open(os.path.join(workdir, rel), encoding="utf-8", errors="replace") as f:
+            lines = f.readlines()
+    except OSError:
+        return found
+    for line in lines:
+        m = _INCLUDE_RE.match(line)
+        if not m:
+            continue
+        # Includes resolve relative to the including file first
+        included = os.path.normpath(os.path.join(os.path.dirname(rel), m.group(1)))
+        if included in seen or included.startswith("..") or os.path.isabs(m.group(1)):
+            continue
+        if not os.path.isfile(os.path.join(workdir, included)):
+            continue
+        seen.add(included)
+        found.append(included)
+        found += _includes(workdir, included, seen)
+    return found
+
+
+class ArtifactStore:
+    """ArtifactStore holds the objects, and the working directory files linked to them.
+
+    Working directories are recorded as absolute paths, the files as paths relative to them.
+    Each method uses its own connection, so a store can be shared between threads and
+    processes.
+
+    Attributes:
+        root (pathlib.Path): The directory of the store.
+        path (pathlib.Path): Its SQLite file.
+
+    Methods:
+        object_path(digest): Returns the file of an object.
+        add(workdir, paths, roots=None): Stores files and links them to their objects.
+        link(digest, target): Links an object out of the store.
+        link_files(source, workdir, paths): Links the stored files of a working directory into another.
+        unshare(workdir, paths): Gives hard-linked files their own writable copy back.
+        gc(sessions, dry_run=False): Removes the objects no saved session reaches.
+        stats(): Returns the objects, links and bytes saved.
+    """
+    def __init__(self, root=None):
+        self.root = pathlib.Path(root) if root else store_root()
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self.path = self.root / "store.sqlite"
+        with self._transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"Store {self.path} was created by a newer version (schema {version})")
+            if version == 0:
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        db.execute(statement)
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=60.0, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def _query(self, sql, args=()):
+        db = self._connect()
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def object_path(self, digest):
+        """Returns the file of an object."""
+        return self.root / "objects" / digest[:2] / digest
+
+    def _store_one(self, workdir, rel, digest):
+        """Links one file to the object of its content, creating the object from it if needed.
+
+        Returns:
+            tuple: The inode the link row records and the bytes deduped, or None if the
+            file could be neither linked nor cloned.
+        """
+        source = os.path.join(workdir, rel)
+        obj = self.object_path(digest)
+        obj.parent.mkdir(exist_ok=True)
+        st = os.stat(source)
+        try:
+            obj_st = os.stat(obj)
+        except FileNotFoundError:
+            obj_st = None
+        if obj_st is not None and obj_st.st_size != st.st_size:
+            logging.error("Object %s has the wrong size, replaced", digest)
+            os.remove(obj)
+            obj_st = None
+
+        if obj_st is None:
+            try:
+                # The file becomes the object (hard link): no byte copied
+                os.link(source, obj)
+            except FileExistsError:
+                # Stored meanwhile by another process
+                return self._store_one(workdir, rel, digest)
+            except OSError:
+                try:
+                    reflink(source, str(obj))
+                except OSError:
+                    return None
+                os.chmod(obj, stat.S_IMODE(os.stat(obj).st_mode) & ~_WRITE_BITS)
+                return st.st_ino, 0
+            os.chmod(obj, stat.S_IMODE(st.st_mode) & ~_WRITE_BITS)
+            return st.st_ino, 0
+
+        if obj_st.st_ino == st.st_ino and obj_st.st_dev == st.st_dev:
+            return st.st_ino, 0
+        try:
+            method = place(str(obj), source)
+        except OSError as e:
+            logging.warning("Cannot link %s to the artifact store: %s", source, e)
+            return None
+        if method == "copy":
+            # Another filesystem, or one without links or clones
+            return None
+        return os.stat(source).st_ino, st.st_size
+
+    def add(self, workdir, paths, roots=None):
+        """Stores files and links each one to the object of its content.
+
+        Args:
+            workdir (str): The working directory.
+            paths (list): The files, relative to it; missing ones are left out.
+            roots (dict, optional): The root file of each path (see the module docstring).
+                Defaults to the path itself.
+
+        Returns:
+            tuple: The files now linked (count) and the bytes deduped.
+        """
+        workdir = os.path.abspath(workdir)
+        roots = roots or {}
+        paths = [os.path.normpath(p) for p in paths]
+        hashes = FingerprintIndex(workdir).full_hashes(paths)
+        rows, objects, saved = [], [], 0
+        for rel, digest in hashes.items():
+            try:
+                size = os.path.getsize(os.path.join(workdir, rel))
+                stored = self._store_one(workdir, rel, digest)
+            except OSError as e:
+                logging.warning("Cannot store %s: %s", os.path.join(workdir, rel), e)
+                continue
+            if stored is None:
+                continue
+            inode, deduped = stored
+            saved += deduped
+            objects.append((digest, size, time.time()))
+            rows.append((workdir, rel, digest, roots.get(rel, rel), inode))
+        if rows:
+            with self._transaction() as db:
+                db.executemany("INSERT OR IGNORE INTO objects (digest, size, added) VALUES (?, ?, ?)", objects)
+                db.executemany("INSERT OR REPLACE INTO links (workdir, path, digest, root, inode)"
+                               " VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows), saved
+
+    def link(self, digest, target):
+        """Links an object out of the store (hard link, else reflink, else copy).
+
+        Args:
+            digest (str): The object.
+            target (str): The file created (replaced if it exists).
+
+        Returns:
+            str: How the file was placed (see `place`).
+
+        Raises:
+            FileNotFoundError: If the store has no such object.
+        """
+        obj = self.object_path(digest)
+        if not obj.exists():
+            raise FileNotFoundError(f"No object {digest} in {self.root}")
+        return place(str(obj), str(target))
+
+    def link_files(self, source, workdir, paths=None):
+        """Links the stored files of a working directory into another, under the same paths.
+
+        Args:
+            source (str): The working directory the files were stored from.
+            workdir (str): The working directory to fill.
+            paths (list, optional): The files. Defaults to every stored file of `source`.
+
+        Returns:
+            dict: How each file was placed (see `place`), by path.
+        """
+        source, workdir = os.path.abspath(source), os.path.abspath(workdir)
+        rows = self._query("SELECT path, digest, root FROM links WHERE workdir = ?", (source,))
+        wanted = None if paths is None else {os.path.normpath(p) for p in paths}
+        placed, linked = {}, []
+        for rel, digest, root in rows:
+            if wanted is not None and rel not in wanted:
+                continue
+            try:
+                placed[rel] = method = self.link(digest, os.path.join(workdir, rel))
+            except OSError as e:
+                logging.warning("Cannot link %s into %s: %s", rel, workdir, e)
+                continue
+            if method != "copy":
+                linked.append((workdir, rel, digest, root, os.stat(os.path.join(workdir, rel)).st_ino))
+        if linked:
+            with self._transaction() as db:
+                db.executemany("INSERT OR REPLACE INTO links (workdir, path, digest, root, inode)"
+                               " VALUES (?, ?, ?, ?, ?)", linked)
+        return placed
+
+    def unshare(self, workdir, paths):
+        """Gives hard-linked files their own writable copy back, before they are written.
+
+        A file no other working directory links gets the object itself (nothing is copied)
+        and the object leaves the store. Clones are already private: they are only
+        forgotten.
+
+        Args:
+            workdir (str): The working directory.
+            paths (list): The files, relative to it.
+
+        Returns:
+            list: The files unshared.
+        """
+        workdir = os.path.abspath(workdir)
+        wanted = {os.path.normpath(p) for p in paths if p}
+        rows = [r for r in self._query("SELECT path, digest FROM links WHERE workdir = ?", (workdir,))
+                if r[0] in wanted]
+        if not rows:
+            return []
+        done, released = [], []
+        for rel, digest in rows:
+            target = os.path.join(workdir, rel)
+            obj = self.object_path(digest)
+            try:
+                st = os.stat(target)
+                obj_st = os.stat(obj)
+            except OSError:
+                done.append(rel)
+                continue
+            if (st.st_ino, st.st_dev) != (obj_st.st_ino, obj_st.st_dev):
+                done.append(rel)
+                continue
+            others = self._query("SELECT COUNT(*) FROM links WHERE digest = ? AND NOT (workdir = ? AND path = ?)",
+                                 (digest, workdir, rel))[0][0]
+            try:
+                if st.st_nlink == 2 and not others:
+                    os.remove(obj)
+                    released.append(digest)
+                else:
+                    place(str(obj), target, hard=False)
+                os.chmod(target, stat.S_IMODE(os.stat(target).st_mode) | stat.S_IWUSR)
+            except OSError as e:
+                logging.warning("Cannot unshare %s: %s", target, e)
+                continue
+            done.append(rel)
+        with self._transaction() as db:
+            db.executemany("DELETE FROM links WHERE workdir = ? AND path = ?", [(workdir, rel) for rel in done])
+            db.executemany("DELETE FROM objects WHERE digest = ?", [(d,) for d in released])
+        return done
+
+    def gc(self, sessions, dry_run=False):
+        """Removes the objects no saved session reaches (see the module docstring).
+
+        Args:
+            sessions (list): The session files.
+            dry_run (bool, optional): Only report what would be removed.
+
+        Returns:
+            tuple: The objects removed (count) and their bytes.
+        """
+        refs = [session_refs(path) for path in sessions]
+        links = self._query("SELECT workdir, path, digest, root, inode FROM links")
+        live, stale = set(), []
+        for workdir, rel, digest, root, inode in links:
+            try:
+                if os.stat(os.path.join(workdir, rel)).st_ino != inode:
+                    raise FileNotFoundError
+            except OSError:
+                # Removed, or rewritten since it was linked
+                stale.append((workdir, rel))
+                continue
+            if any(root in names and session_workdir in (None, workdir) for session_workdir, names in refs):
+                live.add(digest)
+        dead = [(d, size) for d, size in self._query("SELECT digest, size FROM objects") if d not in live]
+        if dry_run:
+            return len(dead), sum(size for _, size in dead)
+        removed = []
+        for digest, size in dead:
+            try:
+                os.remove(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning("Cannot remove object %s: %s", digest, e)
+                continue
+            removed.append((digest, size))
+        with self._transaction() as db:
+            db.executemany("DELETE FROM links WHERE workdir = ? AND path = ?", stale)
+            db.executemany("DELETE FROM links WHERE digest = ?", [(d,) for d, _ in removed])
+            db.executemany("DELETE FROM objects WHERE digest = ?", [(d,) for d, _ in removed])
+        return len(removed), sum(size for _, size in removed)
+
+    def stats(self):
+        """Returns the objects, links and bytes saved.
+
+        Returns:
+            dict: `objects` and `links` (counts), `stored` (bytes of the objects) and
+            `saved` (bytes the links would take as copies, beyond the first one).
+        """
+        objects = self._query("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects")[0]
+        links = self._query(
+            "SELECT COUNT(*), COALESCE(SUM(o.size), 0) FROM links l JOIN objects o ON o.digest = l.digest"
+        )[0]
+        return {"objects": objects[0], "stored": objects[1], "links": links[0], "saved": max(0, links[1] - objects[1])}
+
+
+def session_refs(path):
+    """Returns the working directory and the file names of a session.
+
+    Every string of the node properties (and of the templates) is taken as a possible file
+    name, each word of it as well (lists of directories, `-multidir`).
+
+    Args:
+        path (str | pathlib.Path): The session file.
+
+    Returns:
+        tuple: The working directory the session was saved for (None if not recorded)
+        and the set of names.
+    """
+    from app.utils.session_format import iter_session
+
+    names, workdir = set(), None
+
+    def collect(value):
+        if isinstance(value, str):
+            for name in [value, *value.split()]:
+                names.add(os.path.normpath(name))
+        elif isinstance(value, dict):
+            for v in value.values():
+                collect(v)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                collect(v)
+
+    for kind, payload in iter_session(path):
+        if kind == "node":
+            node_dict, add_custom = payload
+            collect(node_dict.get("custom", {}))
+            collect(add_custom)
+        elif kind == "template":
+            collect(payload)
+        elif kind == "ui" and isinstance(payload, dict) and payload.get("workdir"):
+            workdir = os.path.abspath(payload["workdir"])
+    return workdir, names
+
+
+def _step_files(step, workdir):
+    """Returns the files of a step to store, with their root file."""
+    roots = {}
+    for path in [*step.inputs, *step.outputs]:
+        if not path or os.path.isabs(path) or os.path.normpath(path).startswith(".."):
+            continue
+        path = os.path.normpath(path)
+        if path.endswith(SKIPPED_SUFFIXES) or path.split(os.sep)[0] == STATE_DIR:
+            continue
+        roots.setdefault(path, path)
+        if path.endswith((".top", ".itp")):
+            for included in _includes(workdir, path, set(roots)):
+                roots.setdefault(included, path)
+    return roots
+
+
+def store_step(step, plan, log):
+    """Adds the input and output files of a successful step to the store, if enabled.
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step.
+        log (file): The binary file of the step output, told what was deduped.
+    """
+    from app.jobs.staging import wait_for
+
+    store = enabled_store()
+    if store is None:
+        return
+    workdir = plan["workdir"]
+    wait_for(workdir, step.outputs)
+    roots = _step_files(step, workdir)
+    if not roots:
+        return
+    try:
+        count, saved = store.add(workdir, list(roots), roots)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning("Cannot store the files of %s: %s", step.label, e)
+        return
+    if count:
+        log.write(f"[artifacts] {count} file(s) in the store, {saved / 1e6:.1f} MB deduped\n".encode())
+
+
+def unshare_step(step, plan):
+    """Gives the files a step is about to write or append to their own copy, if the store is enabled.
+
+    Args:
+        step (Step): The step.
+        plan (dict): The plan of the step.
+    """
+    from app.jobs.staging import appended_files
+
+    store = enabled_store()
+    if store is None:
+        return
+    try:
+        store.unshare(plan["workdir"], [*step.outputs, *appended_files(step)])
+    except (OSError, sqlite3.Error) as e:
+        logging.warning("Cannot unshare the outputs of %s: %s", step.label, e)
+
+
+def _session_files(paths):
+    """Returns the session files given, the compact sessions of the directories given."""
+    from app.utils.session_format import SESSION_SUFFIX
+
+    files = []
+    for path in map(pathlib.Path, paths):
+        files += sorted(path.rglob(f"*{SESSION_SUFFIX}")) if path.is_dir() else [path]
+    return files
+
+
+def main(argv=None):
+    """Command line: adds, links and unshares files, collects the garbage, prints the store usage."""
+    parser = argparse.ArgumentParser(description="Content-addressed store of the files shared by working directories")
+    parser.add_argument("--store", default=None, help="store directory (default: $GROGUI_ARTIFACTS, "
+                                                       "else $XDG_STATE_HOME/grogui/artifacts)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="store files of a working directory (default: all of them)")
+    add.add_argument("workdir")
+    add.add_argument("files", nargs="*")
+    link = commands.add_parser("link", help="link the stored files of a working directory into another")
+    link.add_argument("source")
+    link.add_argument("workdir")
+    link.add_argument("files", nargs="*")
+    unshare = commands.add_parser("unshare", help="give linked files their own writable copy")
+    unshare.add_argument("workdir")
+    unshare.add_argument("files", nargs="+")
+    gc = commands.add_parser("gc", help="remove the objects the sessions do not reach")
+    gc.add_argument("sessions", nargs="+", help="session files, or directories searched for sessions")
+    gc.add_argument("--no-autosave", action="store_true", help="do not count the autosaved sessions")
+    gc.add_argument("--dry-run", action="store_true")
+    commands.add_parser("stats", help="print the store usage")
+    args = parser.parse_args(argv)
+
+    store = ArtifactStore(args.store)
+    if args.command == "add":
+        files = args.files or list(FingerprintIndex(args.workdir).scan())
+        files = [p for p in files if p.split(os.sep)[0] != STATE_DIR]
+        count, saved = store.add(args.workdir, files)
+        print(f"{count} file(s) in the store, {saved / 1e6:.1f} MB deduped")
+    elif args.command == "link":
+        placed = store.link_files(args.source, args.workdir, args.files or None)
+        methods = [m for m in ("link", "reflink", "copy") if m in placed.values()]
+        print(f"{len(placed)} file(s) placed ({', '.join(f'{list(placed.values()).count(m)} {m}' for m in methods) or 'none'})")
+    elif args.command == "unshare":
+        print(f"{len(store.unshare(args.workdir, args.files))} file(s) unshared")
+    elif args.command == "gc":
+        missing = [path for path in args.sessions if not os.path.exists(path)]
+        if missing:
+            print(f"No such session: {missing[0]}", file=sys.stderr)
+            return 1
+        sessions = _session_files(args.sessions)
+        if not args.no_autosave:
+            from app.utils.session_journal import default_autosave_dir
+
+            sessions += sorted(default_autosave_dir().glob("*/autosave-*.ggs"))
+        if not sessions:
+            print("No session found: nothing would be reachable", file=sys.stderr)
+            return 1
+        count, size = store.gc(sessions, args.dry_run)
+        print(f"{count} object(s), {size / 1e6:.1f} MB {'to remove' if args.dry_run else 'removed'}"
+              f" ({len(sessions)} session(s) read)")
+    else:
+        usage = store.stats()
+        print(f"{usage['objects']} object(s), {usage['stored'] / 1e6:.1f} MB stored; "
+              f"{usage['links']} link(s), {usage['saved'] / 1e6:.1f} MB saved")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
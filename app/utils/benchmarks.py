@@ -0,0 +1,363 @@
+"""Small benchmarks for the node graph, to keep performance work measurable.
+
+Usage:
+    python -m app.utils.benchmarks nodes --count 1000
+    python -m app.utils.benchmarks frames --counts 1000 5000 10000
+    python -m app.utils.benchmarks session --count 5000
+    python -m app.utils.benchmarks load --counts 1000 2000 5000 10000
+
+Every benchmark runs with an offscreen Qt platform when no display is available,
+and prints one line per measurement.
+"""
+import argparse
+import gc
+import inspect
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+_APP = None
+
+
+def _make_app():
+    """Creates (or reuses) the QApplication needed by NodeGraphQt.
+
+    Returns:
+        QtWidgets.QApplication: The application instance.
+    """
+    if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from Qt import QtWidgets # type: ignore
+
+    global _APP
+    _APP = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    return _APP
+
+
+def _node_classes():
+    """Retrieves the node classes declared in `app.nodes.node_types`.
+
+    Returns:
+        list: The node classes.
+    """
+    from app.nodes import node_types
+    from app.assets.my_prop_bin import MyBaseNode
+
+    return [
+        obj for _, obj in inspect.getmembers(node_types, inspect.isclass)
+        if issubclass(obj, MyBaseNode) and obj.__module__ == node_types.__name__
+    ]
+
+
+def _make_graph():
+    """Creates a NodeGraph with every hand-written node type registered.
+
+    Returns:
+        NodeGraph: The graph.
+    """
+    from NodeGraphQt import NodeGraph # type: ignore
+
+    graph = NodeGraph()
+    for node_cls in _node_classes():
+        graph.register_node(node_cls)
+        node_cls.register_accepts(graph)
+    return graph
+
+
+def bench_node_creation(count=1000, expanded=False):
+    """Measures the time and memory needed to create `count` nodes.
+
+    Args:
+        count (int, optional): Number of nodes to create. Defaults to 1000.
+        expanded (bool, optional): Build the widgets embedded in each node as well,
+            which is what every node used to do at creation. Defaults to False.
+
+    Returns:
+        dict: The number of nodes, the elapsed seconds and the allocated bytes per node.
+    """
+    _make_app()
+    graph = _make_graph()
+    types = [f"{cls.__identifier__}.{cls.__name__}" for cls in _node_classes()]
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(count):
+        node = graph.create_node(types[i % len(types)], pos=[(i % 100) * 250, (i // 100) * 200], push_undo=False)
+        if expanded:
+            node.expand_widgets()
+    elapsed = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"nodes": count, "seconds": elapsed, "bytes_per_node": allocated / max(count, 1)}
+
+
+def bench_frame_time(count=1000, repeats=5):
+    """Measures the canvas repaint time of a chain of `count` synthetic nodes.
+
+    The frame time is measured zoomed out on the whole graph, with and without the
+    level-of-detail rendering, and at 1:1 zoom on the first nodes.
+
+    Args:
+        count (int, optional): Number of nodes. Defaults to 1000.
+        repeats (int, optional): Number of repaints per measurement (the median is kept). Defaults to 5.
+
+    Returns:
+        dict: The median frame time in milliseconds, by mode.
+    """
+    from Qt import QtCore # type: ignore
+    from app.gui.graph_lod import GraphLodController
+    from app.utils.session_format import BulkLoad
+
+    app = _make_app()
+    graph = _make_graph()
+    lod = GraphLodController(graph)
+
+    # Built in bulk: NodeGraphQt names each new node by scanning all the others
+    with BulkLoad(graph):
+        previous = None
+        for i in range(count):
+            node = graph.create_node(
+                "editconf.Editconf", pos=[(i % 100) * 250, (i // 100) * 200], selected=False, push_undo=False
+            )
+            if previous is not None:
+                previous.get_output("out_gro").connect_to(node.get_input("in_gro"), push_undo=False, emit_signal=False)
+            previous = node
+
+    viewer = graph.viewer()
+    viewer.resize(1600, 900)
+    viewer.show()
+    app.processEvents()
+
+    def frame_ms():
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            viewer.viewport().repaint()
+            times.append((time.perf_counter() - start) * 1e3)
+        return statistics.median(times)
+
+    results = {}
+    viewer.fitInView(viewer.scene().itemsBoundingRect(), QtCore.Qt.KeepAspectRatio)
+
+    lod.set_enabled(False)
+    results["zoomed out, full detail"] = frame_ms()
+    lod.set_enabled(True)
+    results["zoomed out, LOD"] = frame_ms()
+
+    viewer.resetTransform()
+    viewer.centerOn(0, 0)
+    lod.update_lod(force=True)
+    results["1:1 zoom"] = frame_ms()
+
+    viewer.close()
+    graph.close()
+    return results
+
+
+def _make_chain(graph, count):
+    """Creates a connected pdb2gmx -> editconf chain of `count` nodes, with some optional props set."""
+    previous = None
+    for i in range(count):
+        node_type = "pdb2gmx.Pdb2gmx" if i == 0 else "editconf.Editconf"
+        node = graph.create_node(node_type, pos=[(i % 100) * 250, (i // 100) * 200], push_undo=False)
+        if i % 10 == 0 and node_type == "editconf.Editconf":
+            node._add_prop(name="-scale", label="Scale box (-scale)")
+            node.set_property("-scale", "1 1 2", push_undo=False)
+        if previous is not None:
+            previous.get_output("out_gro").connect_to(node.get_input("in_gro"), push_undo=False, emit_signal=False)
+        previous = node
+
+
+def _legacy_json_save(graph, path):
+    """Saves a session the way the former `ControlPanel._save_ui` did (optional props in 'add_custom')."""
+    from app.nodes.node_spec import NodeSpec
+
+    graph_data = graph.serialize_session()
+    added_by_name = {}
+    for node in graph.all_nodes():
+        optional_flags = NodeSpec.of(node).optional_flags
+        moved = {k: v for k, v in node.properties()["custom"].items() if k in optional_flags}
+        if moved:
+            added_by_name[node.name()] = moved
+    for node_dict in graph_data["nodes"].values():
+        node_dict.pop("accept_connection_types", None)
+        node_dict.pop("reject_connection_types", None)
+        moved = added_by_name.get(node_dict["name"])
+        if moved:
+            node_dict["add_custom"] = moved
+            for k in moved:
+                node_dict["custom"].pop(k, None)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"graph": graph_data, "ui": {}}, indent=2))
+
+
+def _legacy_json_load(graph, path):
+    """Loads a session the way the former `ControlPanel._load_ui` did."""
+    from app.nodes.node_spec import NodeSpec
+
+    with open(path, encoding="utf-8") as f:
+        graph_data = json.load(f)["graph"]
+    graph.deserialize_session(graph_data)
+    for node_dict in graph_data["nodes"].values():
+        for flag, value in node_dict.get("add_custom", {}).items():
+            node = graph.get_node_by_name(node_dict["name"])
+            label, default_val = NodeSpec.of(node).prop(flag)
+            node._add_prop(name=flag, label=label, default=default_val)
+            node.set_property(flag, value, push_undo=False)
+
+
+def bench_session(count=5000):
+    """Measures saving and loading a session of `count` nodes, in JSON and in the compact format.
+
+    The JSON figures reproduce the former `ControlPanel._save_ui` / `_load_ui`: one
+    `serialize_session` dumped with `indent=2`, then parsed and deserialized at once.
+
+    Args:
+        count (int, optional): Number of nodes. Defaults to 5000.
+
+    Returns:
+        dict: The elapsed seconds (or file size in KiB) by step.
+    """
+    from app.utils.session_format import iter_session, load_session, write_session
+
+    _make_app()
+    graph = _make_graph()
+    _make_chain(graph, count)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "session.json")
+        compact_path = os.path.join(tmp, "session.ggs")
+
+        start = time.perf_counter()
+        _legacy_json_save(graph, json_path)
+        results["json save (s)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        write_session(graph, compact_path, {})
+        results["compact save (s)"] = time.perf_counter() - start
+
+        results["json size (KiB)"] = os.path.getsize(json_path) / 1024
+        results["compact size (KiB)"] = os.path.getsize(compact_path) / 1024
+
+        start = time.perf_counter()
+        for _ in iter_session(compact_path):
+            pass
+        results["compact decode (s)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _legacy_json_load(graph, json_path)
+        results["json load (s)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_session(graph, compact_path)
+        results["compact load (s)"] = time.perf_counter() - start
+
+    graph.close()
+    return results
+
+
+def _write_synthetic_session(path, count):
+    """Writes a compact session holding a pdb2gmx -> editconf chain of `count` nodes.
+
+    The session is written record by record from two serialized template nodes, so
+    large sessions are produced without building them in a graph first.
+    """
+    from app.utils.session_format import SessionWriter, serialize_node
+
+    graph = _make_graph()
+    templates = []
+    for node_type in ("pdb2gmx.Pdb2gmx", "editconf.Editconf"):
+        _, node_dict, _ = serialize_node(graph.create_node(node_type, push_undo=False))
+        for k in ("inputs", "outputs"):
+            node_dict.pop(k, None)
+        templates.append(node_dict)
+    graph.close()
+
+    with SessionWriter(path) as writer:
+        for i in range(count):
+            node_dict = dict(templates[min(i, 1)])
+            node_dict["name"] = f"{node_dict['name']} {i}"
+            node_dict["pos"] = [(i % 100) * 250.0, (i // 100) * 200.0]
+            add_custom = {"-scale": "1 1 2"} if i % 10 == 5 else {}
+            writer.write_node(node_dict, add_custom)
+            if i:
+                writer.write_connection(i - 1, "out_gro", i, "in_gro")
+
+
+def bench_session_load(counts=(1000, 2000, 5000)):
+    """Measures the time needed to load sessions of increasing size into an empty graph.
+
+    Args:
+        counts (iterable, optional): The session sizes, in nodes.
+
+    Returns:
+        dict: The elapsed seconds, by session size.
+    """
+    from app.utils.session_format import load_session
+
+    _make_app()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            path = os.path.join(tmp, f"session-{count}.ggs")
+            _write_synthetic_session(path, count)
+            graph = _make_graph()
+            gc.collect()
+            start = time.perf_counter()
+            nodes, _ = load_session(graph, path)
+            results[count] = time.perf_counter() - start
+            assert len(nodes) == count
+            graph.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GroGUI benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    nodes = sub.add_parser("nodes", help="Node creation time and memory")
+    nodes.add_argument("--count", type=int, default=1000)
+
+    frames = sub.add_parser("frames", help="Canvas frame time on large synthetic graphs")
+    frames.add_argument("--counts", type=int, nargs="+", default=[1000, 5000, 10000])
+
+    session = sub.add_parser("session", help="Session save and load time, JSON vs compact format")
+    session.add_argument("--count", type=int, default=5000)
+
+    load = sub.add_parser("load", help="Session load time by session size")
+    load.add_argument("--counts", type=int, nargs="+", default=[1000, 2000, 5000])
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+
+    if args.bench == "nodes":
+        for expanded in (False, True):
+            res = bench_node_creation(args.count, expanded=expanded)
+            mode = "expanded" if expanded else "lazy"
+            print(f"{mode:>8}: {res['nodes']} nodes in {res['seconds']:.3f}s "
+                  f"({res['seconds'] / res['nodes'] * 1e3:.3f} ms/node, "
+                  f"{res['bytes_per_node'] / 1024:.1f} KiB/node)")
+
+    elif args.bench == "frames":
+        for count in args.counts:
+            for mode, ms in bench_frame_time(count).items():
+                print(f"{count:>6} nodes, {mode:<24}: {ms:8.2f} ms/frame")
+
+    elif args.bench == "session":
+        for step, value in bench_session(args.count).items():
+            print(f"{args.count:>6} nodes, {step:<20}: {value:10.3f}")
+
+    elif args.bench == "load":
+        for count, seconds in bench_session_load(args.counts).items():
+            print(f"{count:>6} nodes: {seconds:7.3f} s ({seconds / count * 1e3:.3f} ms/node)")
+
+
+if __name__ == "__main__":
+    main()
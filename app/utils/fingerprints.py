@@ -0,0 +1,286 @@
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import logging
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+
+
+"""
+Persistent fingerprint index of the files of a working directory.
+
+Telling whether a multi-GB trajectory changed by hashing it on every check is too slow.
+The index keeps, for each file, a quick hash read from a few MB at most: its size, the
+first and last `EDGE` bytes and `SAMPLES` blocks of `BLOCK` bytes evenly spread between
+them (the whole file below `SMALL_FILE`). The full SHA-256 of the content is only computed
+on demand (`full_hashes`, on a thread pool), and kept.
+
+A fingerprint stays valid while the file keeps its size, modification time (ns) and inode:
+only the files where one of them changed are read again, so checking an unchanged working
+directory costs one `stat` per file and one query. A file rewritten with the same size
+keeps its quick hash only if the sampled blocks did not change: compare full hashes when
+any change must be caught.
+
+The index is an SQLite file, `.grogui/fingerprints.sqlite` in the working directory by
+default, shared by the processes using that directory (the exported Python driver keeps
+its own index there, with the same layout and hashes).
+
+Usage:
+    python -m app.utils.fingerprints WORKDIR [--full] [-j N]
+
+Classes:
+    FingerprintIndex:
+        The fingerprints of the files of a directory, in an SQLite file.
+
+Functions:
+    index_path(root): Returns the default index file of a directory.
+    quick_hash(path, size): Returns the quick hash of a file.
+    full_hash(path): Returns the SHA-256 of the content of a file.
+    main(argv=None): Command line (`python -m app.utils.fingerprints`).
+"""
+
+
+SCHEMA_VERSION = 1
+# Files up to this size are hashed whole
+SMALL_FILE = 4 << 20
+# Bytes hashed at each end of a larger file
+EDGE = 1 << 20
+# Blocks hashed between the ends, and their size
+SAMPLES = 16
+BLOCK = 64 << 10
+# The directory of the state files, skipped by the scans
+STATE_DIR = ".grogui"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    quick TEXT NOT NULL,
+    full TEXT,
+    checked REAL NOT NULL
+)
+"""
+
+
+def index_path(root):
+    """Returns the default index file of a directory."""
+    return pathlib.Path(root) / STATE_DIR / "fingerprints.sqlite"
+
+
+def quick_hash(path, size):
+    """Returns the quick hash of a file (see the module docstring).
+
+    Args:
+        path (str): The file.
+        size (int): Its size.
+
+    Returns:
+        str: The BLAKE2b hash (32 hex digits).
+    """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= SMALL_FILE:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+            return digest.hexdigest()
+        digest.update(f.read(EDGE))
+        step = (size - 2 * EDGE - BLOCK) // (SAMPLES - 1)
+        for i in range(SAMPLES):
+            f.seek(EDGE + i * step)
+            digest.update(f.read(BLOCK))
+        f.seek(size - EDGE)
+        digest.update(f.read(EDGE))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    """Returns the SHA-256 of the content of a file (64 hex digits)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+    """FingerprintIndex holds the fingerprints of the files of a directory in an SQLite file.
+
+    Paths are relative to the directory (absolute paths are kept as is). Each method uses
+    its own connection, so an index can be shared between threads.
+
+    Attributes:
+        root (pathlib.Path): The directory.
+        path (pathlib.Path): The index file.
+
+    Methods:
+        lookup(paths): Returns the fingerprints of files, refreshing the changed ones.
+        scan(): Returns the fingerprints of every file of the directory, forgetting the removed ones.
+        full_hashes(paths, workers=None): Returns the full hashes of files, computing the missing ones.
+        forget(paths): Drops files from the index.
+    """
+    def __init__(self, root, path=None):
+        self.root = pathlib.Path(root)
+        self.path = pathlib.Path(path) if path else index_path(self.root)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"Index {self.path} was created by a newer version (schema {version})")
+            if version == 0:
+                db.execute(_SCHEMA)
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=60.0, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def _rows(self, paths=None):
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT path, size, mtime_ns, inode, quick, full FROM files").fetchall()
+        finally:
+            db.close()
+        wanted = None if paths is None else set(paths)
+        return {r[0]: r[1:] for r in rows if wanted is None or r[0] in wanted}
+
+    def lookup(self, paths):
+        """Returns the fingerprints of files, reading again only those that changed.
+
+        Args:
+            paths (list): The files, relative to the directory; missing ones are left out.
+
+        Returns:
+            dict: By path, `size`, `mtime_ns`, `inode`, `quick` and `full` (None if not computed).
+        """
+        known = self._rows(paths)
+        result, changed = {}, []
+        for rel in dict.fromkeys(paths):
+            try:
+                st = os.stat(self.root / rel)
+            except OSError:
+                continue
+            row = known.get(rel)
+            if row is not None and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                result[rel] = {"size": row[0], "mtime_ns": row[1], "inode": row[2], "quick": row[3], "full": row[4]}
+                continue
+            try:
+                quick = quick_hash(self.root / rel, st.st_size)
+            except OSError as e:
+                logging.warning("Cannot fingerprint %s: %s", rel, e)
+                continue
+            result[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino, "quick": quick, "full": None}
+            changed.append(rel)
+        if changed:
+            now = time.time()
+            with self._transaction() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, quick, full, checked)"
+                    " VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                    [(rel, result[rel]["size"], result[rel]["mtime_ns"], result[rel]["inode"], result[rel]["quick"], now)
+                     for rel in changed],
+                )
+        return result
+
+    def scan(self):
+        """Returns the fingerprints of every file of the directory (`lookup`), forgetting the removed ones.
+
+        The state directory (`STATE_DIR`) is skipped.
+
+        Returns:
+            dict: The fingerprints, by relative path.
+        """
+        paths = []
+        for folder, dirs, names in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d != STATE_DIR]
+            rel_folder = os.path.relpath(folder, self.root)
+            paths += [name if rel_folder == "." else os.path.join(rel_folder, name) for name in names]
+        result = self.lookup(paths)
+        gone = [p for p in self._rows() if not os.path.isabs(p) and p not in result]
+        self.forget(gone)
+        return result
+
+    def full_hashes(self, paths, workers=None):
+        """Returns the full hashes of files, computing the missing ones on a thread pool.
+
+        Args:
+            paths (list): The files, relative to the directory; missing ones are left out.
+            workers (int, optional): The hashing threads. Defaults to the cores, 8 at most.
+
+        Returns:
+            dict: The SHA-256 of each file, by path.
+        """
+        prints = self.lookup(paths)
+        missing = [p for p, fp in prints.items() if fp["full"] is None]
+        hashes = {p: fp["full"] for p, fp in prints.items() if fp["full"] is not None}
+        if not missing:
+            return hashes
+        workers = workers or min(8, os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(full_hash, self.root / p): p for p in missing}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    hashes[futures[future]] = future.result()
+                except OSError as e:
+                    logging.warning("Cannot hash %s: %s", futures[future], e)
+        with self._transaction() as db:
+            # Only where the file is still the one hashed
+            db.executemany(
+                "UPDATE files SET full = ? WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                [(hashes[p], p, prints[p]["size"], prints[p]["mtime_ns"], prints[p]["inode"])
+                 for p in missing if p in hashes],
+            )
+        return hashes
+
+    def forget(self, paths):
+        """Drops files from the index.
+
+        Args:
+            paths (list): The files.
+        """
+        if not paths:
+            return
+        with self._transaction() as db:
+            db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+
+def main(argv=None):
+    """Command line: refreshes the index of a directory and prints what it took."""
+    parser = argparse.ArgumentParser(description="Refresh the file fingerprint index of a working directory")
+    parser.add_argument("workdir")
+    parser.add_argument("--full", action="store_true", help="also compute the full SHA-256 of every file")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="hashing threads (--full)")
+    args = parser.parse_args(argv)
+
+    index = FingerprintIndex(args.workdir)
+    start = time.perf_counter()
+    prints = index.scan()
+    print(f"{len(prints)} file(s), {sum(fp['size'] for fp in prints.values()) / 1e9:.2f} GB "
+          f"checked in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.full:
+        start = time.perf_counter()
+        index.full_hashes(list(prints), args.jobs)
+        print(f"Full hashes in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import os
+import pathlib
+import re
+import shutil
+
+
+"""
+MDP files: parsing and editing, a lint pass for throughput killers, and an estimate of the
+output volume of the run.
+
+Keys are compared the way grompp does: case-insensitive, with `-` and `_` equivalent
+(`nstxout-compressed` is `nstxout_compressed`). Editing keeps the comments, the order of
+the lines and the lines left unchanged as they were.
+
+Output volume (per run, single precision):
+    trr   12 bytes per atom for each of x (nstxout), v (nstvout), f (nstfout) frame
+    xtc   about 4 bytes per atom and frame (nstxout-compressed, whole system)
+    edr   about 1 kB per frame (nstenergy)
+    log   about 1.5 kB per frame (nstlog)
+    cpt   x and v of the last step, twice (the current and the previous checkpoint)
+
+Classes:
+    MdpFile:
+        The lines of an mdp file, editable.
+
+Functions:
+    normalize_key(key): Returns the canonical form of an mdp key.
+    lint(mdp): Returns the settings that cost throughput.
+    estimate_output(mdp, natoms, nsteps=None): Returns the bytes written by a run, by file type.
+    replicas_output(sizes, replicas): Returns the output of the replicas of a multi-simulation.
+    count_atoms(path): Returns the number of atoms of a structure file.
+    run_inputs(step, steps, workdir): Returns the mdp, atom count and steps of an mdrun step.
+    estimate_steps_output(steps, workdir): Estimates the output of the mdrun steps of a workflow.
+    check_free_space(steps, workdir): Compares the estimated output with the free space.
+    format_size(size): Returns a size in human-readable units.
+"""
+
+
+# GROMACS defaults of the keys read here
+DEFAULTS = {
+    "integrator": "md",
+    "nsteps": "0",
+    "dt": "0.001",
+    "nstxout": "0",
+    "nstvout": "0",
+    "nstfout": "0",
+    "nstlog": "1000",
+    "nstcalcenergy": "100",
+    "nstenergy": "1000",
+    "nstxout-compressed": "0",
+    "nstlist": "10",
+    "nstcomm": "100",
+    "comm-mode": "linear",
+    "cutoff-scheme": "verlet",
+    "coulombtype": "cut-off",
+    "verlet-buffer-tolerance": "0.005",
+    "tcoupl": "no",
+    "pcoupl": "no",
+    "nsttcouple": "-1",
+    "nstpcouple": "-1",
+    "constraints": "none",
+    "constraint-algorithm": "lincs",
+    "energygrps": "",
+}
+DYNAMICS = {"md", "md-vv", "md-vv-avek", "sd", "bd"}
+
+_LINE_RE = re.compile(r"^\s*([^=;\s][^=;]*?)\s*=\s*([^;]*?)\s*(;.*)?$")
+_TRR_BYTES = 12
+_XTC_BYTES = 4
+_EDR_FRAME = 1000
+_LOG_FRAME = 1500
+_FRAME_HEADER = 100
+_STRUCTURES = (".gro", ".pdb", ".ent", ".brk")
+
+
+def normalize_key(key):
+    """Returns the canonical form of an mdp key: lower case, `-` for `_`."""
+    return key.strip().lower().replace("_", "-")
+
+
+class MdpFile:
+    """MdpFile holds the lines of an mdp file and edits its values in place.
+
+    Attributes:
+        lines (list): One entry per line: `[key, value, comment, raw]` for the settings (`raw` is
+            the line as read, None once edited), `[None, None, text, text]` for the comments
+            and blank lines.
+
+    Methods:
+        parse(text): Builds an MdpFile from the text of a file (class method).
+        read(path): Reads an mdp file (class method).
+        get(key, default=None): Returns the value of a key, or the GROMACS default.
+        get_int(key): Returns the integer value of a key (GROMACS default when unset or invalid).
+        set(key, value): Sets a key, added at the end if missing.
+        remove(key): Removes a key.
+        items(): Returns the (key, value) of the settings, in file order.
+        text(): Returns the file text.
+        write(path): Writes the file.
+    """
+    def __init__(self, lines=None):
+        self.lines = lines or []
+
+    @classmethod
+    def parse(cls, text):
+        lines = []
+        for raw in text.splitlines():
+            m = _LINE_RE.match(raw)
+            if m:
+                lines.append([m.group(1), m.group(2), m.group(3) or "", raw])
+            else:
+                lines.append([None, None, raw, raw])
+        return cls(lines)
+
+    @classmethod
+    def read(cls, path):
+        return cls.parse(pathlib.Path(path).read_text(encoding="utf-8", errors="replace"))
+
+    def _find(self, key):
+        key = normalize_key(key)
+        return next((line for line in self.lines if line[0] is not None and normalize_key(line[0]) == key), None)
+
+    def get(self, key, default=None):
+        line = self._find(key)
+        if line is not None:
+            return line[1]
+        return DEFAULTS.get(normalize_key(key)) if default is None else default
+
+    def get_int(self, key):
+        try:
+            return int(float(self.get(key)))
+        except (TypeError, ValueError):
+            return int(DEFAULTS.get(normalize_key(key), 0))
+
+    def set(self, key, value):
+        line = self._find(key)
+        if line is None:
+            self.lines.append([key, str(value), "", None])
+        elif line[1] != str(value):
+            line[1] = str(value)
+            line[3] = None
+
+    def remove(self, key):
+        line = self._find(key)
+        if line is not None:
+            self.lines.remove(line)
+
+    def items(self):
+        return [(line[0], line[1]) for line in self.lines if line[0] is not None]
+
+    def text(self):
+        out = []
+        for key, value, comment, raw in self.lines:
+            if raw is not None:
+                out.append(raw)
+            else:
+                out.append(f"{key:<24} = {value}" + (f" {comment}" if comment else ""))
+        return "\n".join(out) + "\n"
+
+    def write(self, path):
+        pathlib.Path(path).write_text(self.text(), encoding="utf-8")
+
+
+def lint(mdp):
+    """Returns the settings of an mdp that cost throughput.
+
+    Args:
+        mdp (MdpFile): The mdp.
+
+    Returns:
+        list: `(key, message)` tuples.
+    """
+    issues = []
+    integrator = mdp.get("integrator").lower()
+    dynamics = integrator in DYNAMICS
+
+    def small(key, limit):
+        value = mdp.get_int(key)
+        return 0 < value < limit, value
+
+    if normalize_key(mdp.get("cutoff-scheme")) == "group":
+        issues.append(("cutoff-scheme", "The group scheme was removed in GROMACS 2020: use Verlet"))
+    if mdp.get("coulombtype").lower() == "ewald":
+        issues.append(("coulombtype", "Plain Ewald scales as N^2 and does not run on GPUs: use PME"))
+    if mdp.get("constraint-algorithm").lower() == "shake" and mdp.get("constraints").lower() != "none":
+        issues.append(("constraint-algorithm", "SHAKE rules out domain decomposition and GPU update: use LINCS"))
+    if len(mdp.get("energygrps").split()) > 1:
+        issues.append(("energygrps", "Energy groups are not supported on GPUs: the nonbonded work runs on the CPU"))
+
+    if not dynamics:
+        return issues
+
+    hit, value = small("nstcalcenergy", 10)
+    if hit:
+        issues.append(("nstcalcenergy", f"Energies computed every {value} step(s): a global reduction each time; "
+                                         "100 (the default) is enough for the averages"))
+    hit, value = small("nstenergy", 100)
+    if hit:
+        issues.append(("nstenergy", f"Energies written every {value} step(s), which also forces their computation"))
+    hit, value = small("nstlist", 10)
+    if hit:
+        if mdp.get("verlet-buffer-tolerance").strip().startswith("-"):
+            issues.append(("nstlist", f"Pair search every {value} step(s), kept as is with verlet-buffer-tolerance = -1"))
+        else:
+            issues.append(("nstlist", f"Pair search every {value} step(s): 10 or more lets mdrun tune the list"))
+    for key, what in (("nstxout", "coordinates"), ("nstvout", "velocities"), ("nstfout", "forces")):
+        hit, value = small(key, 5000)
+        if hit:
+            issues.append((key, f"Full-precision {what} written every {value} step(s): use nstxout-compressed "
+                                "for trajectories, checkpoints for restarts"))
+    hit, value = small("nstxout-compressed", 100)
+    if hit:
+        issues.append(("nstxout-compressed", f"Compressed frames every {value} step(s): frames this close are correlated"))
+    hit, value = small("nstlog", 100)
+    if hit:
+        issues.append(("nstlog", f"Log written every {value} step(s)"))
+    if mdp.get("comm-mode").lower() != "none":
+        hit, value = small("nstcomm", 10)
+        if hit:
+            issues.append(("nstcomm", f"Center of mass motion removed every {value} step(s): a global reduction each time"))
+    for key, coupling in (("nsttcouple", "tcoupl"), ("nstpcouple", "pcoupl")):
+        hit, value = small(key, 10)
+        if hit and mdp.get(coupling).lower() != "no":
+            issues.append((key, f"Coupling every {value} step(s): a global reduction each time; -1 lets grompp choose"))
+    return issues
+
+
+def _frames(nsteps, nst):
+    return nsteps // nst + 1 if nst > 0 and nsteps >= 0 else 0
+
+
+def estimate_output(mdp, natoms, nsteps=None):
+    """Returns the bytes written by a run, by file type (see the module docstring).
+
+    Args:
+        mdp (MdpFile): The mdp.
+        natoms (int): The number of atoms.
+        nsteps (int, optional): The `-nsteps` of mdrun: -1 for no end, -2 (or None) for the
+            mdp value.
+
+    Returns:
+        dict: The bytes of "trr", "xtc", "edr", "log", "cpt" and "total"; None when the run
+        has no end (nsteps = -1).
+    """
+    if nsteps is None or nsteps == -2:
+        nsteps = mdp.get_int("nsteps")
+    if nsteps < 0:
+        return None
+    trr = sum(_frames(nsteps, mdp.get_int(key)) * (natoms * _TRR_BYTES + _FRAME_HEADER)
+              for key in ("nstxout", "nstvout", "nstfout"))
+    sizes = {
+        "trr": trr,
+        "xtc": _frames(nsteps, mdp.get_int("nstxout-compressed")) * (natoms * _XTC_BYTES + _FRAME_HEADER),
+        "edr": _frames(nsteps, mdp.get_int("nstenergy")) * _EDR_FRAME,
+        "log": _frames(nsteps, mdp.get_int("nstlog")) * _LOG_FRAME,
+        "cpt": 2 * 2 * natoms * _TRR_BYTES if mdp.get("integrator").lower() in DYNAMICS else 0,
+    }
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def replicas_output(sizes, replicas):
+    """Returns the output of the replicas of a multi-simulation, from the output of one (`estimate_output`)."""
+    if sizes is None:
+        return None
+    return {kind: size * replicas for kind, size in sizes.items()}
+
+
+def count_atoms(path):
+    """Returns the number of atoms of a structure file (.gro or .pdb), or None."""
+    path = pathlib.Path(path)
+    try:
+        if path.suffix == ".gro":
+            with open(path, encoding="utf-8", errors="replace") as f:
+                f.readline()
+                return int(f.readline().split()[0])
+        if path.suffix in _STRUCTURES[1:]:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return sum(1 for line in f if line.startswith(("ATOM", "HETATM"))) or None
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+def _flag(args, flag):
+    return next((args[i + 1] for i, arg in enumerate(args[:-1]) if arg == flag), None)
+
+
+def _structure_atoms(path, producers, workdir, seen=()):
+    """Returns the atom count of a structure and the file it was read from.
+
+    A structure not written yet is looked up in the inputs of its producing step, and up the
+    workflow (a tpr leads to its grompp step): the count is then a lower bound (e.g. before
+    solvation).
+    """
+    if pathlib.Path(path).suffix in _STRUCTURES:
+        natoms = count_atoms(os.path.join(workdir, path))
+        if natoms is not None:
+            return natoms, path
+    producer = producers.get(path)
+    if producer is None or producer.name in seen:
+        return None, None
+    # Structures first: the closest to the missing one
+    for source in sorted(producer.inputs, key=lambda p: pathlib.Path(p).suffix not in _STRUCTURES):
+        if source != path:
+            natoms, found = _structure_atoms(source, producers, workdir, (*seen, producer.name))
+            if natoms is not None:
+                return natoms, found
+    return None, None
+
+
+def run_inputs(step, steps, workdir):
+    """Returns what the size of an mdrun step depends on.
+
+    The step is matched with the grompp step writing its tpr (that of its first replica
+    for a multi-simulation, the replicas being alike), for the mdp and the structure (atom
+    count); `-nsteps` of mdrun overrides the mdp.
+
+    Args:
+        step (Step): The mdrun step.
+        steps (list): The steps of the workflow.
+        workdir (str): The directory the steps run in.
+
+    Returns:
+        dict: `mdp` (MdpFile), `natoms` (of one replica), `nsteps` (None: the mdp value),
+        `replicas` (1 but for a multi-simulation), and `atoms_from`, the structure the atoms
+        were counted in (an upstream one when the grompp input is not written yet: the count
+        is then a lower bound, `lower_bound` is True).
+
+    Raises:
+        ValueError: If the mdp or the atom count cannot be found.
+    """
+    tpr = _flag(step.args, "-s")
+    replicas = step.replicas()
+    tprs = [f"{folder}/{tpr or 'topol.tpr'}" for folder in replicas] or [tpr]
+    source = next((s for path in tprs for s in steps if s.tool == "grompp" and _flag(s.args, "-o") == path), None)
+    if source is None:
+        raise ValueError("no grompp step writes its tpr")
+    mdp_path = os.path.join(workdir, _flag(source.args, "-f") or "grompp.mdp")
+    if not os.path.isfile(mdp_path):
+        raise ValueError(f"{mdp_path} does not exist")
+    producers = {}
+    for s in steps:
+        for path in s.outputs:
+            producers.setdefault(path, s)
+    structure = _flag(source.args, "-c") or "conf.gro"
+    natoms, found = _structure_atoms(structure, producers, workdir)
+    if natoms is None:
+        raise ValueError(f"no structure to count the atoms of {structure}")
+    nsteps = _flag(step.args, "-nsteps")
+    try:
+        nsteps = int(nsteps) if nsteps is not None else None
+    except ValueError:
+        nsteps = None
+    return {
+        "mdp": MdpFile.read(mdp_path),
+        "natoms": natoms,
+        "nsteps": nsteps,
+        "replicas": len(replicas) or 1,
+        "atoms_from": found,
+        "lower_bound": found != structure,
+    }
+
+
+def estimate_steps_output(steps, workdir):
+    """Estimates the output of the mdrun steps of a workflow (see `run_inputs`).
+
+    Args:
+        steps (list): The steps (`Step`).
+        workdir (str): The directory the steps run in.
+
+    Returns:
+        list: One `(step, sizes, note)` per mdrun step: `sizes` from `estimate_output`, or None
+        with the reason in `note`.
+    """
+    result = []
+    for step in steps:
+        if step.tool != "mdrun":
+            continue
+        try:
+            inputs = run_inputs(step, steps, workdir)
+        except ValueError as e:
+            result.append((step, None, str(e)))
+            continue
+        sizes = replicas_output(estimate_output(inputs["mdp"], inputs["natoms"], inputs["nsteps"]), inputs["replicas"])
+        if sizes is None:
+            note = "nsteps = -1: the run has no end"
+        elif inputs["lower_bound"]:
+            note = f"at least: atoms counted in {inputs['atoms_from']}"
+        else:
+            note = ""
+        result.append((step, sizes, note))
+    return result
+
+
+def check_free_space(steps, workdir):
+    """Compares the estimated output of the mdrun steps with the free space of the directory.
+
+    Args:
+        steps (list): The steps (`Step`).
+        workdir (str): The directory the steps run in.
+
+    Returns:
+        tuple: The estimated bytes, the free bytes, and the estimates (`estimate_steps_output`).
+    """
+    estimates = estimate_steps_output(steps, workdir)
+    total = sum(sizes["total"] for _, sizes, _ in estimates if sizes)
+    free = shutil.disk_usage(workdir).free
+    return total, free, estimates
+
+
+def format_size(size):
+    """Returns a size in bytes in human-readable units."""
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
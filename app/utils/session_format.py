@@ -0,0 +1,683 @@
+import json
+import logging
+import os
+import pathlib
+import struct
+import zlib
+
+from NodeGraphQt.base.commands import PortConnectedCmd # type: ignore
+from NodeGraphQt.qgraphics.node_base import NodeItem # type: ignore
+from Qt import QtWidgets # type: ignore
+
+from app.nodes.node_spec import MENU_PROP, NodeSpec
+
+
+"""
+Compact session format (.ggs).
+
+A session file is the `MAGIC` header, a format version byte, then a zlib stream of
+records. Each record is a one-byte tag, a little-endian uint32 payload length and a
+compact JSON payload:
+
+    K  [key]                                    interns a property key (index = order of K records)
+    S  [type_, [field keys], [custom key ids]]  interns a node schema (index = order of S records)
+    G  {graph settings}
+    U  {ui state}
+    T  {template}                               a subgraph template (see `app.nodes.templates`),
+                                                written before the nodes of the session
+    N  [schema id, [field values], [custom values], [[key id, value], ...]]
+                                                a node (index = order of N records); the last list
+                                                holds the optional props (`add_custom`)
+    C  [out node, out port, in node, in port]   a connection between two nodes (by node index)
+    E  [node count, connection count]           end of the session
+
+Node types and property keys are written once and referenced by index, so a node record
+only holds its values. Likewise, the templates used by the session are written once, and
+their instances only hold their overrides. Records are written as the graph is walked and can be read back one
+by one while the file is decompressed, so nodes can be created as they are decoded.
+
+Sessions saved in the former JSON format are read through `iter_session` as well: they are
+converted on the fly into the same events.
+
+Classes:
+    SessionWriter:
+        Writes a session incrementally, record by record.
+
+    BulkLoad:
+        Suspends signals, undo, name scans and repaints of a NodeGraph while loading.
+
+Functions:
+    is_compact_session(path): Tells whether a file is a compact session.
+    iter_session(path): Yields the events of a compact or JSON session.
+    write_session(node_graph, path, ui_data): Writes a NodeGraph and the UI state.
+    load_session(node_graph, path): Streams a session into a NodeGraph, in bulk.
+    serialize_node(node): Serializes one node, optional props apart.
+    restore_node(node_graph, node_dict, add_custom): Creates one node from its serialized dict.
+    restore_connection(out_node, out_port, in_node, in_port): Connects two restored nodes.
+"""
+
+
+MAGIC = b"GROGUI-SESSION"
+FORMAT_VERSION = 1
+SESSION_SUFFIX = ".ggs"
+
+# Node dict entries that are not node fields (written elsewhere, or rebuilt on load)
+_SKIPPED_FIELDS = {"custom", "inputs", "outputs", "accept_connection_types", "reject_connection_types"}
+
+RECORD_HEADER = struct.Struct("<cI")
+_READ_CHUNK = 1 << 16
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class SessionWriter:
+    """SessionWriter writes a compact session incrementally.
+
+    Records are compressed and written to a temporary file as they are added; the file
+    replaces `path` when the writer is closed without error.
+
+    Attributes:
+        path (pathlib.Path): The session file.
+        node_count (int): Number of nodes written so far.
+        connection_count (int): Number of connections written so far.
+        node_ids (list): The NodeGraphQt id of each written node (when given), by index.
+
+    Methods:
+        write_graph(settings): Writes the graph settings.
+        write_ui(ui_data): Writes the UI state.
+        write_template(template): Writes a subgraph template.
+        write_node(node_dict, add_custom=None, node_id=None): Writes a node and returns its index.
+        write_connection(out_index, out_port, in_index, in_port): Writes a connection.
+        close(): Ends the session and moves it into place.
+    """
+    def __init__(self, path, level=6):
+        self.path = pathlib.Path(path)
+        self.node_count = 0
+        self.connection_count = 0
+        self.node_ids = []
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC + bytes([FORMAT_VERSION]))
+        self._compressor = zlib.compressobj(level)
+        self._keys = {}
+        self._schemas = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _record(self, tag, payload):
+        data = _dumps(payload)
+        chunk = self._compressor.compress(RECORD_HEADER.pack(tag, len(data)) + data)
+        if chunk:
+            self._file.write(chunk)
+
+    def _key(self, key):
+        index = self._keys.get(key)
+        if index is None:
+            index = self._keys[key] = len(self._keys)
+            self._record(b"K", [key])
+        return index
+
+    def write_graph(self, settings):
+        self._record(b"G", settings)
+
+    def write_ui(self, ui_data):
+        self._record(b"U", ui_data)
+
+    def write_template(self, template):
+        self._record(b"T", template)
+
+    def write_node(self, node_dict, add_custom=None, node_id=None):
+        """Writes one node (as returned by `serialize_node`).
+
+        Args:
+            node_dict (dict): The serialized node.
+            add_custom (dict, optional): The optional props of the node, by flag.
+            node_id (str, optional): The id of the node in the graph, kept in `node_ids`.
+
+        Returns:
+            int: The index of the node, used by `write_connection`.
+        """
+        fields = tuple(k for k in node_dict if k not in _SKIPPED_FIELDS)
+        custom = node_dict.get("custom") or {}
+        custom_keys = tuple(k for k in custom if k != MENU_PROP)
+
+        schema_key = (node_dict.get("type_"), fields, custom_keys)
+        schema = self._schemas.get(schema_key)
+        if schema is None:
+            key_ids = [self._key(k) for k in custom_keys]
+            schema = self._schemas[schema_key] = len(self._schemas)
+            self._record(b"S", [schema_key[0], list(fields), key_ids])
+
+        optional = [[self._key(k), v] for k, v in (add_custom or {}).items()]
+        self._record(b"N", [
+            schema,
+            [node_dict[k] for k in fields],
+            [custom[k] for k in custom_keys],
+            optional,
+        ])
+        self.node_ids.append(node_id)
+        self.node_count += 1
+        return self.node_count - 1
+
+    def write_connection(self, out_index, out_port, in_index, in_port):
+        self._record(b"C", [out_index, out_port, in_index, in_port])
+        self.connection_count += 1
+
+    def close(self):
+        """Writes the end record, flushes the stream and moves the file into place."""
+        if self._file is None:
+            return
+        self._record(b"E", [self.node_count, self.connection_count])
+        self._file.write(self._compressor.flush())
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Drops the temporary file, leaving any previous session untouched."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def is_compact_session(path):
+    """Tells whether a file is a compact session (rather than a JSON one).
+
+    Args:
+        path (str | pathlib.Path): The session file.
+
+    Returns:
+        bool: True if the file starts with the compact session header.
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _iter_records(path):
+    """Yields the (tag, payload) records of a compact session, decompressing it chunk by chunk."""
+    with open(path, "rb") as f:
+        header = f.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compact session")
+        version = header[len(MAGIC)]
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} uses session format {version}, newer than this version ({FORMAT_VERSION})")
+
+        decompressor = zlib.decompressobj()
+        buffer = b""
+        while True:
+            chunk = f.read(_READ_CHUNK)
+            buffer += decompressor.decompress(chunk) if chunk else decompressor.flush()
+            offset = 0
+            while len(buffer) - offset >= RECORD_HEADER.size:
+                tag, size = RECORD_HEADER.unpack_from(buffer, offset)
+                end = offset + RECORD_HEADER.size + size
+                if end > len(buffer):
+                    break
+                yield tag, json.loads(buffer[offset + RECORD_HEADER.size:end])
+                offset = end
+            buffer = buffer[offset:]
+            if not chunk:
+                break
+        if buffer:
+            raise ValueError(f"{path} is truncated")
+
+
+def _iter_compact(path):
+    keys = []
+    schemas = []
+    ended = False
+    for tag, payload in _iter_records(path):
+        if tag == b"K":
+            keys.append(payload[0])
+        elif tag == b"S":
+            node_type, fields, key_ids = payload
+            schemas.append((node_type, fields, [keys[i] for i in key_ids]))
+            yield "type", node_type
+        elif tag == b"N":
+            schema, values, custom_values, optional = payload
+            node_type, fields, custom_keys = schemas[schema]
+            node_dict = dict(zip(fields, values))
+            node_dict["type_"] = node_type
+            node_dict["custom"] = dict(zip(custom_keys, custom_values))
+            yield "node", (node_dict, {keys[i]: v for i, v in optional})
+        elif tag == b"C":
+            yield "connection", tuple(payload)
+        elif tag == b"G":
+            yield "graph", payload
+        elif tag == b"U":
+            yield "ui", payload
+        elif tag == b"T":
+            yield "template", payload
+        elif tag == b"E":
+            ended = True
+        else:
+            logging.warning("Unknown session record %r skipped", tag)
+    if not ended:
+        raise ValueError(f"{path} is truncated")
+
+
+def _iter_json(path):
+    """Converts a session saved in the former JSON format into `iter_session` events."""
+    data = json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+    graph_data = data.get("graph", {})
+
+    settings = {
+        k: v for k, v in graph_data.get("graph", {}).items()
+        if k not in ("accept_connection_types", "reject_connection_types")
+    }
+    yield "graph", settings
+
+    index_by_id = {}
+    seen_types = set()
+    for node_id, node_dict in graph_data.get("nodes", {}).items():
+        node_type = node_dict.get("type_")
+        if node_type not in seen_types:
+            seen_types.add(node_type)
+            yield "type", node_type
+        node_dict = {k: v for k, v in node_dict.items() if k not in _SKIPPED_FIELDS - {"custom"}}
+        node_dict.get("custom", {}).pop(MENU_PROP, None)
+        index_by_id[node_id] = len(index_by_id)
+        yield "node", (node_dict, node_dict.pop("add_custom", None) or {})
+
+    for conn in graph_data.get("connections", []):
+        out_id, out_port = conn.get("out", ("", ""))
+        in_id, in_port = conn.get("in", ("", ""))
+        if out_id in index_by_id and in_id in index_by_id:
+            yield "connection", (index_by_id[out_id], out_port, index_by_id[in_id], in_port)
+
+    yield "ui", data.get("ui", {})
+
+
+def iter_session(path):
+    """Yields the content of a session file as a stream of events.
+
+    Events are `("graph", settings)`, `("ui", ui_data)`, `("template", template_dict)` (before
+    the nodes), `("type", node_type)` (before the first node of that type),
+    `("node", (node_dict, add_custom))` and
+    `("connection", (out_index, out_port, in_index, in_port))`, where the indexes are the
+    order of the nodes in the stream. JSON sessions are migrated on the fly.
+
+    Args:
+        path (str | pathlib.Path): The session file.
+
+    Yields:
+        tuple: The (kind, payload) events.
+    """
+    if is_compact_session(path):
+        yield from _iter_compact(path)
+    else:
+        yield from _iter_json(path)
+
+
+def write_session(node_graph, path, ui_data=None):
+    """Writes a NodeGraph (and the UI state) as a compact session.
+
+    Each node is serialized once; optional props are stored apart (`add_custom`), since
+    NodeGraphQt cannot deserialize properties the node class does not create itself. The
+    templates of the template instances are written once, before the nodes.
+    Connections are read from the output side only, so each one is written once.
+
+    Args:
+        node_graph (NodeGraph): The graph to save.
+        path (str | pathlib.Path): The session file.
+        ui_data (dict, optional): The UI state (see `UiStateManager.capture`).
+
+    Returns:
+        SessionWriter: The closed writer (node and connection counts).
+    """
+    with SessionWriter(path) as writer:
+        writer.write_graph({
+            "layout_direction": node_graph.layout_direction(),
+            "acyclic": node_graph.acyclic(),
+            "pipe_collision": node_graph.pipe_collision(),
+            "pipe_slicing": node_graph.pipe_slicing(),
+            "pipe_style": node_graph.pipe_style(),
+        })
+        if ui_data is not None:
+            writer.write_ui(ui_data)
+
+        nodes = node_graph.all_nodes()
+        templates = {}
+        for node in nodes:
+            template = getattr(node, "TEMPLATE", None)
+            if template is not None:
+                templates.setdefault(template.name, template)
+        for template in templates.values():
+            writer.write_template(template.to_dict())
+
+        index_by_id = {}
+        outputs_by_index = []
+        for node in nodes:
+            node_id, node_dict, add_custom = serialize_node(node)
+            index_by_id[node_id] = writer.write_node(node_dict, add_custom, node_id=node_id)
+            outputs_by_index.append(node_dict.get("outputs") or {})
+
+        for out_index, outputs in enumerate(outputs_by_index):
+            for out_port, connected in outputs.items():
+                for in_id, in_ports in connected.items():
+                    in_index = index_by_id.get(in_id)
+                    if in_index is None:
+                        continue
+                    for in_port in in_ports:
+                        writer.write_connection(out_index, out_port, in_index, in_port)
+    return writer
+
+
+class BulkLoad:
+    """BulkLoad suspends the per-node overhead of a NodeGraph while many nodes are added.
+
+    Inside the context, the graph emits no signal (so `property_changed`, `node_created` or
+    `port_connected` handlers do not run for each restored value), the undo stack is set
+    aside (commands pushed meanwhile are run but not recorded, the earlier history is kept),
+    unique names are checked against a set instead of scanning every node, and the canvas
+    is updated once, when the context exits.
+
+    `NodeGraph.add_node` is replaced by a bulk version: the node item gets the model values
+    without the redraw each view setter does (`NodeObject.update`), and is drawn once, when
+    added to the scene. The first node of each type still goes through `NodeGraph.add_node`,
+    which registers the properties common to the type, as do the nodes not drawn by a NodeItem.
+
+    Attributes:
+        node_graph (NodeGraph): The graph being loaded.
+    """
+    def __init__(self, node_graph):
+        self.node_graph = node_graph
+        self._names = set()
+        self._viewport = node_graph.viewer().viewport()
+        self._signals_blocked = False
+        self._undo_stack = None
+
+    def __enter__(self):
+        graph = self.node_graph
+        self._names = {n.name() for n in graph.all_nodes()}
+        # NodeGraph.add_node names every node through get_unique_name, which scans all nodes
+        graph.get_unique_name = self._unique_name
+        graph.add_node = self._add_node
+        self._signals_blocked = graph.blockSignals(True)
+        # NodeGraph pushes its commands to _undo_stack: a scratch stack keeps them out of the history
+        self._undo_stack, graph._undo_stack = graph._undo_stack, QtWidgets.QUndoStack(graph)
+        self._viewport.setUpdatesEnabled(False)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        graph = self.node_graph
+        del graph.get_unique_name
+        del graph.add_node
+        graph.blockSignals(self._signals_blocked)
+        scratch, graph._undo_stack = graph._undo_stack, self._undo_stack
+        scratch.deleteLater()
+        self._viewport.setUpdatesEnabled(True)
+        self._viewport.update()
+        return False
+
+    def _unique_name(self, name):
+        name = " ".join(name.split())
+        if name in self._names:
+            base, x = name, 1
+            while f"{base} {x}" in self._names:
+                x += 1
+            name = f"{base} {x}"
+        self._names.add(name)
+        return name
+
+    def _add_node(self, node, pos=None, selected=True, push_undo=True, inherite_graph_style=True):
+        graph = self.node_graph
+        model = node.model
+        temp = model.__dict__
+        if (graph.model.get_node_common_properties(node.type_) is None
+                or temp.get("_TEMP_accept_connection_types") or temp.get("_TEMP_reject_connection_types")
+                or not isinstance(node.view, NodeItem)):
+            type(graph).add_node(graph, node, pos, selected, push_undo, inherite_graph_style)
+            return
+        for key in ("_TEMP_property_widget_types", "_TEMP_property_attrs",
+                    "_TEMP_accept_connection_types", "_TEMP_reject_connection_types"):
+            temp.pop(key, None)
+
+        node._graph = graph
+        node.NODE_NAME = self._unique_name(node.NODE_NAME)
+        model._graph_model = graph.model
+        model.name = node.NODE_NAME
+        if inherite_graph_style:
+            model.layout_direction = graph.layout_direction()
+        _update_view(node)
+
+        # NodeAddedCmd.redo, without the command; the item is laid out and placed before it
+        # is added to the scene, where each move of the item costs much more
+        graph.model.nodes[node.id] = node
+        viewer = graph.viewer()
+        pos = pos or (viewer._previous_pos.x(), viewer._previous_pos.y())
+        node.view.pre_init(viewer, pos)
+        node.view.post_init(viewer, pos)
+        viewer.scene().addItem(node.view)
+        model.width = node.view.width
+        model.height = node.view.height
+
+
+def _update_view(node):
+    """Copies the model values to the node item, as NodeObject.update does, without redrawing it.
+
+    The view setters of NodeGraphQt redraw the item (twice for the layout direction) and
+    reload the icon; the item is drawn once anyway when added to the scene, which sets its
+    size, text color and tooltip from these values.
+    """
+    model, view = node.model, node.view
+    if model.icon is not None and model.icon != view.icon:
+        view.icon = model.icon
+    view._properties.update(
+        id=model.id, type_=model.type_, layout_direction=model.layout_direction,
+        color=model.color, border_color=model.border_color, text_color=model.text_color,
+        visible=model.visible, icon=model.icon,
+    )
+    view.name = model.name
+    if model.disabled:
+        view.disabled = True
+    if model.selected:
+        view.selected = True
+    if not model.visible:
+        view.setVisible(False)
+    for name, widget in view.widgets.items():
+        if name in model.custom_properties:
+            widget.set_value(model.custom_properties[name])
+
+
+def load_session(node_graph, path, on_type=None, on_template=None, on_progress=None, batch_size=200):
+    """Streams a session file (compact or JSON) into a NodeGraph.
+
+    The graph is cleared, then nodes are created in bulk (see `BulkLoad`) as they are
+    decoded, with their optional props restored right away. Every `batch_size` nodes
+    `on_progress` is called, which lets the caller process events while the rest of the
+    file is read; the canvas is updated once, at the end. Connections are made in one pass
+    once all the nodes are created. As with NodeGraphQt sessions, `session_changed` is
+    emitted once it is loaded.
+
+    Args:
+        node_graph (NodeGraph): The graph to load into.
+        path (str | pathlib.Path): The session file.
+        on_type (callable, optional): Called with each node type before its first node,
+            e.g. to register generated node classes.
+        on_template (callable, optional): Called with each template (dict) before the nodes,
+            to register the node class of its instances.
+        on_progress (callable, optional): Called with the number of nodes created so far.
+        batch_size (int, optional): Nodes created between two `on_progress` calls. Defaults to 200.
+
+    Returns:
+        tuple: The created nodes (list, in session order, None for the ones that failed)
+            and the UI state (dict).
+    """
+    node_graph.clear_session()
+    nodes = []
+    connections = []
+    ui_data = {}
+
+    with BulkLoad(node_graph):
+        for kind, payload in iter_session(path):
+            if kind == "node":
+                node_dict, add_custom = payload
+                nodes.append(restore_node(node_graph, node_dict, add_custom))
+                if on_progress is not None and len(nodes) % batch_size == 0:
+                    on_progress(len(nodes))
+
+            elif kind == "connection":
+                connections.append(payload)
+
+            elif kind == "type":
+                if on_type is not None:
+                    on_type(payload)
+
+            elif kind == "template":
+                if on_template is not None:
+                    on_template(payload)
+
+            elif kind == "graph":
+                # NodeGraphQt applies the graph settings the same way as for a JSON session
+                node_graph._deserialize({"graph": payload})
+
+            elif kind == "ui":
+                ui_data = payload
+
+        for out_index, out_port, in_index, in_port in connections:
+            try:
+                out_node, in_node = nodes[out_index], nodes[in_index]
+            except IndexError:
+                logging.warning("Connection to an unknown node skipped")
+                continue
+            restore_connection(out_node, out_port, in_node, in_port)
+
+    node_graph.session_changed.emit(str(path))
+    if on_progress is not None:
+        on_progress(len(nodes))
+    return nodes, ui_data
+
+
+def serialize_node(node):
+    """Serializes one node, with its optional props split from the other ones.
+
+    Args:
+        node (MyBaseNode): The node.
+
+    Returns:
+        tuple: The node id, the node dict (`NodeObject.serialize` without its id level,
+            connections included) and the optional props (`add_custom`), by flag.
+    """
+    node.update_model()
+    node_id, node_dict = next(iter(node.serialize().items()))
+
+    optional_flags = NodeSpec.of(node).optional_flags
+    # NodeGraphQt returns the live custom properties of the model: work on a copy
+    custom = node_dict["custom"] = dict(node_dict.get("custom") or {})
+    custom.pop(MENU_PROP, None)
+    add_custom = {k: custom.pop(k) for k in list(custom) if k in optional_flags}
+    return node_id, node_dict, add_custom
+
+
+def restore_node(node_graph, node_dict, add_custom):
+    """Creates one node from its serialized dict and restores its optional props.
+
+    Values are written to the node model directly, as NodeGraphQt does when deserializing:
+    no undo command is pushed and no property is propagated to connected nodes. The node
+    is added unselected.
+
+    Args:
+        node_graph (NodeGraph): The graph to add the node to.
+        node_dict (dict): The serialized node.
+        add_custom (dict): The optional props of the node, by flag.
+
+    Returns:
+        MyBaseNode: The node, or None if it could not be created.
+    """
+    node_type = node_dict.get("type_")
+    try:
+        node = node_graph._node_factory.create_node_instance(node_type)
+        if node is None:
+            logging.warning("Unknown node type '%s' in session", node_type)
+            return None
+
+        node.NODE_NAME = node_dict.get("name", node.NODE_NAME)
+        model = node.model
+        # NodeModel.set_property copies the model attributes on each call: set them directly
+        for prop in model.properties.keys():
+            # Nodes are restored unselected (no clear_selection walk over the whole graph)
+            if prop in node_dict and prop != "selected":
+                setattr(model, prop, node_dict[prop])
+        custom_props = model.custom_properties
+        for prop, value in (node_dict.get("custom") or {}).items():
+            if prop in custom_props:
+                custom_props[prop] = value
+            else:
+                model.set_property(prop, value)
+
+        node_graph.add_node(node, node_dict.get("pos"), selected=False, push_undo=False)
+
+        if node_dict.get("port_deletion_allowed"):
+            node.set_ports({
+                "input_ports": node_dict["input_ports"],
+                "output_ports": node_dict["output_ports"],
+            })
+    except Exception:
+        logging.exception("Failed to create node '%s'", node_dict.get("name"))
+        return None
+
+    if add_custom:
+        spec = NodeSpec.of(node)
+        for flag, value in add_custom.items():
+            try:
+                label, default_val = spec.prop(flag)
+                node._add_prop(name=flag, label=label, default=default_val)
+                node.model.set_property(flag, value)
+            except Exception:
+                logging.exception(f"Failed to restore property '{flag}' on node '{node.name()}'")
+    return node
+
+
+def restore_connection(out_node, out_port, in_node, in_port):
+    """Connects two restored nodes, as NodeGraphQt does when deserializing (no undo, no signal)."""
+    if out_node is None or in_node is None:
+        return
+
+    out_p = out_node.outputs().get(out_port)
+    in_p = in_node.inputs().get(in_port)
+    if out_p is None or in_p is None:
+        logging.warning(f"Connection {out_node.name()}.{out_port} -> {in_node.name()}.{in_port} skipped")
+        return
+
+    if in_p.model.connected_ports and not in_p.model.multi_connection:
+        logging.warning(f"Connection {out_node.name()}.{out_port} -> {in_node.name()}.{in_port} skipped: "
+                        "the input is already connected")
+        return
+
+    # The saved graph was already checked: skip the per-connection cycle walk of
+    # Port.connect_to, which makes loading long chains quadratic
+    PortConnectedCmd(in_p, out_p, emit_signal=False).redo()
+    in_node.on_input_connected(in_p, out_p)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect a GroGUI session file")
+    parser.add_argument("path", help="Session file (.ggs or former .json)")
+    args = parser.parse_args()
+
+    counts = {}
+    for kind, _ in iter_session(args.path):
+        counts[kind] = counts.get(kind, 0) + 1
+    fmt = "compact" if is_compact_session(args.path) else "json"
+    print(f"{args.path}: {fmt} session, {counts.get('node', 0)} nodes, "
+          f"{counts.get('connection', 0)} connections, {counts.get('type', 0)} node types, "
+          f"{counts.get('template', 0)} templates")
@@ -0,0 +1,368 @@
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import time
+
+from app.nodes.node_spec import NodeSpec
+from app.utils.session_format import (
+    RECORD_HEADER, load_session, restore_connection, restore_node, write_session,
+)
+
+
+"""
+Append-only change journal used by the autosave.
+
+An autosave generation is a full snapshot (`autosave-<gen>.ggs`, the compact session
+format) plus a journal (`autosave-<gen>.journal`) of the edits made since. Journal records
+use the session record framing, uncompressed, so they can be appended and flushed one by
+one:
+
+    B  [node ids]                        the ids of the snapshot nodes, in snapshot order
+    A  [id, node dict, add_custom]       node added
+    D  [ids]                             nodes deleted
+    P  [id, name, value]                 property changed
+    M  [id, x, y]                        node moved
+    C  [out id, out port, in id, in port] ports connected
+    X  [out id, out port, in id, in port] ports disconnected
+
+Ids are the NodeGraphQt node ids of the session that wrote the journal. A record cut short
+by a crash is ignored on replay.
+
+Each running GUI writes its generations in its own subdirectory of the autosave directory,
+`<pid>-<start time>/`, and holds an flock on its `lock` file as long as it runs. A
+subdirectory whose lock is free was left by an instance that did not exit cleanly; the
+ones still locked belong to live instances and are never offered for recovery nor removed.
+
+Classes:
+    ChangeJournal:
+        Writes snapshots and journal records in the autosave subdirectory of one instance.
+
+Functions:
+    find_autosave(directory): Returns the latest (snapshot, journal) pair, if any.
+    recover(node_graph, snapshot, journal): Loads a snapshot and replays its journal.
+"""
+
+
+_GENERATION_RE = re.compile(r"^autosave-(\d+)\.ggs$")
+
+
+def default_autosave_dir():
+    """Returns the directory holding the autosave subdirectories of the GUI instances."""
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return pathlib.Path(base) / "grogui" / "autosave"
+
+
+def _generations(directory):
+    gens = []
+    for path in pathlib.Path(directory).glob("autosave-*.ggs"):
+        m = _GENERATION_RE.match(path.name)
+        if m:
+            gens.append(int(m.group(1)))
+    return sorted(gens)
+
+
+def find_autosave(directory):
+    """Returns the latest autosave generation of a directory.
+
+    Args:
+        directory (str | pathlib.Path): The autosave subdirectory of an instance.
+
+    Returns:
+        tuple: The snapshot and journal paths (the journal may not exist), or None.
+    """
+    directory = pathlib.Path(directory)
+    if not directory.is_dir():
+        return None
+    gens = _generations(directory)
+    if not gens:
+        return None
+    gen = gens[-1]
+    return directory / f"autosave-{gen}.ggs", directory / f"autosave-{gen}.journal"
+
+
+def _try_lock(path):
+    """Returns the open lock file with an exclusive flock, or None if another process holds it."""
+    try:
+        f = open(path, "a")
+    except FileNotFoundError:
+        # Removed by the process that held it
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+class ChangeJournal:
+    """ChangeJournal writes the autosave of a graph as a snapshot plus appended edits.
+
+    Records are buffered by `append` and written by `flush`; `compact` writes a new
+    snapshot generation and starts an empty journal, then drops the previous generation.
+    The generations go to a subdirectory of `root` owned by this instance (created and
+    locked by the first `compact`); `compact` and `discard` only touch that subdirectory.
+
+    Attributes:
+        root (pathlib.Path): The autosave directory shared by the GUI instances.
+        directory (pathlib.Path): The subdirectory of this instance (None until the first snapshot).
+        generation (int): The current snapshot generation (0 before the first snapshot).
+        record_count (int): Records appended to the current journal.
+        size (int): Size in bytes of the current journal.
+
+    Methods:
+        orphans(root=None): Returns the journals left by instances that are not running anymore.
+        append(tag, payload): Buffers one record.
+        flush(): Appends the buffered records to the journal and syncs it to disk.
+        compact(node_graph, ui_data=None): Writes a new snapshot and an empty journal.
+        discard(): Removes the autosave subdirectory of this instance.
+        close(): Closes the journal and releases the subdirectory, keeping its files.
+    """
+    def __init__(self, root=None):
+        self.root = pathlib.Path(root or default_autosave_dir())
+        self.directory = None
+        self.generation = 0
+        self.record_count = 0
+        self.size = 0
+        self._file = None
+        self._lock = None
+        self._pending = []
+
+    @classmethod
+    def orphans(cls, root=None):
+        """Returns the journals left by the instances that did not exit cleanly, newest first.
+
+        Their locks are taken, so another instance starting meanwhile does not offer them
+        too: `discard` them once handled, or `close` them to keep them for a later start.
+        Subdirectories without any snapshot are removed.
+
+        Args:
+            root (str | pathlib.Path, optional): The autosave directory. Defaults to `default_autosave_dir()`.
+
+        Returns:
+            list: The ChangeJournal of each subdirectory whose lock is free.
+        """
+        root = pathlib.Path(root or default_autosave_dir())
+        if not root.is_dir():
+            return []
+        found = []
+        for directory in root.iterdir():
+            # Subdirectories are renamed in place once locked: a dot name is still being created
+            if directory.name.startswith(".") or not directory.is_dir():
+                continue
+            lock = _try_lock(directory / "lock")
+            if lock is None:
+                continue
+            journal = cls(root)
+            journal.directory = directory
+            journal._lock = lock
+            latest = find_autosave(directory)
+            if latest is None:
+                journal.discard()
+                continue
+            found.append((latest[0].stat().st_mtime, journal))
+        found.sort(key=lambda item: item[0], reverse=True)
+        return [journal for _, journal in found]
+
+    def _claim(self):
+        """Creates and locks the subdirectory of this instance."""
+        name = f"{os.getpid()}-{int(time.time())}"
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Built under a dot name and renamed once locked, so its lock is never seen free
+        tmp = self.root / f".{name}"
+        tmp.mkdir()
+        self._lock = open(tmp / "lock", "a")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        os.rename(tmp, self.root / name)
+        self.directory = self.root / name
+
+    def append(self, tag, payload):
+        self._pending.append((tag, payload))
+
+    def flush(self):
+        """Writes the buffered records and syncs the journal.
+
+        Returns:
+            int: The number of records written.
+        """
+        if not self._pending or self._file is None:
+            return 0
+        data = bytearray()
+        for tag, payload in self._pending:
+            raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+            data += RECORD_HEADER.pack(tag, len(raw)) + raw
+        count = len(self._pending)
+        self._pending = []
+
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.record_count += count
+        self.size += len(data)
+        return count
+
+    def compact(self, node_graph, ui_data=None):
+        """Writes the whole graph as a new snapshot generation and starts an empty journal.
+
+        Buffered records are dropped, since the snapshot already holds their changes.
+
+        Args:
+            node_graph (NodeGraph): The graph to save.
+            ui_data (dict, optional): The UI state.
+        """
+        if self.directory is None:
+            self._claim()
+        previous = _generations(self.directory)
+        gen = max(previous + [self.generation]) + 1
+
+        writer = write_session(node_graph, self.directory / f"autosave-{gen}.ggs", ui_data)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.directory / f"autosave-{gen}.journal", "wb")
+        self._pending = [(b"B", writer.node_ids)]
+        self.record_count = 0
+        self.size = 0
+        self.generation = gen
+        self.flush()
+
+        for old in previous:
+            self._remove_generation(old)
+
+    def discard(self):
+        """Closes the journal and removes the subdirectory of this instance."""
+        directory = self.directory
+        if directory is not None and self._lock is not None:
+            # Still locked while removed: another instance never takes it for an orphan
+            shutil.rmtree(directory, ignore_errors=True)
+            if directory.exists():
+                logging.warning("Could not remove the autosave directory %s", directory)
+        self.close()
+
+    def close(self):
+        """Closes the journal and releases the lock of the subdirectory, keeping its files."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        self._pending = []
+        self.directory = None
+
+    def _remove_generation(self, gen):
+        for suffix in (".ggs", ".journal"):
+            try:
+                os.remove(self.directory / f"autosave-{gen}{suffix}")
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.warning("Could not remove autosave generation %d", gen)
+
+
+def iter_journal(path):
+    """Yields the (tag, payload) records of a journal, stopping at a truncated record.
+
+    Args:
+        path (str | pathlib.Path): The journal file.
+
+    Yields:
+        tuple: The records.
+    """
+    data = pathlib.Path(path).read_bytes()
+    offset = 0
+    while len(data) - offset >= RECORD_HEADER.size:
+        tag, size = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + size
+        if end > len(data):
+            break
+        try:
+            payload = json.loads(data[offset + RECORD_HEADER.size:end])
+        except ValueError:
+            break
+        yield tag, payload
+        offset = end
+    if offset < len(data):
+        logging.warning("Autosave journal %s ends with a truncated record (ignored)", path)
+
+
+def recover(node_graph, snapshot, journal=None, on_type=None, on_template=None):
+    """Loads an autosave snapshot into a graph and replays the edits of its journal.
+
+    Args:
+        node_graph (NodeGraph): The graph to load into (cleared first).
+        snapshot (str | pathlib.Path): The snapshot session file.
+        journal (str | pathlib.Path, optional): The journal of the snapshot.
+        on_type (callable, optional): Called with each node type before its first node.
+        on_template (callable, optional): Called with each template of the snapshot.
+
+    Returns:
+        tuple: The number of replayed records and the UI state of the snapshot.
+    """
+    nodes, ui_data = load_session(node_graph, snapshot, on_type=on_type, on_template=on_template)
+    if journal is None or not pathlib.Path(journal).exists():
+        return 0, ui_data
+
+    by_id = {}
+    replayed = 0
+    for tag, payload in iter_journal(journal):
+        try:
+            _replay(node_graph, by_id, nodes, tag, payload, on_type)
+            replayed += 1
+        except Exception:
+            logging.exception("Failed to replay autosave record %r", tag)
+
+    node_graph.clear_selection()
+    node_graph.undo_stack().clear()
+    return replayed, ui_data
+
+
+def _replay(node_graph, by_id, snapshot_nodes, tag, payload, on_type):
+    """Applies one journal record."""
+    if tag == b"B":
+        by_id.update((i, n) for i, n in zip(payload, snapshot_nodes) if i is not None)
+
+    elif tag == b"A":
+        node_id, node_dict, add_custom = payload
+        if on_type is not None:
+            on_type(node_dict.get("type_"))
+        by_id[node_id] = restore_node(node_graph, node_dict, add_custom)
+
+    elif tag == b"D":
+        doomed = [by_id.pop(i) for i in payload if by_id.get(i) is not None]
+        if doomed:
+            node_graph.delete_nodes(doomed, push_undo=False)
+
+    elif tag == b"P":
+        node_id, name, value = payload
+        node = by_id.get(node_id)
+        if node is None:
+            return
+        spec = NodeSpec.of(node)
+        if name in spec.props and not node.has_property(name):
+            # Optional prop added after the snapshot
+            label, default_val = spec.prop(name)
+            node._add_prop(name=name, label=label, default=default_val)
+        node.set_property(name, value, push_undo=False)
+
+    elif tag == b"M":
+        node_id, x, y = payload
+        node = by_id.get(node_id)
+        if node is not None:
+            node.set_pos(x, y)
+
+    elif tag in (b"C", b"X"):
+        out_id, out_port, in_id, in_port = payload
+        out_node, in_node = by_id.get(out_id), by_id.get(in_id)
+        if out_node is None or in_node is None:
+            return
+        if tag == b"C":
+            restore_connection(out_node, out_port, in_node, in_port)
+        else:
+            out_p, in_p = out_node.outputs().get(out_port), in_node.inputs().get(in_port)
+            if out_p is not None and in_p is not None:
+                out_p.disconnect_from(in_p, push_undo=False, emit_signal=False)
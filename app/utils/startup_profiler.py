@@ -0,0 +1,78 @@
+import logging
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """StartupProfiler records how long each startup step (import or construction) takes.
+
+    It is disabled by default, in which case `section` costs a single attribute check.
+    `main.py --profile-startup` enables it and prints the report once the startup is done.
+
+    Attributes:
+        enabled (bool): Whether the sections are recorded.
+        records (list): The recorded (name, seconds, depth) tuples, in start order.
+
+    Methods:
+        enable(): Starts recording, taking the current time as the startup origin.
+        section(name): Context manager timing the enclosed block.
+        mark(name): Records the time elapsed since the startup origin.
+        report(): Returns the formatted report.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._origin = time.perf_counter()
+        self._depth = 0
+
+    def enable(self):
+        self.enabled = True
+        self.records = []
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def section(self, name):
+        """Times the enclosed block under `name` (nested sections are indented in the report).
+
+        Args:
+            name (str): The name of the step, e.g. "import NodeGraphQt" or "MainWindow: props bin".
+        """
+        if not self.enabled:
+            yield
+            return
+        index = len(self.records)
+        self.records.append((name, 0.0, self._depth))
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.records[index] = (name, time.perf_counter() - start, self._depth)
+
+    def mark(self, name):
+        """Records the time elapsed since the startup origin (e.g. the window shown).
+
+        Args:
+            name (str): The name of the milestone.
+        """
+        if self.enabled:
+            self.records.append((f"@ {name}", time.perf_counter() - self._origin, 0))
+
+    def report(self):
+        """Returns the recorded steps as an aligned text table, in milliseconds.
+
+        Returns:
+            str: The report.
+        """
+        lines = ["Startup profile (ms):"]
+        for name, seconds, depth in self.records:
+            lines.append(f"  {seconds * 1e3:9.1f}  {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+    def log_report(self):
+        logging.info("%s", self.report())
+
+
+# Shared profiler used by main.py and the lazily built components
+PROFILER = StartupProfiler()
@@ -1,25 +1,59 @@
+import argparse
 import logging
-from Qt import QtWidgets # type: ignore
-from app.gui.main_window import MainWindow
+from app.utils.startup_profiler import PROFILER
 
 def main():
+    parser = argparse.ArgumentParser(description="GroGUI - Node-based GUI for GROMACS")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print the import and construction time of each component, then exit",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
-    
-    app = QtWidgets.QApplication([])
+    if args.profile_startup:
+        PROFILER.enable()
+
+    # Heavy imports are done here so the profiler can time them
+    with PROFILER.section("import Qt"):
+        from Qt import QtWidgets, QtCore # type: ignore
+
+    with PROFILER.section("QApplication"):
+        app = QtWidgets.QApplication([])
 
     # Load the main style sheet
-    with open("styles.qss", "r", encoding="utf-8") as f:
-        app.setStyleSheet(f.read())
+    with PROFILER.section("style sheet"):
+        with open("styles.qss", "r", encoding="utf-8") as f:
+            app.setStyleSheet(f.read())
     # Shadow theme
     # try:
     #     import qdarktheme
     #     qdarktheme.setup_theme("dark")
     # except Exception:
     #     pass
-    
-    win = MainWindow()
+
+    with PROFILER.section("import app.gui.main_window"):
+        from app.gui.main_window import MainWindow
+
+    with PROFILER.section("MainWindow"):
+        win = MainWindow()
     win.showMaximized()
+
+    if args.profile_startup:
+        # Queued after the deferred startup of the window (see MainWindow._finish_startup)
+        QtCore.QTimer.singleShot(0, lambda: _finish_profile(app, win))
+
     app.exec_()
 
+
+def _finish_profile(app, win):
+    """Records the end of the startup, times the deferred components, prints the report and quits."""
+    PROFILER.mark("startup done")
+    with PROFILER.section("deferred components"):
+        win.build_deferred()
+    print(PROFILER.report())
+    app.quit()
+
 if __name__ == "__main__":
     main()